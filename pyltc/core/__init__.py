@@ -9,12 +9,79 @@ DIR_EGRESS = 'egress'
 DIR_INGRESS = 'ingress'
 
 
+class ITargetObserver(object):
+    """Observes the building and marshaling of ``ITarget`` objects (see ``ITarget.add_observer()``),
+    e.g. for tracing, metrics or journaling, without subclassing the targets. Override the hooks
+    needed; the others do nothing.
+    """
+
+    def on_node_added(self, target, node, command):
+        """Called when a step has been built into the target.
+
+        :param target: ITarget - the target
+        :param node: LtcNode - the qdisc, class or filter added; None for other steps (e.g. clearing)
+        :param command: string - the command of the step, for tc targets (None otherwise)
+        """
+
+    def on_marshal_start(self, target, commands):
+        """Called when the target starts marshaling.
+
+        :param target: ITarget - the target
+        :param commands: tuple - the commands to be marshaled, for tc targets (empty otherwise)
+        """
+
+    def on_command_result(self, target, command, result):
+        """Called for each command the target has executed, failed ones included.
+
+        :param target: ITarget - the target
+        :param command: string - the command executed
+        :param result: CommandLine - the executed command line (see its ``returncode``, ``stdout``
+                       and ``stderr``)
+        """
+
+    def on_marshal_end(self, target):
+        """Called when the target has finished marshaling (also if it failed)."""
+
+
 class ITarget(ABC):
     """Represents a target setup and marshaling method for LTC setup.
 
     Example: tc target (builds a set of tc commands for configuring the kernel)
     """
 
+    #: the ``ITargetObserver`` objects notified by the targets of this class: the ones registered on it
+    #: and on its bases (a tuple, so that notifying no observers costs a truth test)
+    observers = ()
+
+    @classmethod
+    def add_observer(cls, observer):
+        """Registers an ``ITargetObserver`` for the targets of this class and its subclasses
+        (for all targets if called on ``ITarget``)."""
+        cls._registered_observers = vars(cls).get('_registered_observers', ()) + (observer,)
+        cls._update_observers()
+
+    @classmethod
+    def remove_observer(cls, observer):
+        """Unregisters an observer registered with ``add_observer()`` on the same class."""
+        registered = vars(cls).get('_registered_observers', ())
+        cls._registered_observers = tuple(entry for entry in registered if entry is not observer)
+        cls._update_observers()
+
+    @classmethod
+    def _update_observers(cls):
+        classes = [cls]
+        while classes:
+            klass = classes.pop()
+            klass.observers = tuple(observer for base in reversed(klass.__mro__)
+                                    for observer in vars(base).get('_registered_observers', ()))
+            classes.extend(klass.__subclasses__())
+
+    def _notify(self, hook, *args):
+        """Calls given hook of the observers with this target and ``args``. (Callers test
+        ``self.observers`` first, so that building the arguments is skipped without observers.)"""
+        for observer in self.observers:
+            getattr(observer, hook)(self, *args)
+
     @abstractmethod
     def __init__(self, iface, direction):
         """
@@ -94,3 +161,17 @@ class ITarget(ABC):
         Examples for 'marshaling': create a file with tc commands, or
         live execution of the tc commands to actually configure the kernel.
         """
+
+    async def marshal_async(self):
+        """
+        Coroutine counterpart of ``marshal()``, so that many targets can be marshaled
+        concurrently on one event loop. Calls ``marshal()`` unless overridden by targets
+        that do I/O.
+        """
+        self.marshal()
+
+    def abort(self):
+        """
+        Gives up the setup built so far, e.g. when building it failed. Does nothing
+        unless overridden by targets that hold resources before ``marshal()``.
+        """
@@ -0,0 +1,268 @@
+"""
+Offline packet classification over traffic control plans.
+
+Tells where packets would go in a plan (see ``pyltc.core.plan``) without a
+kernel: the filters of a device chain are compiled into vectorized conditions
+and whole arrays of synthetic packet headers are classified at once, e.g.::
+
+  classifier = PlanClassifier(plan, 'lo')
+  result = classifier.classify(random_packets(1000000, seed=7))
+  result.hits()           # OrderedDict: classid -> number of packets
+  result.mean_evaluated   # filters evaluated per packet, on average
+
+Only the conditions pyltc generates are understood: u32 ``ip protocol``,
+``ip sport``/``ip dport`` and match-all (``u32 0 0``) keys, and basic
+``cmp(u16 at 0|2 layer transport gt|lt|eq N)`` ematches joined by and/or.
+All packets are taken to be IPv4.
+
+Requires NumPy.
+"""
+import re
+from collections import namedtuple, OrderedDict
+
+from pyltc.core.plan import KIND_QDISC, KIND_CLASS, KIND_FILTER
+from pyltc.util.optional import numpy as np, require_numpy
+
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+#: the prio the kernel assigns to the first prio-less filter of a parent
+AUTO_PRIO = 0xc000
+
+#: qdiscs whose packets are classified further (the rest are leaves)
+CLASSFUL_QDISCS = ('htb', 'prio', 'hfsc', 'drr')
+
+#: the transport header field at a given offset
+_TRANSPORT_FIELDS = {0: 'sport', 2: 'dport'}
+
+_U32_KEY_REGEX = re.compile(r'match ip (?P<field>protocol|sport|dport) (?P<value>\d+) (?P<mask>0x[0-9a-fA-F]+|\d+)'
+                            r'|match u32 (?P<u32value>\S+) (?P<u32mask>\S+)')
+_CMP_REGEX = re.compile(r'cmp\(u16 at (?P<offset>\d+) layer transport (?P<op>gt|lt|eq) (?P<value>\d+)\)')
+
+
+class ClassifierError(Exception):
+    """Raised when a plan has filters the classifier cannot interpret."""
+
+
+#: Packet headers as equally long NumPy arrays.
+Packets = namedtuple('Packets', 'protocol sport dport')
+
+
+def make_packets(protocol, sport, dport):
+    """Builds a ``Packets`` tuple from sequences (or scalars) of header values.
+
+    :return: Packets
+    """
+    require_numpy(ClassifierError, 'packet classification')
+    protocol, sport, dport = np.broadcast_arrays(np.asarray(protocol, dtype=np.uint8),
+                                                 np.asarray(sport, dtype=np.uint16),
+                                                 np.asarray(dport, dtype=np.uint16))
+    return Packets(protocol, sport, dport)
+
+
+def random_packets(count, seed=None, protocols=(PROTO_TCP, PROTO_UDP)):
+    """Generates packets with uniformly distributed protocols and ports.
+
+    :param count: int - the number of packets
+    :param seed: int - the random seed, for reproducible runs
+    :param protocols: sequence of ints - the protocol numbers to pick from
+    :return: Packets
+    """
+    require_numpy(ClassifierError, 'packet classification')
+    rng = np.random.default_rng(seed)
+    return Packets(rng.choice(np.asarray(protocols, dtype=np.uint8), size=count),
+                   rng.integers(0, 65536, size=count, dtype=np.uint16),
+                   rng.integers(0, 65536, size=count, dtype=np.uint16))
+
+
+def _compile_u32(spec):
+    """Returns a function(packets, idx) -> bool array for a u32 filter spec (all keys must match)."""
+    body = spec[len('u32'):].strip()
+    keys = list()
+    pos = 0
+    for match in _U32_KEY_REGEX.finditer(body):
+        if body[pos:match.start()].strip():
+            break
+        pos = match.end()
+        if match.group('field'):
+            keys.append((match.group('field'), int(match.group('value')), int(match.group('mask'), 0)))
+        elif int(match.group('u32mask'), 0) != 0:
+            raise ClassifierError("Unsupported u32 key: {!r}".format(match.group(0)))
+    if body[pos:].strip() and not body[pos:].strip().startswith('action '):
+        raise ClassifierError("Unsupported u32 filter: {!r}".format(spec))
+
+    def matches(packets, idx):
+        result = np.ones(len(idx), dtype=bool)
+        for field, value, mask in keys:
+            result &= (getattr(packets, field)[idx] & mask) == (value & mask)
+        return result
+
+    return matches
+
+
+def _compile_basic(spec):
+    """Returns a function(packets, idx) -> bool array for a basic filter spec."""
+    expr = spec[len('basic'):].strip()
+    if not expr.startswith('match '):
+        raise ClassifierError("Unsupported basic filter: {!r}".format(spec))
+    expr = expr[len('match '):].strip().strip('"')
+    terms, ops = list(), list()
+    pos = 0
+    for match in _CMP_REGEX.finditer(expr):
+        between = expr[pos:match.start()].strip()
+        if terms and between not in ('and', 'or') or not terms and between:
+            raise ClassifierError("Unsupported basic filter: {!r}".format(spec))
+        if terms:
+            ops.append(between)
+        offset = int(match.group('offset'))
+        if offset not in _TRANSPORT_FIELDS:
+            raise ClassifierError("Unsupported transport offset {} in: {!r}".format(offset, spec))
+        terms.append((_TRANSPORT_FIELDS[offset], match.group('op'), int(match.group('value'))))
+        pos = match.end()
+    if not terms or expr[pos:].strip():
+        raise ClassifierError("Unsupported basic filter: {!r}".format(spec))
+
+    def term(packets, idx, field, op, value):
+        values = getattr(packets, field)[idx]
+        if op == 'gt':
+            return values > value
+        if op == 'lt':
+            return values < value
+        return values == value
+
+    def matches(packets, idx):
+        # ematches are evaluated left to right, without precedence (like the kernel does)
+        result = term(packets, idx, *terms[0])
+        for op, args in zip(ops, terms[1:]):
+            result = result & term(packets, idx, *args) if op == 'and' else result | term(packets, idx, *args)
+        return result
+
+    return matches
+
+
+_COMPILERS = {
+    'u32': _compile_u32,
+    'basic': _compile_basic,
+}
+
+
+class _Filter(namedtuple('_Filter', 'prio flowid matches')):
+    __slots__ = ()
+
+
+class ClassificationResult(object):
+    """The outcome of classifying an array of packets.
+
+    ``index`` holds, per packet, the position of its final class in ``labels``;
+    ``evaluated`` holds the number of filters evaluated for each packet. Labels are
+    classids, or qdisc handles for packets no filter of a classful qdisc matched.
+    """
+
+    def __init__(self, labels, index, evaluated):
+        self.labels = labels
+        self.index = index
+        self.evaluated = evaluated
+
+    def hits(self):
+        """Returns the number of packets ending in each class (or qdisc).
+
+        :return: OrderedDict - label -> int
+        """
+        counts = np.bincount(self.index, minlength=len(self.labels))
+        return OrderedDict((label, int(count)) for label, count in zip(self.labels, counts))
+
+    @property
+    def mean_evaluated(self):
+        """The average number of filters evaluated per packet."""
+        return float(self.evaluated.mean()) if len(self.evaluated) else 0.0
+
+    def __len__(self):
+        return len(self.index)
+
+
+class PlanClassifier(object):
+    """Classifies packets through one chain of a device in a plan."""
+
+    def __init__(self, plan, dev, chain='root'):
+        """Initializer.
+
+        :param plan: TcPlan - the plan to classify through
+        :param dev: string - the device name
+        :param chain: string - 'root' or 'ingress'
+        """
+        require_numpy(ClassifierError, 'packet classification')
+        self._filters = dict()     # parent id -> list of _Filter, in evaluation order
+        self._leaves = dict()      # classid -> id of the classful qdisc attached to it
+        self._top = None
+        labels = list()
+        for node in plan.nodes:
+            if node.dev != dev:
+                continue
+            if node.kind == KIND_QDISC:
+                if node.chain == chain:
+                    self._top = node.nodeid
+                elif node.chain is None and node.spec.split()[0] in CLASSFUL_QDISCS:
+                    self._leaves[node.parent] = node.nodeid
+                labels.append(node.nodeid)
+            elif node.kind == KIND_CLASS:
+                labels.append(node.nodeid)
+            elif node.kind == KIND_FILTER:
+                self._add_filter(node)
+        if self._top is None:
+            raise ClassifierError("No {} qdisc on {} in given plan".format(chain, dev))
+        for filters in self._filters.values():
+            filters.sort(key=lambda flt: flt.prio)  # stable: equal prios keep their order
+        self._labels = labels
+        self._label_index = dict((label, idx) for idx, label in enumerate(labels))
+
+    def _add_filter(self, node):
+        kind = node.spec.split()[0]
+        if kind not in _COMPILERS:
+            raise ClassifierError("Unsupported filter kind: {!r}".format(kind))
+        filters = self._filters.setdefault(node.parent, list())
+        prio = node.nodeid
+        if prio is None:  # the kernel puts a prio-less filter in front of the existing ones
+            prio = min(flt.prio for flt in filters) - 1 if filters else AUTO_PRIO
+        filters.append(_Filter(prio, node.flowid, _COMPILERS[kind](node.spec)))
+
+    @property
+    def labels(self):
+        return list(self._labels)
+
+    def classify(self, packets):
+        """Classifies given packets.
+
+        :param packets: Packets - the packet headers
+        :return: ClassificationResult
+        """
+        count = len(packets.protocol)
+        index = np.full(count, -1, dtype=np.int64)
+        evaluated = np.zeros(count, dtype=np.int64)
+        self._walk(self._top, np.arange(count), packets, index, evaluated)
+        return ClassificationResult(self.labels, index, evaluated)
+
+    def _walk(self, parent, idx, packets, index, evaluated):
+        """Runs the packets at ``idx`` through the filters attached to ``parent``."""
+        remaining = idx
+        for flt in self._filters.get(parent, ()):
+            if not len(remaining):
+                return
+            evaluated[remaining] += 1
+            matched = flt.matches(packets, remaining)
+            if flt.flowid:
+                self._enter(flt.flowid, remaining[matched], packets, index, evaluated)
+            else:  # an action filter (e.g. a redirect) consumes the packets right here
+                index[remaining[matched]] = self._label_index[parent]
+            remaining = remaining[~matched]
+        index[remaining] = self._label_index[parent]
+
+    def _enter(self, classid, idx, packets, index, evaluated):
+        if classid not in self._label_index:
+            raise ClassifierError("Filter points to a missing class: {}".format(classid))
+        if classid in self._filters:
+            self._walk(classid, idx, packets, index, evaluated)
+        elif classid in self._leaves:
+            self._walk(self._leaves[classid], idx, packets, index, evaluated)
+        else:
+            index[idx] = self._label_index[classid]
@@ -0,0 +1,271 @@
+"""
+Fluid model of HTB/netem setups.
+
+Predicts what a plan (see ``pyltc.core.plan``) does to a given offered load
+without applying it: traffic is treated as a fluid, time advances in fixed
+steps and every step is computed for all classes at once with NumPy::
+
+  model = FluidModel(plan, 'lo')
+  offered = numpy.full((500, len(model.sinks)), 2e6)  # 5 sec. of 2mbit per sink
+  result = model.simulate(offered, dt=0.01)
+  result.mean_goodput(start=100)   # bits per second, per sink
+
+A sink is where traffic ends up: a leaf class, or the direct queue of a
+classful qdisc (traffic none of its filters matched). Each step, per sink:
+
+ - netem drops the lost share of the arrivals on enqueue;
+ - the queue is served as far as the token buckets of the sink's class and
+   all its ancestors allow (HTB classes send at up to their ``ceil``, which
+   defaults to ``rate``; a parent too short of tokens scales its children down
+   proportionally to their demand); buckets hold ``rate / HZ + MTU`` bits,
+   like tc's default HTB burst;
+ - whatever exceeds the queue limit (netem ``limit``, 1000 packets otherwise)
+   is dropped.
+
+TCP sinks cannot offer more than the Mathis et al. bound for their loss rate
+(see ``mathis_ceiling``), which is what makes ``FluidModel.shortfalls`` find
+profiles whose TCP branches never reach their configured rate.
+
+Requires NumPy.
+"""
+import re
+from collections import namedtuple
+
+from pyltc.core.plan import KIND_QDISC, KIND_CLASS, KIND_FILTER
+from pyltc.util.rates import convert2bps
+from pyltc.util.optional import numpy as np, require_numpy
+
+
+#: the kernel clock rate tc's default HTB burst is computed with
+HZ = 1000
+
+#: default queue length (in packets) of a leaf without netem, and of HTB direct queues
+DEFAULT_LIMIT = 1000
+
+#: the constant of the Mathis et al. TCP throughput bound, sqrt(3/2)
+MATHIS_CONSTANT = 1.22
+
+_PROTOCOLS = {6: 'tcp', 17: 'udp'}
+_PROTOCOL_REGEX = re.compile(r'\bmatch ip protocol (\d+) 0xff\b')
+
+
+class FluidModelError(Exception):
+    """Raised when a plan or an offered load cannot be modeled."""
+
+
+def mathis_ceiling(loss, rtt, mss=1460):
+    """Returns the steady-state throughput bound of a TCP flow (bits/s),
+    MSS / RTT * C / sqrt(p), or infinity where there is no loss.
+
+    :param loss: float or array - the loss probability (0.02 for 2%)
+    :param rtt: float - the round trip time in seconds
+    :param mss: int - the maximum segment size in bytes
+    :return: float or array
+    """
+    require_numpy(FluidModelError, 'the fluid model')
+    loss = np.asarray(loss, dtype=float)
+    with np.errstate(divide='ignore'):
+        return np.where(loss > 0, mss * 8 / rtt * MATHIS_CONSTANT / np.sqrt(loss), np.inf)
+
+
+def _htb_params(spec):
+    """Returns (rate, ceil) in bits/s from an HTB class spec."""
+    tokens = spec.split()
+    params = dict(zip(tokens[1::2], tokens[2::2]))
+    if 'rate' not in params:
+        raise FluidModelError("HTB class without rate: {!r}".format(spec))
+    rate = convert2bps(params['rate'])
+    return rate, convert2bps(params['ceil']) if 'ceil' in params else rate
+
+
+def _netem_params(spec):
+    """Returns (loss fraction, limit in packets) from a netem qdisc spec."""
+    tokens = spec.split()
+    params = dict(zip(tokens[1::2], tokens[2::2]))
+    loss = float(params['loss'].rstrip('%')) / 100 if 'loss' in params else 0.0
+    return loss, int(params.get('limit', DEFAULT_LIMIT))
+
+
+class FluidResult(namedtuple('FluidResult', 'sinks dt goodput lost overflow queue')):
+    """What a simulation predicts, as (steps, sinks) arrays: ``goodput`` in bits/s,
+    ``lost`` (dropped by netem) and ``overflow`` (dropped at the queue limit) in bits
+    per step, ``queue`` in bits at the end of each step."""
+
+    __slots__ = ()
+
+    def mean_goodput(self, start=0):
+        """Returns the mean goodput (bits/s) of each sink from step ``start`` on."""
+        return self.goodput[start:].mean(axis=0)
+
+
+#: A sink predicted to stay below its configured rate.
+Shortfall = namedtuple('Shortfall', 'sink protocol target predicted')
+
+
+class FluidModel(object):
+    """The fluid model of one chain of a device in a plan."""
+
+    def __init__(self, plan, dev, chain='root', packet_size=1500):
+        """Initializer.
+
+        :param plan: TcPlan - the plan to model
+        :param dev: string - the device name
+        :param chain: string - 'root' or 'ingress'
+        :param packet_size: int - the packet size in bytes, to convert queue limits
+        """
+        require_numpy(FluidModelError, 'the fluid model')
+        self._packet_size = packet_size
+        nodes = [node for node in plan.nodes if node.dev == dev]
+        qdiscs = dict((node.nodeid, node) for node in nodes if node.kind == KIND_QDISC)
+        classes = [node for node in nodes if node.kind == KIND_CLASS]
+        if not any(node.chain == chain for node in qdiscs.values()):
+            raise FluidModelError("No {} qdisc on {} in given plan".format(chain, dev))
+        leaf_qdisc = dict((node.parent, node) for node in qdiscs.values() if node.chain is None)
+
+        # the node above each class or qdisc (nested qdiscs hang off a class)
+        above = dict((node.nodeid, node.parent) for node in classes)
+        for node in qdiscs.values():
+            above[node.nodeid] = None if node.chain else node.parent
+        has_children = set(node.parent for node in classes)
+
+        self._classes = [node.nodeid for node in classes if node.spec.split()[0] == 'htb']
+        sinks, limits, losses, paths = list(), list(), list(), list()
+        for node in classes:
+            leaf = leaf_qdisc.get(node.nodeid)
+            leaf_kind = leaf.spec.split()[0] if leaf else None
+            if node.nodeid in has_children or leaf_kind == 'htb':
+                continue
+            loss, limit = _netem_params(leaf.spec) if leaf_kind == 'netem' else (0.0, DEFAULT_LIMIT)
+            sinks.append(node.nodeid)
+            losses.append(loss)
+            limits.append(limit)
+        for node in qdiscs.values():
+            if node.spec.split()[0] == 'htb':
+                sinks.append(node.nodeid)  # the direct queue
+                losses.append(0.0)
+                limits.append(DEFAULT_LIMIT)
+        for sink in sinks:
+            path, nodeid = list(), sink
+            while nodeid is not None:
+                if nodeid in self._classes:
+                    path.append(nodeid)
+                nodeid = above.get(nodeid)
+            paths.append(path)
+
+        self._sinks = sinks
+        self._loss = np.array(losses, dtype=float)
+        self._limit = np.array(limits, dtype=float) * packet_size * 8
+        self._protocols = [self._protocol(sink, above, nodes) for sink in sinks]
+        params = dict((node.nodeid, _htb_params(node.spec)) for node in classes if node.nodeid in self._classes)
+        self._rates = dict((cls, rate) for cls, (rate, _) in params.items())
+        # membership matrices, one per depth, deepest first: which sinks each class at that depth covers
+        depth = dict()
+        for cls in self._classes:
+            depth[cls], nodeid = 0, above[cls]
+            while nodeid is not None:
+                depth[cls] += nodeid in self._classes
+                nodeid = above.get(nodeid)
+        self._levels = list()
+        for level in sorted(set(depth.values()), reverse=True):
+            members = [cls for cls in self._classes if depth[cls] == level]
+            matrix = np.array([[cls in path for path in paths] for cls in members], dtype=float)
+            cap = np.array([params[cls][1] for cls in members], dtype=float)
+            burst = np.array([params[cls][0] / HZ + packet_size * 8 for cls in members], dtype=float)
+            self._levels.append((members, matrix, cap, burst))
+
+    @staticmethod
+    def _protocol(sink, above, nodes):
+        """Returns 'tcp' or 'udp' if the sink lies below a protocol filter, None otherwise."""
+        protocols = dict()
+        for node in nodes:
+            if node.kind == KIND_FILTER and node.flowid:
+                match = _PROTOCOL_REGEX.search(node.spec)
+                if match:
+                    protocols[node.flowid] = _PROTOCOLS.get(int(match.group(1)))
+        nodeid = sink
+        while nodeid is not None:
+            if nodeid in protocols:
+                return protocols[nodeid]
+            nodeid = above.get(nodeid)
+        return None
+
+    @property
+    def sinks(self):
+        """The sink labels: leaf classids and the handles of HTB qdiscs (their direct queues)."""
+        return list(self._sinks)
+
+    @property
+    def protocols(self):
+        return list(self._protocols)
+
+    @property
+    def loss(self):
+        return self._loss.copy()
+
+    def target_rates(self):
+        """Returns the configured rate of each sink's own class (inf for direct queues)."""
+        return np.array([self._rates.get(sink, np.inf) for sink in self._sinks])
+
+    def simulate(self, offered, dt=0.01, rtt=None, mss=1460):
+        """Runs the model.
+
+        :param offered: array - (steps, sinks) offered load in bits/s
+        :param dt: float - the time step in seconds
+        :param rtt: float - round trip time in seconds; if given, the load of
+                    TCP sinks is capped at their Mathis bound
+        :param mss: int - the TCP maximum segment size in bytes
+        :return: FluidResult
+        """
+        offered = np.asarray(offered, dtype=float)
+        if offered.ndim != 2 or offered.shape[1] != len(self._sinks):
+            raise FluidModelError("Offered load must be a (steps, {}) array".format(len(self._sinks)))
+        if rtt is not None:
+            is_tcp = np.array([proto == 'tcp' for proto in self._protocols])
+            offered = np.where(is_tcp, np.minimum(offered, mathis_ceiling(self._loss, rtt, mss)), offered)
+
+        steps, width = offered.shape
+        goodput, overflow, queue_log = (np.zeros((steps, width)) for _ in range(3))
+        arrivals = offered * dt
+        lost = arrivals * self._loss  # netem drops on enqueue
+        inflow = arrivals - lost
+        # per level: membership, refill per step, bucket size, 1 for the sinks no class of the level covers
+        levels = [(matrix, cap * dt, burst, 1.0 - matrix.sum(axis=0)) for _, matrix, cap, burst in self._levels]
+        tokens = [burst.copy() for _, _, burst, _ in levels]
+        queue = np.zeros(width)
+        for step in range(steps):
+            demand = queue + inflow[step]
+            served = demand.copy()
+            budgets = list()
+            for (matrix, refill, _, uncovered), level_tokens in zip(levels, tokens):
+                budget = level_tokens + refill
+                wanted = matrix @ served
+                scale = np.minimum(1.0, budget / np.maximum(wanted, 1e-12))
+                served *= scale @ matrix + uncovered
+                budgets.append(budget)
+            for idx, ((matrix, _, burst, _), budget) in enumerate(zip(levels, budgets)):
+                tokens[idx] = np.minimum(budget - matrix @ served, burst)
+            queue = demand - served
+            overflow[step] = np.maximum(queue - self._limit, 0.0)
+            queue -= overflow[step]
+            goodput[step] = served
+            queue_log[step] = queue
+        goodput /= dt
+        return FluidResult(self.sinks, dt, goodput, lost, overflow, queue_log)
+
+    def shortfalls(self, rtt=0.05, tolerance=0.05, duration=5.0, dt=0.01, mss=1460):
+        """Finds the sinks that do not reach their configured rate under a greedy load
+        (twice the rate, capped at the Mathis bound for TCP).
+
+        :param rtt: float - the round trip time in seconds assumed for TCP
+        :param tolerance: float - the accepted relative shortfall
+        :param duration: float - the simulated time in seconds (the first half is warm-up)
+        :return: list of Shortfall tuples
+        """
+        targets = self.target_rates()
+        shaped = np.isfinite(targets)
+        steps = max(int(duration / dt), 2)
+        offered = np.tile(np.where(shaped, targets * 2, 0.0), (steps, 1))
+        predicted = self.simulate(offered, dt=dt, rtt=rtt, mss=mss).mean_goodput(start=steps // 2)
+        return [Shortfall(sink, proto, float(target), float(got))
+                for sink, proto, target, got, is_shaped in zip(self._sinks, self._protocols, targets, predicted, shaped)
+                if is_shaped and got < target * (1 - tolerance)]
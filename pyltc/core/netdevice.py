@@ -3,30 +3,165 @@ Network device management classes.
 
 """
 import os
+import re
+from contextlib import contextmanager
 # from os import listdir as os_listdir  # need it this way for mock.patch in unit tests
 from os.path import join as pjoin
 from unittest.mock import MagicMock
 
-from pyltc.util.cmdline import CommandLine
+from pyltc.util import timings
+from pyltc.util.cmdline import CommandLine, PipedCommandLine
+from pyltc.util.netlink import RtnlSocket, NetlinkError, RTM_NEWLINK, RTM_DELLINK, RTMGRP_LINK, parse_link_info
 from pyltc.core import DIR_EGRESS, DIR_INGRESS
 from pyltc.core.tfactory import default_target_factory
 
 
+#: the device name at the start of an ``ip -o link show`` line, e.g. 'veth0' in '5: veth0@if6: <BROADCAST...'
+_IP_LINK_NAME_REGEX = re.compile(r'^\d+:\s+([^:@\s]+)')
+
+
+class DeviceInventory(object):
+    """The network devices of a network namespace, held in memory: loaded with one link dump and
+    kept up to date with the link notifications of the kernel, which are read (without waiting)
+    on each query. Changes made by anyone - e.g. by our own 'ip link' commands, which return only
+    after the kernel has sent their notifications - are seen by the next query.
+    """
+
+    def __init__(self, netns=None):
+        """Initializer.
+
+        :param netns: string - the named network namespace, None for the current one
+        """
+        self._events = RtnlSocket(netns, groups=RTMGRP_LINK)  # subscribed before the dump not to miss changes
+        self._rtnl = RtnlSocket(netns)
+        self._links = dict()  # LinkInfo by name
+        self._names = dict()  # name by ifindex
+        self.reload()
+
+    def close(self):
+        self._events.close()
+        self._rtnl.close()
+
+    def reload(self):
+        """Loads all devices anew."""
+        links = self._rtnl.link_infos()
+        self._links = dict((link.name, link) for link in links)
+        self._names = dict((link.ifindex, link.name) for link in links)
+
+    def refresh(self):
+        """Applies the notifications received since the last refresh (reloads if some were lost)."""
+        try:
+            notifications = self._events.notifications()
+        except NetlinkError:
+            self.reload()
+            return
+        for msg_type, payload in notifications:
+            if msg_type not in (RTM_NEWLINK, RTM_DELLINK):
+                continue
+            link = parse_link_info(payload)
+            self._links.pop(self._names.pop(link.ifindex, None), None)  # also drops the old name of a renamed one
+            if msg_type == RTM_NEWLINK:
+                self._links[link.name] = link
+                self._names[link.ifindex] = link.name
+
+    def names(self):
+        self.refresh()
+        return list(self._links)
+
+    def get(self, name):
+        """Returns the ``LinkInfo`` of the device of given name; None if there is no such device."""
+        self.refresh()
+        return self._links.get(name)
+
+
 class DeviceManager(object):
 
     #: /sys/class/net/ path
     SYS_CLASS_NET = pjoin(os.sep, "sys", "class", "net")
 
+    #: /sys/module/ path (a directory per loaded module)
+    SYS_MODULE = pjoin(os.sep, "sys", "module")
+
+    #: how long (in sec.) a batch of device operations may take
+    BATCH_TIMEOUT = 60
+
+    #: the (named) network namespace devices are looked up and set up in; None for our own
+    netns = None
+
+    #: the ``DeviceInventory`` objects by netns while they are in use (see ``use_inventory()``)
+    _inventories = None
+
+    @classmethod
+    def use_inventory(cls, enabled=True):
+        """Makes the device lookups answer from a ``DeviceInventory`` (one per network namespace)
+        instead of listing /sys/class/net, or running 'ip link show' in a named namespace, every time.
+        ``use_inventory(False)`` closes the inventories and returns to listing."""
+        for inventory in (cls._inventories or dict()).values():
+            if inventory is not None:
+                inventory.close()
+        cls._inventories = dict() if enabled else None
+
+    @classmethod
+    def inventory(cls):
+        """Returns the ``DeviceInventory`` of the current ``netns``; None if not in use."""
+        if cls._inventories is None:
+            return None
+        if cls.netns not in cls._inventories:
+            try:
+                cls._inventories[cls.netns] = DeviceInventory(cls.netns)
+            except OSError:  # e.g. not privileged to enter the namespace: the lookups fall back to listing
+                cls._inventories[cls.netns] = None
+        return cls._inventories[cls.netns]
+
+    @classmethod
+    @contextmanager
+    def in_netns(cls, netns):
+        """Makes the devices looked up (and set up) in the block be those of given named network
+        namespace (None for our own); ``netns`` is restored afterwards."""
+        previous, cls.netns = cls.netns, netns
+        try:
+            yield
+        finally:
+            cls.netns = previous
+
+    @classmethod
+    def netns_command(cls, command):
+        """Returns given ``ip`` or ``tc`` command line so that it runs in the current ``netns``,
+        e.g. 'tc qdisc show' -> 'tc -n ns1 qdisc show'."""
+        if not cls.netns:
+            return command
+        program, _, rest = command.partition(' ')
+        return '{} -n {} {}'.format(program, cls.netns, rest)
+
+    @classmethod
+    def _ip_links(cls, name=None):
+        """Returns the ``ip -o link show`` lines of the current ``netns``."""
+        cmd = 'ip -o link show' + (' dev {}'.format(name) if name else '')
+        return CommandLine(cls.netns_command(cmd), sudo=True).execute().stdout.splitlines()
+
     @classmethod
     def all_iface_names(cls, filter=None):
-        return [dev for dev in os.listdir(cls.SYS_CLASS_NET) if not filter or filter in dev]
+        inventory = cls.inventory()
+        if inventory is not None:
+            names = inventory.names()
+        elif cls.netns:
+            names = [match.group(1) for match in map(_IP_LINK_NAME_REGEX.match, cls._ip_links()) if match]
+        else:
+            names = os.listdir(cls.SYS_CLASS_NET)  # /sys shows the devices of our own namespace only
+        return [dev for dev in names if not filter or filter in dev]
+
+    @classmethod
+    def module_loaded(cls, name):
+        """Returns True if given module is loaded into the kernel (or built in)."""
+        return os.path.isdir(pjoin(cls.SYS_MODULE, name))
 
     @classmethod
     def load_module(cls, name, **kwargs):
         """Loads given module into kernel. Any kwargs are passed as key=value pairs."""
         kwargs_str = " ".join('{}={}'.format(k, v) for k, v in kwargs.items())
         cmd = 'modprobe {} {}'.format(name, kwargs_str).rstrip()
-        CommandLine(cmd, sudo=True).execute()
+        with timings.phase('load_module', module=name):
+            CommandLine(cmd, sudo=True).execute()
 
     @classmethod
     def remove_module(cls, name):
@@ -36,10 +171,58 @@ class DeviceManager(object):
     @classmethod
     def shutdown_module(cls, name):
         """Sets down all module-related devices, then removes module from kernel."""
-        for ifname in cls.all_iface_names(filter=name):
-            cls.device_down(ifname)
+        cls.set_state_many(cls.all_iface_names(filter=name), 'down')
         cls.remove_module(name)
 
+    @classmethod
+    def run_batch(cls, lines, ignore_errors=False):
+        """Runs given ``ip`` commands (without the 'ip', e.g. 'link add ifb3 type ifb') in the current
+        ``netns`` with a single 'ip -batch'. The batch stops at the first failing command, unless
+        ``ignore_errors`` (then all are run, and failures are ignored)."""
+        if not lines:
+            return
+        cmd = 'ip -force -batch -' if ignore_errors else 'ip -batch -'
+        batch = PipedCommandLine(cls.netns_command(cmd), ignore_errors=ignore_errors, sudo=True).start()
+        for line in lines:
+            if not batch.feed(line):
+                break  # the batch stopped at a failed command
+        batch.finish(timeout=cls.BATCH_TIMEOUT)
+
+    @classmethod
+    def add_devices(cls, names):
+        """Adds the network devices of given names (e.g. 'ifb3', 'dummy0') at once, the type of each
+        being its module name. veth devices come in pairs: each two consecutive veth names (e.g.
+        'veth0', 'veth1') are added as the two ends of a pair."""
+        existing = set(cls.all_iface_names())
+        assert not existing.intersection(names), 'Devices already exist: {!r}'.format(
+            [name for name in names if name in existing])
+        veths = [name for name in names if cls.split_name(name)[0] == 'veth']
+        assert len(veths) % 2 == 0, 'veth devices are added in pairs, got: {!r}'.format(veths)
+        lines = ['link add {} type {}'.format(name, cls.split_name(name)[0]) for name in names
+                 if cls.split_name(name)[0] != 'veth']
+        lines.extend('link add {} type veth peer name {}'.format(name, peer)
+                     for name, peer in zip(veths[::2], veths[1::2]))
+        with timings.phase('add_devices', count=len(names)):
+            cls.run_batch(lines)
+
+    @classmethod
+    def set_state_many(cls, names, state):
+        """Sets the network devices of given names 'up' or 'down' at once."""
+        assert state in ('up', 'down'), "state must be 'up' or 'down', got {!r}".format(state)
+        existing = set(cls.all_iface_names())
+        missing = [name for name in names if name not in existing]
+        assert not missing, 'Devices do NOT exist: {!r}'.format(missing)
+        with timings.phase('set_state_many', count=len(names)):
+            cls.run_batch(['link set dev {} {}'.format(name, state) for name in names])
+
+    @classmethod
+    def delete_many(cls, names):
+        """Deletes the network devices of given names at once; the ones that do not exist are skipped.
+        Deleting one end of a veth pair deletes the other, so failing deletions are ignored."""
+        existing = set(cls.all_iface_names())
+        with timings.phase('delete_many', count=len(names)):
+            cls.run_batch(['link del {}'.format(name) for name in names if name in existing], ignore_errors=True)
+
     @classmethod
     def split_name(cls, name):
         module = name.rstrip("0123456789")
@@ -78,41 +261,51 @@ class DeviceManager(object):
 
     @classmethod
     def device_exists(cls, name):
+        inventory = cls.inventory()
+        if inventory is not None:
+            return inventory.get(name) is not None
         return name in cls.all_iface_names()
 
     @classmethod
     def device_add(cls, name):
         assert not cls.device_exists(name), 'Device already exists: {!r}'.format(name)
         module, _ = cls.split_name(name)
-        CommandLine("ip link add {} type {}".format(name, module), sudo=True).execute()
+        CommandLine(cls.netns_command("ip link add {} type {}".format(name, module)), sudo=True).execute()
         assert cls.device_exists(name)
 
     @classmethod
     def ensure_device(cls, name):
-        if cls.device_exists(name):
-            return
-        cls.device_add(name)
+        with timings.phase('ensure_device', device=name):
+            if cls.device_exists(name):
+                return
+            cls.device_add(name)
 
     @classmethod
     def device_is_down(cls, name):
         """Returns True if given network device down, otherwise returns False.
-        Consults /sys/class/net/{device-name}/operstate.
+        Consults the device inventory (if in use) or /sys/class/net/{device-name}/operstate.
 
         :return: bool
         """
         assert cls.device_exists(name), "Device does not exist: {!r}".format(name)
+        inventory = cls.inventory()
+        if inventory is not None:
+            return inventory.get(name).operstate == 'down'
+        if cls.netns:
+            return ' state DOWN ' in cls._ip_links(name)[0]
         with open(pjoin(cls.SYS_CLASS_NET, name, 'operstate')) as fhl:
             return 'down' == fhl.read().strip().lower()
 
     @classmethod
     def device_up(cls, name):
-        assert cls.device_exists(name), 'Device does NOT exist: {!r}'.format(name)
-        CommandLine("ip link set dev {} up".format(name), sudo=True).execute()
+        with timings.phase('device_up', device=name):
+            assert cls.device_exists(name), 'Device does NOT exist: {!r}'.format(name)
+            CommandLine(cls.netns_command("ip link set dev {} up".format(name)), sudo=True).execute()
 
     @classmethod
     def device_down(cls, name):
         assert cls.device_exists(name), 'Device does NOT exist: {!r}'.format(name)
-        CommandLine("ip link set dev {} down".format(name), sudo=True).execute()
+        CommandLine(cls.netns_command("ip link set dev {} down".format(name)), sudo=True).execute()
 
 
 class NetDeviceNotFound(Exception):
@@ -164,7 +357,8 @@ class NetDevice(object):
             new_name = "{}{}".format(module, num)
 
         # create and return new instance:
-        DeviceManager.load_module(module, **{'num{}s'.format(module): 0})
+        if not DeviceManager.module_loaded(module):
+            DeviceManager.load_module(module, **{'num{}s'.format(module): 0})
         DeviceManager.ensure_device(new_name)  # load_module() may have created the device
         dev = cls(new_name, target_factory)
         cls._iface_map[new_name] = dev
@@ -173,6 +367,7 @@ class NetDevice(object):
     def __init__(self, name, target_factory=None):
         assert isinstance(name, str)
         self._name = name
+        self._netns = DeviceManager.netns
         if not target_factory:
             target_factory = default_target_factory
         self._egress_chain = target_factory(self, DIR_EGRESS)
@@ -183,6 +378,11 @@ class NetDevice(object):
     def name(self):
         return self._name
 
+    @property
+    def netns(self):
+        """The network namespace the device lives in (None for our own)."""
+        return self._netns
+
     @property
     def egress(self):
         return self._egress_chain
@@ -0,0 +1,279 @@
+"""
+Traffic control plans.
+
+A plan is a structured snapshot of the kernel traffic control state that a
+sequence of ``tc`` commands (as built by the ``TcTarget`` family) results in.
+Plans know nothing about how they are applied; they are used to compare two
+setups and compute the smallest set of ``tc`` commands turning one into the
+other, so that switching between setups does not need a full clear and rebuild.
+
+Example::
+
+  old = TcPlan(['tc qdisc add dev lo root handle 1:0 htb',
+                'tc class add dev lo parent 1:0 classid 1:1 htb rate 512kbit'])
+  new = TcPlan(['tc qdisc add dev lo root handle 1:0 htb',
+                'tc class add dev lo parent 1:0 classid 1:1 htb rate 2mbit'])
+  old.diff(new)  # ['tc class change dev lo parent 1:0 classid 1:1 htb rate 2mbit']
+
+"""
+import re
+from collections import namedtuple, OrderedDict
+
+
+KIND_QDISC = 'qdisc'
+KIND_CLASS = 'class'
+KIND_FILTER = 'filter'
+
+_QDISC_REGEX = re.compile(r'^tc qdisc add dev (?P<dev>\S+)(?: (?P<parent>root|ingress|parent \S+))?'
+                          r' handle (?P<nodeid>\S+) (?P<spec>.+)$')
+_CLASS_REGEX = re.compile(r'^tc class add dev (?P<dev>\S+) parent (?P<parent>\S+)'
+                          r' classid (?P<nodeid>\S+) (?P<spec>.+)$')
+_FILTER_REGEX = re.compile(r'^tc filter add dev (?P<dev>\S+) parent (?P<parent>\S+) protocol (?P<protocol>\S+)'
+                           r'(?: prio (?P<prio>\d+))? (?P<spec>.+?)(?: flowid (?P<flowid>\S+))?$')
+_CLEAR_REGEX = re.compile(r'^tc qdisc del dev (?P<dev>\S+) (?P<chain>root|ingress)$')
+
+
+class PlanSyntaxError(Exception):
+    """Raised when a command cannot be interpreted as a plan step."""
+
+
+class PlanNode(namedtuple('PlanNode', 'kind dev parent nodeid spec protocol flowid')):
+    """A single qdisc, class or filter of a plan.
+
+    ``parent`` is one of 'root', 'ingress' or the id of the parent node;
+    ``nodeid`` is the qdisc handle, the classid or the filter prio (None if
+    the filter is prio-less and gets one assigned by the kernel).
+    """
+
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """The identity of this node within its plan. (Filter prios are unique per parent only.)"""
+        if self.kind == KIND_FILTER:
+            return self.kind, self.dev, self.parent, self.spec if self.nodeid is None else self.nodeid
+        return self.kind, self.dev, self.nodeid
+
+    @property
+    def chain(self):
+        """'root' or 'ingress' for top-level qdiscs, None otherwise."""
+        if self.kind == KIND_QDISC and self.parent in ('root', 'ingress'):
+            return self.parent
+        return None
+
+    def depends_on(self):
+        """Returns the keys of the nodes that must exist for this node to exist."""
+        if self.kind == KIND_QDISC:
+            return [] if self.chain else [(KIND_CLASS, self.dev, self.parent)]
+        keys = [_id2key(self.dev, self.parent)]
+        if self.flowid:
+            keys.append((KIND_CLASS, self.dev, self.flowid))
+        return keys
+
+    def add_command(self):
+        if self.kind == KIND_QDISC:
+            if self.spec == 'ingress':
+                return "tc qdisc add dev {} handle {} ingress".format(self.dev, self.nodeid)
+            return "tc qdisc add dev {} {} handle {} {}".format(self.dev, self._parent_clause(), self.nodeid, self.spec)
+        if self.kind == KIND_CLASS:
+            return "tc class add dev {} parent {} classid {} {}".format(self.dev, self.parent, self.nodeid, self.spec)
+        return "tc filter add dev {} parent {} protocol {}{} {}{}".format(
+            self.dev, self.parent, self.protocol, self._prio_clause(), self.spec, self._flowid_clause())
+
+    def change_command(self):
+        """Returns a command changing the parameters of this node in place, or None
+        if the kernel does not support changing this kind of node."""
+        if self.kind == KIND_QDISC and self.spec != 'ingress':
+            return "tc qdisc change dev {} {} handle {} {}".format(self.dev, self._parent_clause(), self.nodeid,
+                                                                   self.spec)
+        if self.kind == KIND_CLASS:
+            return "tc class change dev {} parent {} classid {} {}".format(self.dev, self.parent, self.nodeid,
+                                                                           self.spec)
+        return None
+
+    def del_command(self):
+        if self.kind == KIND_QDISC:
+            if self.chain:
+                return "tc qdisc del dev {} {}".format(self.dev, self.chain)
+            return "tc qdisc del dev {} parent {} handle {}".format(self.dev, self.parent, self.nodeid)
+        if self.kind == KIND_CLASS:
+            return "tc class del dev {} classid {}".format(self.dev, self.nodeid)
+        return "tc filter del dev {} parent {} protocol {}{}".format(self.dev, self.parent, self.protocol,
+                                                                    self._prio_clause())
+
+    def _parent_clause(self):
+        return self.chain if self.chain else 'parent ' + self.parent
+
+    def _prio_clause(self):
+        return ' prio {}'.format(self.nodeid) if self.nodeid is not None else ''
+
+    def _flowid_clause(self):
+        return ' flowid {}'.format(self.flowid) if self.flowid else ''
+
+
+def _id2key(dev, nodeid):
+    """Qdisc handles have a zero minor ('1:0'), classids do not ('1:1')."""
+    kind = KIND_QDISC if nodeid.endswith(':0') or nodeid.endswith(':') else KIND_CLASS
+    return kind, dev, nodeid
+
+
+def parse_command(cmd):
+    """Parses a ``tc`` command as built by ``TcTarget`` into a ``PlanNode``.
+    Chain clearing commands are returned as a (dev, chain) tuple.
+
+    :param cmd: string - the tc command
+    :return: PlanNode or tuple
+    """
+    match = _CLEAR_REGEX.match(cmd)
+    if match:
+        return match.group('dev'), match.group('chain')
+    match = _QDISC_REGEX.match(cmd)
+    if match:
+        parent = match.group('parent')
+        if parent is None:
+            parent = 'ingress' if match.group('spec') == 'ingress' else 'root'
+        elif parent.startswith('parent '):
+            parent = parent[len('parent '):]
+        return PlanNode(KIND_QDISC, match.group('dev'), parent, match.group('nodeid'), match.group('spec'),
+                        None, None)
+    match = _CLASS_REGEX.match(cmd)
+    if match:
+        return PlanNode(KIND_CLASS, match.group('dev'), match.group('parent'), match.group('nodeid'),
+                        match.group('spec'), None, None)
+    match = _FILTER_REGEX.match(cmd)
+    if match:
+        prio = int(match.group('prio')) if match.group('prio') else None
+        return PlanNode(KIND_FILTER, match.group('dev'), match.group('parent'), prio, match.group('spec'),
+                        match.group('protocol'), match.group('flowid'))
+    raise PlanSyntaxError("Not a plan command: {!r}".format(cmd))
+
+
+class TcPlan(object):
+    """An ordered set of ``PlanNode`` objects: the tc state a command sequence builds."""
+
+    def __init__(self, commands=None):
+        self._nodes = OrderedDict()
+        self._chains = list()  # (dev, chain) pairs touched, incl. cleared ones
+        if commands:
+            self.extend(commands)
+
+    def add_command(self, cmd):
+        """Updates this plan with the effect of given tc command."""
+        parsed = parse_command(cmd)
+        if not isinstance(parsed, PlanNode):
+            self._clear_chain(*parsed)
+            return
+        if parsed.chain:
+            self._touch_chain(parsed.dev, parsed.chain)
+        self._nodes[parsed.key] = parsed
+
+    def extend(self, commands):
+        for cmd in commands:
+            self.add_command(cmd)
+
+    @property
+    def nodes(self):
+        return list(self._nodes.values())
+
+    @property
+    def chains(self):
+        """The (dev, chain) pairs this plan sets up or clears."""
+        return list(self._chains)
+
+    def renamed(self, devices):
+        """Returns a copy of this plan with devices renamed, e.g. to set up one compiled profile
+        on many devices. (Device names inside specs, like mirred redirect targets, are kept.)
+
+        :param devices: dict - old name -> new name; devices not in it keep their names
+        :return: TcPlan
+        """
+        plan = TcPlan()
+        for node in self._nodes.values():
+            node = node._replace(dev=devices.get(node.dev, node.dev))
+            plan._nodes[node.key] = node
+        plan._chains = [(devices.get(dev, dev), chain) for dev, chain in self._chains]
+        return plan
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __eq__(self, other):
+        """Plans are equal if they describe the same state, regardless of the order of the nodes."""
+        return isinstance(other, TcPlan) and dict(self._nodes) == dict(other._nodes)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _touch_chain(self, dev, chain):
+        if (dev, chain) not in self._chains:
+            self._chains.append((dev, chain))
+
+    def _clear_chain(self, dev, chain):
+        self._touch_chain(dev, chain)
+        for key in self._subtree_keys(lambda node: node.dev == dev and node.chain == chain):
+            del self._nodes[key]
+
+    def _subtree_keys(self, is_top):
+        """Returns the keys of nodes matching ``is_top`` and of all nodes depending on them."""
+        doomed = set()
+        for key, node in self._nodes.items():  # parents always precede children
+            if is_top(node) or any(dep in doomed for dep in node.depends_on()):
+                doomed.add(key)
+        return [key for key in self._nodes if key in doomed]
+
+    def commands(self, clear=False):
+        """Returns the commands building this plan from scratch.
+
+        :param clear: bool - whether to prepend commands clearing each chain this plan touches
+        :return: list of strings
+        """
+        result = ["tc qdisc del dev {} {}".format(dev, chain) for dev, chain in self._chains] if clear else []
+        result.extend(node.add_command() for node in self._nodes.values())
+        return result
+
+    def diff(self, other):
+        """Returns the commands that turn the state of this plan into the state
+        of ``other``. Nodes present in both plans with the same parent and kind
+        are changed in place; anything else is removed and/or added.
+
+        :param other: TcPlan - the target plan
+        :return: list of strings - tc commands, deletions first
+        """
+        mine, theirs = self._nodes, other._nodes
+        changed, replaced = list(), set()
+        for key, node in mine.items():
+            new = theirs.get(key)
+            if new is None:
+                replaced.add(key)
+            elif new != node:
+                if (new.parent, new.spec.split()[0]) == (node.parent, node.spec.split()[0]) and new.change_command():
+                    changed.append(new)
+                else:
+                    replaced.add(key)
+
+        removed = set(self._subtree_keys(lambda node: node.key in replaced))
+        result = list()
+        # filters first: the kernel refuses to delete a class that is still bound to a filter
+        for kind in (KIND_FILTER, KIND_CLASS, KIND_QDISC):
+            for key in reversed(list(mine)):
+                node = mine[key]
+                if node.kind == kind and key in removed and self._needs_delete(node, removed):
+                    result.append(node.del_command())
+        result.extend(node.change_command() for node in changed if node.key not in removed)
+        result.extend(node.add_command() for key, node in theirs.items() if key not in mine or key in removed)
+        return result
+
+    def _needs_delete(self, node, removed):
+        """Tells whether a node being removed needs its own delete command or goes
+        away together with its parent (deleting a qdisc or a class drops everything
+        below it, but a class cannot be deleted while it has child classes)."""
+        parent = node.depends_on()[0] if node.depends_on() else None
+        if parent not in removed:
+            return True
+        if node.kind != KIND_CLASS:
+            return False
+        while parent in removed:
+            if parent[0] == KIND_QDISC:
+                return False
+            parent = self._nodes[parent].depends_on()[0]
+        return True
@@ -14,13 +14,23 @@ thus actually configure the kernel with that setup.
 
 The other implementations here may print the setup to a file or stdout and are useful for testing purposes.
 
+``TcPipelineTarget`` also configures the kernel, but applies the commands as they are built instead of on
+``marshal()``.
+
 Targets of the same "family" differ mainly in their ``marshal()`` where the "installing" behaviour is
 implemented.
 
 """
+import asyncio
+
 from pyltc.core import ITarget, DIR_EGRESS, DIR_INGRESS
 from pyltc.core.ltcnode import Qdisc, QdiscClass, Filter
-from pyltc.util.cmdline import CommandLine, CommandFailed
+from pyltc.core.plan import TcPlan
+from pyltc.util.cmdline import CommandLine, AsyncCommandLine, PipedCommandLine, CommandFailed
+
+
+#: how long (in sec.) ``TcPipelineTarget.marshal()`` waits for the rest of its batch to be applied
+BATCH_TIMEOUT = 60
 
 
 class TcTarget(ITarget):
@@ -52,9 +62,23 @@ class TcTarget(ITarget):
         self._verbose = None
         self.configure()
 
+    def _append(self, cmd, node=None):
+        """Appends a command to the setup, notifying the observers (see ``ITargetObserver``)."""
+        self._commands.append(cmd)
+        if self.observers:
+            self._notify('on_node_added', node, cmd)
+
+    def _marshal_started(self):
+        if self.observers:
+            self._notify('on_marshal_start', tuple(self._commands))
+
+    def _marshal_ended(self):
+        if self.observers:
+            self._notify('on_marshal_end')
+
     def clear(self):
         cmd = "tc qdisc del dev {} {}".format(self._iface.name, self._chain_name)
-        self._commands.append(cmd)
+        self._append(cmd)
 
     def configure(self, **kw):
         self._verbose = kw.pop('verbose', False)
@@ -69,7 +93,7 @@ class TcTarget(ITarget):
             'qdisc_repr': self.as_subcommand(qdisc),
         }
         cmd = "tc qdisc add dev {iface} {parent} handle {handle} {qdisc_repr}".format(**cmd_params)
-        self._commands.append(cmd)
+        self._append(cmd, qdisc)
         return qdisc
 
     def set_root_qdisc(self, name, **kw):
@@ -84,7 +108,7 @@ class TcTarget(ITarget):
             'klass_repr': self.as_subcommand(qdisc_class),
         }
         cmd = "tc class add dev {iface} parent {parentid} classid {classid} {klass_repr}".format(**cmd_params)
-        self._commands.append(cmd)
+        self._append(cmd, qdisc_class)
         return qdisc_class
 
     def add_filter(self, name, parent, cond, flownode, prio=None, handle=None):
@@ -111,7 +135,7 @@ class TcTarget(ITarget):
         }
         cmd = ("tc filter add dev {iface} parent {parentid} protocol ip prio {prio}"
                " {name} match {cond} flowid {flowid}").format(**cmd_params)
-        self._commands.append(cmd)
+        self._append(cmd, filter)
         return filter
 
     def set_redirect(self, pridev, ifbdev):
@@ -122,8 +146,8 @@ class TcTarget(ITarget):
             'pridev': pridev.name,
             'ifbdev': ifbdev.name,
         }
-        self._commands.append(cmd1.format(**args))
-        self._commands.append(cmd2.format(**args))
+        self._append(cmd1.format(**args))
+        self._append(cmd2.format(**args))
 
 
 class PrintingTcTarget(TcTarget):
@@ -137,9 +161,31 @@ class PrintingTcTarget(TcTarget):
     """
 
     def marshal(self):
+        self._marshal_started()
         print("** PRINTING ONLY: tc", self._direction, "commands **")
         for cmd in self._commands:
             print(cmd)
+        self._marshal_ended()
+
+
+class TcPlanTarget(TcTarget):
+    """TcTarget sub-class that does not touch the kernel: on ``marshal()`` it
+    records the accumulated commands into a ``TcPlan``. Several targets may share
+    one plan, which then describes the setup of all of their chains.
+    """
+
+    def __init__(self, iface, direction, plan=None):
+        super(TcPlanTarget, self).__init__(iface, direction)
+        self._plan = plan if plan is not None else TcPlan()
+
+    @property
+    def plan(self):
+        return self._plan
+
+    def marshal(self):
+        self._marshal_started()
+        self._plan.extend(self._commands)
+        self._marshal_ended()
 
 
 class TcFileTarget(TcTarget):
@@ -159,12 +205,16 @@ class TcFileTarget(TcTarget):
         super(TcFileTarget, self).configure(**kw)
 
     def marshal(self):
-        result = '\n'.join(self._commands)
-        if self._verbose:
-            print(result)
-        if self._filename:
-            with open(self._filename, 'w') as fhl:
-                fhl.write(result + '\n')
+        self._marshal_started()
+        try:
+            result = '\n'.join(self._commands)
+            if self._verbose:
+                print(result)
+            if self._filename:
+                with open(self._filename, 'w') as fhl:
+                    fhl.write(result + '\n')
+        finally:
+            self._marshal_ended()
 
 
 class TcCommandTarget(TcTarget):
@@ -175,13 +225,101 @@ class TcCommandTarget(TcTarget):
     def __init__(self, iface, direction):
         super(TcCommandTarget, self).__init__(iface, direction)
 
+    def _in_netns(self, cmd_str):
+        """Makes a command run in the network namespace of our device, e.g. 'tc -n ns1 qdisc add ...'."""
+        if not self._iface.netns:
+            return cmd_str
+        return cmd_str.replace('tc ', 'tc -n {} '.format(self._iface.netns), 1)
+
     def _marshal(self):
         for idx, cmd_str in enumerate(self._commands):
             ignore_errs = (idx == 0 and " del" in cmd_str)  # removal failures are expected, ignore
-            CommandLine(cmd_str, ignore_errors=ignore_errs, verbose=self._verbose, sudo=True).execute()
+            command = CommandLine(self._in_netns(cmd_str), ignore_errors=ignore_errs, verbose=self._verbose,
+                                  sudo=True)
+            try:
+                command.execute()
+            finally:
+                if self.observers and command.returncode is not None:
+                    self._notify('on_command_result', cmd_str, command)
 
     def marshal(self):
+        self._marshal_started()
         try:
             self._marshal()
         except CommandFailed as exc:
             print(exc)
+        finally:
+            self._marshal_ended()
+
+    async def _marshal_async(self):
+        for idx, cmd_str in enumerate(self._commands):
+            ignore_errs = (idx == 0 and " del" in cmd_str)  # removal failures are expected, ignore
+            command = AsyncCommandLine(self._in_netns(cmd_str), ignore_errors=ignore_errs, verbose=self._verbose,
+                                       sudo=True)
+            try:
+                await command.execute()
+            finally:
+                if self.observers and command.returncode is not None:
+                    self._notify('on_command_result', cmd_str, command)
+
+    async def marshal_async(self):
+        self._marshal_started()
+        try:
+            await self._marshal_async()
+        except CommandFailed as exc:
+            print(exc)
+        finally:
+            self._marshal_ended()
+
+
+class TcPipelineTarget(TcCommandTarget):
+    """A ``TcCommandTarget`` that applies its commands while the setup is still being built: each
+    command is fed, as soon as it is built, to a ``tc -batch -`` process, so that generating a large
+    setup and programming the kernel overlap. (The commands are built in order - a node after the
+    nodes it refers to - so a command is applied after the nodes it needs exist.) The initial
+    clearing command is executed on its own, as its failure is expected and ignored.
+
+    The batch stops at its first failing command and the rest of the setup is not fed to it.
+    ``marshal()`` waits for the batch to finish and reports its failure, if any.
+
+    Note that unlike with the other targets, the kernel is changed before ``marshal()``; if building
+    the setup fails, ``abort()`` stops the batch instead.
+    """
+
+    def __init__(self, iface, direction):
+        self._batch = None
+        super(TcPipelineTarget, self).__init__(iface, direction)
+
+    def _append(self, cmd, node=None):
+        super(TcPipelineTarget, self)._append(cmd, node)
+        if len(self._commands) == 1 and " del" in cmd:  # removal failures are expected, ignore
+            command = CommandLine(self._in_netns(cmd), ignore_errors=True, verbose=self._verbose, sudo=True)
+            command.execute()
+            if self.observers:
+                self._notify('on_command_result', cmd, command)
+            return
+        if self._batch is None:
+            self._batch = PipedCommandLine(self._in_netns('tc -batch -'), verbose=self._verbose, sudo=True).start()
+        self._batch.feed(cmd[len('tc '):])
+
+    def _marshal(self):
+        batch, self._batch = self._batch, None
+        if batch is None:
+            return
+        try:
+            batch.finish(timeout=BATCH_TIMEOUT, verbose=self._verbose)
+        except BaseException:
+            batch.terminate()
+            raise
+        finally:
+            if self.observers and batch.returncode is not None:
+                self._notify('on_command_result', batch.cmdline, batch)
+
+    async def _marshal_async(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._marshal)
+
+    def abort(self):
+        """Terminates the batch, if any, without feeding it the rest of the setup."""
+        batch, self._batch = self._batch, None
+        if batch is not None:
+            batch.terminate()
@@ -11,7 +11,7 @@ command.
 
 """
 from pyltc.core import DIR_EGRESS, DIR_INGRESS
-from pyltc.core.target import TcCommandTarget, TcFileTarget, PrintingTcTarget
+from pyltc.core.target import TcCommandTarget, TcFileTarget, PrintingTcTarget, TcPlanTarget, TcPipelineTarget
 
 
 def default_target_factory(iface, direction, callback=None):
@@ -56,6 +56,23 @@ def tc_file_target_factory(iface, direction):
     return target
 
 
+def plan_target_factory(plan):
+    """
+    Returns a factory of ``TcPlanTarget`` objects which all record into given plan.
+
+    :param plan: TcPlan - the plan to collect the marshalled commands in
+    :return: callable - the target factory
+    """
+    def factory(iface, direction):
+        accepted_values = (DIR_EGRESS, DIR_INGRESS)
+        assert direction in accepted_values, "direction must be one of {!r}".format(accepted_values)
+        return TcPlanTarget(iface, direction, plan)
+    return factory
+
+
 #: Note that in case a tc target is not configurable via ``target.configure()``,
 #: then the class can sreve as the factory:
 printing_target_factory = PrintingTcTarget
+
+#: The factory of targets applying the setup while it is being built (see ``TcPipelineTarget``):
+pipeline_target_factory = TcPipelineTarget
@@ -0,0 +1,294 @@
+"""
+High-frequency backlog sampler.
+
+Samples the backlog, queue length, drops and byte counters of HTB classes
+every few milliseconds - fast enough to see the queueing delay a profile
+introduces, which the once-a-second ``stats`` (see ``pyltc.plugins.stats``)
+averages away. Samples are kept in a ``BacklogRing``: NumPy arrays allocated
+once, for a fixed number of samples, and overwritten in place, oldest first::
+
+ $ sudo ./ltc.py backlog -c examples/my.profile 4g --interval 0.002 --duration 30 --output 4g.npz
+
+The sojourn time of a class is estimated with Little's law, as its backlog
+over its service rate: the configured rate of the branch (a queue only builds
+up in a class sending at its rate), or the rate the class is measured to
+send at if it is not a profile branch. Rolling percentiles of it are printed
+every ``--report`` seconds; ``--output`` saves the samples to a compressed
+``.npz`` file, which ``BacklogRing.load()`` (or plain ``numpy.load()``) reads
+back for offline analysis.
+
+A sample is one rtnetlink class dump per device. Requires NumPy.
+"""
+import math
+import time
+import warnings
+from collections import namedtuple
+
+from pyltc.util.netlink import RtnlSocket
+from pyltc.util.rates import convert2bps
+from pyltc.util.optional import numpy as np, require_numpy
+
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_REPORT = 1.0
+DEFAULT_SPAN = 60.0
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+#: samples the measured rate of classes that are not profile branches is computed over
+RATE_WINDOW = 10
+
+#: A sampled class: the device, the class handle, and the spec of the simnet branch it shapes ('' if none).
+Node = namedtuple('Node', 'dev handle branch')
+
+
+class BacklogError(Exception):
+    """Raised when the classes to sample cannot be found, or NumPy is missing."""
+
+
+class BacklogRing(object):
+    """Fixed-size storage of the samples of a set of classes, overwritten oldest first.
+
+    ``times`` holds the time of each sample; ``backlog`` (bytes), ``qlen`` (packets), ``drops``
+    and ``bytes`` hold a column per node. The samples are in ring order; ``window()`` returns
+    them oldest first.
+    """
+
+    def __init__(self, nodes, capacity, rates=None):
+        """Initializer.
+
+        :param nodes: list of ``Node`` - the sampled classes, one column each
+        :param capacity: int - the number of samples kept
+        :param rates: list of floats - the service rate of each node in bits per second,
+                      NaN (or None) where it is to be measured
+        """
+        require_numpy(BacklogError, 'the backlog sampler')
+        if capacity < 2:
+            raise BacklogError("Capacity must be at least two samples, got {}".format(capacity))
+        self.nodes = list(nodes)
+        self.capacity = capacity
+        width = len(self.nodes)
+        self.times = np.zeros(capacity)
+        self.backlog = np.zeros((capacity, width), dtype=np.uint32)
+        self.qlen = np.zeros((capacity, width), dtype=np.uint32)
+        self.drops = np.zeros((capacity, width), dtype=np.uint32)
+        self.bytes = np.zeros((capacity, width), dtype=np.uint64)
+        self.rates = np.full(width, np.nan)
+        if rates is not None:
+            self.rates[:] = [np.nan if rate is None else rate for rate in rates]
+        #: the number of samples written so far (``len()`` is at most ``capacity``)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def advance(self, timestamp):
+        """Starts a new sample at given time and returns its row, with its counters zeroed."""
+        row = self.count % self.capacity
+        self.times[row] = timestamp
+        self.backlog[row] = 0
+        self.qlen[row] = 0
+        self.drops[row] = 0
+        self.bytes[row] = 0
+        self.count += 1
+        return row
+
+    def _rows(self, samples=None):
+        stored = len(self)
+        samples = stored if samples is None else min(samples, stored)
+        return np.arange(self.count - samples, self.count) % self.capacity
+
+    def window(self, samples=None):
+        """Returns copies of (times, backlog, qlen, drops, bytes) of the last ``samples``
+        samples (all stored if None), oldest first."""
+        rows = self._rows(samples)
+        return self.times[rows], self.backlog[rows], self.qlen[rows], self.drops[rows], self.bytes[rows]
+
+    def sojourn(self, samples=None, rate_window=RATE_WINDOW):
+        """Returns the estimated sojourn time (seconds) of each node at each of the last ``samples``
+        samples, as an array of (samples, nodes): the backlog over the configured rate, or over the
+        rate measured over ``rate_window`` samples (NaN before there are as many) if none."""
+        samples = len(self) if samples is None else min(samples, len(self))
+        times, backlog, _, _, nbytes = self.window(samples + rate_window)
+        rates = np.broadcast_to(self.rates, backlog.shape).copy()
+        measured = np.isnan(self.rates)
+        if measured.any():
+            rates[:] = np.nan
+            sent = nbytes[rate_window:].astype(float) - nbytes[:-rate_window]
+            elapsed = (times[rate_window:] - times[:-rate_window])[:, np.newaxis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rates[rate_window:] = sent * 8 / elapsed
+            rates[:, ~measured] = self.rates[~measured]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.where(backlog > 0, backlog * 8.0 / rates, 0.0)
+        return result[-samples:] if samples else result[:0]
+
+    def percentiles(self, percentiles=DEFAULT_PERCENTILES, samples=None, rate_window=RATE_WINDOW):
+        """Returns the given percentiles of the sojourn time of each node over the last ``samples``
+        samples, as an array of (percentiles, nodes); NaN where none is known."""
+        sojourn = self.sojourn(samples, rate_window)
+        if not len(sojourn):
+            return np.full((len(percentiles), len(self.nodes)), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+            return np.nanpercentile(sojourn, percentiles, axis=0)
+
+    def save(self, path, samples=None):
+        """Saves the last ``samples`` samples (all stored if None), oldest first, to a
+        compressed ``.npz`` file."""
+        times, backlog, qlen, drops, nbytes = self.window(samples)
+        np.savez_compressed(path, times=times, backlog=backlog, qlen=qlen, drops=drops, bytes=nbytes,
+                            rates=self.rates, devs=np.array([node.dev for node in self.nodes], dtype=str),
+                            handles=np.array([node.handle for node in self.nodes], dtype=str),
+                            branches=np.array([node.branch for node in self.nodes], dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """Returns a ring holding the samples saved to given file."""
+        require_numpy(BacklogError, 'the backlog sampler')
+        with np.load(path) as data:
+            nodes = [Node(str(dev), str(handle), str(branch))
+                     for dev, handle, branch in zip(data['devs'], data['handles'], data['branches'])]
+            ring = cls(nodes, max(len(data['times']), 2), data['rates'])
+            ring.count = len(data['times'])
+            ring.times[:ring.count] = data['times']
+            for name in ('backlog', 'qlen', 'drops', 'bytes'):
+                getattr(ring, name)[:ring.count] = data[name]
+        return ring
+
+
+class BacklogSampler(object):
+    """Samples the classes of simnet branches, or all classes of devices, into a ``BacklogRing``."""
+
+    def __init__(self, capacity, branches=None, devices=None, netns=None, clock=time.monotonic):
+        """Initializer.
+
+        :param capacity: int - the number of samples the ring keeps
+        :param branches: iterable of simnet ``Branch`` objects - the classes to sample
+        :param devices: iterable of strings - without branches, the devices all classes of are sampled
+        :param netns: string - the named network namespace of the devices, None for the current one
+        :param clock: callable - monotonic clock returning seconds
+        """
+        require_numpy(BacklogError, 'the backlog sampler')
+        self._clock = clock
+        self._rtnl = RtnlSocket(netns)
+        try:
+            branches = list(branches or ())
+            indexes = dict((name, ifindex) for ifindex, name in self._rtnl.links().items())
+            missing = sorted((set(branch.dev for branch in branches) | set(devices or ())) - set(indexes))
+            if missing:
+                raise BacklogError("No such device(s): {}".format(', '.join(missing)))
+            if branches:
+                nodes = [Node(branch.dev, branch.classid, branch.spec) for branch in branches]
+                rates = [convert2bps(branch.rate) for branch in branches]
+            else:
+                nodes = [Node(dev, stats.handle, '') for dev in devices or ()
+                         for stats in self._rtnl.classes(indexes[dev])]
+                rates = None
+            if not nodes:
+                raise BacklogError("No classes to sample")
+        except Exception:
+            self._rtnl.close()
+            raise
+        #: column of each class handle, by device index
+        self._columns = dict()
+        for column, node in enumerate(nodes):
+            self._columns.setdefault(indexes[node.dev], dict())[node.handle] = column
+        self.ring = BacklogRing(nodes, capacity, rates)
+        #: the number of samples skipped because sampling fell behind the interval
+        self.overruns = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._rtnl.close()
+
+    def sample(self):
+        """Dumps the classes and writes their counters to the next row of the ring."""
+        ring = self.ring
+        row = ring.advance(self._clock())
+        backlog, qlen, drops, nbytes = ring.backlog[row], ring.qlen[row], ring.drops[row], ring.bytes[row]
+        for ifindex, columns in self._columns.items():
+            for stats in self._rtnl.classes(ifindex):
+                column = columns.get(stats.handle)
+                if column is not None:
+                    backlog[column] = stats.backlog
+                    qlen[column] = stats.qlen
+                    drops[column] = stats.drops
+                    nbytes[column] = stats.bytes
+        return row
+
+    def run(self, interval=DEFAULT_INTERVAL, count=None, sleep=time.sleep, on_sample=None):
+        """Samples every ``interval`` seconds, ``count`` times (forever if None), calling ``on_sample``
+        (if any) with the ring after each sample. Samples due while an earlier one was still being
+        taken are skipped (and counted in ``overruns``) rather than taken late in a burst."""
+        due = self._clock()
+        idx = 0
+        while count is None or idx < count:
+            self.sample()
+            idx += 1
+            if on_sample:
+                on_sample(self.ring)
+            due += interval
+            now = self._clock()
+            if now - due >= interval:
+                skipped = int((now - due) / interval)
+                self.overruns += skipped
+                due += skipped * interval
+            delay = due - now
+            if delay > 0 and (count is None or idx < count):
+                sleep(delay)
+
+
+def format_report(ring, samples=None, percentiles=DEFAULT_PERCENTILES):
+    """Formats the sojourn time percentiles (in milliseconds), the largest backlog and the drops
+    of each node over the last ``samples`` samples as a text table."""
+    values = ring.percentiles(percentiles, samples)
+    _, backlog, _, drops, _ = ring.window(samples)
+    header = ('dev', 'class') + tuple('p{:g}'.format(pct) for pct in percentiles) + ('max backlog', 'drops',
+                                                                                    'branch')
+    lines = [header]
+    for column, node in enumerate(ring.nodes):
+        dropped = int(drops[-1, column]) - int(drops[0, column]) if len(drops) else 0
+        lines.append((node.dev, node.handle) +
+                     tuple('-' if math.isnan(value) else '{:.2f}ms'.format(value * 1000)
+                           for value in values[:, column]) +
+                     ('{}b'.format(int(backlog[:, column].max()) if len(backlog) else 0), str(max(dropped, 0)),
+                      node.branch))
+    widths = [max(len(line[idx]) for line in lines) for idx in range(len(header) - 1)]
+    return '\n'.join('  '.join(cell.ljust(width) if idx < 2 else cell.rjust(width)
+                               for idx, (cell, width) in enumerate(zip(line, widths))) + '  ' + line[-1]
+                     for line in lines)
+
+
+def backlog_main(args):
+    """Runs the ``backlog`` sub-command of given parsed arguments."""
+    from pyltc.plugins.stats import profile_branches
+    branches, netns = None, args.netns
+    if args.profile_name:
+        branches, netns = profile_branches(args.profile_name, args.config, netns=args.netns)
+    count = int(math.ceil(args.duration / args.interval)) if args.duration else None
+    capacity = args.capacity or int(math.ceil((args.duration or DEFAULT_SPAN) / args.interval))
+    per_report = max(int(round(args.report / args.interval)), 1)
+
+    def report(ring):
+        if ring.count % per_report == 0:
+            print(format_report(ring, per_report), end='\n\n', flush=True)
+
+    try:
+        with BacklogSampler(capacity, branches, args.interface, netns) as sampler:
+            try:
+                sampler.run(args.interval, count, on_sample=report)
+            except KeyboardInterrupt:
+                pass
+            if sampler.ring.count % per_report:
+                print(format_report(sampler.ring, sampler.ring.count % per_report), end='\n\n')
+            if sampler.overruns:
+                print("{} samples skipped: sampling took longer than the interval".format(sampler.overruns))
+            if args.output:
+                sampler.ring.save(args.output)
+    except BacklogError as exc:
+        print(exc)
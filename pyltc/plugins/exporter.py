@@ -0,0 +1,205 @@
+"""
+Prometheus exporter for the branches of simnet profiles.
+
+Exposes the counters of the HTB class of every branch of given profiles (see
+``pyltc.plugins.stats``), labelled by profile, interface, direction, protocol,
+port type and port range, in the Prometheus text format. Either serves them
+over HTTP::
+
+ $ sudo ./ltc.py exporter -c examples/my.profile 4g --listen 127.0.0.1:9977
+ $ curl -s http://127.0.0.1:9977/metrics
+
+or writes them to a file for node_exporter's textfile collector::
+
+ $ sudo ./ltc.py exporter -c examples/my.profile 4g --textfile /var/lib/node_exporter/pyltc.prom
+
+The kernel is sampled every ``--interval`` seconds in the background, and
+each scrape is answered from the last sample, so scrapes cost the same
+however many classes there are, and do not touch the kernel.
+
+"""
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyltc.plugins.stats import StatsSampler, profile_branches
+from pyltc.util.rates import convert2bps
+
+
+DEFAULT_INTERVAL = 5.0
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: (name, type, help, NodeStats field or None for the configured rate) of the branch metrics
+BRANCH_METRICS = (
+    ('pyltc_branch_bytes_total', 'counter', 'Bytes sent through the branch class.', 'bytes'),
+    ('pyltc_branch_packets_total', 'counter', 'Packets sent through the branch class.', 'packets'),
+    ('pyltc_branch_drops_total', 'counter', 'Packets dropped in the branch class or the qdiscs under it.', 'drops'),
+    ('pyltc_branch_overlimits_total', 'counter', 'Times the branch class was over its rate.', 'overlimits'),
+    ('pyltc_branch_requeues_total', 'counter', 'Packets requeued in the branch class.', 'requeues'),
+    ('pyltc_branch_backlog_bytes', 'gauge', 'Bytes queued in the branch class.', 'backlog'),
+    ('pyltc_branch_backlog_packets', 'gauge', 'Packets queued in the branch class.', 'qlen'),
+    ('pyltc_branch_rate_limit_bits', 'gauge', 'The configured rate of the branch, in bits per second.', None),
+)
+
+
+def branch_labels(profile, branch):
+    """Returns the labels of a simnet ``Branch`` of given profile as an ordered dictionary."""
+    parts = branch.spec.split(':')
+    porttype, portrange = ('', 'all') if parts[1] == 'all' else (parts[1], parts[2])
+    return OrderedDict((('profile', profile), ('interface', branch.dev), ('direction', branch.direction),
+                        ('protocol', parts[0]), ('port_type', porttype), ('port_range', portrange),
+                        ('branch', branch.spec)))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(entries, timestamp, duration):
+    """Renders the metrics in the Prometheus text exposition format.
+
+    :param entries: list of (labels, NodeStats) pairs - the branch classes sampled
+    :param timestamp: float - the time of the sample (seconds since the epoch)
+    :param duration: float - how long sampling took, in seconds
+    :return: string
+    """
+    lines = list()
+    labels = ['{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in entry_labels.items()) + '}'
+              for entry_labels, _ in entries]
+    for name, metric_type, help_text, field in BRANCH_METRICS:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for label_str, (_, row) in zip(labels, entries):
+            value = getattr(row, field) if field else convert2bps(row.branch.rate)
+            lines.append('{}{} {}'.format(name, label_str, value))
+    lines.append('# HELP pyltc_sample_timestamp_seconds When the kernel was last sampled.')
+    lines.append('# TYPE pyltc_sample_timestamp_seconds gauge')
+    lines.append('pyltc_sample_timestamp_seconds {:.3f}'.format(timestamp))
+    lines.append('# HELP pyltc_sample_duration_seconds How long sampling the kernel took.')
+    lines.append('# TYPE pyltc_sample_duration_seconds gauge')
+    lines.append('pyltc_sample_duration_seconds {:.6f}'.format(duration))
+    return '\n'.join(lines) + '\n'
+
+
+class Exporter(object):
+    """Keeps the rendered metrics of the last sample of the branches of given profiles."""
+
+    def __init__(self, profiles, interval=DEFAULT_INTERVAL):
+        """Initializer.
+
+        :param profiles: list of (profile name, list of ``Branch``, netns) tuples
+        :param interval: float - seconds between two samples
+        """
+        self._interval = interval
+        self._profiles = dict()
+        branches_by_netns = OrderedDict()
+        for profile, branches, netns in profiles:
+            branches_by_netns.setdefault(netns, list()).extend(branches)
+            self._profiles.update((branch, profile) for branch in branches)
+        self._samplers = [StatsSampler(branches=branches, netns=netns)
+                          for netns, branches in branches_by_netns.items()]
+        self._stopped = threading.Event()
+        self._refreshed = threading.Event()
+        #: the metrics text of the last sample (replaced as a whole, so readers need no lock)
+        self.text = ''
+
+    def refresh(self):
+        """Samples the kernel and renders the metrics."""
+        began, timestamp = time.monotonic(), time.time()
+        entries = list()
+        for sampler in self._samplers:
+            entries.extend((branch_labels(self._profiles[row.branch], row.branch), row) for row in sampler.sample()
+                           if row.node == 'class' and row.branch in self._profiles)
+        self.text = render_metrics(entries, timestamp, time.monotonic() - began)
+        self._refreshed.set()
+        return self.text
+
+    def run(self, count=None, on_refresh=None):
+        """Refreshes the metrics every ``interval`` seconds, ``count`` times (until ``stop()`` if None),
+        calling ``on_refresh`` (if any) with the text after each refresh."""
+        idx = 0
+        due = time.monotonic()
+        while not self._stopped.is_set() and (count is None or idx < count):
+            text = self.refresh()
+            if on_refresh:
+                on_refresh(text)
+            idx += 1
+            due += self._interval
+            if count is None or idx < count:
+                self._stopped.wait(max(due - time.monotonic(), 0))
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        self.stop()
+        for sampler in self._samplers:
+            sampler.close()
+
+    def serve(self, address):
+        """Serves the metrics at ``/metrics`` of given (host, port) until interrupted, refreshing them
+        in a background thread."""
+        refresher = threading.Thread(target=self.run, name='pyltc-exporter', daemon=True)
+        refresher.start()
+        self._refreshed.wait()  # not to serve empty metrics
+        server_class = ThreadingHTTPServer
+        if ':' in address[0]:
+            server_class = type('ThreadingHTTPServer6', (ThreadingHTTPServer,), dict(address_family=socket.AF_INET6))
+        server = server_class(address, _handler_class(self))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.stop()
+            refresher.join()
+
+
+def _handler_class(exporter):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.text.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # not to log every scrape
+
+    return MetricsHandler
+
+
+def write_textfile(path, text):
+    """Writes the text to given file atomically, as the textfile collector may read it any time."""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as fhl:
+        fhl.write(text)
+    os.replace(tmp_path, path)
+
+
+def exporter_main(args):
+    """Runs the ``exporter`` sub-command of given parsed arguments."""
+    profiles = list()
+    for profile in args.profile_names:
+        branches, netns = profile_branches(profile, args.config, netns=args.netns)
+        profiles.append((profile, branches, netns))
+    exporter = Exporter(profiles, interval=args.interval)
+    try:
+        if args.textfile:
+            exporter.run(args.count, on_refresh=lambda text: write_textfile(args.textfile, text))
+        else:
+            exporter.serve(args.listen)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.close()
@@ -0,0 +1,249 @@
+"""
+Compact on-disk recorder of the counters of the profile branches.
+
+For soak tests that run for hours or days: every ``--interval`` seconds the
+HTB classes of the branches of a profile are sampled (see
+``pyltc.plugins.stats``) and a fixed-width record - the time, plus what each
+class sent, dropped and was over its rate since the previous record, and its
+backlog - is appended to a memory-mapped file::
+
+ $ sudo ./ltc.py record -c examples/my.profile 4g --output soak.ltcrec --interval 1
+
+The file starts with a header describing the recorded branches (device, class,
+direction, spec, rate) and is then made of blocks of ``block_rows`` records,
+each block stored column by column, so one counter of one class is contiguous.
+A record of N branches takes 8 + 24 * N bytes: a day of one second records of
+ten branches is 21MB. ``Recording`` reads a file back as NumPy arrays, and
+downsamples it::
+
+ recording = Recording('soak.ltcrec')
+ series = recording.downsample(60)   # one-minute bins
+ series.bytes[:, 0] * 8 / 60         # the rate of the first branch, per minute
+
+Requires NumPy.
+"""
+import json
+import math
+import os
+import struct
+import time
+from collections import namedtuple
+
+from pyltc.plugins.stats import StatsSampler, profile_branches
+from pyltc.util.optional import numpy as np, require_numpy
+
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_BLOCK_ROWS = 4096
+
+MAGIC = b'PYLTCREC'
+VERSION = 1
+
+#: magic, version, size of the header, records written, records per block, length of the JSON description
+_HEADER = struct.Struct('=8sIIQII')
+#: where the number of records written is in the header
+_ROWS_OFFSET = 16
+#: the header is padded to this, so the blocks start on a page
+_ALIGN = 4096
+
+#: the recorded counters and their types: the deltas since the previous record, and the backlog (bytes)
+COUNTERS = (('bytes', 'uint64'), ('packets', 'uint32'), ('drops', 'uint32'), ('overlimits', 'uint32'),
+            ('backlog', 'uint32'))
+COUNTER_NAMES = tuple(name for name, _ in COUNTERS)
+
+#: Records (or downsampled bins of them): ``times`` is an array of seconds since the epoch,
+#: the counters are arrays of (records, branches).
+Series = namedtuple('Series', ('times',) + COUNTER_NAMES)
+
+
+class RecorderError(Exception):
+    """Raised on a file that is not a recording, or if NumPy is missing."""
+
+
+def _block_layout(block_rows, width):
+    """Returns the size of a block and the (name, dtype, offset, shape) of its columns."""
+    layout = [('times', np.dtype('float64'), 0, (block_rows,))]
+    offset = block_rows * 8
+    for name, dtype in COUNTERS:
+        dtype = np.dtype(dtype)
+        layout.append((name, dtype, offset, (width, block_rows)))
+        offset += width * block_rows * dtype.itemsize
+    return offset, layout
+
+
+class Recorder(object):
+    """Appends records of the counters of a set of branches to a file."""
+
+    def __init__(self, path, branches, block_rows=DEFAULT_BLOCK_ROWS, **description):
+        """Initializer. Creates (or truncates) the file and writes its header.
+
+        :param path: string - the file to write
+        :param branches: list of simnet ``Branch`` objects - the recorded branches, a column each
+        :param block_rows: int - the number of records the file grows by at once
+        :param description: further JSON-serializable items to describe the recording with
+        """
+        require_numpy(RecorderError, 'the recorder')
+        self._branches = list(branches)
+        description.update(started=time.time(), counters=COUNTER_NAMES,
+                           branches=[branch._asdict() for branch in self._branches])
+        encoded = json.dumps(description).encode()
+        self._header_size = -(-(_HEADER.size + len(encoded)) // _ALIGN) * _ALIGN
+        self._block_rows = block_rows
+        self._block_size, self._layout = _block_layout(block_rows, len(self._branches))
+        self._fhl = open(path, 'w+b')
+        self._fhl.write(_HEADER.pack(MAGIC, VERSION, self._header_size, 0, block_rows, len(encoded)) + encoded)
+        self._fhl.truncate(self._header_size)
+        self._fhl.flush()
+        self.rows = 0
+        self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _map_block(self, block):
+        offset = self._header_size + block * self._block_size
+        self._fhl.truncate(offset + self._block_size)
+        mapped = np.memmap(self._fhl, mode='r+', offset=offset, shape=(self._block_size,))
+        self._columns = dict((name, mapped[start:start + dtype.itemsize * int(np.prod(shape))].view(dtype)
+                              .reshape(shape)) for name, dtype, start, shape in self._layout)
+        self._mapped = mapped
+
+    def append(self, timestamp, counters):
+        """Appends a record.
+
+        :param timestamp: float - seconds since the epoch
+        :param counters: dictionary of the sequences (a value per branch) of the ``COUNTER_NAMES``
+        """
+        block, row = divmod(self.rows, self._block_rows)
+        if row == 0:
+            self._map_block(block)
+        self._columns['times'][row] = timestamp
+        for name in COUNTER_NAMES:
+            self._columns[name][:, row] = counters[name]
+        self.rows += 1
+        # the record is complete: it can be counted in the header now
+        self._fhl.seek(_ROWS_OFFSET)
+        self._fhl.write(struct.pack('=Q', self.rows))
+
+    def flush(self):
+        if self._columns is not None:
+            self._mapped.flush()
+        self._fhl.flush()
+
+    def close(self):
+        if not self._fhl.closed:
+            self.flush()
+            self._columns = self._mapped = None
+            self._fhl.close()
+
+
+class Recording(object):
+    """A recorder file, memory-mapped for reading."""
+
+    def __init__(self, path):
+        """Initializer.
+
+        :param path: string - the recorder file
+        """
+        require_numpy(RecorderError, 'the recorder')
+        with open(path, 'rb') as fhl:
+            header = fhl.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise RecorderError("Not a recording: {}".format(path))
+            _, version, header_size, rows, block_rows, length = _HEADER.unpack(header)
+            if version != VERSION:
+                raise RecorderError("Unsupported recording version {} in {}".format(version, path))
+            #: the description of the recording, as given to ``Recorder``
+            self.description = json.loads(fhl.read(length).decode())
+        self.branches = self.description['branches']
+        self.rows = rows
+        self._block_rows = block_rows
+        block_size, layout = _block_layout(block_rows, len(self.branches))
+        blocks = -(-rows // block_rows)
+        self._blocks = list()
+        if blocks:
+            mapped = np.memmap(path, mode='r', offset=header_size, shape=(blocks * block_size,))
+            for block in range(blocks):
+                base = block * block_size
+                self._blocks.append(dict((name, mapped[base + start:base + start + dtype.itemsize *
+                                                       int(np.prod(shape))].view(dtype).reshape(shape))
+                                         for name, dtype, start, shape in layout))
+
+    def column(self, name):
+        """Returns an array of the times (``name`` 'times') or of a counter, of (records, branches)."""
+        if name != 'times' and name not in COUNTER_NAMES:
+            raise RecorderError("No such column: {!r}".format(name))
+        parts = list()
+        for idx, block in enumerate(self._blocks):
+            used = min(self.rows - idx * self._block_rows, self._block_rows)
+            parts.append(block[name][:used] if name == 'times' else block[name][:, :used].T)
+        if not parts:
+            return np.zeros((0,) if name == 'times' else (0, len(self.branches)))
+        return np.concatenate(parts)
+
+    def series(self):
+        """Returns all records as a ``Series``."""
+        return Series(*(self.column(name) for name in Series._fields))
+
+    def downsample(self, step):
+        """Returns the records summed into bins of ``step`` seconds (the backlog is the largest
+        in each bin) as a ``Series``; the times are the starts of the (non-empty) bins."""
+        series = self.series()
+        if not len(series.times):
+            return series
+        bins = np.floor((series.times - series.times[0]) / step).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        counters = dict((name, np.add.reduceat(getattr(series, name), starts, axis=0, dtype=np.uint64))
+                        for name in COUNTER_NAMES if name != 'backlog')
+        counters['backlog'] = np.maximum.reduceat(series.backlog, starts, axis=0)
+        return Series(series.times[0] + bins[starts] * step, **counters)
+
+
+class CounterDeltas(object):
+    """Turns the sampled rows of the branch classes into the counters of a record."""
+
+    def __init__(self, branches):
+        self._columns = dict(((branch.dev, branch.classid), idx) for idx, branch in enumerate(branches))
+        self._width = len(branches)
+        self._last = None
+
+    def record(self, rows):
+        """Returns the counters of a record from given ``NodeStats``: the deltas since the previous
+        rows (the counters themselves for a class reset since), and the backlog."""
+        current = dict((name, np.zeros(self._width, dtype=np.uint64)) for name in COUNTER_NAMES)
+        for row in rows:
+            column = self._columns.get((row.dev, row.handle)) if row.node == 'class' else None
+            if column is not None:
+                for name in COUNTER_NAMES:
+                    current[name][column] = getattr(row, name)
+        last, self._last = self._last, current
+        if last is None:
+            last = dict((name, current[name]) for name in COUNTER_NAMES)  # the first record has no deltas
+        # a class whose bytes or packets went down was recreated: all its counters start over
+        reset = (current['bytes'] < last['bytes']) | (current['packets'] < last['packets'])
+        counters = dict((name, np.where(reset | (current[name] < last[name]), current[name],
+                                        current[name] - last[name]))
+                        for name in COUNTER_NAMES if name != 'backlog')
+        counters['backlog'] = current['backlog']
+        return counters
+
+
+def recorder_main(args):
+    """Runs the ``record`` sub-command of given parsed arguments."""
+    require_numpy(RecorderError, 'the recorder')
+    branches, netns = profile_branches(args.profile_name, args.config, interface=args.interface, netns=args.netns)
+    count = int(math.ceil(args.duration / args.interval)) + 1 if args.duration else None
+    deltas = CounterDeltas(branches)
+    description = dict(profile=args.profile_name, interval=args.interval, netns=netns)
+    with StatsSampler(branches=branches, netns=netns) as sampler, \
+            Recorder(args.output, branches, **description) as recorder:
+        try:
+            for rows in sampler.run(args.interval, count):
+                recorder.append(time.time(), deltas.record(rows))
+                if args.verbose:
+                    print("{} records, {} bytes".format(recorder.rows, os.path.getsize(args.output)))
+        except KeyboardInterrupt:
+            pass
@@ -12,13 +12,18 @@ TODO: introduce plugin functionality and convert this to be the first plugin ;)
 import os
 import sys
 import argparse
+import asyncio
+from collections import namedtuple
 
 from pyltc.conf import CONFIG_PATHS, __build__, __version__
 from parser import ParserError
-from pyltc.util.cmdline import CommandLine
+from pyltc.util import timings
+from pyltc.util.cmdline import CommandLine, CommandFailed
 from pyltc.util.confparser import ConfigParser
 from pyltc.core.netdevice import DeviceManager, NetDevice, NetDeviceNotFound
-from pyltc.plugins.simnet_util import BranchParser
+from pyltc.core.plan import TcPlan
+from pyltc.core.tfactory import plan_target_factory
+from pyltc.plugins.simnet_util import BranchParser, timeline_step, listen_address
 
 #: netem (the qdisc that simulates special network conditions) works for a
 # default of 1000 packets. This was a source of problems and the workaround
@@ -27,6 +32,12 @@ from pyltc.plugins.simnet_util import BranchParser
 # be reached.
 NETEM_LIMIT = 1000000000
 
+#: A branch of a simnet setup: the device and classid of the HTB class shaping it, 'upload' or
+# 'download', the branch as given, e.g. 'tcp:dport:8080:512kbit', and the rate of the class.
+# The per-protocol classes all port branches hang off are branches too, e.g. 'tcp:all:2mbit'
+# or (without a rate) 'tcp:all'.
+Branch = namedtuple('Branch', 'dev classid direction spec rate')
+
 
 class IllegalArguments(Exception):
     """Represents an error in command line or profile setup."""
@@ -52,7 +63,8 @@ def parse_ini_file(profile, conf_file, verbose):
         print('Using config file {!r}'.format(conf_file))
 
     conf_parser = ConfigParser(conf_file)
-    conf_parser.parse()
+    with timings.phase('parse_config', file=conf_file):
+        conf_parser.parse()
     try:
         new_args = conf_parser.section(profile)
     except KeyError:  # FIXME: revisit this; raising an exception seems better
@@ -77,6 +89,39 @@ def handle_version_arg(argv):
         sys.exit(0)
 
 
+def handle_timings_args(argv):
+    """Takes the '--timings', '--timings-json PATH' and '--timings-trace PATH' command line arguments
+    out of ``argv`` (they may be given anywhere, so that the parsing of the others gets timed as well).
+    Returns the remaining arguments and the options of ``report_timings()``, None if none was given."""
+    remaining, options = list(), dict()
+    args = iter(argv)
+    for arg in args:
+        name, sep, value = arg.partition('=')
+        if name == '--timings' and not sep:
+            options['summary'] = True
+        elif name in ('--timings-json', '--timings-trace'):
+            value = value if sep else next(args, None)
+            if not value:
+                raise ParserError("{} needs a file name".format(name))
+            options[name[len('--timings-'):]] = value
+        else:
+            remaining.append(arg)
+    return remaining, (options or None)
+
+
+def report_timings(recorder, summary=False, json=None, trace=None):
+    """Prints the summary of given ``Timings`` (to stderr) and/or saves its spans as JSON and as
+    a Chrome trace."""
+    if any(span.name.startswith('sudo ') for span in recorder.spans if span.category == timings.COMMAND):
+        recorder.measure_sudo()
+    if summary:
+        print(recorder.format_summary(), file=sys.stderr)
+    if json:
+        recorder.write_json(json)
+    if trace:
+        recorder.write_chrome_trace(trace)
+
+
 def parse_args(argv, old_args_dict=None):
     """Parses given list of command line arguments using `argparse.ArgumentParser`
        and returns the parsed namespace."""
@@ -90,6 +135,11 @@ def parse_args(argv, old_args_dict=None):
     if 'no_such_profile' in argv:
         parser.error('Config profile NOT found: {}'.format(argv[1]))
     parser.add_argument("-V", "--version", action='store_true', help="show program version and exit")
+    parser.add_argument("--timings", action='store_true',
+                        help="print how long each phase and each executed command took (to stderr)")
+    parser.add_argument("--timings-json", metavar='PATH', help="save the timings as JSON")
+    parser.add_argument("--timings-trace", metavar='PATH',
+                        help="save the timings as a Chrome trace (for chrome://tracing or Perfetto)")
 
     subparsers = parser.add_subparsers(dest="subparser")
     parser_profile = subparsers.add_parser("profile", help="profile to be used")
@@ -100,12 +150,147 @@ def parse_args(argv, old_args_dict=None):
                                 help="configuration file to read from."
                                      " If not specified, default paths will be tried before giving up"
                                      " (see module's CONFIG_PATHS).")
+    parser_profile.add_argument("-p", "--pipeline", action='store_true', required=False, default=False,
+                                help="apply the tc commands while the setup is being built, through a 'tc -batch'"
+                                     " per chain (default: %(default)s)")
+
+    parser_timeline = subparsers.add_parser("timeline", help="profiles to be applied one after another")
+    parser_timeline.add_argument("steps", nargs='+', type=timeline_step, metavar='PROFILE:SECONDS',
+                                 help="profile name from the config file and the number of seconds"
+                                      " to keep it applied, e.g. 4g:30 dsl-poor:10")
+    parser_timeline.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                                 help="more verbose output (default: %(default)s)")
+    parser_timeline.add_argument("-c", "--config", required=False, default=None,
+                                 help="configuration file to read from."
+                                      " If not specified, default paths will be tried before giving up"
+                                      " (see module's CONFIG_PATHS).")
+
+    parser_topology = subparsers.add_parser("topology", help="network of namespaces joined by shaped links")
+    parser_topology.add_argument("name", help="topology name from the topology file")
+    parser_topology.add_argument("action", choices=('up', 'down'),
+                                 help="create the topology, or delete it")
+    parser_topology.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                                 help="more verbose output (default: %(default)s)")
+    parser_topology.add_argument("-c", "--config", required=True,
+                                 help="topology file to read from (see pyltc.plugins.topology)")
+
+    parser_stats = subparsers.add_parser("stats", help="live qdisc and class statistics")
+    parser_stats.add_argument("profile_name", nargs='?', default=None,
+                              help="profile from the config file to map the classes to the branches of")
+    parser_stats.add_argument("-c", "--config", required=False, default=None,
+                              help="configuration file to read from."
+                                   " If not specified, default paths will be tried before giving up"
+                                   " (see module's CONFIG_PATHS).")
+    parser_stats.add_argument("-i", "--interface", action='append', default=None,
+                              help="a network device to show (repeatable; default: the profile's, or all)")
+    parser_stats.add_argument("-n", "--netns", required=False, default=None,
+                              help="the named network namespace the devices are in (default: the profile's,"
+                                   " or the current one)")
+    parser_stats.add_argument("-t", "--interval", type=float, default=1.0,
+                              help="seconds between two samples (default: %(default)s)")
+    parser_stats.add_argument("--count", type=int, default=None,
+                              help="number of samples to show (default: until interrupted)")
+    parser_stats.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                              help="more verbose output (default: %(default)s)")
+
+    parser_top = subparsers.add_parser("top", help="live per-branch rates and drops of a profile")
+    parser_top.add_argument("profile_name", help="profile name from the config file")
+    parser_top.add_argument("-c", "--config", required=False, default=None,
+                            help="configuration file to read from."
+                                 " If not specified, default paths will be tried before giving up"
+                                 " (see module's CONFIG_PATHS).")
+    parser_top.add_argument("-i", "--interface", required=False, default=None,
+                            help="the network device the profile is applied to (default: the profile's)")
+    parser_top.add_argument("-n", "--netns", required=False, default=None,
+                            help="the named network namespace the devices are in (default: the profile's)")
+    parser_top.add_argument("-t", "--interval", type=float, default=0.5,
+                            help="seconds between two refreshes (default: %(default)s)")
+    parser_top.add_argument("-s", "--sort", choices=('util', 'drops', 'profile'), default='util',
+                            help="sort the branches by utilization, drop rate or keep the profile order"
+                                 " (default: %(default)s)")
+    parser_top.add_argument("-b", "--batch", action='store_true', default=False,
+                            help="print the screens one after another instead of refreshing the terminal")
+    parser_top.add_argument("--count", type=int, default=None,
+                            help="number of refreshes (default: until quit)")
+    parser_top.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                            help="more verbose output (default: %(default)s)")
+
+    parser_backlog = subparsers.add_parser("backlog", help="high-frequency backlog and sojourn time sampling")
+    parser_backlog.add_argument("profile_name", nargs='?', default=None,
+                                help="profile from the config file whose branches to sample")
+    parser_backlog.add_argument("-c", "--config", required=False, default=None,
+                                help="configuration file to read from."
+                                     " If not specified, default paths will be tried before giving up"
+                                     " (see module's CONFIG_PATHS).")
+    parser_backlog.add_argument("-i", "--interface", action='append', default=None,
+                                help="without a profile, a network device to sample all classes of (repeatable)")
+    parser_backlog.add_argument("-n", "--netns", required=False, default=None,
+                                help="the named network namespace the devices are in (default: the profile's,"
+                                     " or the current one)")
+    parser_backlog.add_argument("-t", "--interval", type=float, default=0.005,
+                                help="seconds between two samples (default: %(default)s)")
+    parser_backlog.add_argument("-r", "--report", type=float, default=1.0,
+                                help="seconds between two printed reports (default: %(default)s)")
+    parser_backlog.add_argument("-d", "--duration", type=float, default=None,
+                                help="seconds to sample for (default: until interrupted)")
+    parser_backlog.add_argument("--capacity", type=int, default=None,
+                                help="samples kept in memory (default: those of the duration, or of 60 seconds)")
+    parser_backlog.add_argument("-o", "--output", default=None, metavar='PATH',
+                                help="save the kept samples to this .npz file at the end")
+    parser_backlog.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                                help="more verbose output (default: %(default)s)")
+
+    parser_record = subparsers.add_parser("record", help="record the branch counters of a profile to a file")
+    parser_record.add_argument("profile_name", help="profile name from the config file")
+    parser_record.add_argument("-o", "--output", required=True, metavar='PATH',
+                               help="the file to record to (see pyltc.plugins.recorder)")
+    parser_record.add_argument("-c", "--config", required=False, default=None,
+                               help="configuration file to read from."
+                                    " If not specified, default paths will be tried before giving up"
+                                    " (see module's CONFIG_PATHS).")
+    parser_record.add_argument("-i", "--interface", required=False, default=None,
+                               help="the network device the profile is applied to (default: the profile's)")
+    parser_record.add_argument("-n", "--netns", required=False, default=None,
+                               help="the named network namespace the devices are in (default: the profile's)")
+    parser_record.add_argument("-t", "--interval", type=float, default=1.0,
+                               help="seconds between two records (default: %(default)s)")
+    parser_record.add_argument("-d", "--duration", type=float, default=None,
+                               help="seconds to record for (default: until interrupted)")
+    parser_record.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                               help="more verbose output (default: %(default)s)")
+
+    parser_exporter = subparsers.add_parser("exporter", help="Prometheus metrics of the branches of profiles")
+    parser_exporter.add_argument("profile_names", nargs='+', metavar='profile_name',
+                                 help="profile name(s) from the config file")
+    parser_exporter.add_argument("-c", "--config", required=False, default=None,
+                                 help="configuration file to read from."
+                                      " If not specified, default paths will be tried before giving up"
+                                      " (see module's CONFIG_PATHS).")
+    parser_exporter.add_argument("-n", "--netns", required=False, default=None,
+                                 help="the named network namespace the devices are in (default: the profiles')")
+    parser_exporter.add_argument("-t", "--interval", type=float, default=5.0,
+                                 help="seconds between two samples of the kernel (default: %(default)s)")
+    parser_exporter.add_argument("-l", "--listen", type=listen_address, default='127.0.0.1:9977',
+                                 metavar='HOST:PORT', help="serve /metrics at this address (default: %(default)s)")
+    parser_exporter.add_argument("--textfile", default=None, metavar='PATH',
+                                 help="write the metrics to this file (for the node_exporter textfile collector)"
+                                      " instead of serving them")
+    parser_exporter.add_argument("--count", type=int, default=None,
+                                 help="with --textfile, number of writes (default: until interrupted)")
+    parser_exporter.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
+                                 help="more verbose output (default: %(default)s)")
 
     parser_cmd = subparsers.add_parser('simnet', help="traffic control setup to be applied")
     parser_cmd.add_argument("-v", "--verbose", action='store_true', required=False, default=False,
                             help="more verbose output (default: %(default)s)")
     parser_cmd.add_argument("-i", "--interface", required=False, default='lo',
                             help="the network device name (default: %(default)s)")
+    parser_cmd.add_argument("-n", "--netns", required=False, default=None,
+                            help="the named network namespace the device is in, as for 'ip -n'"
+                                 " (default: the current one)")
+    parser_cmd.add_argument("-p", "--pipeline", action='store_true', required=False, default=False,
+                            help="apply the tc commands while the setup is being built, through a 'tc -batch'"
+                                 " per chain (default: %(default)s)")
     parser_cmd.add_argument("-c", "--clear", action='store_true', required=False, default=False,
                             help="issue a chain clearing clause before the actual recipe (default: %(default)s)")
     parser_cmd.add_argument("-b", "--ifbdevice", nargs='?', const='ifb', default=None,
@@ -134,6 +319,7 @@ def parse_args(argv, old_args_dict=None):
         parser.error('No action requested.')
 
     if args.subparser == 'simnet':
+        args.netns = args.netns or old_args_dict.get('netns')
 
         if args.clear and args.upload is None and args.download is None:
             args.upload = []
@@ -142,7 +328,9 @@ def parse_args(argv, old_args_dict=None):
         if not (args.upload or args.download or args.clear):
             parser.error('no action requested: add at least one of --upload, --download, --clear.')
 
-        if not DeviceManager.device_exists(args.interface):
+        with DeviceManager.in_netns(args.netns):
+            interface_exists = DeviceManager.device_exists(args.interface)
+        if not interface_exists:
             raise ParserError("device NOT found: {!s}".format(args.interface))
 
     return args
@@ -178,8 +366,11 @@ def parse_branch_list(args_list, upload, download):
 
 
 def build_tree(target, tcphook, udphook, args_list, upload=None, download=None):
+    """Builds a class (and filter, and optional netem qdisc) per port branch under the
+    protocol hooks; returns the (branch as given, htb class) pairs."""
     branches = parse_branch_list(args_list, upload=upload, download=download)
-    for branch in branches:
+    built = list()
+    for spec, branch in zip(args_list, branches):
         if branch['range'] == 'all':
             continue
 
@@ -200,6 +391,7 @@ def build_tree(target, tcphook, udphook, args_list, upload=None, download=None):
         # class(htb) - shaping
         rate = branch['rate'] if branch['rate'] else '15gbit'  # TODO: move this to a constant
         htb_class = target.add_class('htb', hook, rate=rate)
+        built.append((spec, htb_class))
         # filter(basic) - port
         if '-' not in branch['range']:
             build_single_port_filter(target, hook, htb_class, branch['range'], branch['porttype'])
@@ -211,6 +403,7 @@ def build_tree(target, tcphook, udphook, args_list, upload=None, download=None):
         # qdisc(netem) - loss
         if branch['loss']:
             netem_qdisc = target.add_qdisc('netem', parent=htb_class, loss=branch['loss'], limit=NETEM_LIMIT)
+    return built
 
 
 def determine_all_rates(upload, download):
@@ -258,7 +451,7 @@ class SimNetPlugin(object):
             self._args = SimpleNamespace()
 
             # the default values must match the argparse defaults for these arguments
-            self.configure(clear=False, verbose=False, interface='lo', ifbdevice=None)
+            self.configure(clear=False, verbose=False, interface='lo', ifbdevice=None, netns=None)
             self._args.upload = list()
             self._args.download = list()
 
@@ -268,14 +461,24 @@ class SimNetPlugin(object):
         else:
             self._args = args
 
-    def configure(self, clear=Undef, verbose=Undef, interface=Undef, ifbdevice=Undef):
+        #: the ``Branch`` objects of the setup last built (see ``marshal()``)
+        self.branches = list()
+
+    @property
+    def netns(self):
+        """The named network namespace of the devices (e.g. a loaded profile's), None for our own."""
+        return getattr(self._args, 'netns', None)
+
+    def configure(self, clear=Undef, verbose=Undef, interface=Undef, ifbdevice=Undef, netns=Undef):
         """Configures the general options given as named arguments.
 
         :param clear: bool - whether to generate a clearing command at the command sequence start
         :param verbose: bool - whether to be verbose
         :param interface: string - the network device name
         :param ifbdevice: string - the ifb network device name, if any
+        :param netns: string - the named network namespace of the devices, if not the current one
         """
+        self._args.netns = netns if netns is not Undef else getattr(self._args, 'netns', None)
         self._args.clear = clear if clear is not Undef else self._args.clear
         self._args.verbose = verbose if verbose is not Undef else self._args.verbose
         self._args.interface = interface if interface is not Undef else self._args.interface
@@ -308,57 +511,200 @@ class SimNetPlugin(object):
 
     def marshal(self):
         """Applies setup recipe instruction already built."""
+        targets = self._build_targets()
+        try:
+            for target in targets:
+                with timings.phase('marshal'):
+                    target.marshal()
+        except BaseException:
+            self._abort(targets)
+            raise
+
+    async def marshal_async(self):
+        """Coroutine counterpart of ``marshal()``: the targets (one per device chain)
+        are marshaled concurrently."""
+        targets = self._build_targets()
+        try:
+            with timings.phase('marshal'):
+                await asyncio.gather(*(target.marshal_async() for target in targets))
+        except BaseException:
+            self._abort(targets)
+            raise
+
+    @staticmethod
+    def _abort(targets):
+        for target in targets:
+            target.abort()
+
+    def _build_targets(self):
+        """Builds the setup recipe into the device targets and returns the targets to marshal."""
         # Note that NetDevice.get_device() returns a "Null" NetDevice object if device name is None
         #print(self._args)
-        iface = NetDevice.get_device(self._args.interface, self._target_factory)
-
-        # ifbdev = 'ifb' if self._args.download and not self._args.ifbdevice else None
-
-        if (self._args.download is not None) and (not self._args.ifbdevice):
-            self._args.ifbdevice = 'ifb'
-        ifbdev = NetDevice.get_device(self._args.ifbdevice, self._target_factory)
-        ifbdev.up()
-
+        with DeviceManager.in_netns(self.netns), timings.phase('get_devices'):
+            iface = NetDevice.get_device(self._args.interface, self._target_factory)
+
+            # ifbdev = 'ifb' if self._args.download and not self._args.ifbdevice else None
+
+            if (self._args.download is not None) and (not self._args.ifbdevice):
+                self._args.ifbdevice = 'ifb'
+            ifbdev = NetDevice.get_device(self._args.ifbdevice, self._target_factory)
+            ifbdev.up()
+
+        try:
+            return self._build_setup(iface, ifbdev)
+        except BaseException:  # e.g. a pipeline target may be applying the setup already
+            self._abort((iface.egress, iface.ingress, ifbdev.egress))
+            raise
+
+    def build_branches(self):
+        """Builds the setup recipe into a throwaway plan and returns its ``Branch`` objects. Unlike
+        ``marshal()``, no network device is added, loaded or brought up (e.g. for the read-only
+        commands); with only the ifb module given, the device names are listed to pick the one
+        ``marshal()`` would."""
+        factory = plan_target_factory(TcPlan())
+        ifbdevice = self._args.ifbdevice
+        if (self._args.download is not None) and (not ifbdevice):
+            ifbdevice = 'ifb'
+        with DeviceManager.in_netns(self.netns):
+            iface = NetDevice(self._args.interface, factory)
+            if ifbdevice and DeviceManager.split_name(ifbdevice)[1] is None:
+                ifbdevice = DeviceManager.maximal_existing_name(ifbdevice)
+            ifbdev = NetDevice(ifbdevice, factory) if ifbdevice else NetDevice.get_device(None)
+        self._build_setup(iface, ifbdev)
+        return self.branches
+
+    def _build_setup(self, iface, ifbdev):
+        targets = list()
+        self.branches = list()
         if self._args.upload is not None:
             if self._args.clear:
                 iface.egress.clear()
             if self._args.upload:  # not self._args.clearonly_mode:
-                tcp_all_rate, udp_all_rate = determine_all_rates(self._args.upload, self._args.download)
-                tcp_hook, udp_hook = build_basics(iface.egress, tcp_all_rate, udp_all_rate)
-                build_tree(iface.egress, tcp_hook, udp_hook, self._args.upload, upload=True)
+                with timings.phase('build_tree', direction='upload'):
+                    tcp_all_rate, udp_all_rate = determine_all_rates(self._args.upload, self._args.download)
+                    tcp_hook, udp_hook = build_basics(iface.egress, tcp_all_rate, udp_all_rate)
+                    built = build_tree(iface.egress, tcp_hook, udp_hook, self._args.upload, upload=True)
+                self._add_branches(iface, 'upload', tcp_hook, udp_hook, tcp_all_rate, udp_all_rate, built)
 
             iface.egress.configure(verbose=self._args.verbose)
-            iface.egress.marshal()
+            targets.append(iface.egress)
 
         if self._args.download is not None:
             if self._args.clear:
                 iface.ingress.clear()
                 ifbdev.egress.clear()
             if self._args.download: # not self._args.clearonly_mode:
-                iface.ingress.set_redirect(iface, ifbdev)
-                tcp_all_rate, udp_all_rate = determine_all_rates(self._args.upload, self._args.download)
-                tcp_hook, udp_hook = build_basics(ifbdev.egress, tcp_all_rate, udp_all_rate)
-                build_tree(ifbdev.egress, tcp_hook, udp_hook, self._args.download, download=True)
+                with timings.phase('build_tree', direction='download'):
+                    iface.ingress.set_redirect(iface, ifbdev)
+                    tcp_all_rate, udp_all_rate = determine_all_rates(self._args.upload, self._args.download)
+                    tcp_hook, udp_hook = build_basics(ifbdev.egress, tcp_all_rate, udp_all_rate)
+                    built = build_tree(ifbdev.egress, tcp_hook, udp_hook, self._args.download, download=True)
+                self._add_branches(ifbdev, 'download', tcp_hook, udp_hook, tcp_all_rate, udp_all_rate, built)
 
             iface.ingress.configure(verbose=self._args.verbose)
-            iface.ingress.marshal()
             ifbdev.egress.configure(verbose=self._args.verbose)
-            ifbdev.egress.marshal()
-
-    def load_profile(self, profile_name, config_file=None):
+            targets.extend((iface.ingress, ifbdev.egress))
+        return targets
+
+    def _add_branches(self, device, direction, tcp_hook, udp_hook, tcp_all_rate, udp_all_rate, built):
+        for protocol, hook, rate in (('tcp', tcp_hook, tcp_all_rate), ('udp', udp_hook, udp_all_rate)):
+            spec = '{}:all:{}'.format(protocol, rate) if rate else '{}:all'.format(protocol)
+            self.branches.append(Branch(device.name, hook.parent.classid, direction, spec, hook.parent.params['rate']))
+        self.branches.extend(Branch(device.name, htb_class.classid, direction, spec, htb_class.params['rate'])
+                             for spec, htb_class in built)
+
+    def load_profile(self, profile_name, config_file=None, interface=None, netns=None, ifbdevice=None):
+        """Loads the setup of given profile. ``interface`` and ``netns``, if given, override the
+        profile's; so does ``ifbdevice``, if the profile shapes download traffic."""
         profile_args = parse_ini_file(profile_name, config_file, self._args.verbose)
+        if profile_args[0] == 'simnet':
+            profile_args.extend(('--interface', interface) if interface else ())
+            profile_args.extend(('--netns', netns) if netns else ())
         old_args_dict = self._args.__dict__.copy()
-        self._args = parse_args(profile_args, old_args_dict)
+        with timings.phase('parse_args'):
+            self._args = parse_args(profile_args, old_args_dict)
+        if ifbdevice and self._args.download is not None:
+            self._args.ifbdevice = ifbdevice
 
 
 def plugin_main(argv, target_factory):
     if not argv:
         argv = sys.argv[1:]
     handle_version_arg(argv)
-    args = parse_args(argv)
+    argv, timings_options = handle_timings_args(argv)
+    DeviceManager.use_inventory()  # the devices are looked up many times in a run
+    try:
+        if timings_options is None:
+            return _plugin_main(argv, target_factory)
+        recorder = timings.enable()
+        try:
+            return _plugin_main(argv, target_factory)
+        finally:
+            timings.disable()
+            report_timings(recorder, **timings_options)
+    finally:
+        DeviceManager.use_inventory(False)
+
+
+def _plugin_main(argv, target_factory):
+    with timings.phase('parse_args'):
+        args = parse_args(argv)
     if args.verbose:
         print("Args:", str(args).lstrip("Namespace"))
 
+    if args.subparser == 'timeline':
+        from pyltc.plugins.timeline import Timeline  # imported here as it depends on this module
+        try:
+            Timeline(args.steps, config_file=args.config, verbose=args.verbose).run()
+        except CommandFailed as exc:
+            print(exc)
+        return
+
+    if args.subparser == 'topology':
+        from pyltc.plugins.topology import load_topology, TopologyError
+        try:
+            topology = load_topology(args.name, args.config, verbose=args.verbose)
+            getattr(topology, args.action)()
+        except (TopologyError, CommandFailed) as exc:
+            print(exc)
+        return
+
+    if args.subparser == 'stats':
+        from pyltc.plugins.stats import StatsSampler, format_table, profile_branches
+        branches, netns = None, args.netns
+        if args.profile_name:
+            branches, netns = profile_branches(args.profile_name, args.config, netns=args.netns)
+        with StatsSampler(args.interface, branches, netns) as sampler:
+            try:
+                for rows in sampler.run(args.interval, args.count):
+                    print(format_table(rows), end='\n\n', flush=True)
+            except KeyboardInterrupt:
+                pass
+        return
+
+    if args.subparser == 'backlog':
+        from pyltc.plugins.backlog import backlog_main
+        backlog_main(args)
+        return
+
+    if args.subparser == 'record':
+        from pyltc.plugins.recorder import recorder_main
+        recorder_main(args)
+        return
+
+    if args.subparser == 'exporter':
+        from pyltc.plugins.exporter import exporter_main
+        exporter_main(args)
+        return
+
+    if args.subparser == 'top':
+        from pyltc.plugins.top import top_main
+        top_main(args)
+        return
+
+    if args.pipeline:
+        from pyltc.core.tfactory import pipeline_target_factory
+        target_factory = pipeline_target_factory
     simnet = SimNetPlugin(args, target_factory)
     if 'profile_name' in args:
         simnet.load_profile(args.profile_name, args.config)
@@ -71,3 +71,32 @@ class BranchParser(object):
             return self._branch[name]
         except KeyError:
             raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+
+
+def timeline_step(step_str):
+    """Parses a 'PROFILE:SECONDS' timeline step into a (profile, seconds) tuple.
+    (Named this way as argparse uses the name of its ``type`` callables in error messages.)
+
+    :param step_str: string - the step, e.g. 'dsl-poor:10' or '4g:2.5'
+    :return: tuple - (string, float)
+    """
+    profile, sep, seconds = step_str.rpartition(':')
+    if not (profile and sep):
+        raise ValueError("Expected PROFILE:SECONDS, got {!r}".format(step_str))
+    seconds = float(seconds)
+    if seconds < 0:
+        raise ValueError("Negative duration in {!r}".format(step_str))
+    return profile, seconds
+
+
+def listen_address(address_str):
+    """Parses a 'HOST:PORT' (or ':PORT', for all addresses) listen address into a (host, port) tuple.
+    (Named this way as argparse uses the name of its ``type`` callables in error messages.)
+
+    :param address_str: string - the address, e.g. '127.0.0.1:9977' or '[::1]:9977'
+    :return: tuple - (string, int)
+    """
+    host, sep, port = address_str.rpartition(':')
+    if not sep:
+        raise ValueError("Expected HOST:PORT, got {!r}".format(address_str))
+    return host.strip('[]') or '0.0.0.0', int(port)
@@ -0,0 +1,154 @@
+"""
+Live traffic control statistics.
+
+Samples the counters of the qdiscs and classes of a set of devices (bytes,
+packets, drops, overlimits, requeues, backlog) over rtnetlink (see
+``pyltc.util.netlink``) rather than forking ``tc -s``: one qdisc dump for all
+devices and one class dump per device with a classful qdisc, per sample.
+Rates are computed from the deltas between two consecutive samples. If the
+setup was built from a simnet profile, the classes (and the netem qdiscs
+under them) are mapped back to the profile branch they shape::
+
+ $ sudo ./ltc.py stats -c examples/my.profile 4g
+ $ ./ltc.py stats -i eth0 -i ifb0 --interval 0.5 --count 10
+
+"""
+import time
+from collections import namedtuple, OrderedDict
+
+from pyltc.core.facade import TrafficControl
+from pyltc.util.netlink import RtnlSocket
+from pyltc.util.rates import convert2bps, format_rate
+
+
+DEFAULT_INTERVAL = 1.0
+
+#: the qdiscs that have classes; only devices with one of these get their classes dumped
+CLASSFUL_QDISCS = frozenset(('htb', 'hfsc', 'cbq', 'prio', 'drr', 'qfq', 'ets', 'multiq', 'mq', 'mqprio',
+                             'taprio'))
+
+#: The counters of a qdisc or class (``node`` is 'qdisc' or 'class') at a sample. ``branch``
+#: is the simnet ``Branch`` the node shapes, if known; ``bps``, ``pps`` and ``drop_rate`` (drops
+#: per second) are the rates since the previous sample (None on the first sample of the node,
+#: or if its counters were reset).
+NodeStats = namedtuple('NodeStats', 'dev node kind handle parent branch bytes packets drops overlimits'
+                                    ' requeues backlog qlen bps pps drop_rate')
+
+#: The statistics of a simnet branch at a sample, from its HTB class: ``utilization`` is the
+#: rate relative to the configured rate of the branch (None with the rate).
+BranchStats = namedtuple('BranchStats', 'branch bps utilization drops drop_rate backlog')
+
+
+def profile_branches(profile_name, config_file=None, interface=None, netns=None):
+    """Returns the simnet ``Branch`` objects of given profile (see ``compile_profile()``
+    for the arguments) and the network namespace the profile's devices are in. The
+    devices are left as they are (see ``SimNetPlugin.build_branches()``)."""
+    TrafficControl.init()
+    simnet = TrafficControl.get_plugin('simnet')
+    simnet.load_profile(profile_name, config_file=config_file, interface=interface, netns=netns)
+    return simnet.build_branches(), simnet.netns
+
+
+class StatsSampler(object):
+    """Samples the traffic control counters of devices of a network namespace."""
+
+    def __init__(self, devices=None, branches=None, netns=None, clock=time.monotonic):
+        """Initializer.
+
+        :param devices: iterable of strings - the device names; if None, the devices of the
+                        branches, or all devices if there are no branches either
+        :param branches: iterable of simnet ``Branch`` objects - to map the classes to
+        :param netns: string - the named network namespace of the devices, None for the current one
+        :param clock: callable - monotonic clock returning seconds
+        """
+        branches = list(branches) if branches else list()
+        devices = devices or set(branch.dev for branch in branches)
+        self._devices = set(devices) if devices else None
+        self._branches = dict(((branch.dev, branch.classid), branch) for branch in branches)
+        self._clock = clock
+        self._rtnl = RtnlSocket(netns)
+        self._last = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._rtnl.close()
+
+    def _dump(self):
+        """Returns a (device name, 'qdisc' or 'class', ``TcStats``) triple per node of the sampled devices."""
+        devices = OrderedDict()
+        for stats in self._rtnl.qdiscs():
+            dev = self._rtnl.link_name(stats.ifindex)
+            if self._devices is None or dev in self._devices:
+                devices.setdefault((dev, stats.ifindex), list()).append(stats)
+        nodes = list()
+        for (dev, ifindex), qdiscs in devices.items():
+            classes = self._rtnl.classes(ifindex) if any(q.kind in CLASSFUL_QDISCS for q in qdiscs) else []
+            nodes.extend((dev, 'qdisc', stats) for stats in qdiscs)
+            nodes.extend((dev, 'class', stats) for stats in classes)
+        return nodes
+
+    def sample(self):
+        """Dumps the counters and returns a ``NodeStats`` per qdisc and class, of each device
+        in the order the kernel lists them."""
+        now = self._clock()
+        rows, last = list(), dict()
+        for dev, node, stats in self._dump():
+            key = (dev, node, stats.handle)
+            bps = pps = drop_rate = None
+            if key in self._last:
+                then, before_bytes, before_packets, before_drops = self._last[key]
+                if now > then and stats.bytes >= before_bytes and stats.packets >= before_packets:
+                    bps = (stats.bytes - before_bytes) * 8 / (now - then)
+                    pps = (stats.packets - before_packets) / (now - then)
+                    drop_rate = max(stats.drops - before_drops, 0) / (now - then)
+            last[key] = (now, stats.bytes, stats.packets, stats.drops)
+            branch = self._branches.get((dev, stats.handle if node == 'class' else stats.parent))
+            rows.append(NodeStats(dev, node, stats.kind, stats.handle, stats.parent, branch, stats.bytes,
+                                  stats.packets, stats.drops, stats.overlimits, stats.requeues, stats.backlog,
+                                  stats.qlen, bps, pps, drop_rate))
+        self._last = last
+        return rows
+
+    def run(self, interval=DEFAULT_INTERVAL, count=None, sleep=time.sleep):
+        """Yields the rows of a sample every ``interval`` seconds, ``count`` times (forever if None)."""
+        due = self._clock()
+        idx = 0
+        while count is None or idx < count:
+            yield self.sample()
+            idx += 1
+            due += interval
+            delay = due - self._clock()  # scheduled against the first sample, so delays do not accumulate
+            if delay > 0 and (count is None or idx < count):
+                sleep(delay)
+
+
+def branch_stats(rows):
+    """Returns the ``BranchStats`` of the branches of sampled rows. (The HTB class of a branch
+    counts all its traffic, and the drops of the qdiscs under it as well.)"""
+    result = list()
+    for row in rows:
+        if row.node == 'class' and row.branch:
+            utilization = row.bps / convert2bps(row.branch.rate) if row.bps is not None else None
+            result.append(BranchStats(row.branch, row.bps, utilization, row.drops, row.drop_rate, row.backlog))
+    return result
+
+
+def format_table(rows):
+    """Formats sampled rows as a text table, one line per node."""
+    header = ('dev', 'node', 'kind', 'handle', 'parent', 'rate', 'pps', 'drops', 'overlimits', 'requeues',
+              'backlog', 'branch')
+    lines = [header]
+    for row in rows:
+        branch = '{} {}'.format(row.branch.direction, row.branch.spec) if row.branch else ''
+        lines.append((row.dev, row.node, row.kind, row.handle, row.parent,
+                      format_rate(row.bps) if row.bps is not None else '-',
+                      '{:.0f}'.format(row.pps) if row.pps is not None else '-',
+                      str(row.drops), str(row.overlimits), str(row.requeues), '{}b'.format(row.backlog), branch))
+    widths = [max(len(line[idx]) for line in lines) for idx in range(len(header) - 1)]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)) + '  ' + line[-1]
+                     for line in lines)
@@ -0,0 +1,135 @@
+"""
+Scheduled profile timeline runner.
+
+Applies a sequence of simnet profiles one after another, keeping each one for
+a given number of seconds, e.g.::
+
+ $ sudo ./ltc.py timeline -c examples/my.profile 4g:30 dsl-poor:10 kill-webrtc:5 clear:0
+
+All profiles are compiled into plans (see ``pyltc.core.plan``) before the first
+one is applied. The first step clears the chains used by any of the steps and
+builds its plan; every following switch only executes the difference between
+two consecutive plans, which takes milliseconds rather than a full clear and
+rebuild. The actual time of each switch is logged on stdout.
+
+"""
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from pyltc.core.facade import TrafficControl
+from pyltc.core.plan import TcPlan
+from pyltc.core.tfactory import plan_target_factory
+from pyltc.util.cmdline import CommandLine
+
+
+#: A switch that has been executed: ``scheduled`` and ``actual`` are offsets (in sec.)
+#: from the timeline start, ``took`` is the switch duration (in sec.), ``timestamp``
+#: is the wall clock time the switch began at.
+SwitchRecord = namedtuple('SwitchRecord', 'profile scheduled actual took commands timestamp')
+
+
+def compile_profile(profile_name, config_file=None, verbose=False, interface=None, netns=None, ifbdevice=None):
+    """Builds the plan of given simnet profile without configuring the kernel.
+    (Network devices the profile needs, e.g. an ifb device, are set up though.)
+
+    :param profile_name: string - the profile (config file section) name
+    :param config_file: string - the profile config file; default locations are tried if None
+    :param verbose: bool - whether to be verbose
+    :param interface: string - the device to shape instead of the profile's
+    :param netns: string - the named network namespace the devices are in instead of the profile's
+    :param ifbdevice: string - the ifb device to use for download shaping instead of the profile's
+    :return: TcPlan
+    """
+    return compile_simnet(profile_name, config_file, verbose, interface, netns, ifbdevice)[0]
+
+
+def compile_simnet(profile_name, config_file=None, verbose=False, interface=None, netns=None, ifbdevice=None):
+    """Like ``compile_profile()``, but returns the (plan, simnet plugin) pair; the plugin knows
+    the branches of the profile (see ``SimNetPlugin.branches``)."""
+    TrafficControl.init()
+    plan = TcPlan()
+    simnet = TrafficControl.get_plugin('simnet', target_factory=plan_target_factory(plan))
+    simnet.configure(verbose=verbose)
+    simnet.load_profile(profile_name, config_file=config_file, interface=interface, netns=netns,
+                        ifbdevice=ifbdevice)
+    simnet.marshal()
+    return plan, simnet
+
+
+class Timeline(object):
+    """Runs a sequence of (profile, seconds) steps."""
+
+    def __init__(self, steps, config_file=None, verbose=False):
+        """Initializer.
+
+        :param steps: list of (string, float) tuples - the profile names and durations
+        :param config_file: string - the profile config file; default locations are tried if None
+        :param verbose: bool - whether to be verbose
+        """
+        assert steps, "a timeline needs at least one step"
+        self._steps = list(steps)
+        self._config_file = config_file
+        self._verbose = verbose
+        self._clearing = None
+        self._transitions = None
+
+    @property
+    def transitions(self):
+        """The commands executed on each switch (available after ``compile()``)."""
+        return self._transitions
+
+    def compile(self):
+        """Compiles all profiles into plans and precomputes each switch."""
+        plans = dict()
+        for profile, _ in self._steps:
+            if profile not in plans:
+                plans[profile] = compile_profile(profile, self._config_file, self._verbose)
+        chains = list()
+        for plan in plans.values():
+            chains.extend(chain for chain in plan.chains if chain not in chains)
+        self._clearing = ["tc qdisc del dev {} {}".format(dev, chain) for dev, chain in chains]
+
+        sequence = [plans[profile] for profile, _ in self._steps]
+        self._transitions = [sequence[0].commands()]
+        self._transitions.extend(old.diff(new) for old, new in zip(sequence, sequence[1:]))
+        return self
+
+    def _execute(self, cmd, ignore_errors=False):
+        CommandLine(cmd, ignore_errors=ignore_errors, verbose=self._verbose, sudo=True).execute()
+
+    def _log(self, record):
+        wallclock = datetime.fromtimestamp(record.timestamp).strftime('%H:%M:%S.%f')[:-3]
+        print("timeline: {} +{:.3f}s switched to {!r} (scheduled +{:.3f}s, {} commands in {:.1f} ms)".format(
+              wallclock, record.actual, record.profile, record.scheduled, record.commands, record.took * 1000))
+
+    def run(self, clock=time.monotonic, sleep=time.sleep):
+        """Executes the timeline, returning after the last step's time has elapsed.
+
+        :param clock: callable - monotonic clock returning seconds
+        :param sleep: callable - sleeps for given seconds
+        :return: list of SwitchRecord objects
+        """
+        if self._transitions is None:
+            self.compile()
+        records = list()
+        start = clock()
+        scheduled = 0.0
+        for idx, ((profile, duration), commands) in enumerate(zip(self._steps, self._transitions)):
+            delay = start + scheduled - clock()  # scheduled against the start, so delays do not accumulate
+            if delay > 0:
+                sleep(delay)
+            timestamp, began = time.time(), clock()
+            if idx == 0:
+                for cmd in self._clearing:
+                    self._execute(cmd, ignore_errors=True)  # nothing to clear is fine
+            for cmd in commands:
+                self._execute(cmd)
+            record = SwitchRecord(profile, scheduled, began - start, clock() - began, len(commands), timestamp)
+            self._log(record)
+            records.append(record)
+            scheduled += duration
+        delay = start + scheduled - clock()
+        if delay > 0:
+            sleep(delay)
+        return records
@@ -0,0 +1,141 @@
+"""
+Live per-branch dashboard.
+
+Shows, per device and simnet branch of a profile, the current rate against
+the configured one, the drop rate and the backlog, refreshed every
+``--interval`` seconds (see ``pyltc.plugins.stats`` for how the counters are
+sampled)::
+
+ $ sudo ./ltc.py top -c examples/my.profile 4g
+ $ sudo ./ltc.py top -c examples/my.profile 4g --sort drops --batch --count 10
+
+Keys: 'u' sorts by utilization, 'd' by drop rate, 'p' restores the profile
+order; 'q' quits. With ``--batch`` (or if stdout is not a terminal), the screens are
+printed one after another instead.
+
+"""
+import sys
+import time
+
+from pyltc.plugins.stats import StatsSampler, branch_stats, profile_branches
+from pyltc.util.rates import format_rate
+
+
+DEFAULT_INTERVAL = 0.5
+
+SORT_UTIL = 'util'
+SORT_DROPS = 'drops'
+SORT_PROFILE = 'profile'
+SORT_ORDERS = (SORT_UTIL, SORT_DROPS, SORT_PROFILE)
+
+_SORT_KEYS = {ord('u'): SORT_UTIL, ord('d'): SORT_DROPS, ord('p'): SORT_PROFILE}
+
+_HEADER = ('dev', 'dir', 'rate', 'limit', 'util', 'drops/s', 'drops', 'backlog', 'branch')
+
+
+def sort_branches(stats, order=SORT_UTIL):
+    """Sorts ``BranchStats`` by utilization or drop rate, highest first (those not known yet last),
+    or keeps them in profile order."""
+    if order == SORT_UTIL:
+        return sorted(stats, key=lambda entry: -1 if entry.utilization is None else entry.utilization, reverse=True)
+    if order == SORT_DROPS:
+        return sorted(stats, key=lambda entry: (-1 if entry.drop_rate is None else entry.drop_rate, entry.drops),
+                      reverse=True)
+    return list(stats)
+
+
+def render(stats, order=SORT_UTIL, title=''):
+    """Returns the lines of a screen of given ``BranchStats``."""
+    lines = [_HEADER]
+    for entry in sort_branches(stats, order):
+        branch = entry.branch
+        lines.append((branch.dev, 'up' if branch.direction == 'upload' else 'down',
+                      format_rate(entry.bps) if entry.bps is not None else '-', branch.rate,
+                      '{:.0%}'.format(entry.utilization) if entry.utilization is not None else '-',
+                      '{:.1f}'.format(entry.drop_rate) if entry.drop_rate is not None else '-',
+                      str(entry.drops), '{}b'.format(entry.backlog), branch.spec))
+    widths = [max(len(line[idx]) for line in lines) for idx in range(len(_HEADER) - 1)]
+    # the numbers are right-aligned, the names left-aligned
+    aligned = [[cell.ljust(width) if idx < 2 else cell.rjust(width) for idx, (cell, width)
+                in enumerate(zip(line, widths))] + [line[-1]] for line in lines]
+    return [title] + ['  '.join(cells) for cells in aligned]
+
+
+class Top(object):
+    """Samples the branches of a profile and shows them, on a curses screen or as text."""
+
+    def __init__(self, branches, netns=None, interval=DEFAULT_INTERVAL, order=SORT_UTIL, clock=time.monotonic):
+        """Initializer.
+
+        :param branches: list of simnet ``Branch`` objects - the branches to show
+        :param netns: string - the named network namespace of the devices, None for the current one
+        :param interval: float - seconds between two refreshes
+        :param order: string - one of SORT_ORDERS
+        :param clock: callable - monotonic clock returning seconds
+        """
+        self._branches = branches
+        self._netns = netns
+        self._interval = interval
+        self.order = order
+        self._clock = clock
+
+    def _title(self):
+        return 'ltc top - every {}s, sorted by {} - {}'.format(self._interval, self.order,
+                                                                time.strftime('%H:%M:%S'))
+
+    def screens(self, count=None, sleep=time.sleep):
+        """Yields the lines of a screen per refresh, ``count`` times (forever if None)."""
+        with StatsSampler(branches=self._branches, netns=self._netns, clock=self._clock) as sampler:
+            for rows in sampler.run(self._interval, count, sleep):
+                yield render(branch_stats(rows), self.order, self._title())
+
+    def print_screens(self, count=None):
+        """Prints the screens one after another."""
+        for lines in self.screens(count):
+            print('\n'.join(lines), end='\n\n', flush=True)
+
+    def show(self, count=None):
+        """Shows the screens on the terminal until 'q' is pressed (or ``count`` screens)."""
+        import curses  # not everywhere available, and only needed here
+        curses.wrapper(self._show, count)
+
+    def _show(self, window, count):
+        import curses
+        curses.curs_set(0)
+        quit = list()
+
+        def wait(seconds):
+            # waiting for a key is the sleep between two refreshes, so keys act at once
+            due = self._clock() + seconds
+            while not quit:
+                window.timeout(max(int((due - self._clock()) * 1000), 0))
+                key = window.getch()
+                if key == -1:
+                    return
+                if key == ord('q'):
+                    quit.append(key)
+                elif key in _SORT_KEYS:
+                    self.order = _SORT_KEYS[key]
+                    return
+
+        for lines in self.screens(count, sleep=wait):
+            if quit:
+                return
+            height, width = window.getmaxyx()
+            window.erase()
+            for idx, line in enumerate(lines[:height]):
+                window.addnstr(idx, 0, line, width - 1, curses.A_REVERSE if idx == 1 else curses.A_NORMAL)
+            window.refresh()
+
+
+def top_main(args):
+    """Runs the ``top`` sub-command of given parsed arguments."""
+    branches, netns = profile_branches(args.profile_name, args.config, interface=args.interface, netns=args.netns)
+    top = Top(branches, netns, interval=args.interval, order=args.sort)
+    try:
+        if args.batch or not sys.stdout.isatty():
+            top.print_screens(args.count)
+        else:
+            top.show(args.count)
+    except KeyboardInterrupt:
+        pass
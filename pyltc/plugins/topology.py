@@ -0,0 +1,243 @@
+"""
+Virtual network topologies.
+
+Builds many shaped links at once: nodes are network namespaces, links are
+veth pairs between two of them, and each link may have a simnet profile
+applied to its first end. Topologies are declared in a config file in the
+format of the profile files, one section per topology::
+
+  ; a client reaching a server through a router, on a poor 4G uplink
+  [lab]
+  profiles examples/my.profile
+  addresses 10.100.0.0/16
+  node client router server
+  link client:eth0 router:eth0 4g-upload
+  link router:eth1 server:eth0
+
+and brought up and torn down with::
+
+ $ sudo ./ltc.py topology -c lab.topology lab up
+ $ sudo ./ltc.py topology -c lab.topology lab down
+
+Each link gets the next /30 of ``addresses``, its first end the first host
+address. Bringing a topology up takes a single ``ip -batch`` for all
+namespaces and veth pairs, then an ``ip -n <node> -batch`` (addresses, links
+up) and a ``tc -n <node> -batch`` (the compiled profiles, see
+``pyltc.core.plan``) per node, run concurrently. Tearing down deletes the
+namespaces in a single ``ip -batch``, which takes their devices and tc setups
+with them.
+
+Routes are not set up: a node reaches its direct neighbours.
+
+"""
+import asyncio
+import ipaddress
+import os
+from collections import namedtuple, OrderedDict
+from tempfile import TemporaryDirectory
+
+from pyltc.plugins.timeline import compile_profile
+from pyltc.util.cmdline import CommandLine, AsyncCommandLine
+from pyltc.util.confparser import ConfigParser
+
+
+#: the address pool links get their /30 subnets from, unless the topology says otherwise
+DEFAULT_ADDRESSES = '10.100.0.0/16'
+
+#: how many per-node batches run at once (each is a process with three pipes)
+MAX_CONCURRENT_BATCHES = 32
+
+#: how long (in sec.) a single batch may take
+BATCH_TIMEOUT = 60
+
+
+class TopologyError(Exception):
+    """Raised on an invalid topology declaration."""
+
+
+#: A veth pair between ``node``:``dev`` and ``peer``:``peer_dev``; ``profile`` (or None) is
+#: applied to ``dev``; ``addr`` and ``peer_addr`` are interface addresses, e.g. '10.100.0.1/30'.
+Link = namedtuple('Link', 'node dev peer peer_dev profile addr peer_addr')
+
+
+def _endpoint(token):
+    node, sep, dev = token.partition(':')
+    if not (node and sep and dev):
+        raise TopologyError("Expected NODE:DEVICE, got {!r}".format(token))
+    return node, dev
+
+
+def parse_topology(tokens):
+    """Parses the option tokens of a topology config section (as ``ConfigParser.section()``
+    returns them) into a ``Topology``.
+
+    :param tokens: list of strings - e.g. ['--node', 'a', 'b', '--link', 'a:eth0', 'b:eth0']
+    :return: Topology
+    """
+    options = OrderedDict((('profiles', list()), ('addresses', list()), ('node', list()), ('link', list())))
+    current = None
+    for token in tokens:
+        if token.startswith('--'):
+            if token[2:] not in options:
+                raise TopologyError("Unknown topology option: {!r}".format(token[2:]))
+            current = list()
+            options[token[2:]].append(current)
+        else:
+            current.append(token)
+
+    nodes = [node for values in options['node'] for node in values]
+    links = list()
+    for values in options['link']:
+        if len(values) not in (2, 3):
+            raise TopologyError("Expected 'link NODE:DEVICE NODE:DEVICE [PROFILE]', got {!r}".format(values))
+        links.append(_endpoint(values[0]) + _endpoint(values[1]) + (values[2] if len(values) == 3 else None,))
+    profiles = options['profiles'][-1][0] if options['profiles'] else None
+    addresses = options['addresses'][-1][0] if options['addresses'] else DEFAULT_ADDRESSES
+    return Topology(nodes, links, profiles=profiles, addresses=addresses)
+
+
+def load_topology(name, config_file, verbose=False):
+    """Loads a topology from given section of a config file.
+
+    :return: Topology
+    """
+    conf_parser = ConfigParser(config_file)
+    conf_parser.parse()
+    try:
+        tokens = conf_parser.section(name)
+    except KeyError:
+        raise TopologyError("No topology {!r} in {}".format(name, config_file))
+    topology = parse_topology(tokens)
+    if topology.profiles and not os.path.isabs(topology.profiles):
+        # a relative profiles path is taken relative to the topology file
+        topology.profiles = os.path.join(os.path.dirname(os.path.abspath(config_file)), topology.profiles)
+    topology.verbose = verbose
+    return topology
+
+
+class Topology(object):
+    """A set of nodes (network namespaces) and the links (veth pairs) between them."""
+
+    def __init__(self, nodes, links, profiles=None, addresses=DEFAULT_ADDRESSES, verbose=False):
+        """Initializer.
+
+        :param nodes: list of strings - the node (and namespace) names
+        :param links: list of (node, dev, peer, peer_dev, profile) tuples; profile may be None
+        :param profiles: string - the profile config file the link profiles are defined in
+        :param addresses: string - the address pool the links get their /30 subnets from
+        :param verbose: bool - whether to print the batches executed
+        """
+        if len(set(nodes)) != len(nodes):
+            raise TopologyError("Duplicate node names")
+        self._nodes = list(nodes)
+        self.profiles = profiles
+        self.verbose = verbose
+        subnets = ipaddress.ip_network(addresses).subnets(new_prefix=30)
+        self._links = list()
+        devices = set()
+        for node, dev, peer, peer_dev, profile in links:
+            for endpoint in ((node, dev), (peer, peer_dev)):
+                if endpoint[0] not in self._nodes:
+                    raise TopologyError("Link to an undeclared node: {!r}".format(endpoint[0]))
+                if endpoint in devices:
+                    raise TopologyError("Device used by two links: {}:{}".format(*endpoint))
+                devices.add(endpoint)
+            if node == peer:
+                raise TopologyError("Link from node {!r} to itself".format(node))
+            if profile and not profiles:
+                raise TopologyError("Link profile {!r} given, but no profiles file".format(profile))
+            try:
+                subnet = next(subnets)
+            except StopIteration:
+                raise TopologyError("Address pool {} exhausted".format(addresses))
+            addr, peer_addr = ('{}/30'.format(host) for host in subnet.hosts())
+            self._links.append(Link(node, dev, peer, peer_dev, profile, addr, peer_addr))
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    @property
+    def links(self):
+        return list(self._links)
+
+    def host_batch(self):
+        """Returns the ``ip -batch`` lines creating all namespaces and veth pairs."""
+        lines = ['netns add {}'.format(node) for node in self._nodes]
+        lines.extend('link add {} netns {} type veth peer name {} netns {}'.format(
+                     link.dev, link.node, link.peer_dev, link.peer) for link in self._links)
+        return lines
+
+    def node_batches(self):
+        """Returns the ``ip -n <node> -batch`` lines of each node: addresses and links up.
+
+        :return: OrderedDict - node -> list of strings
+        """
+        batches = OrderedDict((node, ['link set dev lo up']) for node in self._nodes)
+        for link in self._links:
+            for node, dev, addr in ((link.node, link.dev, link.addr), (link.peer, link.peer_dev, link.peer_addr)):
+                batches[node].append('addr add {} dev {}'.format(addr, dev))
+                batches[node].append('link set dev {} up'.format(dev))
+        return batches
+
+    def compile(self):
+        """Compiles the link profiles into the ``tc -n <node> -batch`` lines of each node.
+        The devices must exist (download profiles set up an ifb device per link). Profiles
+        shaping only the link's device are compiled once and renamed for further links.
+
+        :return: OrderedDict - node -> list of strings
+        """
+        batches = OrderedDict((node, list()) for node in self._nodes)
+        ifbs = dict()
+        compiled = dict()  # profile -> (dev, plan), of profiles shaping a single device
+        for link in self._links:
+            if not link.profile:
+                continue
+            if link.profile in compiled:
+                dev, plan = compiled[link.profile]
+                plan = plan.renamed({dev: link.dev})
+            else:
+                ifbdevice = 'ifb{}'.format(ifbs.setdefault(link.node, 0))
+                plan = compile_profile(link.profile, self.profiles, self.verbose, interface=link.dev,
+                                       netns=link.node, ifbdevice=ifbdevice)
+                if any(dev == ifbdevice for dev, _ in plan.chains):
+                    ifbs[link.node] += 1  # the ifb device was set up in the node, so compile each time
+                else:
+                    compiled[link.profile] = link.dev, plan
+            batches[link.node].extend(cmd[len('tc '):] for cmd in plan.commands())
+        return batches
+
+    def _write_batch(self, tmpdir, name, lines):
+        path = os.path.join(tmpdir, name + '.batch')
+        with open(path, 'w') as fhl:
+            fhl.write('\n'.join(lines) + '\n')
+        return path
+
+    async def _run_batches(self, program, batches, tmpdir):
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+
+        async def run(node, lines):
+            path = self._write_batch(tmpdir, '{}-{}'.format(program, node), lines)
+            async with semaphore:
+                await AsyncCommandLine('{} -n {} -batch {}'.format(program, node, path), verbose=self.verbose,
+                                       sudo=True).execute(timeout=BATCH_TIMEOUT)
+
+        await asyncio.gather(*(run(node, lines) for node, lines in batches.items() if lines))
+
+    def _run_host_batch(self, lines, tmpdir, ignore_errors=False):
+        path = self._write_batch(tmpdir, 'host', lines)
+        cmd = 'ip -force -batch {}'.format(path) if ignore_errors else 'ip -batch {}'.format(path)
+        CommandLine(cmd, ignore_errors=ignore_errors, verbose=self.verbose, sudo=True).execute(timeout=BATCH_TIMEOUT)
+
+    def up(self):
+        """Creates the namespaces and links, then applies the link profiles."""
+        with TemporaryDirectory(prefix='ltc-topology-') as tmpdir:
+            self._run_host_batch(self.host_batch(), tmpdir)
+            asyncio.run(self._run_batches('ip', self.node_batches(), tmpdir))
+            asyncio.run(self._run_batches('tc', self.compile(), tmpdir))
+
+    def down(self):
+        """Deletes the namespaces, and with them all links and their tc setup.
+        Nodes that do not exist (any more) are skipped."""
+        with TemporaryDirectory(prefix='ltc-topology-') as tmpdir:
+            self._run_host_batch(['netns del {}'.format(node) for node in self._nodes], tmpdir, ignore_errors=True)
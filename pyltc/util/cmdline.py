@@ -3,8 +3,11 @@ Command line execution utility module.
 
 """
 import time
+import asyncio
 import subprocess
 
+from pyltc.util import timings
+
 
 def popen_factory():
     """Returns subprocess.Popen on Linux, otherwise returns MockPopen
@@ -41,6 +44,11 @@ def popen_factory():
     return MockPopen
 
 
+def async_process_factory():
+    """Returns the coroutine function creating subprocesses for ``AsyncCommandLine``."""
+    return asyncio.create_subprocess_exec
+
+
 class CommandFailed(Exception):
     """Rased when a command line execution yielded a non-zero return code."""
 
@@ -100,22 +108,17 @@ class CommandLine(object):
         result += construct_the_list(command)
         return result
 
-    def terminate(self):
-        # TODO: refactor
+    def terminate(self, timeout=2):
+        """Terminates the process started by ``execute_daemon()``, killing it if it
+        does not exit within ``timeout`` seconds; returns its return code."""
         if not self._proc:
             return None
         self._proc.terminate()
-        rc = self._proc.poll()
-        c = 0
-        while rc == None:
-            time.sleep(0.1)
-            if c > 19:
-                self._proc.kill()
-                break
-            c += 1
-            rc = self._proc.poll()
-        time.sleep(0.1)
-        return self._proc.poll()
+        try:
+            return self._proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            return self._proc.wait()
 
     def execute_daemon(self):
         command_list = self._construct_cmd_list(self._cmdline)
@@ -128,18 +131,25 @@ class CommandLine(object):
         """Prepares and executes the command."""
         command_list = self._construct_cmd_list(self._cmdline)
         PopenClass = popen_factory()
+        timer = timings.active
+        start = timer.now() if timer else None
         proc = PopenClass(command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        spawned = timer.now() if timer else None
         self._proc = proc
         stdout, stderr = proc.communicate(timeout=timeout)
+        if timer:
+            timer.command(command_list, start, spawned, timer.now(), proc.returncode)
+        self._finish(command_list, proc.returncode, stdout, stderr)
+        return self  # allows for one-line creation + execution with assignment
+
+    def _finish(self, command_list, returncode, stdout, stderr):
         self._stdout = stdout.decode('unicode_escape') if stdout else ""
         self._stderr = stderr.decode('unicode_escape') if stderr else ""
-        rc = proc.returncode
-        self._returncode = rc
+        self._returncode = returncode
         if self._verbose:
             print(">", " ".join(command_list))
-        if rc and not self._ignore_errors:
+        if returncode and not self._ignore_errors:
             raise CommandFailed(self)
-        return self  # allows for one-line creation + execution with assignment
 
     @property
     def returncode(self):
@@ -152,3 +162,127 @@ class CommandLine(object):
     @property
     def stderr(self):
         return self._stderr
+
+
+class AsyncCommandLine(CommandLine):
+    """``CommandLine`` variant for asyncio: ``execute()``, ``execute_daemon()`` and
+    ``terminate()`` are coroutines, so that many commands and long running processes
+    can be driven concurrently on one event loop. Waiting for a process to exit relies
+    on the event loop's child watcher, not on polling.
+
+    Example::
+
+      cmd = await AsyncCommandLine('tc qdisc show', sudo=True).execute()
+      print(cmd.stdout)
+    """
+
+    async def execute_daemon(self):
+        command_list = self._construct_cmd_list(self._cmdline)
+        create_process = async_process_factory()
+        self._proc = await create_process(*command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return self
+
+    async def execute(self, timeout=10):
+        """Prepares and executes the command."""
+        command_list = self._construct_cmd_list(self._cmdline)
+        create_process = async_process_factory()
+        timer = timings.active
+        start = timer.now() if timer else None
+        proc = await create_process(*command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        spawned = timer.now() if timer else None
+        self._proc = proc
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(" ".join(command_list), timeout)
+        if timer:
+            # concurrent commands of one thread are told apart by their task
+            timer.command(command_list, start, spawned, timer.now(), proc.returncode, lane=id(asyncio.current_task()))
+        self._finish(command_list, proc.returncode, stdout, stderr)
+        return self
+
+    async def terminate(self, timeout=2):
+        """Terminates the process started by ``execute_daemon()``, killing it if it
+        does not exit within ``timeout`` seconds; returns its return code."""
+        if not self._proc:
+            return None
+        if self._proc.returncode is None:
+            self._proc.terminate()
+        try:
+            return await asyncio.wait_for(self._proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._proc.kill()
+            return await self._proc.wait()
+
+
+class PipedCommandLine(CommandLine):
+    """``CommandLine`` variant for programs that read their input while it is being produced,
+    e.g. ``tc -batch -``: ``start()`` the process, ``feed()`` it lines as they come, then
+    ``finish()`` by closing its input and waiting for it to exit.
+
+    Example::
+
+      batch = PipedCommandLine('tc -batch -', sudo=True).start()
+      batch.feed('qdisc add dev lo root handle 1:0 htb')
+      batch.finish()
+    """
+
+    def __init__(self, cmdline, ignore_errors=False, verbose=False, sudo=False):
+        super(PipedCommandLine, self).__init__(cmdline, ignore_errors=ignore_errors, verbose=verbose, sudo=sudo)
+        self._command_list = None
+        self._started = None
+        self._fed = list()
+
+    def start(self):
+        """Starts the process, with its input on a pipe."""
+        self._command_list = self._construct_cmd_list(self._cmdline)
+        PopenClass = popen_factory()
+        timer = timings.active
+        start = timer.now() if timer else None
+        self._proc = PopenClass(self._command_list, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        self._started = (start, timer.now()) if timer else None
+        return self
+
+    def feed(self, line):
+        """Writes a line to the input of the process. Returns False, writing nothing, if the
+        process has exited (e.g. a batch stopped at a failed command)."""
+        if self._proc.poll() is not None:
+            return False
+        try:
+            self._proc.stdin.write(line.encode('utf-8') + b'\n')
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            return False
+        self._fed.append(line)
+        return True
+
+    def finish(self, timeout=10, verbose=None):
+        """Closes the input of the process and waits for it to exit. ``verbose``, if given, overrides
+        the verbosity given on creation (e.g. if only known by now); verbosely, the lines fed are
+        printed too."""
+        if verbose is not None:
+            self._verbose = verbose
+        stdout, stderr = self._proc.communicate(timeout=timeout)
+        timer = timings.active
+        if timer and self._started:
+            timer.command(self._command_list, self._started[0], self._started[1], timer.now(), self._proc.returncode)
+        if self._verbose:
+            print(">", " ".join(self._command_list))
+            for line in self._fed:
+                print("   ", line)
+            self._verbose = False  # printed already, not again by _finish()
+        self._finish(self._command_list, self._proc.returncode, stdout, stderr)
+        return self
+
+    def terminate(self, timeout=2):
+        """Cancels the process: terminates it (see ``CommandLine.terminate()``) and closes its pipes."""
+        if not self._proc:
+            return None
+        returncode = super(PipedCommandLine, self).terminate(timeout)
+        for stream in (self._proc.stdin, self._proc.stdout, self._proc.stderr):
+            if stream:
+                stream.close()
+        return returncode
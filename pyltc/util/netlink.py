@@ -0,0 +1,318 @@
+"""
+Minimal rtnetlink client for reading traffic control statistics.
+
+Talks to the kernel over a ``NETLINK_ROUTE`` socket (see rtnetlink(7)) using
+only the standard library: a qdisc dump (``RTM_GETQDISC``) covers all devices
+of the network namespace in one request; class dumps (``RTM_GETTCLASS``) are
+per device, as the kernel only dumps the classes of the device asked for.
+The same counters ``tc -s qdisc/class show`` prints are returned, without
+forking ``tc``::
+
+  with RtnlSocket() as rtnl:
+      for stats in rtnl.qdiscs():
+          print(rtnl.link_name(stats.ifindex), stats.kind, stats.handle, stats.bytes)
+
+A socket subscribed to ``RTMGRP_LINK`` receives the link notifications (devices
+added, changed or removed), e.g. to keep a device inventory up to date.
+
+"""
+import ctypes
+import errno
+import os
+import socket
+import struct
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWQDISC = 36
+RTM_GETQDISC = 38
+RTM_NEWTCLASS = 40
+RTM_GETTCLASS = 42
+
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+
+#: the multicast group of the link notifications (RTM_NEWLINK, RTM_DELLINK)
+RTMGRP_LINK = 0x1
+
+#: the operational states of devices (RFC 2863), as in /sys/class/net/<dev>/operstate
+OPERSTATES = ('unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing', 'dormant', 'up')
+
+TCA_KIND = 1
+TCA_STATS = 3
+TCA_STATS2 = 7
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+TCA_STATS_PKT64 = 8
+
+TC_H_ROOT = 0xFFFFFFFF
+TC_H_INGRESS = 0xFFFFFFF1
+
+#: the setns(2) flag for network namespaces
+CLONE_NEWNET = 0x40000000
+#: where ``ip netns`` keeps the named namespaces
+NETNS_RUN_DIR = '/run/netns'
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_RTATTR = struct.Struct('=HH')
+_TCMSG = struct.Struct('=BxxxiIII')
+_IFINFOMSG = struct.Struct('=BxHiII')
+_GNET_STATS_BASIC = struct.Struct('=QI')
+_GNET_STATS_QUEUE = struct.Struct('=IIIII')
+_TC_STATS = struct.Struct('=QIIIIIII')
+_U64 = struct.Struct('=Q')
+
+#: the receive buffer size; a dump part is at most a page (or 8k) of messages
+RECV_BUFSIZE = 65536
+
+
+class NetlinkError(OSError):
+    """Raised when the kernel answers a request with an error."""
+
+
+class TcStats(namedtuple('TcStats', 'ifindex kind handle parent bytes packets drops overlimits requeues'
+                                    ' backlog qlen')):
+    """The counters of a qdisc or class. ``handle`` and ``parent`` are formatted as ``tc`` does
+    (e.g. '1:0', '1:1a'; 'root' and 'ingress' for the top-level parents); ``backlog`` is in bytes."""
+
+    __slots__ = ()
+
+
+#: A network device: ``flags`` are its IFF_* flags, ``operstate`` one of ``OPERSTATES``.
+LinkInfo = namedtuple('LinkInfo', 'ifindex name flags operstate')
+
+
+@lru_cache(maxsize=4096)
+def format_handle(handle):
+    """Formats a 32-bit tc handle the way ``tc`` does: 'major:minor' in hex."""
+    if handle == TC_H_ROOT:
+        return 'root'
+    if handle == TC_H_INGRESS:
+        return 'ingress'
+    return '{:x}:{:x}'.format(handle >> 16, handle & 0xFFFF)
+
+
+def iter_attrs(data, offset=0):
+    """Yields the (type, payload) pairs of the rtattr list in ``data`` from ``offset``."""
+    end = len(data)
+    while offset + _RTATTR.size <= end:
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        yield attr_type & 0x3FFF, data[offset + _RTATTR.size:offset + length]  # without the NLA_F_* flags
+        offset += (length + 3) & ~3
+
+
+def iter_messages(data):
+    """Yields the (type, flags, seq, payload) of the netlink messages in ``data``."""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, data[offset + _NLMSGHDR.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+def parse_tcmsg(payload):
+    """Parses the payload of an RTM_NEWQDISC/RTM_NEWTCLASS message into a ``TcStats``."""
+    # the hot path of sampling: the attributes are walked inline, skipping all but the needed ones
+    _, ifindex, handle, parent, _ = _TCMSG.unpack_from(payload)
+    kind = None
+    nbytes = packets = drops = overlimits = requeues = backlog = qlen = 0
+    stats2 = False
+    offset, end = _TCMSG.size, len(payload)
+    while offset + 4 <= end:
+        length, attr_type = _RTATTR.unpack_from(payload, offset)
+        if length < 4:
+            break
+        attr_type &= 0x3FFF
+        if attr_type == TCA_KIND:
+            kind = bytes(payload[offset + 4:offset + length]).rstrip(b'\0').decode()
+        elif attr_type == TCA_STATS2:
+            stats2 = True
+            inner, inner_end = offset + 4, offset + length
+            while inner + 4 <= inner_end:
+                inner_length, stats_type = _RTATTR.unpack_from(payload, inner)
+                if inner_length < 4:
+                    break
+                if stats_type == TCA_STATS_BASIC:
+                    nbytes, packets = _GNET_STATS_BASIC.unpack_from(payload, inner + 4)
+                elif stats_type == TCA_STATS_PKT64:
+                    packets, = _U64.unpack_from(payload, inner + 4)
+                elif stats_type == TCA_STATS_QUEUE:
+                    qlen, backlog, drops, requeues, overlimits = _GNET_STATS_QUEUE.unpack_from(payload, inner + 4)
+                inner += (inner_length + 3) & ~3
+            if kind is not None:
+                break  # only the legacy TCA_STATS and TCA_XSTATS follow
+        elif attr_type == TCA_STATS and not stats2:  # the legacy struct tc_stats, for old kernels
+            nbytes, packets, drops, overlimits, _, _, qlen, backlog = _TC_STATS.unpack_from(payload, offset + 4)
+        offset += (length + 3) & ~3
+    return TcStats(ifindex, kind, format_handle(handle), format_handle(parent), nbytes, packets, drops, overlimits,
+                   requeues, backlog, qlen)
+
+
+def parse_ifinfomsg(payload):
+    """Parses the payload of an RTM_NEWLINK message into an (ifindex, name) pair."""
+    _, _, ifindex, _, _ = _IFINFOMSG.unpack_from(payload)
+    for attr_type, value in iter_attrs(payload, _IFINFOMSG.size):
+        if attr_type == IFLA_IFNAME:
+            return ifindex, bytes(value).rstrip(b'\0').decode()
+    return ifindex, None
+
+
+def parse_link_info(payload):
+    """Parses the payload of an RTM_NEWLINK/RTM_DELLINK message into a ``LinkInfo``."""
+    _, _, ifindex, flags, _ = _IFINFOMSG.unpack_from(payload)
+    name, operstate = None, 0
+    for attr_type, value in iter_attrs(payload, _IFINFOMSG.size):
+        if attr_type == IFLA_IFNAME:
+            name = bytes(value).rstrip(b'\0').decode()
+        elif attr_type == IFLA_OPERSTATE:
+            operstate = value[0]
+    return LinkInfo(ifindex, name, flags, OPERSTATES[operstate] if operstate < len(OPERSTATES) else 'unknown')
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def _setns(fd):
+    if _libc.setns(fd, CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+@contextmanager
+def entered(netns):
+    """Moves the calling thread into given named network namespace for the duration of the
+    block (sockets created there stay in it). ``None`` leaves the thread where it is."""
+    if not netns:
+        yield
+        return
+    own = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        target = os.open(os.path.join(NETNS_RUN_DIR, netns), os.O_RDONLY)
+        try:
+            _setns(target)
+        finally:
+            os.close(target)
+        try:
+            yield
+        finally:
+            _setns(own)
+    finally:
+        os.close(own)
+
+
+def netns_socket(netns, *args):
+    """Creates a socket (of given ``socket.socket()`` arguments) in the named network
+    namespace, or in the current one if ``netns`` is None. The socket stays in that
+    namespace; the calling thread is moved back to its own."""
+    with entered(netns):
+        return socket.socket(*args)
+
+
+class RtnlSocket(object):
+    """A ``NETLINK_ROUTE`` socket dumping qdiscs, classes and links of a network namespace,
+    or receiving the notifications of given multicast groups. Dumps need no privileges;
+    entering a named namespace does."""
+
+    def __init__(self, netns=None, groups=0):
+        """Initializer.
+
+        :param netns: string - the named network namespace, None for the current one
+        :param groups: int - the multicast groups to receive the notifications of (e.g. ``RTMGRP_LINK``);
+                       a socket receiving notifications should not be used for dumps
+        """
+        self._sock = netns_socket(netns, socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self._sock.bind((0, groups))
+        self._seq = 0
+        self._links = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._sock.close()
+
+    def dump(self, msg_type, payload):
+        """Sends a dump request of given type and family header; returns the payloads of the answer."""
+        self._seq += 1
+        self._sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type, NLM_F_REQUEST | NLM_F_DUMP,
+                                       self._seq, 0) + payload)
+        payloads = list()
+        while True:
+            data = memoryview(self._sock.recv(RECV_BUFSIZE))  # the payloads are views into it, not copies
+            for reply_type, _, seq, reply in iter_messages(data):
+                if seq != self._seq:
+                    continue  # a late part of an earlier, interrupted dump
+                if reply_type == NLMSG_DONE:
+                    return payloads
+                if reply_type == NLMSG_ERROR:
+                    err = -struct.unpack_from('=i', reply)[0]
+                    if err == 0:
+                        return payloads
+                    raise NetlinkError(err, os.strerror(err))
+                payloads.append(reply)
+
+    def qdiscs(self):
+        """Returns the ``TcStats`` of all qdiscs of all devices."""
+        return [parse_tcmsg(reply) for reply in self.dump(RTM_GETQDISC, _TCMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))]
+
+    def classes(self, ifindex):
+        """Returns the ``TcStats`` of all classes of the device of given index."""
+        return [parse_tcmsg(reply) for reply in self.dump(RTM_GETTCLASS,
+                                                          _TCMSG.pack(socket.AF_UNSPEC, ifindex, 0, 0, 0))]
+
+    def links(self):
+        """Returns a dictionary of the device names by device index (and caches it)."""
+        replies = self.dump(RTM_GETLINK, _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+        self._links = dict(parse_ifinfomsg(reply) for reply in replies)
+        return dict(self._links)
+
+    def link_infos(self):
+        """Returns the ``LinkInfo`` of all devices."""
+        return [parse_link_info(reply) for reply in self.dump(RTM_GETLINK,
+                                                              _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))]
+
+    def notifications(self):
+        """Returns the (message type, payload) of the notifications received since the last call,
+        without waiting. Raises ``NetlinkError`` (ENOBUFS) if some were lost, not read in time."""
+        messages = list()
+        lost = False
+        while True:
+            try:
+                data = self._sock.recv(RECV_BUFSIZE, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            except OSError as exc:
+                if exc.errno != errno.ENOBUFS:
+                    raise
+                lost = True
+                continue
+            messages.extend((msg_type, payload) for msg_type, _, _, payload in iter_messages(memoryview(data)))
+        if lost:
+            raise NetlinkError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+        return messages
+
+    def link_name(self, ifindex):
+        """Returns the name of the device of given index; the device list is dumped again
+        (only) on an unknown index, e.g. of a device added since."""
+        if ifindex not in self._links:
+            self.links()
+        return self._links.get(ifindex)
@@ -0,0 +1,18 @@
+"""
+Optional dependencies.
+
+NumPy is only needed by a few features (the packet classifier, the fluid model, the
+backlog sampler and the recorder). Their modules import it from here, as ``None`` if it
+is not installed, and call ``require_numpy()`` before using it.
+
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def require_numpy(exc_class, feature):
+    """Raises ``exc_class`` saying that ``feature`` (e.g. 'the recorder') needs NumPy, if it is not installed."""
+    if numpy is None:
+        raise exc_class("NumPy is needed for {}; please install it.".format(feature))
@@ -82,3 +82,11 @@ def convert2bps(ratestr, valildate=True):
        in SI or IEC units as understood by tc."""
     rate, units = split_rate(ratestr, valildate)
     return rate * _RATE_KOEFF[units]
+
+
+def format_rate(bps):
+    """Formats a rate in bits per second the way ``tc`` prints rates, e.g. 1500000 -> '1.5mbit'."""
+    for units in ('tbit', 'gbit', 'mbit', 'kbit'):
+        if bps >= _RATE_KOEFF[units]:
+            return '{:.4g}{}'.format(bps / _RATE_KOEFF[units], units)
+    return '{:.4g}bit'.format(bps)
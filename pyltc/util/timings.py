@@ -0,0 +1,185 @@
+"""
+Phase and command timing instrumentation.
+
+Off by default. While off, ``phase()`` returns a shared no-op context manager
+and command execution only checks ``active``, so the instrumented code pays
+next to nothing. ``enable()`` turns it on: from then on every phase (parsing
+the arguments and the config file, building the tree, setting up devices,
+executing the targets) and every executed command is recorded as a ``Span``
+with ``time.monotonic()`` timings::
+
+  from pyltc.util import timings
+
+  recorder = timings.enable()
+  with timings.phase('build_tree'):
+      ...
+  print(recorder.format_summary())
+  recorder.write_chrome_trace('apply.trace.json')  # for chrome://tracing or Perfetto
+
+On the command line, ``--timings`` prints the summary (to stderr) at the end of
+a run; ``--timings-json PATH`` and ``--timings-trace PATH`` save the spans as
+JSON and as a Chrome trace.
+
+"""
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager, nullcontext
+
+
+#: the kinds of spans
+PHASE = 'phase'
+COMMAND = 'command'
+
+#: A timed phase or command. ``start`` is seconds since the recorder was enabled; ``lane`` is a small
+#: number per thread (or asyncio task) that ran it; ``args`` is a dictionary of details: for commands,
+#: the seconds taken to start the process ('spawn') and the return code ('rc').
+Span = namedtuple('Span', 'category name start duration lane args')
+
+#: the ``Timings`` recording now, None while timing is off
+active = None
+
+_NO_OP = nullcontext()
+
+
+def command_key(command_list):
+    """Returns the name commands are summed up by: the program (after sudo) and its
+    first two words that are not options or their values, e.g. 'tc class add'."""
+    words = command_list[1:] if command_list and command_list[0] == 'sudo' else command_list
+    key = words[:1]
+    skip = False
+    for word in words[1:]:
+        if len(key) == 3:
+            break
+        if skip:
+            skip = False
+        elif word.startswith('-'):
+            skip = word in ('-n', '-netns')  # takes a value
+        else:
+            key.append(word)
+    return ' '.join(key)
+
+
+class Timings(object):
+    """Records the spans of a run."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.origin = clock()
+        self.spans = list()
+        self._lanes = dict()
+        self._lock = threading.Lock()
+        #: estimated seconds sudo adds to a command, if measured (see ``measure_sudo()``)
+        self.sudo_overhead = None
+
+    def now(self):
+        return self._clock()
+
+    def _lane(self, key):
+        with self._lock:
+            return self._lanes.setdefault(key, len(self._lanes) + 1)
+
+    def record(self, category, name, start, end, lane=None, **args):
+        """Records a span of given absolute (clock) start and end times."""
+        lane = self._lane(threading.get_ident() if lane is None else lane)
+        self.spans.append(Span(category, name, start - self.origin, end - start, lane, args))
+
+    @contextmanager
+    def span(self, category, name, **args):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.record(category, name, start, self._clock(), **args)
+
+    def command(self, command_list, start, spawned, end, returncode, lane=None):
+        """Records an executed command: ``spawned`` is when its process was started."""
+        self.record(COMMAND, ' '.join(command_list), start, end, lane, spawn=spawned - start, rc=returncode)
+
+    def measure_sudo(self, repeat=5):
+        """Estimates the time sudo adds to a command as the difference of the fastest of ``repeat``
+        runs of 'sudo -n true' and of 'true'; None if sudo cannot be run."""
+
+        def fastest(command):
+            best = None
+            for _ in range(repeat):
+                start = time.monotonic()
+                subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                best = min(best or float('inf'), time.monotonic() - start)
+            return best
+
+        try:
+            self.sudo_overhead = max(fastest(['sudo', '-n', 'true']) - fastest(['true']), 0.0)
+        except (OSError, subprocess.CalledProcessError):
+            self.sudo_overhead = None
+        return self.sudo_overhead
+
+    def summary(self):
+        """Returns (category, name, count, total, max) tuples: the phases by name, the commands
+        by ``command_key()``, in the order they first ran. Times are in seconds."""
+        totals = OrderedDict()
+        for span in sorted(self.spans, key=lambda span: span.start):
+            name = command_key(span.name.split()) if span.category == COMMAND else span.name
+            count, total, longest = totals.get((span.category, name), (0, 0.0, 0.0))
+            totals[span.category, name] = (count + 1, total + span.duration, max(longest, span.duration))
+        return [key + value for key, value in totals.items()]
+
+    def format_summary(self):
+        """Formats the summary as a text table, with the estimated sudo overhead (if measured)."""
+        lines = [('', 'count', 'total ms', 'mean ms', 'max ms')]
+        for category, name, count, total, longest in self.summary():
+            lines.append(('{} {}'.format(category, name), str(count), '{:.2f}'.format(total * 1000),
+                          '{:.2f}'.format(total / count * 1000), '{:.2f}'.format(longest * 1000)))
+        sudo_commands = sum(1 for span in self.spans if span.category == COMMAND and span.name.startswith('sudo '))
+        if self.sudo_overhead is not None and sudo_commands:
+            lines.append(('sudo overhead (est.)', str(sudo_commands),
+                          '{:.2f}'.format(self.sudo_overhead * sudo_commands * 1000),
+                          '{:.2f}'.format(self.sudo_overhead * 1000), ''))
+        widths = [max(len(line[idx]) for line in lines) for idx in range(len(lines[0]))]
+        return '\n'.join('  '.join(cell.ljust(width) if idx == 0 else cell.rjust(width)
+                                   for idx, (cell, width) in enumerate(zip(line, widths))).rstrip()
+                         for line in lines)
+
+    def to_dict(self):
+        """Returns the spans (times in seconds) as a JSON-serializable dictionary."""
+        return dict(sudo_overhead=self.sudo_overhead, spans=[span._asdict() for span in self.spans])
+
+    def chrome_trace(self):
+        """Returns the spans as a Chrome trace (complete events, times in microseconds)."""
+        pid = os.getpid()
+        return dict(displayTimeUnit='ms', traceEvents=[
+            dict(name=span.name, cat=span.category, ph='X', ts=round(span.start * 1e6, 3),
+                 dur=round(span.duration * 1e6, 3), pid=pid, tid=span.lane, args=span.args)
+            for span in self.spans])
+
+    def write_json(self, path):
+        with open(path, 'w') as fhl:
+            json.dump(self.to_dict(), fhl, indent=1)
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as fhl:
+            json.dump(self.chrome_trace(), fhl)
+
+
+def enable(clock=time.monotonic):
+    """Turns timing on with a new recorder, and returns it."""
+    global active
+    active = Timings(clock)
+    return active
+
+
+def disable():
+    """Turns timing off; returns the recorder that was active, if any."""
+    global active
+    recorder, active = active, None
+    return recorder
+
+
+def phase(name, **args):
+    """Returns a context manager timing a phase of given name while timing is on, a no-op one otherwise."""
+    if active is None:
+        return _NO_OP
+    return active.span(PHASE, name, **args)
@@ -0,0 +1,275 @@
+"""
+Apply-latency benchmark for pyltc.
+
+Generates synthetic simnet profiles of 1 to 10k upload branches and applies
+them to a device of a throwaway network namespace in each of these modes:
+
+ - ``command``: ``TcCommandTarget``, one ``tc`` process per command;
+ - ``async``: the same through ``marshal_async()``;
+ - ``batch``: the profile compiled into a plan, applied with a single
+   ``tc -batch``;
+ - ``diff``: only the commands that differ from the setup in place (see
+   ``TcPlan.diff()``), applied with a single ``tc -batch``.
+
+Every run starts from a variant of the profile with other rates in place, so
+``command``, ``async`` and ``batch`` measure a full reapply and ``diff`` the
+rate change. Per mode and size it records the wall times, the number of
+processes spawned and their CPU time, and the peak RSS of the benchmark, and
+writes them out as JSON::
+
+ $ sudo python3 tests/benchmarks/apply_latency.py --sizes 1 100 10000 -o apply.json
+
+Sizes above ``--spawn-limit`` are skipped in the per-command modes, which take
+minutes there. Needs root; uses a ``dummy`` device (``--device-type veth``
+where the dummy module is not available).
+
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from os.path import abspath, normpath, dirname, join as pjoin
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+
+REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
+if not REPO_ROOT in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from pyltc.core.facade import TrafficControl
+from pyltc.core.plan import TcPlan
+from pyltc.core.tfactory import default_target_factory, plan_target_factory
+from pyltc.plugins.simnet import SimNetPlugin, parse_args
+from pyltc.util import cmdline
+from pyltc.util.cmdline import CommandLine
+from tests.benchmarks.report import new_report, write_report
+
+
+MODES = ('command', 'async', 'batch', 'diff')
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000)
+#: the largest profile (in branches) applied in the modes spawning a process per command
+DEFAULT_SPAWN_LIMIT = 1000
+DEFAULT_REPEAT = 3
+DEVICE = 'bench0'
+#: the first port of the synthetic branches; branch i shapes port FIRST_PORT + i
+FIRST_PORT = 1024
+
+
+def synthetic_branches(count, rate_factor=1):
+    """Returns ``count`` simnet upload branch specs, alternating TCP and UDP, one port each,
+    e.g. ['tcp:dport:1024:64kbit', 'udp:dport:1025:65kbit', ...].
+
+    :param rate_factor: int - multiplies all rates, to get a variant of the same profile
+    """
+    return ['{}:dport:{}:{}kbit'.format(('tcp', 'udp')[idx % 2], FIRST_PORT + idx, (64 + idx % 1000) * rate_factor)
+            for idx in range(count)]
+
+
+def simnet_args(branches, netns, dev=DEVICE):
+    """Returns the simnet arguments of a profile clearing and setting up given upload branches."""
+    return ['simnet', '--netns', netns, '--interface', dev, '--clear', '--upload'] + list(branches)
+
+
+def compile_plan(argv):
+    """Returns the plan of given simnet arguments."""
+    TrafficControl.init()
+    plan = TcPlan()
+    SimNetPlugin(parse_args(argv), plan_target_factory(plan)).marshal()
+    return plan
+
+
+def tc_batch(netns, commands, tmpdir):
+    """Applies given tc commands in given namespace with a single ``tc -batch``, through a file
+    in ``tmpdir``; if the first command is a chain deletion, errors are ignored."""
+    if not commands:
+        return
+    path = pjoin(tmpdir, 'apply.batch')
+    with open(path, 'w') as fhl:
+        fhl.write(''.join(cmd[len('tc '):] + '\n' for cmd in commands))
+    ignore_errors = bool(commands) and commands[0].startswith('tc qdisc del')
+    force = '-force ' if ignore_errors else ''
+    CommandLine('tc -n {} {}-batch {}'.format(netns, force, path), ignore_errors=ignore_errors,
+                sudo=True).execute(timeout=600)
+
+
+def apply_profile(mode, argv, current, netns, tmpdir):
+    """Applies the profile of given simnet arguments in given mode (see ``MODES``).
+
+    :param current: TcPlan - the setup in place, which the ``diff`` mode changes
+    :return: list of strings - the commands applied with ``tc -batch``; None in the per-command modes
+    """
+    TrafficControl.init()
+    if mode in ('command', 'async'):
+        simnet = SimNetPlugin(parse_args(argv), default_target_factory)
+        if mode == 'command':
+            simnet.marshal()
+        else:
+            asyncio.run(simnet.marshal_async())
+        return None
+    if mode == 'batch':
+        commands = compile_plan(argv).commands(clear=True)
+    elif mode == 'diff':
+        commands = current.diff(compile_plan(argv))
+    else:
+        raise ValueError("Unknown apply mode: {!r}".format(mode))
+    tc_batch(netns, commands, tmpdir)
+    return commands
+
+
+class Usage(object):
+    """Resource usage of a block: wall time, processes spawned and their CPU time,
+    and the peak RSS (in KiB) of this process so far."""
+
+    def __init__(self):
+        self.wall = self.spawns = self.child_cpu = self.peak_rss = self.commands = None
+
+
+@contextmanager
+def measured():
+    """Measures the resource usage of the block; yields a ``Usage`` filled in on exit."""
+    usage = Usage()
+    spawns = [0]
+    real_popen = cmdline.popen_factory()
+    real_create = cmdline.async_process_factory()
+
+    def counting_popen(*args, **kw):
+        spawns[0] += 1
+        return real_popen(*args, **kw)
+
+    async def counting_create(*args, **kw):
+        spawns[0] += 1
+        return await real_create(*args, **kw)
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with mock.patch('pyltc.util.cmdline.popen_factory', return_value=counting_popen), \
+            mock.patch('pyltc.util.cmdline.async_process_factory', return_value=counting_create):
+        start = time.perf_counter()
+        yield usage
+        usage.wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage.spawns = spawns[0]
+    usage.child_cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+    usage.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Bench(object):
+    """Applies synthetic profiles to a device of a throwaway network namespace."""
+
+    def __init__(self, device_type='dummy', tmpdir=None):
+        self.netns = 'ltcbench{}'.format(os.getpid())
+        self._device_type = device_type
+        self._tmpdir = tmpdir
+
+    def _ip(self, cmd):
+        CommandLine('ip -n {} {}'.format(self.netns, cmd), sudo=True).execute()
+
+    def __enter__(self):
+        CommandLine('ip netns add {}'.format(self.netns), sudo=True).execute()
+        try:
+            peer = ' peer name {}p'.format(DEVICE) if self._device_type == 'veth' else ''
+            self._ip('link add {} type {}{}'.format(DEVICE, self._device_type, peer))
+            self._ip('link set dev {} up'.format(DEVICE))
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        CommandLine('ip netns del {}'.format(self.netns), ignore_errors=True, sudo=True).execute()
+
+    def tc_batch(self, commands):
+        tc_batch(self.netns, commands, self._tmpdir)
+
+    def apply(self, mode, size):
+        """Applies the size-branch profile in given mode, over its variant with other rates,
+        and returns the ``Usage`` of applying it."""
+        argv = simnet_args(synthetic_branches(size), self.netns)
+        base = compile_plan(simnet_args(synthetic_branches(size, rate_factor=2), self.netns))
+        self.tc_batch(base.commands(clear=True))
+        with measured() as usage:
+            commands = apply_profile(mode, argv, base, self.netns, self._tmpdir)
+        usage.commands = len(commands if commands is not None else compile_plan(argv).commands(clear=True))
+        return usage
+
+
+def run(sizes=DEFAULT_SIZES, modes=MODES, repeat=DEFAULT_REPEAT, spawn_limit=DEFAULT_SPAWN_LIMIT,
+        device_type='dummy', log=None):
+    """Runs the benchmark and returns the report as a dictionary."""
+    results = list()
+    with TemporaryDirectory() as tmpdir, Bench(device_type, tmpdir) as bench:
+        for size in sizes:
+            for mode in modes:
+                entry = dict(mode=mode, branches=size)
+                results.append(entry)
+                if mode in ('command', 'async') and size > spawn_limit:
+                    entry['skipped'] = 'above the spawn limit of {} branches'.format(spawn_limit)
+                    continue
+                runs = [bench.apply(mode, size) for _ in range(repeat)]
+                entry.update(commands=runs[0].commands,
+                             wall_s=[round(usage.wall, 6) for usage in runs],
+                             wall_median_s=round(statistics.median(usage.wall for usage in runs), 6),
+                             spawns=runs[0].spawns,
+                             child_cpu_s=round(statistics.median(usage.child_cpu for usage in runs), 6),
+                             peak_rss_kb=max(usage.peak_rss for usage in runs))
+                if log:
+                    log("{mode:>8} {branches:>6} branches: {wall_median_s:9.4f} s, {spawns} spawns".format(**entry))
+    return new_report('apply_latency', results, device_type=device_type, repeat=repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures how long applying simnet profiles takes.")
+    parser.add_argument("-s", "--sizes", nargs='+', type=int, default=DEFAULT_SIZES,
+                        help="profile sizes in branches (default: %(default)s)")
+    parser.add_argument("-m", "--modes", nargs='+', choices=MODES, default=MODES,
+                        help="apply modes (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="runs per mode and size (default: %(default)s)")
+    parser.add_argument("--spawn-limit", type=int, default=DEFAULT_SPAWN_LIMIT,
+                        help="largest size applied per command (default: %(default)s)")
+    parser.add_argument("--device-type", choices=('dummy', 'veth'), default='dummy',
+                        help="type of the device shaped (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=None, help="the JSON report file (default: stdout)")
+    args = parser.parse_args(argv)
+    report = run(args.sizes, args.modes, args.repeat, args.spawn_limit, args.device_type,
+                 log=lambda msg: print(msg, file=sys.stderr))
+    write_report(report, args.output)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestApplyLatency(unittest.TestCase):
+
+    def test_synthetic_branches(self):
+        self.assertEqual(['tcp:dport:1024:64kbit', 'udp:dport:1025:65kbit'], synthetic_branches(2))
+        self.assertEqual(['tcp:dport:1024:128kbit'], synthetic_branches(1, rate_factor=2))
+        self.assertEqual(1000, len(set(synthetic_branches(1000))))
+
+    def test_compile_and_diff(self):
+        from tests.util.fakekernel import FakeKernel
+        with FakeKernel(devices=('lo', DEVICE)):
+            plan = compile_plan(simnet_args(synthetic_branches(10), 'ns1'))
+            base = compile_plan(simnet_args(synthetic_branches(10, rate_factor=2), 'ns1'))
+        self.assertEqual(7 + 2 * 10, len(plan))
+        self.assertEqual(10, len(base.diff(plan)))
+        self.assertTrue(all(' class change ' in cmd for cmd in base.diff(plan)))
+
+    def test_measured_counts_spawns(self):
+        from tests.util.fakekernel import FakeKernel
+        with FakeKernel(devices=('lo',)), measured() as usage:
+            CommandLine('tc qdisc add dev lo root handle 1:0 htb').execute()
+            asyncio.run(cmdline.AsyncCommandLine('tc qdisc del dev lo root').execute())
+        self.assertEqual(2, usage.spawns)
+        self.assertGreater(usage.wall, 0)
+
+
+if __name__ == '__main__':
+    main()
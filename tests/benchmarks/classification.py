@@ -0,0 +1,224 @@
+"""
+Data-plane classification benchmark for pyltc.
+
+Installs a generated simnet tree on the client veth of a ``NetnsPair`` (see
+``tests.util.netns``) and has the kernel's ``pktgen`` send UDP packets through
+it, with destination ports drawn at random over all configured ranges. Per
+filter strategy and tree size it reports the packets per second achieved and
+the CPU time (system, irq and softirq) spent per packet, also relative to a
+baseline run without a tree. The strategies are the filters simnet builds:
+
+ - ``u32``: single port branches, one ``u32`` match each, evaluated in turn;
+ - ``basic``: port range branches, one ``basic`` filter with ``cmp`` ematches each.
+
+All rates are set to 15gbit, so HTB queues but does not shape; pktgen runs in
+``queue_xmit`` mode so its packets go through the egress qdisc::
+
+ $ sudo python3 tests/benchmarks/classification.py --sizes 10 100 1000 -o classification.json
+
+Needs root and the ``pktgen`` module (loaded if missing). The system is best
+left otherwise idle, as CPU time is taken from ``/proc/stat``.
+
+"""
+import argparse
+import os
+import re
+import sys
+from os.path import abspath, normpath, dirname, join as pjoin
+from tempfile import TemporaryDirectory
+
+
+REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
+if not REPO_ROOT in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from pyltc.core.netdevice import DeviceManager
+from tests.benchmarks.apply_latency import compile_plan, simnet_args, tc_batch, FIRST_PORT
+from tests.benchmarks.report import new_report, write_report
+from tests.util.netns import NetnsPair, entered
+
+
+STRATEGIES = ('u32', 'basic')
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_PACKETS = 2000000
+PACKET_SIZE = 64
+#: the ports a 'basic' range branch covers
+RANGE_WIDTH = 10
+RATE = '15gbit'
+
+PKTGEN_THREAD = 'kpktgend_0'
+_RESULT_REGEX = re.compile(r'Result: OK: (?P<usec>\d+)\(c\d+\+d\d+\) usec, (?P<sent>\d+) \(')
+_ERRORS_REGEX = re.compile(r'\berrors: (?P<errors>\d+)')
+
+
+def strategy_branches(strategy, count):
+    """Returns ``count`` UDP upload branch specs simnet builds filters of given strategy for,
+    and the (first, last) port of all their ranges."""
+    if strategy == 'u32':
+        branches = ['udp:dport:{}:{}'.format(FIRST_PORT + idx, RATE) for idx in range(count)]
+        return branches, (FIRST_PORT, FIRST_PORT + count - 1)
+    if strategy == 'basic':
+        branches = ['udp:dport:{}-{}:{}'.format(FIRST_PORT + idx * RANGE_WIDTH, FIRST_PORT + (idx + 1) * RANGE_WIDTH - 1,
+                                                RATE) for idx in range(count)]
+        return branches, (FIRST_PORT, FIRST_PORT + count * RANGE_WIDTH - 1)
+    raise ValueError("Unknown filter strategy: {!r}".format(strategy))
+
+
+def cpu_jiffies():
+    """Returns the system, irq and softirq jiffies of all CPUs so far (see proc(5))."""
+    with open('/proc/stat') as fhl:
+        fields = fhl.readline().split()
+    return sum(int(fields[idx]) for idx in (3, 6, 7))
+
+
+def parse_result(text):
+    """Parses a pktgen device file: returns (packets sent, usec, errors)."""
+    match = _RESULT_REGEX.search(text)
+    if not match:
+        raise RuntimeError("No pktgen result in {!r}".format(text))
+    errors = _ERRORS_REGEX.search(text)
+    return int(match.group('sent')), int(match.group('usec')), int(errors.group('errors')) if errors else 0
+
+
+class Pktgen(object):
+    """Drives pktgen (through /proc/net/pktgen) on a device of a network namespace."""
+
+    def __init__(self, netns, dev):
+        self._netns = netns
+        self._dev = dev
+
+    def _path(self, name):
+        return pjoin('/proc/thread-self/net/pktgen', name)
+
+    def _write(self, name, line):
+        with entered(self._netns):
+            with open(self._path(name), 'w') as fhl:
+                fhl.write(line + '\n')
+
+    def _read(self, name):
+        with entered(self._netns):
+            with open(self._path(name)) as fhl:
+                return fhl.read()
+
+    def setup(self, dst, ports, count, pkt_size=PACKET_SIZE):
+        """Prepares sending ``count`` UDP packets to ``dst`` with random destination ports
+        within the (min, max) ``ports``."""
+        with entered(self._netns):
+            if not os.path.exists(self._path('pgctrl')):
+                DeviceManager.load_module('pktgen')
+        self._write(PKTGEN_THREAD, 'rem_device_all')
+        self._write(PKTGEN_THREAD, 'add_device {}'.format(self._dev))
+        for line in ('count {}'.format(count), 'pkt_size {}'.format(pkt_size), 'dst {}'.format(dst),
+                     'udp_dst_min {}'.format(ports[0]), 'udp_dst_max {}'.format(ports[1]),
+                     'flag UDPDST_RND', 'xmit_mode queue_xmit'):
+            self._write(self._dev, line)
+
+    def run(self):
+        """Sends the packets (returns when done) and returns (packets sent, usec, errors)."""
+        self._write('pgctrl', 'start')
+        return parse_result(self._read(self._dev))
+
+    def close(self):
+        try:
+            self._write(PKTGEN_THREAD, 'rem_device_all')
+        except OSError:
+            pass  # pktgen is not available; not to hide why
+
+
+def measure(fabric, pktgen, branches, ports, packets, tmpdir):
+    """Installs the branches (none: the default qdisc) and sends the packets through them.
+
+    :return: dict - packets, errors, seconds, pps and CPU ns per packet
+    """
+    if branches:
+        plan = compile_plan(simnet_args(branches, fabric.client, fabric.client_dev))
+        tc_batch(fabric.client, plan.commands(clear=True), tmpdir)
+    else:
+        tc_batch(fabric.client, ['tc qdisc del dev {} root'.format(fabric.client_dev)], tmpdir)
+    pktgen.setup(fabric.server_addr, ports, packets)
+    before = cpu_jiffies()
+    sent, usec, errors = pktgen.run()
+    cpu = (cpu_jiffies() - before) / os.sysconf('SC_CLK_TCK')
+    return dict(packets=sent, errors=errors, seconds=usec / 1e6, pps=round(sent / usec * 1e6),
+                cpu_ns_per_packet=round(cpu * 1e9 / sent, 1))
+
+
+def run(strategies=STRATEGIES, sizes=DEFAULT_SIZES, packets=DEFAULT_PACKETS, log=None):
+    """Runs the benchmark and returns the report as a dictionary."""
+    results = list()
+    with TemporaryDirectory() as tmpdir, NetnsPair(prefix='ltcbench') as fabric:
+        pktgen = Pktgen(fabric.client, fabric.client_dev)
+        try:
+            widest = max(strategy_branches(strategy, max(sizes))[1][1] for strategy in strategies)
+            baseline = measure(fabric, pktgen, None, (FIRST_PORT, widest), packets, tmpdir)
+            results.append(dict(strategy=None, branches=0, **baseline))
+            if log:
+                log("baseline: {pps} pps, {cpu_ns_per_packet} ns/packet".format(**baseline))
+            for strategy in strategies:
+                for size in sizes:
+                    branches, ports = strategy_branches(strategy, size)
+                    entry = dict(strategy=strategy, branches=size)
+                    entry.update(measure(fabric, pktgen, branches, ports, packets, tmpdir))
+                    entry['extra_cpu_ns_per_packet'] = round(entry['cpu_ns_per_packet'] -
+                                                             baseline['cpu_ns_per_packet'], 1)
+                    results.append(entry)
+                    if log:
+                        log("{strategy:>6} {branches:>6} branches: {pps} pps, {cpu_ns_per_packet} ns/packet"
+                            .format(**entry))
+        finally:
+            pktgen.close()
+    return new_report('classification', results, packets=packets, packet_size=PACKET_SIZE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures the packet rate through simnet trees using pktgen.")
+    parser.add_argument("-s", "--sizes", nargs='+', type=int, default=DEFAULT_SIZES,
+                        help="tree sizes in branches (default: %(default)s)")
+    parser.add_argument("--strategies", nargs='+', choices=STRATEGIES, default=STRATEGIES,
+                        help="filter strategies (default: all)")
+    parser.add_argument("-p", "--packets", type=int, default=DEFAULT_PACKETS,
+                        help="packets sent per run (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=None, help="the JSON report file (default: stdout)")
+    args = parser.parse_args(argv)
+    report = run(args.strategies, args.sizes, args.packets, log=lambda msg: print(msg, file=sys.stderr))
+    write_report(report, args.output)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestClassification(unittest.TestCase):
+
+    def test_strategy_branches(self):
+        branches, ports = strategy_branches('u32', 3)
+        self.assertEqual('udp:dport:1026:15gbit', branches[-1])
+        self.assertEqual((1024, 1026), ports)
+        branches, ports = strategy_branches('basic', 2)
+        self.assertEqual(['udp:dport:1024-1033:15gbit', 'udp:dport:1034-1043:15gbit'], branches)
+        self.assertEqual((1024, 1043), ports)
+        self.assertRaises(ValueError, strategy_branches, 'flower', 1)
+
+    def test_filters(self):
+        from tests.util.fakekernel import FakeKernel
+        with FakeKernel(devices=('lo', 'veth0')):
+            u32 = compile_plan(simnet_args(strategy_branches('u32', 5)[0], 'ns1', 'veth0'))
+            basic = compile_plan(simnet_args(strategy_branches('basic', 5)[0], 'ns1', 'veth0'))
+        self.assertEqual(5, sum(' u32 match ip dport ' in cmd for cmd in u32.commands()))
+        self.assertEqual(5, sum(' basic match ' in cmd for cmd in basic.commands()))
+
+    def test_parse_result(self):
+        text = ("Params: count 1000  min_pkt_size: 64  max_pkt_size: 64\n"
+                "Current:\n     pkts-sofar: 1000  errors: 3\n"
+                "Result: OK: 1500(c1400+d100) usec, 1000 (64byte,0frags)\n  666666pps 341Mb/sec\n")
+        self.assertEqual((1000, 1500, 3), parse_result(text))
+        self.assertRaises(RuntimeError, parse_result, "Result: Idle\n")
+
+    def test_cpu_jiffies(self):
+        self.assertGreaterEqual(cpu_jiffies(), 0)
+
+
+if __name__ == '__main__':
+    main()
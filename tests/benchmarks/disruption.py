@@ -0,0 +1,246 @@
+"""
+Reconfiguration-disruption benchmark for pyltc.
+
+Keeps a greedy TCP flow and a constant-rate UDP flow running through the
+client veth of a ``NetnsPair`` (see ``tests.util.netns``) while a two-branch
+profile is reapplied over and over, alternating between two rates, in each
+apply mode of ``tests.benchmarks.apply_latency`` (``command``, ``async``,
+``batch``, ``diff``). For every reapply it records:
+
+ - ``apply_s``: how long applying took;
+ - ``tcp_gap_s``/``udp_gap_s``: the longest time between two arrivals;
+ - ``udp_lost``: the UDP datagrams lost (UDP is offered below its rate, so
+   none are lost to shaping);
+ - ``unshaped_bytes``: the TCP bytes received beyond the new rate (plus the
+   tolerance), i.e. while the tree was torn down;
+ - ``reconverge_s``: the time from the start of the apply until the TCP rate
+   stays within the tolerance of the new rate (None if it does not within
+   ``SETTLE`` seconds).
+
+::
+
+ $ sudo python3 tests/benchmarks/disruption.py -o disruption.json
+ $ sudo python3 tests/benchmarks/disruption.py --modes batch diff --rates 2mbit 3mbit --reapplies 10
+
+Needs root.
+
+"""
+import argparse
+import statistics
+import sys
+import time
+from os.path import abspath, normpath, dirname, join as pjoin
+from tempfile import TemporaryDirectory
+
+
+REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
+if not REPO_ROOT in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from pyltc.util.rates import convert2bps
+from tests.benchmarks.apply_latency import MODES, apply_profile, compile_plan, simnet_args, tc_batch
+from tests.benchmarks.report import new_report, write_report
+from tests.util.netns import NetnsPair
+from tests.util.traffic import TrafficSink, TrafficSource
+
+
+DEFAULT_RATES = ('4mbit', '8mbit')
+DEFAULT_REAPPLIES = 5
+TCP_PORT, UDP_PORT = 9100, 9200
+#: the UDP flow is sent at this share of the lower rate
+UDP_SHARE = 0.5
+#: how long (sec.) the flows run before the first reapply
+WARMUP = 1.0
+#: how long (sec.) the flows are watched after each reapply
+SETTLE = 1.5
+#: the interval (sec.) the TCP rate is sampled at
+SAMPLE_INTERVAL = 0.02
+#: the window (sec.) rates are averaged over
+WINDOW = 0.2
+#: the relative error of the TCP rate taken as converged
+TOLERANCE = 0.15
+
+
+def profile_branches(rate):
+    return ['tcp:dport:{}:{}'.format(TCP_PORT, rate), 'udp:dport:{}:{}'.format(UDP_PORT, rate)]
+
+
+def windowed_rates(samples, window=WINDOW):
+    """Turns (time, bytes received so far) samples into (time, bits/s over the preceding
+    ``window``) pairs, for the samples at least a window after the first."""
+    rates, start = list(), 0
+    for now, received in samples:
+        while samples[start][0] < now - window:
+            start += 1
+        then, before = samples[max(start - 1, 0)]
+        if now - then >= window:
+            rates.append((now, (received - before) * 8 / (now - then)))
+    return rates
+
+
+def reconvergence(rates, target, since, tolerance=TOLERANCE):
+    """Returns how long after ``since`` the rate stays within the tolerance of the target,
+    or None if the last rate is off."""
+    settled = None
+    for now, rate in rates:
+        if abs(rate / target - 1) <= tolerance:
+            settled = now if settled is None else settled
+        else:
+            settled = None
+    return None if settled is None else max(settled - WINDOW - since, 0.0)
+
+
+def unshaped_bytes(rates, target, tolerance=TOLERANCE):
+    """Returns the bytes received beyond the target rate (plus the tolerance)."""
+    excess, last = 0.0, None
+    for now, rate in rates:
+        if last is not None:
+            excess += max(rate - target * (1 + tolerance), 0.0) * (now - last) / 8
+        last = now
+    return int(excess)
+
+
+class Flows(object):
+    """A greedy TCP flow and a constant-rate UDP flow across a namespace pair."""
+
+    def __init__(self, fabric, udp_rate, duration):
+        common = dict(host=fabric.server_addr)
+        self.tcp_sink = TrafficSink('tcp', port=TCP_PORT, netns=fabric.server, **common)
+        self.udp_sink = TrafficSink('udp', port=UDP_PORT, netns=fabric.server, flow=UDP_PORT, **common)
+        self.tcp_source = TrafficSource('tcp', port=TCP_PORT, duration=duration, netns=fabric.client, **common)
+        self.udp_source = TrafficSource('udp', port=UDP_PORT, rate=udp_rate, duration=duration, netns=fabric.client,
+                                        flow=UDP_PORT, **common)
+
+    def __enter__(self):
+        for endpoint in (self.tcp_sink, self.udp_sink, self.tcp_source, self.udp_source):
+            endpoint.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for source, sink in ((self.tcp_source, self.tcp_sink), (self.udp_source, self.udp_sink)):
+            source.stop()
+            source.join()
+            sink.source_done()
+            sink.join(timeout=5)
+
+    def watch(self, seconds):
+        """Samples the TCP bytes received for given time; returns the (time, bytes) samples."""
+        samples = list()
+        end = time.perf_counter() + seconds
+        while True:
+            now = time.perf_counter()
+            samples.append((now, self.tcp_sink.received))
+            if now >= end:
+                return samples
+            time.sleep(SAMPLE_INTERVAL)
+
+
+def run_mode(mode, fabric, tmpdir, rates=DEFAULT_RATES, reapplies=DEFAULT_REAPPLIES):
+    """Reapplies the profile in given mode while the flows run; returns a record per reapply."""
+    plans = dict((rate, compile_plan(simnet_args(profile_branches(rate), fabric.client, fabric.client_dev)))
+                 for rate in rates)
+    tc_batch(fabric.client, plans[rates[0]].commands(clear=True), tmpdir)
+    udp_rate = int(min(convert2bps(rate) for rate in rates) * UDP_SHARE)
+    records = list()
+    with Flows(fabric, udp_rate, WARMUP + reapplies * SETTLE + 10) as flows:
+        samples = flows.watch(WARMUP)
+        for idx in range(reapplies):
+            current, rate = rates[idx % len(rates)], rates[(idx + 1) % len(rates)]
+            argv = simnet_args(profile_branches(rate), fabric.client, fabric.client_dev)
+            flows.tcp_sink.take_max_gap()
+            flows.udp_sink.take_max_gap()
+            sent, received = flows.udp_source.datagrams, flows.udp_sink.packets
+            start = time.perf_counter()
+            apply_profile(mode, argv, plans[current], fabric.client, tmpdir)
+            applied = time.perf_counter()
+            # the samples of the window before the apply let the first rates after it be computed
+            samples = [sample for sample in samples if sample[0] >= start - WINDOW] + flows.watch(SETTLE)
+            rates_after = [(now, bps) for now, bps in windowed_rates(samples) if now > start]
+            target = convert2bps(rate)
+            records.append(dict(rate=rate, apply_s=round(applied - start, 4),
+                                tcp_gap_s=round(flows.tcp_sink.take_max_gap(), 4),
+                                udp_gap_s=round(flows.udp_sink.take_max_gap(), 4),
+                                udp_lost=max((flows.udp_source.datagrams - sent) -
+                                             (flows.udp_sink.packets - received), 0),
+                                unshaped_bytes=unshaped_bytes(rates_after, target),
+                                reconverge_s=_rounded(reconvergence(rates_after, target, start))))
+    return records
+
+
+def _rounded(seconds):
+    return None if seconds is None else round(seconds, 4)
+
+
+def _summary(records):
+    summary = dict()
+    for key in ('apply_s', 'tcp_gap_s', 'udp_gap_s', 'udp_lost', 'unshaped_bytes'):
+        summary[key] = max(record[key] for record in records)
+    converged = [record['reconverge_s'] for record in records if record['reconverge_s'] is not None]
+    summary['reconverge_median_s'] = round(statistics.median(converged), 4) if converged else None
+    summary['not_converged'] = len(records) - len(converged)
+    return summary
+
+
+def run(modes=MODES, rates=DEFAULT_RATES, reapplies=DEFAULT_REAPPLIES, log=None):
+    """Runs the benchmark and returns the report as a dictionary."""
+    results = list()
+    with TemporaryDirectory() as tmpdir, NetnsPair(prefix='ltcbench') as fabric:
+        for mode in modes:
+            records = run_mode(mode, fabric, tmpdir, rates, reapplies)
+            entry = dict(mode=mode, summary=_summary(records), reapplies=records)
+            results.append(entry)
+            if log:
+                log("{:>8}: {}".format(mode, entry['summary']))
+    return new_report('disruption', results, rates=list(rates), udp_share=UDP_SHARE, settle=SETTLE,
+                      tolerance=TOLERANCE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures how reapplying a profile disrupts running traffic.")
+    parser.add_argument("-m", "--modes", nargs='+', choices=MODES, default=MODES,
+                        help="apply modes (default: all)")
+    parser.add_argument("--rates", nargs=2, default=DEFAULT_RATES, metavar='RATE',
+                        help="the two rates the profile alternates between (default: %(default)s)")
+    parser.add_argument("-n", "--reapplies", type=int, default=DEFAULT_REAPPLIES,
+                        help="reapplies per mode (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=None, help="the JSON report file (default: stdout)")
+    args = parser.parse_args(argv)
+    report = run(args.modes, args.rates, args.reapplies, log=lambda msg: print(msg, file=sys.stderr))
+    write_report(report, args.output)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestDisruption(unittest.TestCase):
+
+    def test_windowed_rates(self):
+        samples = [(idx * 0.1, idx * 1000) for idx in range(6)]  # 80 kbit/s
+        rates = windowed_rates(samples, window=0.2)
+        self.assertEqual([0.2, 0.3, 0.4, 0.5], [round(now, 1) for now, _ in rates])
+        for _, rate in rates:
+            self.assertAlmostEqual(80000, rate)
+
+    def test_reconvergence(self):
+        rates = [(1.0, 2e6), (1.1, 9e5), (1.2, 1.02e6), (1.3, 1e6)]
+        self.assertAlmostEqual(1.2 - WINDOW - 1.0, reconvergence(rates, 1e6, since=1.0) + 0.0, delta=1e-9)
+        self.assertIsNone(reconvergence(rates + [(1.4, 5e5)], 1e6, since=1.0))
+        self.assertEqual(0.0, reconvergence([(1.3, 1e6)], 1e6, since=1.2))
+
+    def test_unshaped_bytes(self):
+        rates = [(0.0, 1e6), (0.1, 9e6), (0.2, 1e6)]
+        self.assertEqual(int((9e6 - 1e6 * (1 + TOLERANCE)) * 0.1 / 8), unshaped_bytes(rates, 1e6))
+
+    def test_sink_max_gap(self):
+        sink = TrafficSink('udp')
+        for now in (1.0, 1.1, 1.5, 1.6):
+            sink._account(100, now)
+        self.assertAlmostEqual(0.4, sink.take_max_gap())
+        self.assertEqual(0.0, sink.take_max_gap())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Shaping-fidelity benchmark for pyltc.
+
+Sweeps a grid of configured rates, loss percentages, flow counts and
+protocols. For each cell it installs a one-branch simnet tree on the client
+veth of a ``NetnsPair`` (see ``tests.util.netns``), runs the flows through it
+with the in-process traffic generator (see ``tests.util.traffic``) and
+records the achieved goodput against the configured rate::
+
+ $ sudo python3 tests/benchmarks/fidelity.py -o fidelity.json --csv fidelity.csv
+ $ sudo python3 tests/benchmarks/fidelity.py --rates 64kbit 10gbit --losses 0 --flows 1
+
+Cells also record the HTB parameters the kernel derived for the branch class
+(``burst``, ``cburst``, ``quantum``, from ``tc -d class show``) and, for UDP,
+the loss and mean one-way delay. The report's summary lists the cells off by
+more than ``--max-error``, each with the likely reasons:
+
+ - ``generator``: the rate is above what the generator achieves unshaped, so
+   the error says nothing about the shaping;
+ - ``quantum``: HTB clamped the quantum (rate / r2q is below one MTU or above
+   200000 bytes), so classes sharing a parent are no longer served in
+   proportion to their rates;
+ - ``burst``: the burst is less than one MTU, so the class cannot send a
+   full packet at once;
+ - ``netem-limit``: the netem queue (``NETEM_LIMIT`` packets) let the delay
+   of overloaded UDP grow beyond ``DELAY_LIMIT``;
+ - ``tcp-loss``: TCP over a lossy branch cannot reach the rate (see
+   ``pyltc.core.fluid.mathis_ceiling``).
+
+Needs root. UDP is offered at ``UDP_OVERLOAD`` times the configured rate.
+
+"""
+import argparse
+import csv
+import itertools
+import re
+import sys
+from os.path import abspath, normpath, dirname, join as pjoin
+from tempfile import TemporaryDirectory
+
+
+REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
+if not REPO_ROOT in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from pyltc.plugins.simnet import NETEM_LIMIT
+from pyltc.util.cmdline import CommandLine, CommandFailed
+from pyltc.util.rates import convert2bps
+from tests.benchmarks.apply_latency import compile_plan, simnet_args, tc_batch
+from tests.benchmarks.report import new_report, write_report
+from tests.util.netns import NetnsPair
+from tests.util.traffic import measure_many
+
+
+DEFAULT_RATES = ('64kbit', '512kbit', '4mbit', '32mbit', '256mbit', '1gbit', '10gbit')
+DEFAULT_LOSSES = (0, 1, 5)
+DEFAULT_FLOWS = (1, 4)
+PROTOCOLS = ('udp', 'tcp')
+DEFAULT_MAX_ERROR = 0.1
+#: the longest (in sec.) a cell's flows send; they stop earlier once their rates have converged
+DURATION = 3
+#: the relative error the flow rates are measured within
+TOLERANCE = 0.1
+#: UDP is offered at this multiple of the configured rate
+UDP_OVERLOAD = 2
+#: the mean one-way delay (sec.) beyond which a netem queue is taken as overgrown
+DELAY_LIMIT = 1.0
+FIRST_PORT = 9100
+MTU = 1500
+#: the bounds HTB clamps a class quantum to (bytes)
+QUANTUM_MIN, QUANTUM_MAX = 1000, 200000
+
+CSV_FIELDS = ('protocol', 'rate', 'loss', 'flows', 'goodput', 'error', 'udp_loss', 'delay', 'burst', 'cburst',
+              'quantum', 'reasons', 'failure')
+
+_HTB_CLASS_REGEX = re.compile(r'\bquantum (?P<quantum>\d+) .*\bburst (?P<burst>\d+[KMG]?b)/\d+ .*'
+                              r'\bcburst (?P<cburst>\d+[KMG]?b)/\d+')
+_SIZE_UNITS = {'b': 1, 'Kb': 1024, 'Mb': 1024 ** 2, 'Gb': 1024 ** 3}
+
+
+def _bytes(size):
+    number = re.match(r'\d+', size).group()
+    return int(number) * _SIZE_UNITS[size[len(number):]]
+
+
+def parse_htb_class(text):
+    """Returns the quantum, burst and cburst (bytes) of the first class of ``tc -d class show``
+    output, or None if there is none."""
+    match = _HTB_CLASS_REGEX.search(text)
+    if not match:
+        return None
+    return dict(quantum=int(match.group('quantum')), burst=_bytes(match.group('burst')),
+                cburst=_bytes(match.group('cburst')))
+
+
+def cell_branch(protocol, rate, loss, flows):
+    """Returns the simnet branch spec of a cell and the ports of its flows."""
+    ports = list(range(FIRST_PORT, FIRST_PORT + flows))
+    port_range = str(FIRST_PORT) if flows == 1 else '{}-{}'.format(ports[0], ports[-1])
+    spec = '{}:dport:{}:{}'.format(protocol, port_range, rate)
+    return (spec + ':{}%'.format(loss) if loss else spec), ports
+
+
+def reasons(cell, free_rate, max_error=DEFAULT_MAX_ERROR):
+    """Returns the likely reasons a cell is off (see the module docstring)."""
+    found = list()
+    rate = convert2bps(cell['rate'])
+    if free_rate is not None and rate * (1 - max_error) > free_rate:
+        found.append('generator')
+    if cell.get('quantum') is not None:
+        if cell['quantum'] in (QUANTUM_MIN, QUANTUM_MAX) and not QUANTUM_MIN < rate / 8 / 10 < QUANTUM_MAX:
+            found.append('quantum')
+        if cell['burst'] < MTU:
+            found.append('burst')
+    if cell['protocol'] == 'udp' and cell['loss'] and (cell.get('delay') or 0) > DELAY_LIMIT:
+        found.append('netem-limit')
+    if cell['protocol'] == 'tcp' and cell['loss']:
+        found.append('tcp-loss')
+    return found
+
+
+def summarize(cells, max_error=DEFAULT_MAX_ERROR):
+    """Returns the cells off by more than ``max_error`` (or failed), and the number of cells
+    per reason among them."""
+    off = [cell for cell in cells if cell.get('failure') or abs(cell['error']) > max_error]
+    counts = dict()
+    for cell in off:
+        for reason in cell.get('reasons') or ['unexplained']:
+            counts[reason] = counts.get(reason, 0) + 1
+    return dict(max_error=max_error, cells=len(cells), off=len(off), reasons=counts,
+                off_cells=[dict((key, cell.get(key)) for key in ('protocol', 'rate', 'loss', 'flows', 'error',
+                                                                  'reasons', 'failure')) for cell in off])
+
+
+class Grid(object):
+    """Runs the cells of the grid on one namespace pair."""
+
+    def __init__(self, fabric, tmpdir, duration=DURATION):
+        self._fabric = fabric
+        self._tmpdir = tmpdir
+        self._duration = duration
+        self._free = dict()
+
+    def _flows(self, protocol, ports, rate):
+        per_flow = '{}bit'.format(int(convert2bps(rate) * UDP_OVERLOAD / len(ports))) if protocol == 'udp' else None
+        fabric = self._fabric
+        return measure_many([(protocol, port, per_flow) for port in ports], host=fabric.server_addr,
+                            duration=self._duration, tolerance=TOLERANCE, source_netns=fabric.client,
+                            sink_netns=fabric.server)
+
+    def _clear(self):
+        tc_batch(self._fabric.client, ['tc qdisc del dev {} root'.format(self._fabric.client_dev)], self._tmpdir)
+
+    def free_rate(self, protocol, flows):
+        """Returns the total goodput (bits/s) of unshaped, unpaced flows; measured once."""
+        if (protocol, flows) not in self._free:
+            self._clear()
+            ports = list(range(FIRST_PORT, FIRST_PORT + flows))
+            results = measure_many([(protocol, port, None) for port in ports], host=self._fabric.server_addr,
+                                   duration=self._duration, tolerance=TOLERANCE,
+                                   source_netns=self._fabric.client, sink_netns=self._fabric.server)
+            self._free[(protocol, flows)] = sum(result.goodput for result in results.values())
+        return self._free[(protocol, flows)]
+
+    def htb_class(self, classid):
+        output = CommandLine('tc -n {} -d class show dev {} classid {}'.format(
+            self._fabric.client, self._fabric.client_dev, classid), sudo=True).execute().stdout
+        return parse_htb_class(output)
+
+    def run_cell(self, protocol, rate, loss, flows, max_error=DEFAULT_MAX_ERROR):
+        cell = dict(protocol=protocol, rate=rate, loss=loss, flows=flows)
+        free = self.free_rate(protocol, flows)
+        spec, ports = cell_branch(protocol, rate, loss, flows)
+        try:
+            plan = compile_plan(simnet_args([spec], self._fabric.client, self._fabric.client_dev))
+            tc_batch(self._fabric.client, plan.commands(clear=True), self._tmpdir)
+        except CommandFailed as exc:
+            cell.update(failure=str(exc), error=None)
+            return cell
+        branch_class = [node for node in plan.nodes if node.kind == 'class'][-1]
+        cell.update(self.htb_class(branch_class.nodeid) or dict())
+        results = self._flows(protocol, ports, rate)
+        goodput = sum(result.goodput for result in results.values())
+        cell.update(goodput=goodput, error=round(goodput / convert2bps(rate) - 1, 4))
+        if protocol == 'udp':
+            cell['udp_loss'] = round(max(result.loss for result in results.values()), 4)
+            delays = [result.delay for result in results.values() if result.delay is not None]
+            cell['delay'] = round(max(delays), 4) if delays else None
+        cell['reasons'] = reasons(cell, free, max_error)
+        return cell
+
+
+def run(rates=DEFAULT_RATES, losses=DEFAULT_LOSSES, flows=DEFAULT_FLOWS, protocols=PROTOCOLS,
+        max_error=DEFAULT_MAX_ERROR, duration=DURATION, log=None):
+    """Runs the grid and returns the report as a dictionary."""
+    cells = list()
+    with TemporaryDirectory() as tmpdir, NetnsPair(prefix='ltcbench') as fabric:
+        grid = Grid(fabric, tmpdir, duration)
+        for protocol, count, loss, rate in itertools.product(protocols, flows, losses, rates):
+            cell = grid.run_cell(protocol, rate, loss, count, max_error)
+            cells.append(cell)
+            if log:
+                log("{protocol} {flows} flow(s), {rate:>8}, {loss}% loss: error {error}{note}".format(
+                    note=' ({})'.format(cell['failure'] if cell.get('failure') else ', '.join(cell['reasons'])),
+                    **cell))
+        free = dict(('{}/{}'.format(*key), value) for key, value in grid._free.items())
+    report = new_report('fidelity', cells, free_rates=free, netem_limit=NETEM_LIMIT, udp_overload=UDP_OVERLOAD)
+    report['summary'] = summarize(cells, max_error)
+    return report
+
+
+def write_csv(cells, path):
+    with open(path, 'w', newline='') as fhl:
+        writer = csv.DictWriter(fhl, CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for cell in cells:
+            row = dict(cell, reasons=' '.join(cell.get('reasons') or ()))
+            writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures how closely simnet trees shape to their rates.")
+    parser.add_argument("--rates", nargs='+', default=DEFAULT_RATES, help="configured rates (default: %(default)s)")
+    parser.add_argument("--losses", nargs='+', type=int, default=DEFAULT_LOSSES,
+                        help="loss percentages (default: %(default)s)")
+    parser.add_argument("--flows", nargs='+', type=int, default=DEFAULT_FLOWS,
+                        help="concurrent flows per cell (default: %(default)s)")
+    parser.add_argument("--protocols", nargs='+', choices=PROTOCOLS, default=PROTOCOLS,
+                        help="protocols (default: all)")
+    parser.add_argument("--max-error", type=float, default=DEFAULT_MAX_ERROR,
+                        help="relative error a cell is accurate within (default: %(default)s)")
+    parser.add_argument("-d", "--duration", type=float, default=DURATION,
+                        help="longest time (sec.) a cell's flows send (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=None, help="the JSON report file (default: stdout)")
+    parser.add_argument("--csv", default=None, help="a CSV file to write the cells into too")
+    args = parser.parse_args(argv)
+    report = run(args.rates, args.losses, args.flows, args.protocols, args.max_error, args.duration,
+                 log=lambda msg: print(msg, file=sys.stderr))
+    write_report(report, args.output)
+    if args.csv:
+        write_csv(report['results'], args.csv)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestFidelity(unittest.TestCase):
+
+    def test_cell_branch(self):
+        self.assertEqual(('udp:dport:9100:64kbit', [9100]), cell_branch('udp', '64kbit', 0, 1))
+        self.assertEqual(('tcp:dport:9100-9103:1mbit:5%', [9100, 9101, 9102, 9103]),
+                         cell_branch('tcp', '1mbit', 5, 4))
+
+    def test_parse_htb_class(self):
+        text = ("class htb 2:1 parent 2: prio 0 quantum 1000 rate 64Kbit ceil 64Kbit linklayer ethernet "
+                "burst 1600b/1 mpu 0b cburst 1600b/1 mpu 0b level 0 \n")
+        self.assertEqual(dict(quantum=1000, burst=1600, cburst=1600), parse_htb_class(text))
+        self.assertEqual(1250 * 1024, parse_htb_class(text.replace('burst 1600b', 'burst 1250Kb'))['burst'])
+        self.assertIsNone(parse_htb_class(''))
+
+    def test_reasons(self):
+        cell = dict(protocol='udp', rate='10gbit', loss=0, quantum=200000, burst=0, cburst=0)
+        self.assertEqual(['generator', 'quantum', 'burst'], reasons(cell, free_rate=2e9))
+        cell = dict(protocol='udp', rate='1mbit', loss=5, quantum=12500, burst=1600, cburst=1600, delay=3.0)
+        self.assertEqual(['netem-limit'], reasons(cell, free_rate=2e9))
+        cell = dict(protocol='tcp', rate='1mbit', loss=1, quantum=12500, burst=1600, cburst=1600)
+        self.assertEqual(['tcp-loss'], reasons(cell, free_rate=2e9))
+
+    def test_summarize(self):
+        cells = [dict(protocol='udp', rate='1mbit', loss=0, flows=1, error=0.01, reasons=[]),
+                 dict(protocol='udp', rate='10gbit', loss=0, flows=1, error=-0.8, reasons=['generator']),
+                 dict(protocol='tcp', rate='1mbit', loss=5, flows=1, error=None, failure='no netem')]
+        summary = summarize(cells)
+        self.assertEqual(2, summary['off'])
+        self.assertEqual({'generator': 1, 'unexplained': 1}, summary['reasons'])
+
+    def test_csv(self):
+        with TemporaryDirectory() as tmpdir:
+            path = pjoin(tmpdir, 'cells.csv')
+            write_csv([dict(protocol='udp', rate='1mbit', loss=0, flows=1, goodput=999000, error=-0.001,
+                            reasons=['burst', 'quantum'])], path)
+            with open(path) as fhl:
+                rows = list(csv.DictReader(fhl))
+        self.assertEqual('burst quantum', rows[0]['reasons'])
+        self.assertEqual('999000', rows[0]['goodput'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Micro-benchmarks of the pure-Python plan generation pipeline.
+
+Times the hot paths between a profile and its ``tc`` commands without
+touching the kernel; targets are sinks that drop what they are given:
+
+ - ``branch_parser``: ``BranchParser`` on 100 branch specs;
+ - ``determine_all_rates``: on the same specs;
+ - ``build_tree``: ``build_basics()`` and ``build_tree()`` of the 100 branches;
+ - ``as_subcommand``: ``TcTarget.as_subcommand()`` of an HTB class;
+ - ``construct_cmd_list``: ``CommandLine._construct_cmd_list()`` of a quoted
+   ``basic`` filter command;
+ - ``config_parse``: ``ConfigParser.parse()`` of a 2MB profile file.
+
+Each benchmark is run in batches of as many calls as take at least 0.2 sec.
+(see ``timeit.Timer.autorange()``); the best and median time per call of the
+batches are reported. A report can be compared to an earlier one, e.g. of the
+parent commit, and the run fails if any benchmark got slower than allowed::
+
+ $ python3 tests/benchmarks/plan_generation.py -o before.json
+ $ git checkout my-branch
+ $ python3 tests/benchmarks/plan_generation.py --compare before.json --max-regression 0.1
+
+"""
+import argparse
+import os
+import statistics
+import sys
+import timeit
+from os.path import abspath, normpath, dirname, join as pjoin
+from tempfile import TemporaryDirectory
+
+
+REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
+if not REPO_ROOT in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from pyltc.core.facade import TrafficControl
+from pyltc.core.netdevice import NetDevice
+from pyltc.core.target import TcTarget
+from pyltc.plugins.simnet import build_basics, build_tree, determine_all_rates
+from pyltc.plugins.simnet_util import BranchParser
+from pyltc.util.cmdline import CommandLine
+from pyltc.util.confparser import ConfigParser
+from tests.benchmarks.report import new_report, write_report, load_report
+
+
+DEFAULT_REPEAT = 5
+#: the accepted slowdown (relative to the compared report) of the best time per call
+DEFAULT_MAX_REGRESSION = 0.2
+BRANCH_COUNT = 100
+#: the size of the profile file parsed, in bytes (approximately)
+PROFILE_FILE_SIZE = 2 * 1024 * 1024
+
+FILTER_COMMAND = ('tc filter add dev eth0 parent 2:0 protocol ip prio 3 basic match '
+                  '"cmp(u16 at 2 layer transport gt 9999) and cmp(u16 at 2 layer transport lt 20001)" flowid 2:3')
+
+
+class NullTarget(TcTarget):
+    """A ``TcTarget`` that builds the commands, but does nothing on ``marshal()``."""
+
+    def marshal(self):
+        pass
+
+
+def sample_branches(count=BRANCH_COUNT):
+    """Returns ``count`` upload branch specs mixing protocols, port types, ranges and losses."""
+    templates = ('tcp:dport:{port}:512kbit', 'udp:sport:{port}-{end}:1mbit:2%',
+                 'tcp:rport:{port}:256kbit:1%', 'udp:lport:{port}-{end}:2mbit')
+    return [templates[idx % 4].format(port=1024 + 10 * idx, end=1033 + 10 * idx) for idx in range(count)]
+
+
+def write_profile_file(path, size=PROFILE_FILE_SIZE):
+    """Writes a profile file of about ``size`` bytes: sections of 20 branches each."""
+    branches = ''.join('  {}\n'.format(branch) for branch in sample_branches(20))
+    with open(path, 'w') as fhl:
+        written, idx = 0, 0
+        while written < size:
+            section = '; profile {0}\n[profile-{0}]\nclear\ninterface eth0\nupload\n{1}\n'.format(idx, branches)
+            written += fhl.write(section)
+            idx += 1
+
+
+def benchmarks(tmpdir):
+    """Returns the (name, callable) pairs to time; ``tmpdir`` is for their input files."""
+    branches = sample_branches()
+
+    def branch_parser():
+        for branch in branches:
+            BranchParser(branch, upload=True).as_dict()
+
+    def all_rates():
+        determine_all_rates(branches + ['tcp:all:5mbit'], None)
+
+    def tree():
+        TrafficControl.init()
+        target = NetDevice('eth0', NullTarget).egress
+        tcp_hook, udp_hook = build_basics(target, False, False)
+        build_tree(target, tcp_hook, udp_hook, branches, upload=True)
+
+    TrafficControl.init()
+    target = NetDevice('eth0', NullTarget).egress
+    htb_class = target.add_class('htb', target.set_root_qdisc('htb'), rate='512kbit', ceil='1mbit')
+
+    def as_subcommand():
+        TcTarget.as_subcommand(htb_class)
+
+    cmdline = CommandLine(FILTER_COMMAND)
+
+    def construct_cmd_list():
+        cmdline._construct_cmd_list(FILTER_COMMAND)
+
+    profile_file = pjoin(tmpdir, 'large.profile')
+    write_profile_file(profile_file)
+
+    def config_parse():
+        ConfigParser(profile_file).parse()
+
+    return [('branch_parser', branch_parser), ('determine_all_rates', all_rates), ('build_tree', tree),
+            ('as_subcommand', as_subcommand), ('construct_cmd_list', construct_cmd_list),
+            ('config_parse', config_parse)]
+
+
+def time_call(func, repeat=DEFAULT_REPEAT):
+    """Returns (loops, per-call times in sec. of ``repeat`` batches of ``loops`` calls)."""
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    return loops, [elapsed / loops for elapsed in timer.repeat(repeat=repeat, number=loops)]
+
+
+def run(names=None, repeat=DEFAULT_REPEAT, log=None):
+    """Runs the benchmarks (all, or those of given names) and returns the report."""
+    results = list()
+    with TemporaryDirectory() as tmpdir:
+        for name, func in benchmarks(tmpdir):
+            if names and name not in names:
+                continue
+            loops, times = time_call(func, repeat)
+            entry = dict(name=name, loops=loops, times_s=times, best_s=min(times), median_s=statistics.median(times))
+            results.append(entry)
+            if log:
+                log("{name:>20}: {best_s:.3e} s per call (median {median_s:.3e})".format(**entry))
+    return new_report('plan_generation', results, repeat=repeat)
+
+
+def compare(report, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """Compares the best times of two reports.
+
+    :return: list of (name, baseline best, best, ratio, regressed) tuples, for the benchmarks in both
+    """
+    before = dict((entry['name'], entry['best_s']) for entry in baseline['results'])
+    rows = list()
+    for entry in report['results']:
+        if entry['name'] in before:
+            ratio = entry['best_s'] / before[entry['name']]
+            rows.append((entry['name'], before[entry['name']], entry['best_s'], ratio, ratio > 1 + max_regression))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times the pure-Python plan generation hot paths.")
+    parser.add_argument("names", nargs='*', help="benchmarks to run (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="timed batches per benchmark (default: %(default)s)")
+    parser.add_argument("-o", "--output", default=None, help="the JSON report file (default: stdout)")
+    parser.add_argument("--compare", default=None, metavar='REPORT',
+                        help="an earlier report to compare with; exits with 1 on regressions")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="accepted relative slowdown of the best time (default: %(default)s)")
+    args = parser.parse_args(argv)
+    report = run(args.names, args.repeat, log=lambda msg: print(msg, file=sys.stderr))
+    if args.output or not args.compare:
+        write_report(report, args.output)
+    if args.compare:
+        rows = compare(report, load_report(args.compare), args.max_regression)
+        for name, before, after, ratio, regressed in rows:
+            print("{:>20}: {:.3e} -> {:.3e} s ({:+.1%}){}".format(name, before, after, ratio - 1,
+                                                                  '  REGRESSION' if regressed else ''))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestPlanGeneration(unittest.TestCase):
+
+    def test_sample_branches(self):
+        branches = sample_branches(4)
+        self.assertEqual('tcp:dport:1024:512kbit', branches[0])
+        self.assertEqual('udp:sport:1034-1043:1mbit:2%', branches[1])
+        for branch in branches:
+            BranchParser(branch, upload=True)
+
+    def test_profile_file(self):
+        with TemporaryDirectory() as tmpdir:
+            path = pjoin(tmpdir, 'test.profile')
+            write_profile_file(path, size=10000)
+            self.assertGreaterEqual(os.path.getsize(path), 10000)
+            parser = ConfigParser(path).parse()
+            self.assertEqual(['--clear', '--interface', 'eth0', '--upload'], parser.section('profile-0')[:4])
+
+    def test_benchmarks_run(self):
+        with TemporaryDirectory() as tmpdir:
+            for name, func in benchmarks(tmpdir):
+                if name != 'config_parse':
+                    func()
+
+    def test_compare(self):
+        before = dict(results=[dict(name='a', best_s=1.0), dict(name='b', best_s=1.0)])
+        after = dict(results=[dict(name='a', best_s=1.1), dict(name='b', best_s=1.3), dict(name='c', best_s=1.0)])
+        self.assertEqual([('a', 1.0, 1.1, 1.1, False), ('b', 1.0, 1.3, 1.3, True)], compare(after, before, 0.2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Benchmark report helpers.
+
+Every benchmark writes a JSON report of the same shape, so reports of two
+commits or releases can be compared::
+
+  {"benchmark": "apply_latency", "meta": {"pyltc": "0.4.7", ...}, "results": [{...}, ...]}
+
+"""
+import json
+import platform
+import time
+
+from pyltc.conf import __version__
+
+
+def metadata(**extra):
+    """Returns the report metadata: versions, kernel release and time, plus given items."""
+    meta = dict(pyltc='.'.join(str(num) for num in __version__), python=platform.python_version(),
+                kernel=platform.release(), time=time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+    meta.update(extra)
+    return meta
+
+
+def new_report(benchmark, results, **extra):
+    """Returns a report of given benchmark name, results list and extra metadata."""
+    return dict(benchmark=benchmark, meta=metadata(**extra), results=results)
+
+
+def write_report(report, output=None):
+    """Writes the report to given file, or stdout if None."""
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as fhl:
+            fhl.write(text + '\n')
+    else:
+        print(text)
+
+
+def load_report(path):
+    with open(path) as fhl:
+        return json.load(fhl)
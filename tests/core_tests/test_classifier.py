@@ -0,0 +1,62 @@
+"""
+Unit tests for the offline packet classifier.
+
+"""
+import unittest
+
+from pyltc.core import classifier
+from pyltc.core.classifier import PlanClassifier, ClassifierError, make_packets, random_packets, PROTO_TCP, PROTO_UDP
+from pyltc.core.plan import TcPlan
+
+
+PLAN = [
+    'tc qdisc add dev lo root handle 1:0 htb',
+    'tc class add dev lo parent 1:0 classid 1:1 htb rate 15gbit',
+    'tc class add dev lo parent 1:0 classid 1:2 htb rate 15gbit',
+    'tc filter add dev lo parent 1:0 protocol ip prio 1 u32 match ip protocol 6 0xff flowid 1:1',
+    'tc filter add dev lo parent 1:0 protocol ip prio 2 u32 match ip protocol 17 0xff flowid 1:2',
+    'tc qdisc add dev lo parent 1:1 handle 2:0 htb',
+    'tc qdisc add dev lo parent 1:2 handle 3:0 htb',
+    'tc class add dev lo parent 2:0 classid 2:1 htb rate 512kbit',
+    'tc filter add dev lo parent 2:0 protocol ip prio 1 basic match'
+    ' "cmp(u16 at 2 layer transport gt 8999) and cmp(u16 at 2 layer transport lt 9011)" flowid 2:1',
+    'tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%',
+    'tc class add dev lo parent 3:0 classid 3:1 htb rate 1mbit',
+    'tc filter add dev lo parent 3:0 protocol ip prio 1 u32 match ip sport 8100 0xffff flowid 3:1',
+]
+
+
+@unittest.skipIf(classifier.np is None, "NumPy is not installed")
+class TestPlanClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = PlanClassifier(TcPlan(PLAN), 'lo')
+
+    def test_single_packets(self):
+        packets = make_packets([PROTO_TCP, PROTO_TCP, PROTO_TCP, PROTO_UDP, PROTO_UDP, 1],
+                               [1234, 1234, 1234, 8100, 8101, 0],
+                               [9000, 9010, 9011, 53, 53, 0])
+        result = self.classifier.classify(packets)
+        self.assertEqual(['2:1', '2:1', '2:0', '3:1', '3:0', '1:0'], [result.labels[idx] for idx in result.index])
+        self.assertEqual([2, 2, 2, 3, 3, 2], result.evaluated.tolist())
+
+    def test_hits(self):
+        result = self.classifier.classify(random_packets(200000, seed=1))
+        hits = result.hits()
+        self.assertEqual(200000, sum(hits.values()))
+        self.assertEqual(0, hits['1:1'] + hits['1:2'] + hits['4:0'] + hits['1:0'])  # all classified further
+        self.assertAlmostEqual(11 / 65536, hits['2:1'] / (hits['2:1'] + hits['2:0']), delta=0.0002)
+        self.assertAlmostEqual(1 / 65536, hits['3:1'] / (hits['3:1'] + hits['3:0']), delta=0.0001)
+        self.assertGreater(result.mean_evaluated, 2.0)
+        self.assertLess(result.mean_evaluated, 3.0)
+
+    def test_unsupported_filter(self):
+        plan = TcPlan(PLAN[:2] + ['tc filter add dev lo parent 1:0 protocol ip prio 1 flower ip_proto tcp flowid 1:1'])
+        self.assertRaises(ClassifierError, PlanClassifier, plan, 'lo')
+
+    def test_missing_chain(self):
+        self.assertRaises(ClassifierError, PlanClassifier, TcPlan(PLAN), 'lo', 'ingress')
+
+
+if __name__ == '__main__':
+    unittest.main()
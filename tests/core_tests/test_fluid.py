@@ -0,0 +1,116 @@
+"""
+Unit tests for the HTB/netem fluid model.
+
+"""
+import unittest
+from os.path import abspath, dirname, join as pjoin
+
+from pyltc.core import fluid
+from pyltc.core.fluid import FluidModel, FluidModelError, mathis_ceiling
+from pyltc.core.plan import TcPlan
+from pyltc.plugins.timeline import compile_profile
+from tests.util.fakekernel import FakeKernel
+
+
+EXAMPLE_PROFILES = pjoin(dirname(abspath(__file__)), '..', '..', 'examples', 'my.profile')
+
+
+BASICS = [
+    'tc qdisc add dev lo root handle 1:0 htb',
+    'tc class add dev lo parent 1:0 classid 1:1 htb rate 15gbit',
+    'tc class add dev lo parent 1:0 classid 1:2 htb rate 15gbit',
+    'tc filter add dev lo parent 1:0 protocol ip prio 1 u32 match ip protocol 6 0xff flowid 1:1',
+    'tc filter add dev lo parent 1:0 protocol ip prio 2 u32 match ip protocol 17 0xff flowid 1:2',
+    'tc qdisc add dev lo parent 1:1 handle 2:0 htb',
+    'tc qdisc add dev lo parent 1:2 handle 3:0 htb',
+]
+
+BRANCHES = [
+    'tc class add dev lo parent 2:0 classid 2:1 htb rate 512kbit',
+    'tc filter add dev lo parent 2:0 protocol ip prio 1 u32 match ip dport 443 0xffff flowid 2:1',
+    'tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%',
+    'tc class add dev lo parent 3:0 classid 3:1 htb rate 1mbit',
+    'tc filter add dev lo parent 3:0 protocol ip prio 1 u32 match ip sport 8100 0xffff flowid 3:1',
+]
+
+
+@unittest.skipIf(fluid.np is None, "NumPy is not installed")
+class TestFluidModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = FluidModel(TcPlan(BASICS + BRANCHES), 'lo')
+
+    def offered(self, rates, steps=500):
+        load = fluid.np.zeros((steps, len(self.model.sinks)))
+        for sink, rate in rates.items():
+            load[:, self.model.sinks.index(sink)] = rate
+        return load
+
+    def test_sinks(self):
+        self.assertEqual(['2:1', '3:1', '1:0', '2:0', '3:0'], self.model.sinks)
+        self.assertEqual(['tcp', 'udp', None, 'tcp', 'udp'], self.model.protocols)
+        self.assertEqual([0.02, 0, 0, 0, 0], self.model.loss.tolist())
+
+    def test_underload_loses_netem_share(self):
+        result = self.model.simulate(self.offered({'2:1': 256e3, '3:1': 512e3}))
+        goodput = result.mean_goodput(start=100)
+        self.assertAlmostEqual(256e3 * 0.98, goodput[0], delta=1)
+        self.assertAlmostEqual(512e3, goodput[1], delta=1)
+        self.assertEqual(0, result.overflow.sum())
+
+    def test_overload_is_shaped_and_overflows(self):
+        result = self.model.simulate(self.offered({'3:1': 5e6}))
+        self.assertAlmostEqual(1e6, result.mean_goodput(start=100)[1], delta=1e3)
+        limit = fluid.DEFAULT_LIMIT * 1500 * 8
+        self.assertAlmostEqual(limit, result.queue[-1, 1])
+        self.assertGreater(result.overflow[:, 1].sum(), 0)
+
+    def test_parent_limits_children(self):
+        plan = TcPlan([
+            'tc qdisc add dev lo root handle 1:0 htb',
+            'tc class add dev lo parent 1:0 classid 1:1 htb rate 1mbit',
+            'tc class add dev lo parent 1:1 classid 1:2 htb rate 1mbit',
+            'tc class add dev lo parent 1:1 classid 1:3 htb rate 1mbit',
+        ])
+        model = FluidModel(plan, 'lo')
+        self.assertEqual(['1:2', '1:3', '1:0'], model.sinks)
+        goodput = model.simulate(fluid.np.tile([1e6, 1e6, 0], (500, 1))).mean_goodput(start=100)
+        self.assertAlmostEqual(1e6, goodput[:2].sum(), delta=1e3)
+        self.assertAlmostEqual(goodput[0], goodput[1])
+
+    def test_mathis_ceiling(self):
+        self.assertAlmostEqual(1460 * 8 / 0.1 * 1.22 / 0.1, float(mathis_ceiling(0.01, 0.1)))
+        self.assertEqual(float('inf'), float(mathis_ceiling(0, 0.1)))
+
+    def test_shortfalls(self):
+        self.assertEqual([], self.model.shortfalls(rtt=0.05))
+        lossy = FluidModel(TcPlan(BASICS + [cmd.replace('loss 2%', 'loss 20%') for cmd in BRANCHES]), 'lo')
+        (shortfall,) = lossy.shortfalls(rtt=0.2)
+        self.assertEqual(('2:1', 'tcp', 512e3), shortfall[:3])
+        self.assertAlmostEqual(float(mathis_ceiling(0.2, 0.2)) * 0.8, shortfall.predicted, delta=1)
+
+    def test_bad_input(self):
+        self.assertRaises(FluidModelError, FluidModel, TcPlan(BASICS), 'eth0')
+        self.assertRaises(FluidModelError, self.model.simulate, fluid.np.zeros((10, 2)))
+
+
+@unittest.skipIf(fluid.np is None, "NumPy is not installed")
+class TestExampleProfiles(unittest.TestCase):
+    """The kind of check CI runs on profiles, instead of live iperf measurements."""
+
+    def shortfalls(self, profile, dev, rtt):
+        with FakeKernel(devices=('lo', 'eth0')):
+            plan = compile_profile(profile, EXAMPLE_PROFILES)
+        return FluidModel(plan, dev).shortfalls(rtt=rtt)
+
+    def test_4g_upload_meets_targets(self):
+        self.assertEqual([], self.shortfalls('4g-upload', 'eth0', rtt=0.05))
+
+    def test_4g_download_tcp_cannot_reach_rate(self):
+        # 2% loss at 50 ms RTT caps a TCP flow at ~2mbit, below the 2560kbit configured
+        (shortfall,) = self.shortfalls('4g-download', 'ifb0', rtt=0.05)
+        self.assertEqual(('2:1', 'tcp', 2560e3), shortfall[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
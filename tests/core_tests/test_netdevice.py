@@ -6,7 +6,14 @@ import unittest
 from unittest import mock
 from unittest.mock import call
 
-from pyltc.core.netdevice import DeviceManager, NetDevice
+from pyltc.core.netdevice import DeviceInventory, DeviceManager, NetDevice
+from pyltc.util import netlink
+from pyltc.util.cmdline import CommandLine, CommandFailed
+from pyltc.util.netlink import LinkInfo, NetlinkError
+from tests.util.fakekernel import FakeKernel
+from tests.util.fakertnl import FakeRtnl
+from tests.util.netns import NetnsPair, _can_create_netns
+from tests.util_tests.test_netlink import _link
 
 
 class MockedModuleTest(unittest.TestCase):
@@ -68,10 +75,11 @@ class MockedModuleTest(unittest.TestCase):
         fake_load_module.assert_not_called()
         fake_ensure_device.assert_not_called()
 
+    @mock.patch('pyltc.core.netdevice.DeviceManager.module_loaded', return_value=False)
     @mock.patch('pyltc.core.netdevice.DeviceManager.ensure_device')
     @mock.patch('pyltc.core.netdevice.DeviceManager.load_module')
     @mock.patch('pyltc.core.netdevice.os.listdir')
-    def test_get_device_no_such_devices(self, fake_listdir, fake_load_module, fake_ensure_device):
+    def test_get_device_no_such_devices(self, fake_listdir, fake_load_module, fake_ensure_device, _):
         fake_listdir.return_value = ['eth0']
         dev = NetDevice.get_device('ifb')
         self.assertEqual('ifb0', dev.name)
@@ -79,10 +87,11 @@ class MockedModuleTest(unittest.TestCase):
         fake_load_module.assert_called_once_with('ifb', numifbs=0)
         fake_ensure_device.assert_called_once_with('ifb0')
 
+    @mock.patch('pyltc.core.netdevice.DeviceManager.module_loaded', return_value=False)
     @mock.patch('pyltc.core.netdevice.DeviceManager.ensure_device')
     @mock.patch('pyltc.core.netdevice.DeviceManager.load_module')
     @mock.patch('pyltc.core.netdevice.os.listdir')
-    def test_get_device_two_such_devices(self, fake_os_listdir, fake_load_module, fake_ensure_device):
+    def test_get_device_two_such_devices(self, fake_os_listdir, fake_load_module, fake_ensure_device, _):
         fake_os_listdir.return_value = ['ifb0', 'eth0', 'ifb1']
         dev = NetDevice.get_device('ifb')
         self.assertEqual('ifb1', dev.name)
@@ -91,6 +100,196 @@ class MockedModuleTest(unittest.TestCase):
         fake_ensure_device.assert_called_once_with('ifb1')
         fake_ensure_device.assert_has_calls([])
 
+    @mock.patch('pyltc.core.netdevice.os.path.isdir', return_value=True)
+    @mock.patch('pyltc.core.netdevice.DeviceManager.ensure_device')
+    @mock.patch('pyltc.core.netdevice.DeviceManager.load_module')
+    @mock.patch('pyltc.core.netdevice.os.listdir')
+    def test_get_device_module_loaded(self, fake_listdir, fake_load_module, fake_ensure_device, fake_isdir):
+        fake_listdir.return_value = ['eth0']
+        dev = NetDevice.get_device('dummy')
+        self.assertEqual('dummy0', dev.name)
+        fake_isdir.assert_called_once_with('/sys/module/dummy')
+        fake_load_module.assert_not_called()
+        fake_ensure_device.assert_called_once_with('dummy0')
+
+
+class BulkTest(unittest.TestCase):
+    """Tests the bulk device operations against the fake kernel."""
+
+    def test_add_set_state_delete(self):
+        names = ['ifb{}'.format(num) for num in range(50)] + ['dummy0']
+        with FakeKernel() as kernel:
+            DeviceManager.add_devices(names)
+            self.assertEqual(['lo'] + names, DeviceManager.all_iface_names())
+            self.assertTrue(DeviceManager.device_is_down('ifb7'))
+            DeviceManager.set_state_many(names, 'up')
+            self.assertFalse(any(DeviceManager.device_is_down(name) for name in names))
+            DeviceManager.delete_many(names[:49] + ['ifb99'])
+            self.assertEqual(['lo', 'ifb49', 'dummy0'], DeviceManager.all_iface_names())
+        self.assertEqual(51 + 51 + 49, len(kernel.executed))  # ifb99 does not exist: not deleted
+
+    def test_batch_stops_at_failure(self):
+        with FakeKernel(devices=('lo', 'ifb1')) as kernel:
+            with mock.patch.object(DeviceManager, 'all_iface_names', return_value=['lo']):
+                self.assertRaises(CommandFailed, DeviceManager.add_devices, ['ifb0', 'ifb1', 'ifb2'])
+            self.assertEqual(['lo', 'ifb1', 'ifb0'], DeviceManager.all_iface_names())
+            DeviceManager.run_batch(['link del ifb5', 'link del ifb0'], ignore_errors=True)
+            self.assertEqual(['lo', 'ifb1'], DeviceManager.all_iface_names())
+        self.assertEqual(['ip link add ifb0 type ifb', 'ip link add ifb1 type ifb', 'ip link del ifb5',
+                          'ip link del ifb0'], kernel.executed)
+
+    def test_veth_pairs(self):
+        with FakeKernel() as kernel:
+            DeviceManager.add_devices(['veth0', 'ifb3', 'veth1'])
+            self.assertEqual(['lo', 'ifb3', 'veth0', 'veth1'], DeviceManager.all_iface_names())
+            DeviceManager.delete_many(['veth0', 'veth1'])  # veth1 goes with veth0
+            self.assertEqual(['lo', 'ifb3'], DeviceManager.all_iface_names())
+        self.assertIn('ip link add veth0 type veth peer name veth1', kernel.executed)
+        self.assertRaises(AssertionError, DeviceManager.add_devices, ['veth0'])
+
+    def test_devices_listed_once(self):
+        names = ['ifb{}'.format(num) for num in range(10)]
+        with FakeKernel():
+            with mock.patch.object(DeviceManager, 'all_iface_names', return_value=['lo']) as fake_names:
+                DeviceManager.add_devices(names)
+            self.assertEqual(1, fake_names.call_count)
+            with mock.patch.object(DeviceManager, 'all_iface_names', return_value=['lo'] + names) as fake_names:
+                DeviceManager.set_state_many(names, 'up')
+                DeviceManager.delete_many(names)
+            self.assertEqual(2, fake_names.call_count)
+
+    def test_shutdown_module(self):
+        with FakeKernel() as kernel:
+            DeviceManager.load_module('ifb', numifbs=3)
+            DeviceManager.set_state_many(['ifb0', 'ifb2'], 'up')
+            DeviceManager.shutdown_module('ifb')
+            self.assertFalse(kernel.module_loaded('ifb'))
+        self.assertIn('ip link set dev ifb1 down', kernel.executed)
+
+
+class NetnsTest(unittest.TestCase):
+    """Tests DeviceManager and NetDevice in a named network namespace, w/o running ``ip``."""
+
+    IP_LINK_OUTPUT = ("1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN mode DEFAULT\n"
+                      "5: veth0@if6: <BROADCAST,MULTICAST> mtu 1500 qdisc noop state DOWN mode DEFAULT\n"
+                      "7: ifb0: <BROADCAST,NOARP,UP,LOWER_UP> mtu 1500 qdisc noqueue state UNKNOWN mode DEFAULT\n")
+
+    def setUp(self):
+        patcher = mock.patch.object(DeviceManager, 'netns', 'ns1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_netns_command(self):
+        self.assertEqual('tc -n ns1 qdisc show', DeviceManager.netns_command('tc qdisc show'))
+        with mock.patch.object(DeviceManager, 'netns', None):
+            self.assertEqual('tc qdisc show', DeviceManager.netns_command('tc qdisc show'))
+
+    @mock.patch('pyltc.core.netdevice.CommandLine')
+    def test_all_iface_names(self, fake_command_line):
+        fake_command_line.return_value.execute.return_value.stdout = self.IP_LINK_OUTPUT
+        self.assertEqual(['lo', 'veth0', 'ifb0'], DeviceManager.all_iface_names())
+        self.assertEqual(['ifb0'], DeviceManager.all_iface_names('ifb'))
+        fake_command_line.assert_called_with('ip -n ns1 -o link show', sudo=True)
+
+    @mock.patch('pyltc.core.netdevice.CommandLine')
+    def test_device_is_down(self, fake_command_line):
+        fake_command_line.return_value.execute.return_value.stdout = self.IP_LINK_OUTPUT.splitlines()[1]
+        self.assertTrue(DeviceManager.device_is_down('veth0'))
+        fake_command_line.assert_called_with('ip -n ns1 -o link show dev veth0', sudo=True)
+        fake_command_line.return_value.execute.return_value.stdout = self.IP_LINK_OUTPUT.splitlines()[2]
+        self.assertFalse(DeviceManager.device_is_down('ifb0'))
+
+    @mock.patch('pyltc.core.netdevice.CommandLine')
+    def test_device_up(self, fake_command_line):
+        fake_command_line.return_value.execute.return_value.stdout = self.IP_LINK_OUTPUT
+        DeviceManager.device_up('veth0')
+        fake_command_line.assert_called_with('ip -n ns1 link set dev veth0 up', sudo=True)
+
+    def test_device_remembers_netns(self):
+        dev = NetDevice('veth0')
+        with mock.patch.object(DeviceManager, 'netns', None):
+            self.assertEqual('ns1', dev.netns)
+            self.assertIsNone(NetDevice('eth0').netns)
+
+    def test_in_netns(self):
+        with DeviceManager.in_netns('ns2'):
+            self.assertEqual('ns2', NetDevice('veth0').netns)
+        self.assertEqual('ns1', DeviceManager.netns)
+        with self.assertRaises(KeyError), DeviceManager.in_netns(None):
+            raise KeyError
+        self.assertEqual('ns1', DeviceManager.netns)
+
+
+class InventoryTest(unittest.TestCase):
+    """Tests DeviceInventory and the DeviceManager lookups served from it, w/o netlink."""
+
+    def setUp(self):
+        self.rtnl = FakeRtnl(link_infos=[LinkInfo(1, 'lo', 0x9, 'unknown'), LinkInfo(4, 'ifb0', 0x82, 'down'),
+                                         LinkInfo(5, 'ifb1', 0x83, 'unknown')])
+        patcher = self.rtnl.installed('pyltc.core.netdevice')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_notifications_applied(self):
+        inventory = DeviceInventory()
+        self.rtnl.queued = [(netlink.RTM_NEWLINK, _link(6, 'dummy0', 0x82, 2)),
+                            (netlink.RTM_DELLINK, _link(4, 'ifb0')),
+                            (netlink.RTM_NEWLINK, _link(5, 'eth9', 0x1003, 6))]  # ifb1 renamed
+        self.assertEqual(['dummy0', 'eth9', 'lo'], sorted(inventory.names()))
+        self.assertEqual(LinkInfo(5, 'eth9', 0x1003, 'up'), inventory.get('eth9'))
+        self.assertIsNone(inventory.get('ifb1'))
+        self.assertEqual(1, self.rtnl.link_dumps)
+
+    def test_other_notifications_ignored(self):
+        inventory = DeviceInventory()
+        self.rtnl.queued = [(netlink.RTM_GETLINK, _link(4, 'ifb0'))]
+        self.assertEqual(['ifb0', 'ifb1', 'lo'], sorted(inventory.names()))
+
+    def test_reloaded_if_notifications_lost(self):
+        inventory = DeviceInventory()
+        self.rtnl.link_info_list.append(LinkInfo(6, 'dummy0', 0x82, 'down'))
+        self.rtnl.queued = NetlinkError(105, 'No buffer space available')
+        self.assertEqual('down', inventory.get('dummy0').operstate)
+        self.assertEqual(2, self.rtnl.link_dumps)
+
+    @mock.patch('pyltc.core.netdevice.os.listdir')
+    def test_device_manager_lookups(self, fake_listdir):
+        DeviceManager.use_inventory()
+        self.addCleanup(DeviceManager.use_inventory, False)
+        self.assertTrue(DeviceManager.device_exists('ifb1'))
+        self.assertFalse(DeviceManager.device_exists('ifb2'))
+        self.assertEqual('ifb2', DeviceManager.minimal_nonexisting_name('ifb'))
+        self.assertTrue(DeviceManager.device_is_down('ifb0'))
+        self.assertFalse(DeviceManager.device_is_down('lo'))
+        fake_listdir.assert_not_called()
+        self.assertEqual(1, self.rtnl.link_dumps)
+
+    @mock.patch('pyltc.core.netdevice.os.listdir')
+    def test_falls_back_to_listing(self, fake_listdir):
+        fake_listdir.return_value = ['lo', 'eth0']
+        DeviceManager.use_inventory()
+        self.addCleanup(DeviceManager.use_inventory, False)
+        with mock.patch('pyltc.core.netdevice.RtnlSocket', side_effect=PermissionError(1, 'Operation not permitted')):
+            self.assertTrue(DeviceManager.device_exists('eth0'))
+        fake_listdir.assert_called_once_with(DeviceManager.SYS_CLASS_NET)
+
+
+@unittest.skipUnless(_can_create_netns(), "needs root and network namespace support")
+class LiveInventoryTest(unittest.TestCase):
+
+    def test_follows_changes(self):
+        with NetnsPair(prefix='ltcinv') as fabric:
+            inventory = DeviceInventory(fabric.client)
+            try:
+                self.assertEqual({'lo', fabric.client_dev, fabric.ifb_dev}, set(inventory.names()))
+                CommandLine('ip -n {} link add vinv0 type veth peer name vinv1'.format(fabric.client),
+                            sudo=True).execute()
+                CommandLine('ip -n {} link del {}'.format(fabric.client, fabric.ifb_dev), sudo=True).execute()
+                self.assertEqual({'lo', fabric.client_dev, 'vinv0', 'vinv1'}, set(inventory.names()))
+                self.assertEqual('down', inventory.get('vinv0').operstate)
+            finally:
+                inventory.close()
+
 
 class LiveModuleTest(unittest.TestCase):
     """Tests DeviceManager and NetDevice with loading module(s) and creating, reconfiguring
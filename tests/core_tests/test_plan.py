@@ -0,0 +1,147 @@
+"""
+Unit tests for the traffic control plans module.
+
+"""
+import unittest
+
+from pyltc.core.plan import TcPlan, PlanNode, PlanSyntaxError, parse_command
+from tests.util.fakekernel import FakeKernel
+
+
+BASE = [
+    'tc qdisc del dev lo root',
+    'tc qdisc add dev lo root handle 1:0 htb',
+    'tc class add dev lo parent 1:0 classid 1:1 htb rate 15gbit',
+    'tc class add dev lo parent 1:0 classid 1:2 htb rate 15gbit',
+    'tc filter add dev lo parent 1:0 protocol ip prio 1 u32 match ip protocol 6 0xff flowid 1:1',
+    'tc filter add dev lo parent 1:0 protocol ip prio 2 u32 match ip protocol 17 0xff flowid 1:2',
+    'tc qdisc add dev lo parent 1:1 handle 2:0 htb',
+    'tc qdisc add dev lo parent 1:2 handle 3:0 htb',
+]
+
+TCP_443 = [
+    'tc class add dev lo parent 2:0 classid 2:1 htb rate 512kbit',
+    'tc filter add dev lo parent 2:0 protocol ip prio 1 u32 match ip dport 443 0xffff flowid 2:1',
+    'tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%',
+]
+
+
+class TestParseCommand(unittest.TestCase):
+
+    def test_clear(self):
+        self.assertEqual(('lo', 'root'), parse_command('tc qdisc del dev lo root'))
+        self.assertEqual(('ifb0', 'ingress'), parse_command('tc qdisc del dev ifb0 ingress'))
+
+    def test_qdisc(self):
+        node = parse_command('tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%')
+        self.assertEqual(PlanNode('qdisc', 'lo', '2:1', '4:0', 'netem limit 1000000000 loss 2%', None, None), node)
+        self.assertEqual('root', parse_command('tc qdisc add dev lo root handle 1:0 htb').parent)
+        node = parse_command('tc qdisc add dev lo handle ffff:0 ingress')
+        self.assertEqual(('ingress', 'ingress'), (node.parent, node.chain))
+
+    def test_filter(self):
+        node = parse_command('tc filter add dev lo parent 2:0 protocol ip prio 1 basic match'
+                             ' "cmp(u16 at 2 layer transport gt 8999) and cmp(u16 at 2 layer transport lt 9011)"'
+                             ' flowid 2:1')
+        self.assertEqual(1, node.nodeid)
+        self.assertEqual('2:1', node.flowid)
+        self.assertTrue(node.spec.startswith('basic match "cmp('))
+        node = parse_command('tc filter add dev lo parent ffff:0 protocol ip u32 match u32 0 0 action mirred'
+                             ' egress redirect dev ifb0')
+        self.assertIsNone(node.nodeid)
+        self.assertIsNone(node.flowid)
+
+    def test_invalid(self):
+        self.assertRaises(PlanSyntaxError, parse_command, 'tc qdisc show dev lo')
+
+    def test_round_trip(self):
+        for cmd in BASE[1:] + TCP_443:
+            self.assertEqual(cmd, parse_command(cmd).add_command())
+
+
+class TestTcPlan(unittest.TestCase):
+
+    def test_commands(self):
+        plan = TcPlan(BASE + TCP_443)
+        self.assertEqual(BASE[1:] + TCP_443, plan.commands())
+        self.assertEqual(BASE + TCP_443, plan.commands(clear=True))
+        self.assertEqual([('lo', 'root')], plan.chains)
+
+    def test_renamed(self):
+        plan = TcPlan(BASE + TCP_443)
+        renamed = plan.renamed({'lo': 'eth0'})
+        self.assertEqual([cmd.replace(' dev lo ', ' dev eth0 ') for cmd in plan.commands()], renamed.commands())
+        self.assertEqual([('eth0', 'root')], renamed.chains)
+        self.assertEqual(plan, plan.renamed({'eth1': 'eth2'}))
+
+    def test_clear_drops_chain(self):
+        plan = TcPlan(BASE + TCP_443 + ['tc qdisc del dev lo root'])
+        self.assertEqual(0, len(plan))
+        self.assertEqual([('lo', 'root')], plan.chains)
+
+    def test_diff_identical(self):
+        self.assertEqual([], TcPlan(BASE + TCP_443).diff(TcPlan(BASE + TCP_443)))
+
+    def test_diff_changes_in_place(self):
+        old = TcPlan(BASE + TCP_443)
+        new = TcPlan(BASE + [cmd.replace('512kbit', '2mbit').replace('loss 2%', 'loss 1%') for cmd in TCP_443])
+        expected = [
+            'tc class change dev lo parent 2:0 classid 2:1 htb rate 2mbit',
+            'tc qdisc change dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 1%',
+        ]
+        self.assertEqual(expected, old.diff(new))
+
+    def test_diff_additions(self):
+        expected = TCP_443
+        self.assertEqual(expected, TcPlan(BASE).diff(TcPlan(BASE + TCP_443)))
+
+    def test_diff_removals(self):
+        expected = [
+            'tc filter del dev lo parent 2:0 protocol ip prio 1',
+            'tc class del dev lo classid 2:1',  # the netem qdisc goes away with its class
+        ]
+        self.assertEqual(expected, TcPlan(BASE + TCP_443).diff(TcPlan(BASE)))
+
+    def test_diff_replaced_filter(self):
+        old = TcPlan(BASE + TCP_443)
+        new = TcPlan(BASE + [cmd.replace('dport 443', 'dport 8443') for cmd in TCP_443])
+        expected = [
+            'tc filter del dev lo parent 2:0 protocol ip prio 1',
+            'tc filter add dev lo parent 2:0 protocol ip prio 1 u32 match ip dport 8443 0xffff flowid 2:1',
+        ]
+        self.assertEqual(expected, old.diff(new))
+
+    def test_diff_replaced_root(self):
+        old = TcPlan(BASE + TCP_443)
+        new = TcPlan([cmd.replace('root handle 1:0 htb', 'root handle 1:0 prio') for cmd in BASE])
+        self.assertEqual(['tc qdisc del dev lo root'] + new.commands(), old.diff(new))
+
+    def test_diff_to_empty(self):
+        self.assertEqual(['tc qdisc del dev lo root'], TcPlan(BASE + TCP_443).diff(TcPlan(['tc qdisc del dev lo root'])))
+
+
+class TestDiffOracle(unittest.TestCase):
+    """Applies diffs to the fake kernel: the result must be the target plan."""
+
+    def assertDiffReaches(self, old, new):
+        kernel = FakeKernel()
+        for cmd in old.commands() + old.diff(new):
+            kernel.execute(cmd)
+        self.assertEqual(new, kernel.plan())
+
+    def test_variants(self):
+        base_tcp = TcPlan(BASE + TCP_443)
+        variants = [
+            TcPlan(BASE),
+            TcPlan(BASE + [cmd.replace('512kbit', '2mbit').replace('loss 2%', 'loss 1%') for cmd in TCP_443]),
+            TcPlan(BASE + [cmd.replace('dport 443', 'dport 8443') for cmd in TCP_443]),
+            TcPlan(BASE + TCP_443[:2]),
+            TcPlan([cmd.replace('root handle 1:0 htb', 'root handle 1:0 prio') for cmd in BASE[:2]]),
+        ]
+        for new in variants:
+            self.assertDiffReaches(base_tcp, new)
+            self.assertDiffReaches(new, base_tcp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,17 @@
 Unit tests for the target chain builders module.
 
 """
+import asyncio
 import unittest
 from unittest import mock
 import io
 import time
 
-from pyltc.core import DIR_EGRESS, DIR_INGRESS
+from pyltc.core import DIR_EGRESS, DIR_INGRESS, ITarget, ITargetObserver
 from pyltc.core.ltcnode import Qdisc, QdiscClass, Filter
-from pyltc.core.netdevice import NetDevice
-from pyltc.core.target import TcTarget, TcFileTarget, TcCommandTarget
+from pyltc.core.netdevice import DeviceManager, NetDevice
+from pyltc.core.target import TcTarget, TcFileTarget, TcCommandTarget, TcPlanTarget, TcPipelineTarget
+from tests.util.fakekernel import FakeKernel
 
 
 class DummyTcTarget(TcTarget):
@@ -179,6 +181,160 @@ class TestTcCommandTarget(unittest.TestCase):
         ]
         fake_command_line.assert_has_calls(calls)
 
+    @mock.patch('pyltc.core.target.CommandLine')
+    def test_marshal_in_netns(self, fake_command_line):
+        Qdisc.init()
+        with mock.patch.object(DeviceManager, 'netns', 'ns1'):
+            target = TcCommandTarget(NetDevice('foo13'), DIR_EGRESS)
+        target.set_root_qdisc('htb')
+        target.marshal()
+        fake_command_line.assert_called_once_with('tc -n ns1 qdisc add dev foo13 root handle 1:0 htb',
+                                                  ignore_errors=False, sudo=True, verbose=False)
+
+
+class TestTcPipelineTarget(unittest.TestCase):
+
+    def setUp(self):
+        Qdisc.init()
+
+    def test_applied_while_built(self):
+        with FakeKernel(devices=('lo',)) as kernel:
+            target = TcPipelineTarget(NetDevice('lo'), DIR_EGRESS)
+            target.clear()
+            rootqd = target.set_root_qdisc('htb')
+            self.assertEqual(['tc qdisc del dev lo root', 'tc qdisc add dev lo root handle 1:0 htb'],
+                             kernel.executed)
+            target.add_class('htb', rootqd, rate='1mbit')
+            self.assertEqual(3, len(kernel.executed))
+            with mock.patch('pyltc.core.target.print') as fake_print:
+                target.marshal()
+            fake_print.assert_not_called()
+            self.assertEqual(['tc qdisc add dev lo root handle 1:0 htb',
+                              'tc class add dev lo parent 1:0 classid 1:1 htb rate 1mbit'], kernel.plan().commands())
+
+    def test_failure_stops_the_batch(self):
+        with FakeKernel(devices=('lo',)) as kernel:
+            target = TcPipelineTarget(NetDevice('lo'), DIR_EGRESS)
+            rootqd = target.set_root_qdisc('htb')
+            target.add_class('htb', Qdisc('htb', None), rate='1mbit')  # its parent qdisc was not added
+            target.add_class('htb', rootqd, rate='2mbit')
+            self.assertEqual(2, len(kernel.executed))
+            with mock.patch('pyltc.core.target.print') as fake_print:
+                target.marshal()
+            self.assertIn('Command failed -:2', str(fake_print.call_args[0][0]))
+            self.assertEqual(['tc qdisc add dev lo root handle 1:0 htb'], kernel.plan().commands())
+
+    def test_in_netns(self):
+        with FakeKernel(devices=('lo',)) as kernel:
+            with mock.patch.object(DeviceManager, 'netns', 'ns1'):
+                target = TcPipelineTarget(NetDevice('lo'), DIR_EGRESS)
+            target.set_root_qdisc('htb')
+            asyncio.run(target.marshal_async())
+        self.assertEqual(['tc -n ns1 qdisc add dev lo root handle 1:0 htb'], kernel.executed)
+
+    def test_abort(self):
+        with FakeKernel(devices=('lo',)) as kernel:
+            target = TcPipelineTarget(NetDevice('lo'), DIR_EGRESS)
+            target.set_root_qdisc('htb')
+            batch = target._batch
+            target.abort()
+            self.assertFalse(batch.feed('qdisc del dev lo root'))  # terminated
+            target.marshal()  # nothing left to wait for
+            self.assertEqual(['tc qdisc add dev lo root handle 1:0 htb'], kernel.plan().commands())
+
+    def test_verbose_configured_after_building(self):
+        with FakeKernel(devices=('lo',)):
+            target = TcPipelineTarget(NetDevice('lo'), DIR_EGRESS)
+            target.set_root_qdisc('htb')
+            target.configure(verbose=True)
+            with mock.patch('pyltc.util.cmdline.print') as fake_print:
+                target.marshal()
+            printed = [" ".join(call[0]) for call in fake_print.call_args_list]
+            self.assertEqual(['> sudo tc -batch -', '    qdisc add dev lo root handle 1:0 htb'], printed)
+
+
+class RecordingObserver(ITargetObserver):
+
+    def __init__(self):
+        self.events = list()
+
+    def on_node_added(self, target, node, command):
+        self.events.append(('node', type(node).__name__ if node else None, command))
+
+    def on_marshal_start(self, target, commands):
+        self.events.append(('start', len(commands)))
+
+    def on_command_result(self, target, command, result):
+        self.events.append(('result', command, result.returncode))
+
+    def on_marshal_end(self, target):
+        self.events.append(('end',))
+
+
+class TestTargetObservers(unittest.TestCase):
+
+    def setUp(self):
+        Qdisc.init()
+        self.observer = RecordingObserver()
+
+    def tearDown(self):
+        ITarget.remove_observer(self.observer)
+        TcCommandTarget.remove_observer(self.observer)
+
+    def test_no_observers(self):
+        self.assertEqual((), ITarget.observers)
+        self.assertEqual((), TcCommandTarget.observers)
+
+    def test_build_notified(self):
+        ITarget.add_observer(self.observer)
+        target = DummyTcTarget(NetDevice('obs1'), DIR_EGRESS)
+        target.clear()
+        rootqd = target.set_root_qdisc('htb')
+        qclass = target.add_class('htb', rootqd, rate='1mbit')
+        target.add_filter('u32', rootqd, 'ip dport 5001 0xffff', qclass)
+        self.assertEqual([('node', None, 'tc qdisc del dev obs1 root'), ('node', 'Qdisc', target._commands[1]),
+                          ('node', 'QdiscClass', target._commands[2]), ('node', 'Filter', target._commands[3])],
+                         self.observer.events)
+
+    def test_registered_on_subclass(self):
+        TcCommandTarget.add_observer(self.observer)
+        plan_target = TcPlanTarget(NetDevice('obs2'), DIR_EGRESS)
+        plan_target.set_root_qdisc('htb')
+        plan_target.marshal()
+        self.assertEqual([], self.observer.events)
+        other = ITargetObserver()
+        ITarget.add_observer(other)
+        self.addCleanup(ITarget.remove_observer, other)
+        self.assertEqual((other, self.observer), TcCommandTarget.observers)
+        TcCommandTarget.remove_observer(self.observer)
+        self.assertEqual((other,), TcCommandTarget.observers)
+
+    def test_command_results(self):
+        ITarget.add_observer(self.observer)
+        with FakeKernel(devices=('lo',)):
+            target = TcCommandTarget(NetDevice('lo'), DIR_EGRESS)
+            target.clear()
+            target.set_root_qdisc('htb')
+            target.add_class('htb', Qdisc('htb', None), rate='1mbit')  # its parent qdisc was not added
+            del self.observer.events[:]
+            with mock.patch('pyltc.core.target.print'), mock.patch('pyltc.util.cmdline.print', create=True):
+                target.marshal()
+        self.assertEqual(('start', 3), self.observer.events[0])
+        self.assertEqual([2, 0, 2], [event[2] for event in self.observer.events[1:4]])
+        self.assertEqual('tc qdisc add dev lo root handle 1:0 htb', self.observer.events[2][1])
+        self.assertEqual(('end',), self.observer.events[-1])
+        self.assertEqual(5, len(self.observer.events))
+
+    def test_command_results_async(self):
+        ITarget.add_observer(self.observer)
+        with FakeKernel(devices=('lo',)):
+            target = TcCommandTarget(NetDevice('lo'), DIR_EGRESS)
+            target.set_root_qdisc('htb')
+            del self.observer.events[:]
+            asyncio.run(target.marshal_async())
+        self.assertEqual([('start', 1), ('result', 'tc qdisc add dev lo root handle 1:0 htb', 0), ('end',)],
+                         self.observer.events)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,13 @@
 """
 Live tests for pyltc.
 
-We execute actual tc commands and then launch iperf server and client
-and measure the badwith.
+We execute actual tc commands and then run in-process traffic sources and sinks
+(see ``tests.util.traffic``) and measure the badwith.
+
+Each test shapes a veth device of its own pair of network namespaces (see
+``tests.util.netns``), never the host's ``lo``, so the tests can run in parallel,
+e.g. ``python -m pytest -n auto tests/integration/live_tests.py`` with pytest-xdist.
+Needs root.
 
 """
 import unittest
@@ -22,17 +27,20 @@ from pyltc.plugins.simnet_util import BranchParser
 from pyltc.util.rates import convert2bps
 from pyltc.util.counter import Counter
 from tests.util.base import LtcLiveTargetRun
-from tests.util.iperf_proc import TCPNetPerfTest
+from tests.util.netns import NetnsPair
+from tests.util.traffic import measure
 from pyltc.core.target import TcTarget
 
 
-#: the standard duration (in sec.) for which the iperf client sends data to the iperf server
+#: the longest (in sec.) a traffic source sends data to the sink; probes stop earlier once their rate has converged
 DURATION = 2
 #: shall the test runs be verbose or not (TODO: make this a command line option)
 VERBOSITY = False
 #: the ratio of measured/expected rate when no shaping is applied that we tolerate as acceptable for tests to pass
 MAX_FREE_RATE_TOLERANCE = 0.75
 MAX_SHAPED_TOLERANCE = 0.25
+#: the number of random ports probed inside and outside of each branch's range
+RANDOM_PROBES = 2
 
 DEFAULT_TEST_HOST = '127.0.0.1'
 DEFAULT_TEST_PORT = 5001
@@ -54,7 +62,7 @@ class TcRecordTarget(TcTarget):
 
 class TestPyLtcLive(unittest.TestCase):
     """
-    Live test setting up traffic control and then executing iperf server + client
+    Live test setting up traffic control and then running a traffic source + sink
     for different ports (shaped and not-shaped).
     """
 
@@ -74,13 +82,18 @@ class TestPyLtcLive(unittest.TestCase):
 
         else:
             print('--Record mode OFF--')
-            pyltc_entry_point(['simnet', '-i', 'lo', '-c', '-b'])
-            pyltc_entry_point(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:15000:512kbit', 'tcp:dport:16001-16005:1mbit'])
-            tcp_netperf = TCPNetPerfTest('dummy', host='127.0.0.1', port=DEFAULT_TEST_PORT, duration=DURATION)
-            cls.tcp_free_rate = tcp_netperf.run()
+            with NetnsPair() as fabric:
+                pyltc_entry_point(['simnet', '-n', fabric.client, '-i', fabric.client_dev, '-c', '--upload',
+                                   'tcp:dport:15000:512kbit', 'tcp:dport:16001-16005:1mbit'])
+                cls.tcp_free_rate = measure('tcp', DEFAULT_TEST_PORT, host=fabric.server_addr, duration=DURATION,
+                                            tolerance=MAX_FREE_RATE_TOLERANCE, source_netns=fabric.client,
+                                            sink_netns=fabric.server).goodput
 
     def setUp(self):
         self._targets = list()
+        if not self.record_mode:
+            self.fabric = NetnsPair().create()
+            self.addCleanup(self.fabric.destroy)
 
     def _err_message(self, margin, actual):
         return 'Expected relative error margin max {} but got {}'.format(margin, actual)
@@ -107,14 +120,16 @@ class TestPyLtcLive(unittest.TestCase):
             tcp_free_rate = self.tcp_free_rate
         assert tcp_free_rate or udp_free_rate
 
-        arg_list = ['simnet', '-i', 'lo', '-c']
+        arg_list = ['simnet', '-n', self.fabric.client, '-i', self.fabric.client_dev, '-c']
         arg_list.append('--upload')
         for case in cases:
             arg_list.append(case)
 
         if VERBOSITY:
             arg_list.append('-v')
-        live_test = LtcLiveTargetRun(arg_list, udp_sendrate='10mbit', duration=DURATION)
+        live_test = LtcLiveTargetRun(arg_list, udp_sendrate='10mbit', duration=DURATION, random_probes=RANDOM_PROBES,
+                                     shaped_tolerance=MAX_SHAPED_TOLERANCE, free_tolerance=MAX_FREE_RATE_TOLERANCE,
+                                     fabric=self.fabric)
         live_test.run()
         for case in cases:
             assert ('tcp' in case and tcp_free_rate) or ('udp' in case and udp_free_rate), \
@@ -127,6 +142,10 @@ class TestPyLtcLive(unittest.TestCase):
             self._check_bandwidth(free_rate, results['left_out'], MAX_FREE_RATE_TOLERANCE)
             self._check_bandwidth(convert2bps(branch['rate']), results['right_in'], MAX_SHAPED_TOLERANCE)
             self._check_bandwidth(free_rate, results['right_out'], MAX_FREE_RATE_TOLERANCE)
+            for idx in range(1, RANDOM_PROBES + 1):
+                self._check_bandwidth(convert2bps(branch['rate']), results['random_in_{:02d}'.format(idx)],
+                                      MAX_SHAPED_TOLERANCE)
+                self._check_bandwidth(free_rate, results['random_out_{:02d}'.format(idx)], MAX_FREE_RATE_TOLERANCE)
 
     def _do_record(self, cases):
         arg_list = ['simnet', '-i', 'lo', '-c']
@@ -208,6 +227,32 @@ class TestPyLtcLive(unittest.TestCase):
         print('test_ingress_complex END')
 
 
+class TestLiveRunProbes(unittest.TestCase):
+    """Probe selection of ``LtcLiveTargetRun``; needs no traffic."""
+
+    def _run(self, groups, random_probes=0):
+        run = LtcLiveTargetRun([], '1mbit', random_probes=random_probes, seed=1)
+        run._branches = [BranchParser(group, upload=True).as_dict() for group in groups]
+        return run
+
+    def test_port_range_before_all(self):
+        run = self._run(['tcp:all:10mbit', 'tcp:dport:9000:1mbit'])
+        self.assertEqual(1, run._class_of('tcp', 9000))
+        self.assertEqual(0, run._class_of('tcp', 9001))
+        self.assertIsNone(run._class_of('tcp', 9001, ranges_only=True))
+        self.assertIsNone(run._class_of('udp', 9000))
+
+    def test_random_probes_with_all(self):
+        run = self._run(['tcp:all:10mbit', 'tcp:dport:9000:1mbit'], random_probes=1)
+        probes = dict(run._probes_for_port_range('9000', 'tcp', set()))
+        self.assertEqual(9000, probes['random_in_01'])
+        self.assertNotEqual(9000, probes['random_out_01'])
+
+    def test_no_free_port(self):
+        run = self._run(['udp:dport:1024-65535:1mbit'], random_probes=1)
+        self.assertRaises(RuntimeError, run._probes_for_port_range, '1024-65535', 'udp', set())
+
+
 if __name__ == '__main__':
     import sys
     if 'record' in sys.argv:
@@ -1,6 +1,8 @@
 """
 Simulation tests for pyltc.
 We generate tc commands without executing them, which allows for quick regression testing.
+The commands are applied to an in-memory fake kernel instead, which validates them;
+neither root access nor a real kernel is needed, so the suite can run in parallel.
 
 TODO: A larger test suite is comming soon, and it will be machine generated.
 
@@ -15,23 +17,20 @@ REPO_ROOT = normpath(abspath(pjoin(dirname(__file__), "..", "..")))
 if not REPO_ROOT in sys.path:
     sys.path.append(REPO_ROOT)
 
-from pyltc.core.netdevice import DeviceManager
+from pyltc.core.plan import TcPlan
 from tests.util.base import LtcSimulateTargetRun
+from tests.util.fakekernel import FakeKernel
 
 
 class TestPyLtcFake(unittest.TestCase):
 
-    @classmethod
-    def setUpClass(cls):
-        DeviceManager.shutdown_module('ifb')
-        assert not DeviceManager.all_iface_names('ifb'), 'Unreachable'
-
-    @classmethod
-    def tearDownClass(cls):
-        DeviceManager.shutdown_module('ifb')
+    def setUp(self):
+        self.kernel = FakeKernel()
+        self.kernel.__enter__()
+        self.addCleanup(self.kernel.__exit__, None, None, None)
 
     def test_upload_simple_tcp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9000-9010:512kbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9000-9010:512kbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -48,7 +47,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_simple_tcp_rport(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:rport:9000-9010:512kbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:rport:9000-9010:512kbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -65,7 +64,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_single_port_tcp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9100:1mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9100:1mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -82,7 +81,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_simple_udp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'udp:dport:9200-9210:786kbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'udp:dport:9200-9210:786kbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -99,7 +98,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_single_port_udp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'udp:dport:9300:2mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'udp:dport:9300:2mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -116,7 +115,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_all_rage(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:all:128kbit', 'udp:all:24mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:all:128kbit', 'udp:all:24mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -131,7 +130,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_upload_complex(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9700:2mbit', 'tcp:sport:9800-9820:4mbit:3%', 'udp:sport:9900-9910:786kbit:10%', 'udp:dport:9999:1gbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9700:2mbit', 'tcp:sport:9800-9820:4mbit:3%', 'udp:sport:9900-9910:786kbit:10%', 'udp:dport:9999:1gbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -156,7 +155,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_simple_tcp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:dport:9400-9410:1mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:dport:9400-9410:1mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -176,7 +175,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_simple_tcp_lport(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:lport:9400-9410:1mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:lport:9400-9410:1mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -196,7 +195,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_single_port_tcp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:sport:9500:6%'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:sport:9500:6%'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -217,7 +216,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_simple_udp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'udp:dport:9600-9610:786gbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'udp:dport:9600-9610:786gbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -237,7 +236,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_single_port_udp(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'udp:sport:9600:2mbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'udp:sport:9600:2mbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -257,7 +256,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_all_rage(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:all:128gbit', 'udp:all:224kbit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:all:128gbit', 'udp:all:224kbit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -275,7 +274,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_download_complex(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:dport:10000:1mbit', 'tcp:sport:10100-10120:384kbit:7%', 'udp:sport:10200-10210:512mbit:10%', 'udp:dport:10300:12bit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--download', 'tcp:dport:10000:1mbit', 'tcp:sport:10100-10120:384kbit:7%', 'udp:sport:10200-10210:512mbit:10%', 'udp:dport:10300:12bit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo ingress',
@@ -303,7 +302,7 @@ class TestPyLtcFake(unittest.TestCase):
         self.assertEqual(expected, fake_test.result)
 
     def test_both_complex(self):
-        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9700:2mbit', 'tcp:sport:9800-9820:4mbit:3%', 'udp:sport:9900-9910:786kbit:10%', 'udp:dport:9999:1gbit', '--download', 'tcp:dport:10000:1mbit', 'tcp:sport:10100-10120:384kbit:7%', 'udp:sport:10200-10210:512mbit:10%', 'udp:dport:10300:12bit'])
+        fake_test = LtcSimulateTargetRun(['simnet', '-i', 'lo', '-c', '--upload', 'tcp:dport:9700:2mbit', 'tcp:sport:9800-9820:4mbit:3%', 'udp:sport:9900-9910:786kbit:10%', 'udp:dport:9999:1gbit', '--download', 'tcp:dport:10000:1mbit', 'tcp:sport:10100-10120:384kbit:7%', 'udp:sport:10200-10210:512mbit:10%', 'udp:dport:10300:12bit'], kernel=self.kernel)
         fake_test.run()
         expected = [
             'tc qdisc del dev lo root',
@@ -347,6 +346,7 @@ class TestPyLtcFake(unittest.TestCase):
             'tc filter add dev ifb0 parent 8:0 protocol ip prio 2 u32 match ip dport 10300 0xffff flowid 8:2'
         ]
         self.assertEqual(expected, fake_test.result)
+        self.assertEqual(TcPlan(expected), self.kernel.plan(['lo', 'ifb0']))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,136 @@
+"""
+Unit tests for the high-frequency backlog sampler.
+
+"""
+import os
+import tempfile
+import unittest
+
+from pyltc.plugins import backlog
+from pyltc.plugins.backlog import BacklogError, BacklogRing, BacklogSampler, Node, format_report
+from pyltc.plugins.simnet import Branch
+from tests.util.fakeclock import FakeClock
+from tests.util.fakertnl import FakeRtnl, tc_stats
+
+
+NODES = [Node('eth0', '1:1', 'tcp:all'), Node('eth0', '2:1', '')]
+
+
+def _sampler(rtnl, clock, capacity=8, branches=None, devices=None):
+    with rtnl.installed('pyltc.plugins.backlog'):
+        return BacklogSampler(capacity, branches, devices, clock=clock)
+
+
+@unittest.skipIf(backlog.np is None, "NumPy is not installed")
+class TestBacklogRing(unittest.TestCase):
+
+    def _ring(self, capacity, backlogs, rates=(1e6, None)):
+        ring = BacklogRing(NODES, capacity, rates)
+        for idx, value in enumerate(backlogs):
+            row = ring.advance(idx * 0.01)
+            ring.backlog[row] = value
+            ring.bytes[row] = idx * 1250  # 1mbit in steps of 10ms
+        return ring
+
+    def test_window_wraps_oldest_first(self):
+        ring = self._ring(4, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(4, len(ring))
+        times, values, _, _, _ = ring.window()
+        self.assertEqual([0.02, 0.03, 0.04, 0.05], [round(value, 2) for value in times])
+        self.assertEqual([2, 3, 4, 5], list(values[:, 0]))
+        self.assertEqual([4, 5], list(ring.window(2)[1][:, 0]))
+
+    def test_advance_zeroes_the_row(self):
+        ring = self._ring(2, [7, 8])
+        row = ring.advance(1.0)
+        self.assertEqual([0, 0], list(ring.backlog[row]))
+
+    def test_sojourn(self):
+        ring = self._ring(16, [0, 1250, 2500] + [1250] * 9)
+        sojourn = ring.sojourn(rate_window=10)
+        self.assertEqual((12, 2), sojourn.shape)
+        self.assertEqual([0.0, 0.01, 0.02], list(sojourn[:3, 0]))  # 1250 bytes at 1mbit: 10ms
+        self.assertTrue(all(value != value for value in sojourn[1:10, 1]))  # rate not measured yet: NaN
+        self.assertAlmostEqual(0.01, sojourn[-1, 1])  # measured 1mbit
+
+    def test_percentiles(self):
+        ring = self._ring(128, [1250 * (idx % 2) for idx in range(100)], rates=(1e6, 1e6))
+        values = ring.percentiles((50, 99), samples=100)
+        self.assertEqual((2, 2), values.shape)
+        self.assertAlmostEqual(0.005, values[0, 0])
+        self.assertAlmostEqual(0.01, values[1, 0], places=4)
+
+    def test_save_load(self):
+        ring = self._ring(4, [0, 1, 2, 3, 4, 5])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'samples.npz')
+            ring.save(path, samples=3)
+            loaded = BacklogRing.load(path)
+        self.assertEqual(NODES, loaded.nodes)
+        self.assertEqual(3, len(loaded))
+        self.assertEqual([3, 4, 5], list(loaded.window()[1][:, 0]))
+        self.assertEqual(1e6, loaded.rates[0])
+        self.assertNotEqual(loaded.rates[1], loaded.rates[1])
+
+    def test_invalid_capacity(self):
+        self.assertRaises(BacklogError, BacklogRing, NODES, 1)
+
+
+@unittest.skipIf(backlog.np is None, "NumPy is not installed")
+class TestBacklogSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.rtnl = FakeRtnl({1: 'lo', 2: 'eth0'}, classes=[tc_stats(2, 'htb', '1:0', 'root'),
+                                                            tc_stats(2, 'htb', '2:1', '1:0', drops=1)])
+        self.clock = FakeClock(now=10.0)
+
+    def _set_backlog(self, backlog_bytes):
+        self.rtnl.update(2, '2:1', backlog=backlog_bytes, qlen=backlog_bytes // 1000)
+
+    def test_branches(self):
+        branches = [Branch('eth0', '2:1', 'upload', 'udp:dport:5000:1mbit', '1mbit')]
+        sampler = _sampler(self.rtnl, self.clock, branches=branches)
+        self._set_backlog(3000)
+        row = sampler.sample()
+        ring = sampler.ring
+        self.assertEqual([Node('eth0', '2:1', 'udp:dport:5000:1mbit')], ring.nodes)
+        self.assertEqual((10.0, 3000, 3, 1), (ring.times[row], ring.backlog[row, 0], ring.qlen[row, 0],
+                                              ring.drops[row, 0]))
+        self.assertAlmostEqual(0.024, ring.sojourn()[-1, 0])
+
+    def test_all_classes_of_devices(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        self.assertEqual([Node('eth0', '1:0', ''), Node('eth0', '2:1', '')], sampler.ring.nodes)
+
+    def test_missing_device(self):
+        branches = [Branch('eth1', '1:1', 'upload', 'tcp:all', '15gbit')]
+        with self.assertRaises(BacklogError):
+            _sampler(self.rtnl, self.clock, branches=branches)
+
+    def test_run_skips_overruns(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        times = list()
+
+        def on_sample(ring):
+            times.append(self.clock.now)
+            self.clock.now += 0.0035 if len(times) == 2 else 0.0005  # the second sample is slow
+
+        sampler.run(interval=0.001, count=4, sleep=self.clock.sleep, on_sample=on_sample)
+        self.assertEqual([10.0, 10.001, 10.0045, 10.005], [round(value, 4) for value in times])
+        self.assertEqual(2, sampler.overruns)
+        self.assertEqual(4, sampler.ring.count)
+
+    def test_format_report(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        for backlog_bytes in (1500, 3000, 2000):
+            self._set_backlog(backlog_bytes)
+            sampler.sample()
+        lines = format_report(sampler.ring).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('dev '))
+        self.assertIn(' 3000b ', lines[2])
+        self.assertIn(' - ', lines[2])  # nothing sent: the rate of 2:1 is not known
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Unit tests for the Prometheus exporter.
+
+"""
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+from pyltc.plugins.exporter import Exporter, branch_labels, render_metrics, write_textfile
+from pyltc.plugins.simnet import Branch
+from pyltc.plugins.stats import NodeStats
+from tests.util.fakertnl import FakeRtnl, tc_stats
+
+
+BRANCHES = [Branch('eth0', '1:1', 'upload', 'tcp:all', '15gbit'),
+            Branch('ifb0', '2:1', 'download', 'udp:dport:5000-5010:1mbit:2%', '1mbit')]
+
+
+def _exporter(rtnl, interval=5.0):
+    with rtnl.installed('pyltc.plugins.stats'):
+        return Exporter([('4g', BRANCHES, None)], interval=interval)
+
+
+def _node(branch, nbytes):
+    return NodeStats(branch.dev, 'class', 'htb', branch.classid, 'root', branch, nbytes, 1, 0, 0, 0, 0, 0,
+                     None, None, None)
+
+
+class TestRendering(unittest.TestCase):
+
+    def test_branch_labels(self):
+        self.assertEqual([('profile', '4g'), ('interface', 'eth0'), ('direction', 'upload'), ('protocol', 'tcp'),
+                          ('port_type', ''), ('port_range', 'all'), ('branch', 'tcp:all')],
+                         list(branch_labels('4g', BRANCHES[0]).items()))
+        labels = branch_labels('4g', BRANCHES[1])
+        self.assertEqual(('udp', 'dport', '5000-5010'), (labels['protocol'], labels['port_type'], labels['port_range']))
+
+    def test_render_metrics(self):
+        entries = [(branch_labels('4g', branch), _node(branch, 1000 * idx)) for idx, branch in enumerate(BRANCHES)]
+        lines = render_metrics(entries, 1700000000.0, 0.0125).splitlines()
+        self.assertIn('# TYPE pyltc_branch_bytes_total counter', lines)
+        self.assertIn('pyltc_branch_bytes_total{profile="4g",interface="ifb0",direction="download",protocol="udp",'
+                      'port_type="dport",port_range="5000-5010",branch="udp:dport:5000-5010:1mbit:2%"} 1000', lines)
+        self.assertIn('pyltc_branch_rate_limit_bits{profile="4g",interface="eth0",direction="upload",protocol="tcp",'
+                      'port_type="",port_range="all",branch="tcp:all"} 15000000000', lines)
+        self.assertEqual(['pyltc_sample_timestamp_seconds 1700000000.000', 'pyltc_sample_duration_seconds 0.012500'],
+                         [line for line in lines if line.startswith('pyltc_sample_')])
+
+    def test_label_values_escaped(self):
+        text = render_metrics([({'profile': 'a"b\\c\nd'}, _node(BRANCHES[0], 0))], 0.0, 0.0)
+        self.assertIn('pyltc_branch_bytes_total{profile="a\\"b\\\\c\\nd"} 0\n', text)
+
+
+class TestExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.rtnl = FakeRtnl({2: 'eth0', 3: 'ifb0'},
+                             [tc_stats(2, 'htb', '1:0', 'root'), tc_stats(3, 'htb', '2:0', 'root')],
+                             [tc_stats(2, 'htb', '1:1', 'root', packets=10, drops=1, overlimits=2, requeues=3,
+                                       backlog=1500, qlen=1),
+                              tc_stats(3, 'htb', '2:1', 'root'),
+                              tc_stats(3, 'htb', '2:2', 'root')])  # not a branch: not exported
+
+    def test_refresh(self):
+        exporter = _exporter(self.rtnl)
+        self.assertEqual('', exporter.text)
+        self.rtnl.update(2, '1:1', bytes=4096)
+        text = exporter.refresh()
+        self.assertIs(text, exporter.text)
+        samples = [line for line in text.splitlines() if line.startswith('pyltc_branch_bytes_total')]
+        self.assertEqual(2, len(samples))
+        self.assertTrue(samples[0].endswith('branch="tcp:all"} 4096'))
+        self.assertIn('pyltc_branch_backlog_bytes{profile="4g",interface="eth0"', text)
+
+    def test_run_count(self):
+        texts = list()
+        _exporter(self.rtnl, interval=0.01).run(count=3, on_refresh=texts.append)
+        self.assertEqual(3, len(texts))
+
+    def test_write_textfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'pyltc.prom')
+            write_textfile(path, 'first\n')
+            write_textfile(path, 'second\n')
+            with open(path) as fhl:
+                self.assertEqual('second\n', fhl.read())
+            self.assertEqual(['pyltc.prom'], os.listdir(tmpdir))
+
+    def test_serve(self):
+        exporter = _exporter(self.rtnl, interval=0.05)
+
+        def server_class(address, handler):
+            # on an ephemeral port, scraped (and shut down) from another thread
+            server = ThreadingHTTPServer(address, handler)
+            threading.Thread(target=self._scrape, args=(server, server.server_address[1]), daemon=True).start()
+            return server
+
+        with mock.patch('pyltc.plugins.exporter.ThreadingHTTPServer', server_class):
+            exporter.serve(('127.0.0.1', 0))
+        self.assertEqual(200, self.status)
+        self.assertIn('pyltc_branch_bytes_total{', self.body)
+        self.assertEqual(404, self.missing)
+
+    def _scrape(self, server, port):
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port)) as resp:
+                self.status, self.body = resp.status, resp.read().decode()
+            try:
+                urllib.request.urlopen('http://127.0.0.1:{}/'.format(port))
+            except urllib.error.HTTPError as exc:
+                self.missing = exc.code
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
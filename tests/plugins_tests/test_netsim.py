@@ -1,6 +1,8 @@
 import unittest
 
-from pyltc.plugins.simnet import SimNetPlugin
+from pyltc.core.netdevice import DeviceManager
+from pyltc.plugins.simnet import SimNetPlugin, parse_args
+from tests.util.fakekernel import FakeKernel
 
 
 class TestNetSim(unittest.TestCase):
@@ -26,6 +28,21 @@ class TestNetSim(unittest.TestCase):
         self.assertTrue(netsim._args.verbose)
         self.assertFalse(netsim._args.clearonly_mode)
 
+    def test_configure_netns(self):
+        netsim = SimNetPlugin()
+        self.assertIsNone(netsim._args.netns)
+        netsim.configure(interface='veth0', netns='ns1')
+        self.assertEqual('ns1', netsim._args.netns)
+        netsim.configure(clear=True)
+        self.assertEqual('ns1', netsim._args.netns)
+
+    def test_parse_args_netns(self):
+        with FakeKernel(devices=('lo', 'veth0')):
+            args = parse_args(['simnet', '--netns', 'ns1', '--interface', 'veth0', '--clear'])
+        self.assertEqual('ns1', args.netns)
+        self.assertIsNone(DeviceManager.netns)  # the devices are looked up there only when building
+        self.assertEqual('ns1', SimNetPlugin(args).netns)
+
     def test_setup(self):
         netsim = SimNetPlugin()
         netsim.setup(upload=True, protocol="tcp", porttype="dport",  range="5000", rate="512kbit")
@@ -0,0 +1,108 @@
+"""
+Unit tests for the on-disk recorder of the branch counters.
+
+"""
+import os
+import tempfile
+import unittest
+
+from pyltc.plugins import recorder
+from pyltc.plugins.recorder import CounterDeltas, Recorder, RecorderError, Recording, COUNTER_NAMES
+from pyltc.plugins.simnet import Branch
+from pyltc.plugins.stats import NodeStats
+
+
+BRANCHES = [Branch('eth0', '1:1', 'upload', 'tcp:all', '15gbit'),
+            Branch('ifb0', '2:1', 'download', 'udp:dport:5000:1mbit', '1mbit')]
+
+
+def _counters(idx):
+    return dict(bytes=[1000 * idx, 10 * idx], packets=[idx, 0], drops=[0, idx % 2], overlimits=[0, 0],
+                backlog=[idx, 100 * idx])
+
+
+def _row(branch, nbytes, packets=0, drops=0, backlog=0, node='class'):
+    return NodeStats(branch.dev, node, 'htb', branch.classid, 'root', branch, nbytes, packets, drops, 0, 0, backlog,
+                     0, None, None, None)
+
+
+@unittest.skipIf(recorder.np is None, "NumPy is not installed")
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'test.ltcrec')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _record(self, count, block_rows=4, step=0.5):
+        with Recorder(self.path, BRANCHES, block_rows=block_rows, profile='4g') as rec:
+            for idx in range(count):
+                rec.append(1000.0 + idx * step, _counters(idx))
+        return Recording(self.path)
+
+    def test_roundtrip_across_blocks(self):
+        recording = self._record(10)
+        self.assertEqual(10, recording.rows)
+        self.assertEqual('4g', recording.description['profile'])
+        self.assertEqual(['tcp:all', 'udp:dport:5000:1mbit'], [branch['spec'] for branch in recording.branches])
+        series = recording.series()
+        self.assertEqual([1000.0 + idx * 0.5 for idx in range(10)], list(series.times))
+        self.assertEqual((10, 2), series.bytes.shape)
+        self.assertEqual([1000 * idx for idx in range(10)], list(series.bytes[:, 0]))
+        self.assertEqual([100 * idx for idx in range(10)], list(series.backlog[:, 1]))
+
+    def test_file_grows_by_blocks(self):
+        self._record(5)
+        size = os.path.getsize(self.path)
+        self._record(8)
+        self.assertEqual(size, os.path.getsize(self.path))
+        self.assertEqual(4096 + 2 * 4 * (8 + 24 * 2), size)
+
+    def test_read_while_recording(self):
+        with Recorder(self.path, BRANCHES, block_rows=4) as rec:
+            for idx in range(3):
+                rec.append(float(idx), _counters(idx))
+            rec.flush()
+            self.assertEqual([0.0, 1.0, 2.0], list(Recording(self.path).column('times')))
+
+    def test_empty(self):
+        recording = self._record(0)
+        self.assertEqual(0, recording.rows)
+        self.assertEqual((0, 2), recording.column('drops').shape)
+        self.assertEqual(0, len(recording.downsample(60).times))
+
+    def test_downsample(self):
+        series = self._record(10).downsample(2.0)  # 4 records a bin
+        self.assertEqual([1000.0, 1002.0, 1004.0], list(series.times))
+        self.assertEqual([6000, 22000, 17000], list(series.bytes[:, 0]))
+        self.assertEqual([2, 2, 1], list(series.drops[:, 1]))
+        self.assertEqual([3, 7, 9], list(series.backlog[:, 0]))
+
+    def test_errors(self):
+        with open(self.path, 'wb') as fhl:
+            fhl.write(b'tc -s class show\n')
+        self.assertRaises(RecorderError, Recording, self.path)
+        self.assertRaises(RecorderError, self._record(1).column, 'rate')
+
+
+@unittest.skipIf(recorder.np is None, "NumPy is not installed")
+class TestCounterDeltas(unittest.TestCase):
+
+    def test_record(self):
+        deltas = CounterDeltas(BRANCHES)
+        first = deltas.record([_row(BRANCHES[0], 5000, 5), _row(BRANCHES[1], 100, 1, backlog=60),
+                               _row(BRANCHES[1], 999, 9, node='qdisc')])
+        self.assertEqual(set(COUNTER_NAMES), set(first))
+        self.assertEqual([0, 0], list(first['bytes']))
+        self.assertEqual([0, 60], list(first['backlog']))
+        second = deltas.record([_row(BRANCHES[0], 8000, 8, drops=2), _row(BRANCHES[1], 40, 1)])  # 2:1 reset
+        self.assertEqual([3000, 40], list(second['bytes']))
+        self.assertEqual([3, 1], list(second['packets']))
+        self.assertEqual([2, 0], list(second['drops']))
+        self.assertEqual([0, 0], list(second['backlog']))
+
+
+if __name__ == '__main__':
+    unittest.main()
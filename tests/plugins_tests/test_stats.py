@@ -0,0 +1,174 @@
+"""
+Unit tests for the live traffic control statistics.
+
+"""
+import os
+import tempfile
+import unittest
+
+from pyltc.core.facade import TrafficControl
+from pyltc.core.netdevice import DeviceManager
+from pyltc.core.tfactory import default_target_factory
+from pyltc.plugins.simnet import Branch, SimNetPlugin, parse_args
+from pyltc.plugins.stats import StatsSampler, branch_stats, format_table, profile_branches
+from tests.util.fakekernel import FakeKernel
+from tests.util.fakeclock import FakeClock
+from tests.util.fakertnl import FakeRtnl, tc_stats
+from tests.util.netns import NetnsPair, _can_create_netns
+
+
+PROFILES = """\
+[shaped]
+clear
+interface lo
+upload
+  tcp:all:10mbit
+  tcp:dport:8080:512kbit
+  udp:dport:5000-5010:1mbit:2%
+download
+  tcp:sport:443:2mbit
+"""
+
+
+def _sampler(rtnl, clock, devices=None, branches=None):
+    with rtnl.installed('pyltc.plugins.stats'):
+        return StatsSampler(devices, branches, clock=clock)
+
+
+class TestStatsSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.rtnl = FakeRtnl({1: 'lo', 2: 'eth0', 3: 'ifb0'},
+                             [tc_stats(1, 'noqueue', '0:0', 'root'),
+                              tc_stats(2, 'htb', '1:0', 'root', bytes=1000, packets=10),
+                              tc_stats(2, 'netem', '4:0', '3:1', bytes=500, packets=5),
+                              tc_stats(3, 'pfifo_fast', '0:0', 'root')],
+                             [tc_stats(2, 'htb', '1:1', 'root', bytes=1000, packets=10),
+                              tc_stats(2, 'htb', '3:1', 'root', bytes=500, packets=5)])
+        self.clock = FakeClock()
+        self.branches = [Branch('eth0', '1:1', 'upload', 'tcp:all', '15gbit'),
+                         Branch('eth0', '3:1', 'upload', 'udp:dport:5000:1mbit:2%', '1mbit')]
+
+    def test_devices_of_branches(self):
+        rows = _sampler(self.rtnl, self.clock, branches=self.branches).sample()
+        self.assertEqual({'eth0'}, set(row.dev for row in rows))
+        self.assertEqual(['qdisc', 'qdisc', 'class', 'class'], [row.node for row in rows])
+
+    def test_classes_of_classful_devices_only(self):
+        rows = _sampler(self.rtnl, self.clock).sample()
+        self.assertEqual(['lo', 'eth0', 'eth0', 'eth0', 'eth0', 'ifb0'], [row.dev for row in rows])
+        self.assertEqual([2], self.rtnl.class_dumps)
+
+    def test_branches_mapped(self):
+        rows = _sampler(self.rtnl, self.clock, branches=self.branches).sample()
+        mapped = dict(((row.node, row.handle), row.branch.spec if row.branch else None) for row in rows)
+        self.assertEqual({('qdisc', '1:0'): None, ('qdisc', '4:0'): 'udp:dport:5000:1mbit:2%',
+                          ('class', '1:1'): 'tcp:all', ('class', '3:1'): 'udp:dport:5000:1mbit:2%'}, mapped)
+
+    def test_rates(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        self.assertTrue(all(row.bps is None for row in sampler.sample()))
+        self.clock.now += 2.0
+        self.rtnl.update(2, '1:1', bytes=251000, packets=210)
+        self.rtnl.update(2, '3:1', bytes=100, packets=1)  # recreated: counters reset
+        rows = dict(((row.node, row.handle), row) for row in sampler.sample())
+        self.assertEqual(1000000, rows['class', '1:1'].bps)
+        self.assertEqual(100, rows['class', '1:1'].pps)
+        self.assertEqual(0, rows['qdisc', '1:0'].bps)
+        self.assertIsNone(rows['class', '3:1'].bps)
+
+    def test_drop_rate(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        sampler.sample()
+        self.clock.now += 0.5
+        self.rtnl.update(2, '3:1', bytes=600, packets=6, drops=4)
+        rows = dict(((row.node, row.handle), row) for row in sampler.sample())
+        self.assertEqual(8, rows['class', '3:1'].drop_rate)
+        self.assertEqual(0, rows['class', '1:1'].drop_rate)
+
+    def test_branch_stats(self):
+        sampler = _sampler(self.rtnl, self.clock, branches=self.branches)
+        self.assertEqual([None, None], [entry.utilization for entry in branch_stats(sampler.sample())])
+        self.clock.now += 1.0
+        self.rtnl.update(2, '3:1', bytes=63000, packets=50, drops=3, backlog=1500, qlen=1)
+        stats = branch_stats(sampler.sample())
+        self.assertEqual(['tcp:all', 'udp:dport:5000:1mbit:2%'], [entry.branch.spec for entry in stats])
+        self.assertEqual(0.0, stats[0].utilization)
+        self.assertAlmostEqual(0.5, stats[1].utilization)
+        self.assertEqual((3, 3, 1500), (stats[1].drops, stats[1].drop_rate, stats[1].backlog))
+
+    def test_run(self):
+        sampler = _sampler(self.rtnl, self.clock, devices=['eth0'])
+        times = list()
+        for _ in sampler.run(interval=0.5, count=3, sleep=self.clock.sleep):
+            times.append(self.clock.now)
+            self.clock.now += 0.1  # sampling took time; the next one is still due at the interval
+        self.assertEqual([100.0, 100.5, 101.0], times)
+
+    def test_format_table(self):
+        sampler = _sampler(self.rtnl, self.clock, branches=self.branches)
+        sampler.sample()
+        self.clock.now += 1.0
+        lines = format_table(sampler.sample()).splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[0].startswith('dev '))
+        self.assertIn(' 0bit ', lines[3])
+        self.assertTrue(lines[3].endswith('upload tcp:all'))
+
+
+class TestProfileBranches(unittest.TestCase):
+
+    def test_profile_branches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'test.profile')
+            with open(path, 'w') as fhl:
+                fhl.write(PROFILES)
+            with FakeKernel(devices=('lo', 'ifb0')):
+                branches, netns = profile_branches('shaped', path)
+        self.assertIsNone(netns)
+        self.assertEqual([Branch('lo', '1:1', 'upload', 'tcp:all:10mbit', '10mbit'),
+                          Branch('lo', '1:2', 'upload', 'udp:all', '15gbit'),
+                          Branch('lo', '2:1', 'upload', 'tcp:dport:8080:512kbit', '512kbit'),
+                          Branch('lo', '3:1', 'upload', 'udp:dport:5000-5010:1mbit:2%', '1mbit'),
+                          Branch('ifb0', '5:1', 'download', 'tcp:all:10mbit', '10mbit'),
+                          Branch('ifb0', '5:2', 'download', 'udp:all', '15gbit'),
+                          Branch('ifb0', '6:1', 'download', 'tcp:sport:443:2mbit', '2mbit')], branches)
+
+    def test_devices_left_alone(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'test.profile')
+            with open(path, 'w') as fhl:
+                fhl.write(PROFILES)
+            with FakeKernel(devices=('lo',)) as kernel:
+                branches, _ = profile_branches('shaped', path)
+                self.assertEqual([], kernel.executed)  # no modprobe, no device added or brought up
+                self.assertEqual(['lo'], kernel.all_iface_names())
+        self.assertEqual({'lo', 'ifb0'}, set(branch.dev for branch in branches))
+
+
+@unittest.skipUnless(_can_create_netns(), "needs root and network namespace support")
+class TestStatsLive(unittest.TestCase):
+
+    def tearDown(self):
+        DeviceManager.netns = None
+
+    def test_sample(self):
+        with NetnsPair(prefix='ltcstats') as fabric:
+            TrafficControl.init()
+            args = parse_args(['simnet', '--netns', fabric.client, '--interface', fabric.client_dev, '--clear',
+                               '--upload', 'tcp:dport:9100:2mbit'])
+            simnet = SimNetPlugin(args, default_target_factory)
+            simnet.marshal()
+            with StatsSampler(branches=simnet.branches, netns=fabric.client) as sampler:
+                sampler.sample()
+                rows = sampler.sample()
+        self.assertEqual({fabric.client_dev}, set(row.dev for row in rows))
+        branches = dict((row.branch.spec, row) for row in rows if row.node == 'class' and row.branch)
+        self.assertEqual({'tcp:all', 'udp:all', 'tcp:dport:9100:2mbit'}, set(branches))
+        self.assertEqual(('htb', '2:1'), (branches['tcp:dport:9100:2mbit'].kind,
+                                          branches['tcp:dport:9100:2mbit'].handle))
+        self.assertTrue(all(row.bps is not None for row in rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
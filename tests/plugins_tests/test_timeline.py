@@ -0,0 +1,89 @@
+"""
+Unit tests for the scheduled profile timeline runner.
+
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pyltc.plugins.timeline import Timeline, compile_profile
+from tests.util.fakeclock import FakeClock
+
+
+PROFILES = """\
+[fast]
+clear
+interface lo
+upload
+  tcp:rport:443:5mbit
+
+[slow]
+clear
+interface lo
+upload
+  tcp:rport:443:512kbit:2%
+
+[clear]
+clear
+interface lo
+upload
+"""
+
+
+class RecordingTimeline(Timeline):
+    """Records the commands instead of executing them."""
+
+    def __init__(self, *args, **kw):
+        super(RecordingTimeline, self).__init__(*args, **kw)
+        self.executed = list()
+
+    def _execute(self, cmd, ignore_errors=False):
+        self.executed.append(cmd)
+
+
+class TestTimeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.config_file = tempfile.mkstemp(suffix='.profile')
+        with os.fdopen(fd, 'w') as fhl:
+            fhl.write(PROFILES)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.config_file)
+
+    def test_compile_profile(self):
+        plan = compile_profile('slow', self.config_file)
+        self.assertEqual([('lo', 'root')], plan.chains)
+        self.assertEqual('tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%',
+                         plan.commands()[-1])
+
+    def test_transitions(self):
+        timeline = RecordingTimeline([('fast', 30), ('slow', 10), ('clear', 0)], config_file=self.config_file)
+        timeline.compile()
+        first, to_slow, to_clear = timeline.transitions
+        self.assertEqual(9, len(first))
+        expected = [
+            'tc class change dev lo parent 2:0 classid 2:1 htb rate 512kbit',
+            'tc qdisc add dev lo parent 2:1 handle 4:0 netem limit 1000000000 loss 2%',
+        ]
+        self.assertEqual(expected, to_slow)
+        self.assertEqual(['tc qdisc del dev lo root'], to_clear)
+
+    @mock.patch('pyltc.plugins.timeline.print')
+    def test_run_schedule(self, fake_print):
+        clock = FakeClock()
+        timeline = RecordingTimeline([('fast', 30), ('slow', 10), ('fast', 5)], config_file=self.config_file)
+        records = timeline.run(clock=clock, sleep=clock.sleep)
+        self.assertEqual(['fast', 'slow', 'fast'], [rec.profile for rec in records])
+        self.assertEqual([0.0, 30.0, 40.0], [rec.scheduled for rec in records])
+        self.assertEqual([0.0, 30.0, 40.0], [rec.actual for rec in records])
+        self.assertEqual(145.0, clock.now)  # the last step is held too
+        self.assertEqual('tc qdisc del dev lo root', timeline.executed[0])
+        self.assertEqual(3, fake_print.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Unit tests for the live per-branch dashboard.
+
+"""
+import unittest
+
+from pyltc.plugins.simnet import Branch
+from pyltc.plugins.stats import BranchStats
+from pyltc.plugins.top import Top, render, sort_branches, SORT_DROPS, SORT_PROFILE, SORT_UTIL
+from tests.util.fakeclock import FakeClock
+from tests.util.fakertnl import FakeRtnl, tc_stats
+
+
+BRANCHES = [Branch('eth0', '1:1', 'upload', 'tcp:all', '15gbit'),
+            Branch('eth0', '2:1', 'upload', 'tcp:rport:443:512kbit:2%', '512kbit'),
+            Branch('ifb0', '2:1', 'download', 'udp:dport:5000:1mbit', '1mbit')]
+
+STATS = [BranchStats(BRANCHES[0], 256000, 256000 / 15e9, 0, 0.0, 0),
+         BranchStats(BRANCHES[1], 460800, 0.9, 12, 4.0, 3000),
+         BranchStats(BRANCHES[2], None, None, 30, None, 0)]
+
+
+class TestTop(unittest.TestCase):
+
+    def test_sort_branches(self):
+        self.assertEqual([1, 0, 2], [STATS.index(entry) for entry in sort_branches(STATS, SORT_UTIL)])
+        self.assertEqual([1, 0, 2], [STATS.index(entry) for entry in sort_branches(STATS, SORT_DROPS)])
+        self.assertEqual(STATS, sort_branches(STATS, SORT_PROFILE))
+
+    def test_render(self):
+        lines = render(STATS, SORT_UTIL, title='title')
+        self.assertEqual('title', lines[0])
+        self.assertTrue(lines[1].startswith('dev '))
+        self.assertEqual(['eth0', 'up', '460.8kbit', '512kbit', '90%', '4.0', '12', '3000b', 'tcp:rport:443:512kbit:2%'],
+                         lines[2].split())
+        self.assertEqual(['ifb0', 'down', '-', '1mbit', '-', '-', '30', '0b', 'udp:dport:5000:1mbit'],
+                         lines[4].split())
+        self.assertEqual(len(lines[2]) - len('tcp:rport:443:512kbit:2%'), lines[4].index('udp:'))
+
+    def test_screens(self):
+        rtnl = FakeRtnl({2: 'eth0'}, [tc_stats(2, 'htb', '1:0', 'root')], [tc_stats(2, 'htb', '2:1', 'root')])
+        clock = FakeClock(now=0.0)
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            nbytes = int(clock.now * 64000)  # 512kbit
+            rtnl.update(2, '1:0', bytes=nbytes)
+            rtnl.update(2, '2:1', bytes=nbytes)
+
+        with rtnl.installed('pyltc.plugins.stats'):
+            top = Top(BRANCHES[1:2], interval=0.5, clock=clock)
+            screens = list(top.screens(count=2, sleep=sleep))
+        self.assertEqual(2, len(screens))
+        self.assertIn(' - ', screens[0][2])
+        self.assertEqual('100%', screens[1][2].split()[4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+Unit tests for virtual network topologies.
+
+"""
+import os
+import tempfile
+import unittest
+
+from pyltc.plugins.topology import Topology, TopologyError, parse_topology, load_topology
+from pyltc.util.cmdline import CommandLine
+from tests.util.fakekernel import FakeKernel
+
+
+PROFILES = """\
+[slow]
+clear
+interface lo
+upload
+  tcp:rport:443:512kbit
+
+[slow-down]
+clear
+interface lo
+download
+  tcp:rport:443:512kbit
+"""
+
+TOPOLOGY = """\
+[lab]
+profiles {profiles}
+addresses 10.100.0.0/29
+node client router
+node server
+link client:eth0 router:eth0 slow
+link router:eth1 server:eth0
+"""
+
+
+def _can_create_netns():
+    if os.geteuid() != 0:
+        return False
+    try:
+        CommandLine('ip netns add ltc-topology-probe', sudo=True).execute()
+        CommandLine('ip netns del ltc-topology-probe', sudo=True).execute()
+    except Exception:
+        return False
+    return True
+
+
+class TestTopology(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.profiles = os.path.join(cls.tmpdir.name, 'test.profile')
+        cls.topology_file = os.path.join(cls.tmpdir.name, 'test.topology')
+        with open(cls.profiles, 'w') as fhl:
+            fhl.write(PROFILES)
+        with open(cls.topology_file, 'w') as fhl:
+            fhl.write(TOPOLOGY.format(profiles='test.profile'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_load(self):
+        topology = load_topology('lab', self.topology_file)
+        self.assertEqual(['client', 'router', 'server'], topology.nodes)
+        self.assertEqual(self.profiles, topology.profiles)
+        first, second = topology.links
+        self.assertEqual(('client', 'eth0', 'router', 'eth0', 'slow', '10.100.0.1/30', '10.100.0.2/30'), first)
+        self.assertEqual(('router', 'eth1', 'server', 'eth0', None, '10.100.0.5/30', '10.100.0.6/30'), second)
+        self.assertRaises(TopologyError, load_topology, 'nonesuch', self.topology_file)
+
+    def test_invalid(self):
+        self.assertRaises(TopologyError, parse_topology, ['--nodes', 'a'])
+        self.assertRaises(TopologyError, parse_topology, ['--node', 'a', 'b', '--link', 'a:eth0'])
+        self.assertRaises(TopologyError, parse_topology, ['--node', 'a', 'b', '--link', 'a', 'b:eth0'])
+        self.assertRaises(TopologyError, Topology, ['a', 'a'], [])
+        self.assertRaises(TopologyError, Topology, ['a'], [('a', 'eth0', 'b', 'eth0', None)])
+        self.assertRaises(TopologyError, Topology, ['a', 'b'], [('a', 'eth0', 'b', 'eth0', 'slow')])
+        self.assertRaises(TopologyError, Topology, ['a', 'b', 'c'],
+                          [('a', 'eth0', 'b', 'eth0', None), ('a', 'eth0', 'c', 'eth0', None)])
+        self.assertRaises(TopologyError, Topology, ['a', 'b'], [('a', 'eth0', 'b', 'eth0', None)] * 2,
+                          addresses='10.0.0.0/30')
+
+    def test_batches(self):
+        topology = load_topology('lab', self.topology_file)
+        self.assertEqual([
+            'netns add client',
+            'netns add router',
+            'netns add server',
+            'link add eth0 netns client type veth peer name eth0 netns router',
+            'link add eth1 netns router type veth peer name eth0 netns server',
+        ], topology.host_batch())
+        batches = topology.node_batches()
+        self.assertEqual(['link set dev lo up', 'addr add 10.100.0.1/30 dev eth0', 'link set dev eth0 up'],
+                         batches['client'])
+        self.assertEqual(5, len(batches['router']))
+
+    def test_compile(self):
+        topology = load_topology('lab', self.topology_file)
+        with FakeKernel(devices=('lo', 'eth0')):
+            batches = topology.compile()
+        self.assertEqual([], batches['router'])
+        self.assertEqual('qdisc add dev eth0 root handle 1:0 htb', batches['client'][0])
+        self.assertEqual(9, len(batches['client']))
+
+    def test_compile_ifb_per_download_link(self):
+        links = [('a', 'eth0', 'b', 'eth0', 'slow-down'), ('a', 'eth1', 'c', 'eth0', 'slow-down')]
+        topology = Topology(['a', 'b', 'c'], links, profiles=self.profiles)
+        with FakeKernel(devices=('lo', 'eth0', 'eth1', 'ifb0', 'ifb1')):
+            batches = topology.compile()
+        redirects = [cmd for cmd in batches['a'] if 'mirred' in cmd]
+        self.assertEqual(2, len(redirects))
+        self.assertIn('dev ifb0', redirects[0])
+        self.assertIn('dev ifb1', redirects[1])
+
+    @unittest.skipUnless(_can_create_netns(), "needs root and network namespace support")
+    def test_up_down(self):
+        prefix = 'ltc{}'.format(os.getpid())
+        nodes = ['{}n{}'.format(prefix, idx) for idx in range(8)]
+        links = [(node, 'eth0', peer, 'eth1', 'slow') for node, peer in zip(nodes, nodes[1:])]
+        topology = Topology(nodes, links, profiles=self.profiles)
+        try:
+            topology.up()
+            self.assertTrue(all(os.path.exists(os.path.join('/run/netns', node)) for node in nodes))
+            for node in (nodes[0], nodes[-2]):  # compiled once, renamed for the other links
+                output = CommandLine('tc -n {} qdisc show dev eth0'.format(node), sudo=True).execute().stdout
+                self.assertIn('qdisc htb 1: root', output)
+            output = CommandLine('ip -n {} addr show dev eth1'.format(nodes[1]), sudo=True).execute().stdout
+            self.assertIn('10.100.0.2/30', output)
+        finally:
+            topology.down()
+        self.assertFalse(any(os.path.exists(os.path.join('/run/netns', node)) for node in nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
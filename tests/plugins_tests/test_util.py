@@ -5,7 +5,7 @@ Unit tests for the pytc helper stuff.
 import unittest
 from configparser import ParsingError
 
-from pyltc.plugins.simnet_util import BranchParser
+from pyltc.plugins.simnet_util import BranchParser, timeline_step, listen_address
 
 
 class TestBranchParser(unittest.TestCase):
@@ -109,5 +109,31 @@ class TestBranchParser(unittest.TestCase):
         #     print(err)
 
 
+class TestTimelineStep(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(('4g', 30.0), timeline_step('4g:30'))
+        self.assertEqual(('dsl-poor', 2.5), timeline_step('dsl-poor:2.5'))
+        self.assertEqual(('odd:name', 0.0), timeline_step('odd:name:0'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, timeline_step, '4g')
+        self.assertRaises(ValueError, timeline_step, ':30')
+        self.assertRaises(ValueError, timeline_step, '4g:soon')
+        self.assertRaises(ValueError, timeline_step, '4g:-1')
+
+
+class TestListenAddress(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(('127.0.0.1', 9977), listen_address('127.0.0.1:9977'))
+        self.assertEqual(('0.0.0.0', 9977), listen_address(':9977'))
+        self.assertEqual(('::1', 80), listen_address('[::1]:80'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, listen_address, '9977')
+        self.assertRaises(ValueError, listen_address, 'localhost:http')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,18 +2,25 @@
 Unit tests for the simnet plugin wrapper class.
 
 """
+import asyncio
 import unittest
+from unittest import mock
 
 from pyltc.core.facade import TrafficControl
-from pyltc.core.netdevice import DeviceManager
+from pyltc.core.plan import TcPlan
+from pyltc.core.target import TcPipelineTarget
+from pyltc.core.tfactory import default_target_factory, pipeline_target_factory
 from tests.util.base import TcTestTarget
+from tests.util.fakekernel import FakeKernel
 
 
 class TestWrapper(unittest.TestCase):
 
     def setUp(self):
         self.result = list()
-        DeviceManager.shutdown_module('ifb')
+        self.kernel = FakeKernel()
+        self.kernel.__enter__()
+        self.addCleanup(self.kernel.__exit__, None, None, None)
 
     def our_callback(self, result):
         self.result = self.result + result
@@ -88,5 +95,58 @@ class TestWrapper(unittest.TestCase):
         #         print(resline)
         self.assertEqual(expected, self.result)
 
+    def test_marshal_async(self):
+        TrafficControl.init()
+        simnet = TrafficControl.get_plugin('simnet', self.target_factory)
+        simnet.configure(interface='lo', ifbdevice='ifb0', clear=True)
+        simnet.setup(upload=True, protocol='tcp', porttype='dport', range='8000-8080', rate='512kbit', jitter='7%')
+        simnet.setup(download=True, protocol='udp', porttype='sport', range='8100', rate='1mbit')
+        simnet.marshal()
+        expected = TcPlan(self.result)
+
+        with FakeKernel() as kernel:
+            TrafficControl.init()
+            simnet = TrafficControl.get_plugin('simnet', default_target_factory)
+            simnet.configure(interface='lo', ifbdevice='ifb0', clear=True)
+            simnet.setup(upload=True, protocol='tcp', porttype='dport', range='8000-8080', rate='512kbit', jitter='7%')
+            simnet.setup(download=True, protocol='udp', porttype='sport', range='8100', rate='1mbit')
+            asyncio.run(simnet.marshal_async())
+            self.assertEqual(expected, kernel.plan(['lo', 'ifb0']))
+
+    def test_marshal_pipelined(self):
+        TrafficControl.init()
+        simnet = TrafficControl.get_plugin('simnet', self.target_factory)
+        simnet.configure(interface='lo', ifbdevice='ifb0', clear=True)
+        simnet.setup(upload=True, protocol='tcp', porttype='dport', range='8000-8080', rate='512kbit', jitter='7%')
+        simnet.setup(download=True, protocol='udp', porttype='sport', range='8100', rate='1mbit')
+        simnet.marshal()
+        expected = TcPlan(self.result)
+
+        with FakeKernel() as kernel:
+            TrafficControl.init()
+            simnet = TrafficControl.get_plugin('simnet', pipeline_target_factory)
+            simnet.configure(interface='lo', ifbdevice='ifb0', clear=True)
+            simnet.setup(upload=True, protocol='tcp', porttype='dport', range='8000-8080', rate='512kbit', jitter='7%')
+            simnet.setup(download=True, protocol='udp', porttype='sport', range='8100', rate='1mbit')
+            simnet.marshal()
+            self.assertEqual(expected, kernel.plan(['lo', 'ifb0']))
+
+    def test_pipelined_build_failure_aborts(self):
+        with FakeKernel() as kernel:
+            TrafficControl.init()
+            simnet = TrafficControl.get_plugin('simnet', pipeline_target_factory)
+            simnet.configure(interface='lo', ifbdevice='ifb0', clear=True)
+            simnet.setup(upload=True, protocol='tcp', porttype='dport', range='8000-8080', rate='512kbit')
+            with mock.patch('pyltc.plugins.simnet.build_tree', side_effect=ValueError('bad setup')), \
+                    mock.patch.object(TcPipelineTarget, 'abort', autospec=True,
+                                      side_effect=TcPipelineTarget.abort) as abort:
+                self.assertRaises(ValueError, simnet.marshal)
+            self.assertEqual(3, abort.call_count)  # lo egress and ingress, ifb0 egress
+            self.assertEqual(None, abort.call_args_list[0][0][0]._batch)
+            applied = kernel.plan(['lo']).commands()  # the basics, applied before building failed
+            self.assertTrue(applied)
+            self.assertFalse([cmd for cmd in applied if 'netem' in cmd])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,11 +2,25 @@
 Base test classes for PyLTC integration testing.
 
 """
+import random
+
 from pyltc.plugins.simnet import parse_args
 from pyltc.core.target import TcTarget, TcCommandTarget, TcFileTarget
 from pyltc.main import pyltc_entry_point
-from tests.util.iperf_proc import TCPNetPerfTest, UDPNetPerfTest
+from tests.util.traffic import measure_many
 from pyltc.plugins.simnet_util import BranchParser
+from pyltc.util.rates import convert2bps
+
+
+#: how many times its rate a UDP probe sends into a shaped class (at most at the given UDP send rate);
+#: enough to show the shaping, while the backlog left for the next probe of the class stays short
+UDP_OVERLOAD = 2
+
+#: the scheduling class of TCP probes to unshaped ports; they run one at a time, on their own
+UNSHAPED_TCP = 'unshaped-tcp'
+
+#: how many random ports are drawn for a probe outside of every port range before giving up
+MAX_PORT_DRAWS = 1000
 
 
 class TcTestTarget(TcTarget):
@@ -23,15 +37,21 @@ class TcTestTarget(TcTarget):
 
 class LtcSimulateTargetRun(object):
     """Used by simulation pyltc tests.
-    Executes given pyltc command using the TcTestTarget."""
+    Executes given pyltc command using the TcTestTarget.
+    If a FakeKernel is given, the generated commands are also applied to it,
+    so that the kernel validates them and the resulting tree can be inspected."""
 
-    def __init__(self, argv, full=False):
+    def __init__(self, argv, full=False, kernel=None):
         self._argv = argv
         self._full = full
+        self._kernel = kernel
         self._result = []
 
     def our_callback(self, result):
         self._result = self._result + result
+        if self._kernel:
+            for cmd in result:
+                self._kernel.execute(cmd, ignore_errors=' del ' in cmd)  # as TcTarget does for clearing
 
     def test_target_factory(self, iface, direction):
         return TcTestTarget(iface, direction, self.our_callback)
@@ -49,51 +69,150 @@ class LtcSimulateTargetRun(object):
 class LtcLiveTargetRun(object):
     """Used by live pyltc tests.
     Executes given pyltc command using TcCommandTarget
-    and measures rates, then returns results."""
-
-    def __init__(self, argv, udp_sendrate, duration=5, full=False):
+    and measures rates, then returns results.
+    The probes run concurrently, in waves that never put two probes into the same HTB
+    class, so the run takes a few probe durations regardless of the number of branches.
+    Given tolerances (the relative errors the tests accept for shaped and free rates),
+    each probe stops as soon as its rate has converged and ``duration`` is only the cap.
+    Given a ``NetnsPair`` fabric (see ``tests.util.netns``), the probes run from its client
+    to its server namespace; ``argv`` is then expected to shape the client device."""
+
+    def __init__(self, argv, udp_sendrate, duration=5, full=False, random_probes=0, seed=None,
+                 shaped_tolerance=None, free_tolerance=None, fabric=None):
         self._argv = argv
+        self._fabric = fabric
         self._udp_sendrate = udp_sendrate
         self._duration = duration
+        self._shaped_tolerance = shaped_tolerance
+        self._free_tolerance = free_tolerance
         self._full = full
+        self._random_probes = random_probes
+        self._random = random.Random(seed)
+        self._groups = None
+        self._branches = None
         self._result = None
 
     def _target_factory(self, iface, direction):
         return TcCommandTarget(iface, direction)
 
-    def _test_for_port_range(self, klass, port_range, sendrate):
+    def _probes_for_port_range(self, port_range, protocol, taken):
+        """Returns the (key, port) probes for a port range: its edges, the ports just
+        outside of them and ``random_probes`` random ports inside and outside of it."""
         left_in_port, right_in_port, *_ = map(int, (port_range + "-0").split('-'))
         right_in_port = right_in_port if right_in_port else left_in_port
-        left_out_port = left_in_port - 1
-        right_out_port = right_in_port + 1
-
-        bandwidth_dict = {}
-        tcp_netperf_1 = klass(sendrate, host='127.0.0.1', port=left_in_port, duration=self._duration)
-        bandwidth_dict['left_in'] = tcp_netperf_1.run()
-        tcp_netperf_2 = klass(sendrate, host='127.0.0.1', port=left_out_port, duration=self._duration)
-        bandwidth_dict['left_out'] = tcp_netperf_2.run()
-        tcp_netperf_3 = klass(sendrate, host='127.0.0.1', port=right_in_port, duration=self._duration)
-        bandwidth_dict['right_in'] = tcp_netperf_3.run()
-        tcp_netperf_4 = klass(sendrate, host='127.0.0.1', port=right_out_port, duration=self._duration)
-        bandwidth_dict['right_out'] = tcp_netperf_4.run()
-
-        return bandwidth_dict
+        probes = [
+            ('left_in', left_in_port),
+            ('left_out', left_in_port - 1),
+            ('right_in', right_in_port),
+            ('right_out', right_in_port + 1),
+        ]
+        for idx in range(1, self._random_probes + 1):
+            probes.append(('random_in_{:02d}'.format(idx), self._random.randint(left_in_port, right_in_port)))
+            for _ in range(MAX_PORT_DRAWS):
+                port = self._random.randint(1024, 65535)
+                if port not in taken and self._class_of(protocol, port, ranges_only=True) is None:
+                    break
+            else:
+                raise RuntimeError("no free {} port outside of the port ranges found in {} draws".format(
+                    protocol, MAX_PORT_DRAWS))
+            taken.add(port)
+            probes.append(('random_out_{:02d}'.format(idx), port))
+        return probes
+
+    def _class_of(self, protocol, port, ranges_only=False):
+        """Returns the index of the branch shaping traffic to given port, or None if it is not shaped.
+        A port range branch takes precedence over the 'all' branch of the protocol, which is
+        ignored with ``ranges_only``."""
+        all_idx = None
+        for idx, branch in enumerate(self._branches):
+            if branch['protocol'] != protocol:
+                continue
+            if branch['range'] == 'all':
+                all_idx = idx if all_idx is None else all_idx
+                continue
+            if branch['porttype'] != 'dport':
+                continue
+            left, _, right = branch['range'].partition('-')
+            if int(left) <= port <= int(right or left):
+                return idx
+        return None if ranges_only else all_idx
+
+    @staticmethod
+    def schedule_probes(probes):
+        """Groups probes into waves that can run concurrently: a wave never has two probes
+        shaped by the same HTB class (they would share its rate) nor two probes on the same port.
+
+        :param probes: list of (probe, port, class) tuples; class is None for unshaped probes
+        :return: list of lists of probes
+        """
+        waves = list()
+        for probe in probes:
+            _, port, klass = probe
+            for wave in waves:
+                if all(port != other[1] and (klass is None or klass != other[2]) for other in wave):
+                    wave.append(probe)
+                    break
+            else:
+                waves.append([probe])
+        return waves
+
+    def _measure(self):
+        probes, taken = list(), set()
+        for group, branch in zip(self._groups, self._branches):
+            if branch['range'] == 'all':
+                continue
+            for key, port in self._probes_for_port_range(branch['range'], branch['protocol'], taken):
+                taken.add(port)
+                klass = self._class_of(branch['protocol'], port)
+                if klass is None and branch['protocol'] == 'tcp':
+                    klass = UNSHAPED_TCP
+                probes.append(((group, key, branch['protocol']), port, klass))
+
+        # an unpaced probe takes all the CPU it gets, so next to others it would not reach the free rate
+        waves = [[probe] for probe in probes if probe[2] == UNSHAPED_TCP]
+        waves += self.schedule_probes([probe for probe in probes if probe[2] != UNSHAPED_TCP])
+        result = dict((group, dict()) for group in self._groups)
+        for wave in waves:
+            flows = [(protocol, port, self._sendrate(protocol, klass)) for (_, _, protocol), port, klass in wave]
+            measured = measure_many(flows, duration=self._duration, tolerance=self._tolerances(wave),
+                                    **self._endpoints())
+            for (group, key, _), port, _ in wave:
+                result[group][key] = measured[port].goodput
+        return result
+
+    def _sendrate(self, protocol, klass):
+        """Returns the rate to send a probe at: None (unpaced) for TCP, the UDP send rate capped
+        at ``UDP_OVERLOAD`` times the rate of the class shaping the probe for UDP."""
+        if protocol == 'tcp':
+            return None
+        sendrate = convert2bps(self._udp_sendrate)
+        if klass is None or not self._branches[klass]['rate']:
+            return sendrate
+        return min(sendrate, UDP_OVERLOAD * convert2bps(self._branches[klass]['rate']))
+
+    def _endpoints(self):
+        """Returns the measure_many() arguments placing the probes in the fabric, if any."""
+        if not self._fabric:
+            return dict()
+        return dict(host=self._fabric.server_addr, source_netns=self._fabric.client, sink_netns=self._fabric.server)
+
+    def _tolerances(self, wave):
+        """Returns the tolerance of each probe of a wave (port -> float), or None to measure for the full duration."""
+        if self._shaped_tolerance is None or self._free_tolerance is None:
+            return None
+        return dict((port, self._free_tolerance if klass in (None, UNSHAPED_TCP) else self._shaped_tolerance)
+                    for _, port, klass in wave)
 
     def run(self):
         orig_argv = self._argv[:]
         pyltc_entry_point(self._argv, self._target_factory)
         args = parse_args(orig_argv)
-        result = {}
-        for group in args.upload:
-            group_dict = BranchParser(group, upload=True).as_dict()
-            klass = TCPNetPerfTest if group_dict['protocol'] == 'tcp' else UDPNetPerfTest
-            bandwidth_dict = self._test_for_port_range(klass, group_dict['range'], self._udp_sendrate)
-            result[group] = bandwidth_dict
-
-        self._result = result
+        self._groups = args.upload
+        self._branches = [BranchParser(group, upload=True).as_dict() for group in args.upload]
+        self._result = self._measure()
 
 # This here shows an example of what the function returns (since it is not too simple):
-# (as of now the 'random' ports are not yet implemented)
+# (the 'random' probes are there when random_probes=3)
 #         return {
 #             'tcp:8080:512kbit': {
 #                 'left-in': 782323,
@@ -101,12 +220,12 @@ class LtcLiveTargetRun(object):
 #                 'right-in': 62343234234,
 #                 'right-out': 82374234,
 #
-#                 'random-in-01': 453452345,
-#                 'random-in-02': 453452345,
-#                 'random-in-03': 453452345,
-#                 'random-out-01': 453452345,
-#                 'random-out-02': 453452345,
-#                 'random-out-03': 453452345,
+#                 'random_in_01': 453452345,
+#                 'random_in_02': 453452345,
+#                 'random_in_03': 453452345,
+#                 'random_out_01': 453452345,
+#                 'random_out_02': 453452345,
+#                 'random_out_03': 453452345,
 #             }
 #         }
 
@@ -0,0 +1,21 @@
+"""
+Fake monotonic clock for testing code that is given a clock (and a sleep function),
+e.g. the samplers, the timeline runner and the timings recorder.
+
+"""
+
+
+class FakeClock(object):
+    """A monotonic clock that only moves when told to: by ``sleep()``, by setting ``now``, or by
+    ``tick`` seconds at every reading (e.g. to make each measured step take time)."""
+
+    def __init__(self, now=100.0, tick=0.0):
+        self.now = now
+        self.tick = tick
+
+    def __call__(self):
+        self.now += self.tick
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
@@ -0,0 +1,620 @@
+"""
+Hermetic in-memory fake kernel for PyLTC tests.
+
+``FakeKernel`` models the parts of the kernel pyltc talks to: network devices
+and their modules (as handled by ``DeviceManager``) and a traffic control state
+machine that accepts the ``tc`` commands targets emit. It validates handles and
+parents the way the kernel does and exposes the resulting tree as a ``TcPlan``.
+
+Used as a context manager, it takes over all command execution (via
+``pyltc.util.cmdline.popen_factory`` and ``async_process_factory``) and the ``/sys/class/net`` lookups, so
+tests need neither root access nor a real kernel and can run in parallel::
+
+  with FakeKernel() as kernel:
+      pyltc_entry_point(['simnet', '-c', '--upload', 'tcp:dport:8000:1mbit'])
+      print(kernel.plan().commands())
+
+"""
+import shlex
+import signal
+import subprocess
+from contextlib import ExitStack
+from unittest import mock
+
+from pyltc.core.netdevice import DeviceManager
+from pyltc.core.plan import TcPlan
+
+
+#: qdisc kinds the fake kernel knows about; only the classful ones accept classes
+CLASSFUL_QDISCS = ('htb', 'prio', 'hfsc', 'drr')
+CLASSLESS_QDISCS = ('netem', 'pfifo', 'bfifo', 'pfifo_fast', 'sfq', 'fq_codel', 'tbf', 'ingress')
+FILTER_KINDS = ('u32', 'basic', 'flower', 'bpf', 'matchall', 'fw')
+
+#: devices created on module load when the 'num<module>s' parameter is not given
+DEFAULT_DEVICE_COUNTS = {'ifb': 2, 'dummy': 1}
+
+#: the kernel's name prefix for the device types a peer is created with (veth pairs)
+PAIRED_DEVICE_TYPES = {'veth': 'veth'}
+
+#: the prio the kernel assigns to the first prio-less filter of a parent
+AUTO_PRIO = 0xc000
+
+
+class FakeKernelError(Exception):
+    """Raised when the fake kernel rejects a command, like the real one would."""
+
+    def __init__(self, message, returncode=2):
+        super(FakeKernelError, self).__init__(message)
+        self.returncode = returncode
+
+
+def parse_handle(handle):
+    """Parses a tc handle the way tc does: both parts are hex, the minor may be omitted.
+
+    :param handle: string - e.g. '1:0', '10:', 'ffff:0'
+    :return: tuple - (int, int)
+    """
+    major, _, minor = handle.partition(':')
+    try:
+        return int(major or '0', 16), int(minor or '0', 16)
+    except ValueError:
+        raise FakeKernelError("Error: Invalid handle: {!r}".format(handle))
+
+
+def format_handle(handle):
+    return '{:x}:{:x}'.format(*handle)
+
+
+def _quoted(tokens):
+    """Joins tokens back, double-quoting the ones with spaces (as pyltc does)."""
+    return " ".join('"{}"'.format(tok) if ' ' in tok else tok for tok in tokens)
+
+
+class _Device(object):
+
+    def __init__(self, name, up=False):
+        self.name = name
+        self.up = up
+        self.qdiscs = dict()   # handle -> [parent, spec]; parent is 'root', 'ingress' or a classid
+        self.classes = dict()  # classid -> [parent, spec]
+        self.filters = dict()  # serial -> [parent, prio, protocol, spec, bound classid, flowid, explicit prio]
+        self.order = list()    # creation order of ('qdisc'|'class'|'filter', handle or serial) items
+        self.serial = 0
+        self.peer = None       # the other end of a veth pair
+
+    def drop_filters(self, matching):
+        for serial in [serial for serial, flt in self.filters.items() if matching(flt)]:
+            del self.filters[serial]
+            self.order.remove(('filter', serial))
+
+
+class _BatchInput(object):
+    """The input of a fake batch process: like 'tc -batch -' (or 'ip -batch -'), executes each line as
+    it is written and stops at the first failing one, after which writing raises BrokenPipeError.
+    With '-force', all lines are executed and the batch fails at the end if any did."""
+
+    def __init__(self, kernel, command_list):
+        if command_list and command_list[0] == 'sudo':
+            command_list = command_list[1:]
+        assert command_list[-2:] == ['-batch', '-'], "Not a batch reading stdin: {!r}".format(command_list)
+        self._kernel = kernel
+        self._force = '-force' in command_list
+        self._prefix = [token for token in command_list[:-2] if token != '-force']
+        self._pending = ''
+        self._lineno = 0
+        self._errors = list()
+        #: (returncode, stdout, stderr) once the batch has finished
+        self.result = None
+
+    def write(self, data):
+        if self.result:
+            raise BrokenPipeError(32, 'Broken pipe')
+        lines = (self._pending + data.decode('utf-8')).split('\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self._lineno += 1
+            returncode, _, stderr = self._kernel.run(self._prefix + shlex.split(line))
+            if returncode:
+                self._errors.append('{}\nCommand failed -:{}\n'.format(stderr, self._lineno))
+                if not self._force:
+                    self.result = (1, '', self._errors[0])
+                    break
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.result:
+            self.result = (1 if self._errors else 0, '', ''.join(self._errors))
+
+
+class FakeKernel(object):
+    """In-memory stand-in for the network devices and the tc subsystem."""
+
+    def __init__(self, devices=('lo',)):
+        """Initializer.
+
+        :param devices: sequence of strings - names of devices existing from the start (all up)
+        """
+        self._devices = dict((name, _Device(name, up=True)) for name in devices)
+        self._modules = set()
+        self._stack = None
+        self.executed = list()  # all command lines executed, as strings
+
+    # ----------------------------------------------------------------
+    #  Installation
+
+    def __enter__(self):
+        kernel = self
+
+        class FakePopen(object):
+            """Routes ``CommandLine`` executions to the fake kernel; a process started with its
+            input on a pipe is a batch (e.g. 'tc -batch -') that runs each line as it is written."""
+
+            def __init__(self, command_list, *args, **kw):
+                self.returncode = None
+                self.stdin = _BatchInput(kernel, command_list) if kw.get('stdin') == subprocess.PIPE else None
+                self.stdout = self.stderr = None
+                self._result = None if self.stdin else kernel.run(command_list)
+
+            def poll(self):
+                if self.stdin and self.stdin.result:
+                    self.returncode = self.stdin.result[0]
+                return self.returncode
+
+            def communicate(self, timeout=None):
+                if self.stdin:
+                    self.stdin.close()
+                    self._result = self.stdin.result
+                self.returncode, stdout, stderr = self._result
+                return stdout.encode('utf-8'), stderr.encode('utf-8')
+
+            def terminate(self):
+                """Stops a batch: the lines written so far stay applied, no further ones are run."""
+                if self.stdin and not self.stdin.result:
+                    self.stdin.result = (-signal.SIGTERM, '', '')
+                self.poll()
+
+            kill = terminate
+
+            def wait(self, timeout=None):
+                return self.poll()
+
+        class FakeProcess(FakePopen):
+            """Routes ``AsyncCommandLine`` executions to the fake kernel."""
+
+            async def communicate(self):
+                return FakePopen.communicate(self)
+
+            async def wait(self):
+                self.returncode = self._result[0]
+                return self.returncode
+
+        async def create_process(*command_list, **kw):
+            return FakeProcess(list(command_list))
+
+        self._stack = ExitStack()
+        self._stack.enter_context(mock.patch('pyltc.util.cmdline.popen_factory', return_value=FakePopen))
+        self._stack.enter_context(mock.patch('pyltc.util.cmdline.async_process_factory', return_value=create_process))
+        self._stack.enter_context(mock.patch.object(DeviceManager, 'inventory', lambda: None))
+        self._stack.enter_context(mock.patch.object(DeviceManager, 'all_iface_names', self.all_iface_names))
+        self._stack.enter_context(mock.patch.object(DeviceManager, 'device_is_down', self.device_is_down))
+        self._stack.enter_context(mock.patch.object(DeviceManager, 'module_loaded', self.module_loaded))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    def run(self, command_list):
+        """Executes a command list as built by ``CommandLine``.
+
+        :return: tuple - (returncode, stdout, stderr)
+        """
+        if command_list and command_list[0] == 'sudo':
+            command_list = command_list[1:]
+        self.executed.append(_quoted(command_list))
+        if command_list[1:2] == ['-n']:
+            command_list = command_list[:1] + command_list[3:]  # namespaces are not modeled
+        try:
+            if command_list[0] == 'tc':
+                self._tc(command_list[1:])
+            elif command_list[0] == 'ip':
+                self._ip(command_list[1:])
+            elif command_list[0] == 'modprobe':
+                self._modprobe(command_list[1:])
+            else:
+                raise FakeKernelError("{}: command not found".format(command_list[0]), returncode=127)
+        except FakeKernelError as exc:
+            return exc.returncode, "", str(exc)
+        return 0, "", ""
+
+    def execute(self, cmd, ignore_errors=False):
+        """Executes a command string (e.g. one of the commands a target emits).
+
+        :param cmd: string - the command
+        :param ignore_errors: bool - whether to swallow a rejection
+        :return: int - the return code
+        """
+        tokens = shlex.split(cmd)
+        returncode, _, stderr = self.run(tokens)
+        if returncode and not ignore_errors:
+            raise FakeKernelError(stderr, returncode)
+        return returncode
+
+    # ----------------------------------------------------------------
+    #  Devices and modules (mirrors DeviceManager)
+
+    def all_iface_names(self, filter=None):
+        return [name for name in self._devices if not filter or filter in name]
+
+    def device_is_down(self, name):
+        assert name in self._devices, "Device does not exist: {!r}".format(name)
+        return not self._devices[name].up
+
+    def device(self, name):
+        try:
+            return self._devices[name]
+        except KeyError:
+            raise FakeKernelError('Cannot find device "{}"'.format(name), returncode=1)
+
+    def module_loaded(self, name):
+        return name in self._modules
+
+    def _modprobe(self, args):
+        if args[0] in ('--remove', '-r'):
+            module = args[1]
+            if module not in self._modules:
+                raise FakeKernelError("modprobe: FATAL: Module {} is not currently loaded.".format(module), 1)
+            for name in self.all_iface_names(filter=module):
+                del self._devices[name]
+            self._modules.discard(module)
+            return
+        module, params = args[0], dict(arg.split('=', 1) for arg in args[1:])
+        if module not in DEFAULT_DEVICE_COUNTS:
+            raise FakeKernelError("modprobe: FATAL: Module {} not found.".format(module), 1)
+        if module in self._modules:
+            return  # like modprobe: parameters are ignored for an already loaded module
+        self._modules.add(module)
+        count = int(params.get('num{}s'.format(module), DEFAULT_DEVICE_COUNTS[module]))
+        for num in range(count):
+            self._devices.setdefault('{}{}'.format(module, num), _Device('{}{}'.format(module, num)))
+
+    def _add_veth(self, name, peer_name):
+        if peer_name is None:  # named by the kernel, like the first free vethN
+            peer_name = next('veth{}'.format(num) for num in range(len(self._devices) + 1)
+                             if 'veth{}'.format(num) not in self._devices and 'veth{}'.format(num) != name)
+        if name in self._devices or peer_name in self._devices:
+            raise FakeKernelError("RTNETLINK answers: File exists")
+        dev, peer = _Device(name), _Device(peer_name)
+        dev.peer, peer.peer = peer_name, name
+        self._devices[name] = dev
+        self._devices[peer_name] = peer
+
+    def _ip(self, args):
+        if args[:2] == ['link', 'add'] and args[3:5] == ['type', 'veth'] and len(args) in (5, 8) \
+                and args[5:7] in ([], ['peer', 'name']):
+            self._add_veth(args[2], args[7] if len(args) == 8 else None)
+            return
+        if args[:2] == ['link', 'add'] and len(args) == 5 and args[3] == 'type':
+            name, module = args[2], args[4]
+            if name in self._devices:
+                raise FakeKernelError("RTNETLINK answers: File exists")
+            if module not in DEFAULT_DEVICE_COUNTS:
+                raise FakeKernelError("Error: Unknown device type.")
+            self._modules.add(module)  # loaded on demand
+            self._devices[name] = _Device(name)
+            return
+        if args[:3] == ['link', 'set', 'dev'] and len(args) == 5 and args[4] in ('up', 'down'):
+            self.device(args[3]).up = args[4] == 'up'
+            return
+        if args[:2] == ['link', 'del'] and len(args) == 3:
+            peer = self.device(args[2]).peer
+            del self._devices[args[2]]
+            self._devices.pop(peer, None)  # a veth pair goes as a whole
+            return
+        raise FakeKernelError("Command line is not complete. Try option \"help\"", 255)
+
+    # ----------------------------------------------------------------
+    #  Traffic control
+
+    def _tc(self, args):
+        if len(args) < 4 or args[0] not in ('qdisc', 'class', 'filter') or args[2] != 'dev':
+            raise FakeKernelError("Command line is not complete. Try option \"help\"", 255)
+        obj, verb = args[0], args[1]
+        dev = self.device(args[3])
+        opts, rest = self._parse_tc_options(args[4:])
+        handler = getattr(self, '_{}_{}'.format(obj, verb), None)
+        if handler is None:
+            raise FakeKernelError('Command "{}" is unknown, try "tc {} help".'.format(verb, obj), 255)
+        handler(dev, opts, rest)
+
+    @staticmethod
+    def _parse_tc_options(tokens):
+        opts = dict()
+        idx = 0
+        while idx < len(tokens):
+            tok = tokens[idx]
+            if tok in ('root', 'ingress') and 'parent' not in opts:
+                opts['parent'] = tok
+                idx += 1
+            elif tok in ('parent', 'handle', 'classid', 'protocol', 'prio') and idx + 1 < len(tokens):
+                opts[tok] = tokens[idx + 1]
+                idx += 2
+            else:
+                break
+        rest = tokens[idx:]
+        if len(rest) >= 2 and rest[-2] == 'flowid':
+            opts['flowid'], rest = rest[-1], rest[:-2]
+        return opts, rest
+
+    def _qdisc_parent(self, dev, opts):
+        parent = opts.get('parent')
+        if parent is None:
+            raise FakeKernelError("Error: Parent not specified.")
+        if parent in ('root', 'ingress'):
+            return parent
+        classid = parse_handle(parent)
+        if classid not in dev.classes:
+            raise FakeKernelError("Error: Failed to find specified qdisc.")
+        return classid
+
+    def _find_qdisc(self, dev, parent):
+        for handle, (qparent, _) in dev.qdiscs.items():
+            if qparent == parent:
+                return handle
+        return None
+
+    def _qdisc_add(self, dev, opts, rest):
+        if not rest and opts.get('parent') == 'ingress':
+            rest = ['ingress']  # 'ingress' is both the hook and the qdisc kind
+        if not rest:
+            raise FakeKernelError("Error: Qdisc kind is not specified.")
+        kind = rest[0]
+        if kind not in CLASSFUL_QDISCS + CLASSLESS_QDISCS:
+            raise FakeKernelError("Error: Specified qdisc kind is unknown.")
+        if kind == 'ingress':
+            opts.setdefault('parent', 'ingress')
+            if opts['parent'] != 'ingress':
+                raise FakeKernelError("Error: Ingress qdisc can only be attached to the ingress hook.")
+        elif opts.get('parent') == 'ingress':
+            raise FakeKernelError("Error: Specified qdisc kind cannot be attached to the ingress hook.")
+        handle = parse_handle(opts['handle']) if 'handle' in opts else (0x8001 + len(dev.qdiscs), 0)
+        if kind == 'ingress' and handle != (0xffff, 0):
+            raise FakeKernelError("Error: Invalid handle.")
+        parent = self._qdisc_parent(dev, opts)
+        if handle[1] != 0:
+            raise FakeKernelError("Error: Invalid minor handle.")
+        if self._find_qdisc(dev, parent) is not None:
+            raise FakeKernelError("Error: Exclusivity flag on, cannot modify.")
+        if handle in dev.qdiscs:
+            raise FakeKernelError("Error: Exclusivity flag on, cannot modify.")
+        if isinstance(parent, tuple):
+            parent_qdisc = dev.qdiscs[(parent[0], 0)]
+            if parent_qdisc[1].split()[0] not in CLASSFUL_QDISCS:
+                raise FakeKernelError("Error: Specified class not found.")
+        dev.qdiscs[handle] = [parent, _quoted(rest)]
+        dev.order.append(('qdisc', handle))
+
+    def _qdisc_change(self, dev, opts, rest):
+        parent = self._qdisc_parent(dev, opts)
+        handle = parse_handle(opts['handle']) if 'handle' in opts else self._find_qdisc(dev, parent)
+        if handle not in dev.qdiscs or dev.qdiscs[handle][0] != parent:
+            raise FakeKernelError("Error: Specified qdisc not found.")
+        if dev.qdiscs[handle][1].split()[0] != rest[0]:
+            raise FakeKernelError("Error: Invalid qdisc name.")
+        dev.qdiscs[handle][1] = _quoted(rest)
+
+    def _qdisc_del(self, dev, opts, rest):
+        parent = self._qdisc_parent(dev, opts)
+        handle = self._find_qdisc(dev, parent)
+        if handle is None:
+            if parent == 'ingress':
+                raise FakeKernelError("Error: Invalid handle.")
+            raise FakeKernelError("Error: Cannot delete qdisc with handle of zero.")
+        if 'handle' in opts and parse_handle(opts['handle']) != handle:
+            raise FakeKernelError("Error: Invalid handle.")
+        self._drop_qdisc(dev, handle)
+
+    def _drop_qdisc(self, dev, handle):
+        """Removes a qdisc with its classes, filters and child qdiscs."""
+        del dev.qdiscs[handle]
+        for classid in [cid for cid in dev.classes if cid[0] == handle[0]]:
+            self._drop_class(dev, classid)
+        dev.drop_filters(lambda flt: flt[0] == handle)
+        dev.order.remove(('qdisc', handle))
+
+    def _drop_class(self, dev, classid):
+        if classid not in dev.classes:
+            return
+        del dev.classes[classid]
+        dev.order.remove(('class', classid))
+        dev.drop_filters(lambda flt: flt[0] == classid)
+        leaf = self._find_qdisc(dev, classid)
+        if leaf is not None:
+            self._drop_qdisc(dev, leaf)
+
+    def _class_parent(self, dev, opts):
+        if 'parent' not in opts:
+            raise FakeKernelError("Error: Parent not specified.")
+        parent = parse_handle(opts['parent'])
+        if parent[1] == 0:
+            if parent not in dev.qdiscs:
+                raise FakeKernelError("Error: Failed to find qdisc with specified handle.")
+        elif parent not in dev.classes:
+            raise FakeKernelError("Error: Parent class not found.")
+        return parent
+
+    def _class_add(self, dev, opts, rest):
+        parent = self._class_parent(dev, opts)
+        if 'classid' not in opts:
+            raise FakeKernelError("Error: Class id not specified.")
+        classid = parse_handle(opts['classid'])
+        qdisc = dev.qdiscs.get((parent[0], 0))
+        if classid[0] != parent[0] or classid[1] == 0 or qdisc is None:
+            raise FakeKernelError("Error: Invalid class id.")
+        if not rest or qdisc[1].split()[0] != rest[0] or rest[0] not in CLASSFUL_QDISCS:
+            raise FakeKernelError("Error: Qdisc kind does not match class kind.")
+        if classid in dev.classes:
+            raise FakeKernelError("Error: Exclusivity flag on, cannot modify.")
+        if rest[0] == 'htb' and 'rate' not in rest:
+            raise FakeKernelError("Error: HTB: rate must be specified.")
+        dev.classes[classid] = [parent, _quoted(rest)]
+        dev.order.append(('class', classid))
+
+    def _class_change(self, dev, opts, rest):
+        parent = self._class_parent(dev, opts)
+        classid = parse_handle(opts.get('classid', ''))
+        if classid not in dev.classes or dev.classes[classid][0] != parent:
+            raise FakeKernelError("Error: Specified class not found.")
+        dev.classes[classid][1] = _quoted(rest)
+
+    def _class_del(self, dev, opts, rest):
+        classid = parse_handle(opts.get('classid', ''))
+        if classid not in dev.classes:
+            raise FakeKernelError("Error: Specified class not found.")
+        if any(pcls == classid for pcls, _ in dev.classes.values()):
+            raise FakeKernelError("Error: Class has children, cannot delete.", returncode=2)
+        if any(flt[4] == classid for flt in dev.filters.values()):
+            raise FakeKernelError("Error: Class in use by filter.", returncode=2)
+        self._drop_class(dev, classid)
+
+    def _filter_parent(self, dev, opts):
+        if 'parent' not in opts or opts['parent'] in ('root', 'ingress'):
+            raise FakeKernelError("Error: Parent not specified.")
+        parent = parse_handle(opts['parent'])
+        if parent not in (dev.qdiscs if parent[1] == 0 else dev.classes):
+            raise FakeKernelError("Error: Parent Qdisc doesn't exists.")
+        return parent
+
+    def _filter_add(self, dev, opts, rest):
+        parent = self._filter_parent(dev, opts)
+        if not rest or rest[0] not in FILTER_KINDS:
+            raise FakeKernelError("Error: Specified filter kind not found.")
+        protocol = opts.get('protocol', 'all')
+        at_parent = [flt for flt in dev.filters.values() if flt[0] == parent]
+        if 'prio' in opts:
+            prio = int(opts['prio'])
+        else:
+            prio = min(flt[1] for flt in at_parent) - 1 if at_parent else AUTO_PRIO
+        for flt in at_parent:
+            if flt[1] == prio and (flt[2] != protocol or flt[3].split()[0] != rest[0]):
+                raise FakeKernelError("Error: Filter kind and protocol must match existing filters"
+                                      " already in a single priority.")
+        flowid = None
+        if 'flowid' in opts:
+            flowid = parse_handle(opts['flowid'])
+            if flowid[0] != parent[0] or flowid not in dev.classes:
+                flowid = None  # the kernel accepts it, but the filter is not bound to any class
+        dev.serial += 1
+        dev.filters[dev.serial] = [parent, prio, protocol, _quoted(rest), flowid, opts.get('flowid'), 'prio' in opts]
+        dev.order.append(('filter', dev.serial))
+
+    def _filter_del(self, dev, opts, rest):
+        parent = self._filter_parent(dev, opts)
+        protocol = opts.get('protocol')
+        prio = int(opts['prio']) if 'prio' in opts else None
+
+        def matching(flt):
+            return flt[0] == parent and prio in (None, flt[1]) and protocol in (None, flt[2])
+
+        if prio is not None and not any(matching(flt) for flt in dev.filters.values()):
+            raise FakeKernelError("Error: Filter with specified priority/protocol not found.")
+        dev.drop_filters(matching)
+
+    # ----------------------------------------------------------------
+    #  Inspection
+
+    def plan(self, devices=None):
+        """Returns the current tc tree of given devices (all by default) as a ``TcPlan``,
+        in an order where parents always precede their children.
+
+        :param devices: sequence of strings - the device names
+        :return: TcPlan
+        """
+        commands = list()
+        for name in devices or list(self._devices):
+            dev = self._devices[name]
+            for kind, handle in dev.order:
+                if kind == 'qdisc':
+                    parent, spec = dev.qdiscs[handle]
+                    if spec == 'ingress':
+                        cmd = "tc qdisc add dev {} handle {} ingress".format(name, format_handle(handle))
+                    else:
+                        where = parent if parent in ('root', 'ingress') else 'parent ' + format_handle(parent)
+                        cmd = "tc qdisc add dev {} {} handle {} {}".format(name, where, format_handle(handle), spec)
+                elif kind == 'class':
+                    parent, spec = dev.classes[handle]
+                    cmd = "tc class add dev {} parent {} classid {} {}".format(
+                        name, format_handle(parent), format_handle(handle), spec)
+                else:
+                    parent, prio, protocol, spec, _, flowid, explicit_prio = dev.filters[handle]
+                    cmd = "tc filter add dev {} parent {} protocol {}{} {}{}".format(
+                        name, format_handle(parent), protocol, ' prio {}'.format(prio) if explicit_prio else '',
+                        spec, ' flowid {}'.format(flowid) if flowid else '')
+                commands.append(cmd)
+        return TcPlan(commands)
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+from pyltc.core.netdevice import NetDevice
+from pyltc.util.cmdline import CommandLine, CommandFailed
+
+
+class TestFakeKernel(unittest.TestCase):
+
+    RECIPE = [
+        'tc qdisc add dev lo root handle 1:0 htb',
+        'tc class add dev lo parent 1:0 classid 1:1 htb rate 15gbit',
+        'tc filter add dev lo parent 1:0 protocol ip prio 1 u32 match ip protocol 6 0xff flowid 1:1',
+        'tc qdisc add dev lo parent 1:1 handle 2:0 htb',
+        'tc class add dev lo parent 2:0 classid 2:1 htb rate 512kbit',
+        'tc filter add dev lo parent 2:0 protocol ip prio 1 basic match'
+        ' "cmp(u16 at 2 layer transport gt 8999) and cmp(u16 at 2 layer transport lt 9011)" flowid 2:1',
+        'tc qdisc add dev lo parent 2:1 handle 3:0 netem limit 1000000000 loss 2%',
+    ]
+
+    def test_recipe_round_trip(self):
+        kernel = FakeKernel()
+        for cmd in self.RECIPE:
+            kernel.execute(cmd)
+        self.assertEqual(TcPlan(self.RECIPE), kernel.plan())
+
+    def test_invalid_parents_rejected(self):
+        kernel = FakeKernel()
+        self.assertRaises(FakeKernelError, kernel.execute, 'tc qdisc del dev lo root')
+        self.assertRaises(FakeKernelError, kernel.execute, 'tc class add dev lo parent 1:0 classid 1:1 htb rate 1mbit')
+        kernel.execute(self.RECIPE[0])
+        self.assertRaises(FakeKernelError, kernel.execute, self.RECIPE[0])
+        self.assertRaises(FakeKernelError, kernel.execute, 'tc class add dev lo parent 1:0 classid 2:1 htb rate 1mbit')
+        self.assertRaises(FakeKernelError, kernel.execute, 'tc qdisc add dev eth9 root handle 1:0 htb')
+
+    def test_class_in_use(self):
+        kernel = FakeKernel()
+        for cmd in self.RECIPE:
+            kernel.execute(cmd)
+        self.assertRaises(FakeKernelError, kernel.execute, 'tc class del dev lo classid 2:1')
+        kernel.execute('tc filter del dev lo parent 2:0 protocol ip prio 1')
+        kernel.execute('tc class del dev lo classid 2:1')
+        self.assertEqual(TcPlan(self.RECIPE[:4]), kernel.plan())
+
+    def test_device_manager(self):
+        with FakeKernel() as kernel:
+            NetDevice.init()
+            dev = NetDevice.get_device('ifb')
+            self.assertEqual('ifb0', dev.name)
+            self.assertTrue(dev.is_down())
+            dev.up()
+            self.assertTrue(dev.is_up())
+            self.assertRaises(CommandFailed, CommandLine('tc qdisc del dev ifb0 root', sudo=True).execute)
+            DeviceManager.shutdown_module('ifb')
+            self.assertEqual([], DeviceManager.all_iface_names('ifb'))
+            self.assertIn('modprobe ifb numifbs=0', kernel.executed)
+
+
+if __name__ == '__main__':
+    unittest.main()
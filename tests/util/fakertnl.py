@@ -0,0 +1,90 @@
+"""
+Fake rtnetlink socket for testing the live statistics (``stats``, ``top``, ``exporter``,
+``backlog``, ``record``) and the device inventory without a kernel: ``FakeRtnl`` stands in
+for ``pyltc.util.netlink.RtnlSocket`` (see also ``tests.util.fakeclock``)::
+
+  rtnl = FakeRtnl({2: 'eth0'}, [tc_stats(2, 'htb', '1:0', 'root')], [tc_stats(2, 'htb', '1:1', 'root')])
+  with rtnl.installed('pyltc.plugins.stats'):
+      sampler = StatsSampler(['eth0'], clock=clock)
+  rtnl.update(2, '1:1', bytes=1500, packets=1)  # the counters at the next dump
+
+"""
+from unittest import mock
+
+from pyltc.util.netlink import TcStats
+
+
+#: the counters of ``TcStats``, 0 unless given to ``tc_stats()``
+COUNTERS = ('bytes', 'packets', 'drops', 'overlimits', 'requeues', 'backlog', 'qlen')
+
+
+def tc_stats(ifindex, kind, handle, parent, **counters):
+    """Returns the ``TcStats`` of a qdisc or class with given counters (e.g. ``bytes=1500``), the others being 0."""
+    values = dict.fromkeys(COUNTERS, 0)
+    values.update(counters)
+    return TcStats(ifindex, kind, handle, parent, **values)
+
+
+class FakeRtnl(object):
+    """Serves given devices, qdiscs and classes as an ``RtnlSocket`` does; the counters can be
+    changed between dumps (see ``update()``) and the class dumps are recorded. The link
+    notifications to receive next are queued in ``queued`` (an exception there is raised)."""
+
+    def __init__(self, links=None, qdiscs=(), classes=(), link_infos=()):
+        """Initializer.
+
+        :param links: dict - the device names by device index
+        :param qdiscs: iterable of ``TcStats`` - the qdiscs of all devices
+        :param classes: iterable of ``TcStats`` - the classes of all devices
+        :param link_infos: iterable of ``LinkInfo`` - the devices as dumped by ``link_infos()``
+        """
+        self.link_names = dict(links or dict())
+        self.qdisc_list = list(qdiscs)
+        self.class_list = list(classes)
+        self.link_info_list = list(link_infos)
+        self.queued = list()
+        #: the device indexes of the class dumps, in order
+        self.class_dumps = list()
+        #: how many times ``link_infos()`` was dumped
+        self.link_dumps = 0
+
+    def installed(self, module):
+        """Returns a patcher making given module (e.g. 'pyltc.plugins.stats') create this fake
+        instead of an ``RtnlSocket``."""
+        return mock.patch('{}.RtnlSocket'.format(module), return_value=self)
+
+    def update(self, ifindex, handle, **counters):
+        """Sets given counters of the qdisc or class of given device index and handle."""
+        for nodes in (self.qdisc_list, self.class_list):
+            for idx, node in enumerate(nodes):
+                if (node.ifindex, node.handle) == (ifindex, handle):
+                    nodes[idx] = node._replace(**counters)
+                    return
+        raise KeyError((ifindex, handle))
+
+    def qdiscs(self):
+        return list(self.qdisc_list)
+
+    def classes(self, ifindex):
+        self.class_dumps.append(ifindex)
+        return [node for node in self.class_list if node.ifindex == ifindex]
+
+    def links(self):
+        return dict(self.link_names)
+
+    def link_name(self, ifindex):
+        return self.link_names.get(ifindex)
+
+    def link_infos(self):
+        self.link_dumps += 1
+        return list(self.link_info_list)
+
+    def notifications(self):
+        queued, self.queued = self.queued, list()
+        if isinstance(queued, Exception):
+            raise queued
+        return queued
+
+    def close(self):
+        pass
+
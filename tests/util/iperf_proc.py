@@ -5,14 +5,39 @@ Used by tests for simple bandwidth measurements; uses iperf.
 """
 
 import time
+import asyncio
 
-from pyltc.util.cmdline import CommandLine
+from pyltc.util.cmdline import CommandLine, AsyncCommandLine
 
 
 # FIXME: Do we need these? Remove if not.
 OUTPUT_REGEXP = r'^\[.*?\]\s+\d+\.\d+\-\d+\.\d+\s+sec\s+\d[\.\d]+\s+\w+\s+(\d+)\s+bits/sec.*$'
 TIMEOUT = 60
 
+#: how long to wait for an iperf server to bind its port
+LISTEN_TIMEOUT = 5
+
+
+def port_bound(protocol, port):
+    """Tells whether a local socket is listening on (tcp) or bound to (udp) given port."""
+    with open('/proc/net/{}'.format(protocol)) as fhl:
+        next(fhl)  # the header
+        for line in fhl:
+            fields = line.split()
+            local_port = int(fields[1].rsplit(':', 1)[1], 16)
+            if local_port == port and (protocol == 'udp' or fields[3] == '0A'):  # 0A is TCP_LISTEN
+                return True
+    return False
+
+
+async def wait_for_port(protocol, port, timeout=LISTEN_TIMEOUT):
+    """Returns as soon as the port is bound, instead of sleeping for a fixed interval."""
+    deadline = time.monotonic() + timeout
+    while not port_bound(protocol, port):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Nothing bound to {} port {} after {} sec.".format(protocol, port, timeout))
+        await asyncio.sleep(0.005)
+
 
 class Iperf3Server(object):
     """Used for running iperf server component
@@ -34,6 +59,14 @@ class Iperf3Server(object):
         self.cmd.execute_daemon()
         return self.cmd
 
+    async def run_async(self, protocol):
+        cmd_tmpl = "{} -s -B {} -p {} -f b -y C" if protocol == 'tcp' else "{} -us -B {} -p {} -f b -y C"
+        cmd_text = cmd_tmpl.format(self._iperf_bin, self._host, self._port)
+        print('cmd_text(server): {!r}'.format(cmd_text))
+        self.cmd = await AsyncCommandLine(cmd_text).execute_daemon()
+        await wait_for_port(protocol, self._port)
+        return self.cmd
+
     def join(self): # TODO: Perhaps not used anymore?
         self.thread.join()
 
@@ -62,6 +95,12 @@ class TCPClient(Iperf3Client):
         self.cmd = CommandLine(cmd_text).execute_daemon()
         return self.cmd
 
+    async def run_async(self):
+        cmd_text = "{} -c {} -p {} -t {} -f b".format(self._iperf_bin, self._host, self._port, self._duration)
+        print('cmd_text(tcpclient): {!r}'.format(cmd_text))
+        self.cmd = await AsyncCommandLine(cmd_text).execute_daemon()
+        return self.cmd
+
 
 class UDPClient(Iperf3Client):
     """Used for running iperf client component in TCP mode.
@@ -78,6 +117,12 @@ class UDPClient(Iperf3Client):
         self.cmd = CommandLine(cmd_text).execute_daemon()
         return self.cmd
 
+    async def run_async(self):
+        cmd_text = "{} -uc {} -p {} -t {} -f b -b {}".format(self._iperf_bin, self._host, self._port, self._duration, self._sendrate)
+        print('cmd_text(udpclient): {!r}'.format(cmd_text))
+        self.cmd = await AsyncCommandLine(cmd_text).execute_daemon()
+        return self.cmd
+
 
 class NetPerfTest(object):
     """Parent of TCPNetPerfTest and UDPNetPerfTest,
@@ -90,60 +135,53 @@ class NetPerfTest(object):
         self._port = port
         self._duration = duration
 
-    def _gather_server_output(self, server_cmd, client_cmd):
-        output_line = None
-        with server_cmd._proc.stdout:
-            for line in iter(server_cmd._proc.stdout.readline, b''):
-                if line:
-                    output_line = line
-                    rc = server_cmd.terminate()
-                    if rc != None:
-                        break
-                    print('Unexpected None returncode after kill()!..')
-
-        server_cmd._proc.stderr.close()
-        client_cmd._proc.stdout.close()
-        client_cmd._proc.stderr.close()
+    async def _gather_server_output(self, server_cmd, client_cmd):
+        """Waits for the server's report line, then stops the server (no fixed sleeps)."""
+        output_line = await server_cmd._proc.stdout.readline()
+        await server_cmd.terminate()
+        await client_cmd.terminate(timeout=TIMEOUT)  # normally exited already
         assert output_line, 'No output from iperf server! cmdline: {}'.format(server_cmd.cmdline)
         return output_line
 
+    async def run_async(self):
+        """Runs the measurement as a coroutine, so that several can share one event loop.
+
+        :return: int - the bandwidth measured (bits/s)
+        """
+        server_cmd = await Iperf3Server(iperf_bin=self._iperf_bin, host=self._ip, port=self._port).run_async(
+            self._protocol)
+        client_cmd = await self._client().run_async()
+        output_line = await self._gather_server_output(server_cmd, client_cmd)
+        return int(output_line.split(b',')[8])
+
     def run(self):
-        raise NotImplemented('Abstract method.')
+        return asyncio.run(self.run_async())
 
 
 class TCPNetPerfTest(NetPerfTest):
     """Wraps the iperf server-client functionallity for tcp."""
 
+    _protocol = 'tcp'
+
     def __init__(self, sendrate, iperf_bin='iperf', host='127.0.0.1', port=5001, duration=4):
         """``sendrate`` is only a dummy argument here, to conform to NetPerfTest interface."""
         super(TCPNetPerfTest, self).__init__('dummy', iperf_bin=iperf_bin, host=host, port=port, duration=duration)
 
-    def run(self):
-        server = Iperf3Server(iperf_bin=self._iperf_bin, host=self._ip, port=self._port)
-        server_cmd = server.run("tcp")
-        time.sleep(0.1)
-        client = TCPClient(iperf_bin=self._iperf_bin, host=self._ip, port=self._port, duration=self._duration)
-        client_cmd = client.run()
-
-        output_line = self._gather_server_output(server_cmd, client_cmd)
-        return int(output_line.split(b',')[8])
+    def _client(self):
+        return TCPClient(iperf_bin=self._iperf_bin, host=self._ip, port=self._port, duration=self._duration)
 
 
 class UDPNetPerfTest(NetPerfTest):
     """Wraps the iperf server-client functionallity for udp."""
 
+    _protocol = 'udp'
+
     def __init__(self, sendrate, iperf_bin='iperf', host='127.0.0.1', port=5001, duration=4):
         super(UDPNetPerfTest, self).__init__(sendrate, iperf_bin=iperf_bin, host=host, port=port, duration=duration)
 
-    def run(self):
-        server = Iperf3Server(iperf_bin=self._iperf_bin, host=self._ip, port=self._port)
-        server_cmd = server.run("udp")
-        time.sleep(0.1)
-        client = UDPClient(self._sendrate, iperf_bin=self._iperf_bin, host=self._ip, port=self._port, duration=self._duration)
-        client_cmd = client.run()
-
-        output_line = self._gather_server_output(server_cmd, client_cmd)
-        return int(output_line.split(b',')[8])
+    def _client(self):
+        return UDPClient(self._sendrate, iperf_bin=self._iperf_bin, host=self._ip, port=self._port,
+                         duration=self._duration)
 
 
 #________________________________________
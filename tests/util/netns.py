@@ -0,0 +1,146 @@
+"""
+Network namespace fabric for live tests.
+
+A ``NetnsPair`` is a throwaway pair of network namespaces, a client and a
+server, joined by a veth pair, with an ifb device of its own on the client
+side. pyltc shapes the client's veth from the outside (``ltc simnet -n
+<client> -i veth0 ...`` runs ``tc -n``/``ip -n``), and traffic sent from the
+client namespace to the server address crosses it. So a test neither shapes
+the host's ``lo`` nor shares an ifb with other tests, and tests can run in
+parallel, e.g. one per core with pytest-xdist::
+
+  with NetnsPair() as fabric:
+      pyltc_entry_point(['simnet', '-n', fabric.client, '-i', fabric.client_dev, '-c', '--upload', ...])
+      with entered(fabric.client):
+          sock = socket.socket()  # a socket stays in the namespace it was created in
+      sock.connect((fabric.server_addr, 9100))
+
+Creating namespaces takes ``ip`` (run through sudo like all pyltc commands);
+entering them takes a process with CAP_SYS_ADMIN, i.e. tests run as root.
+
+"""
+import itertools
+import os
+
+from pyltc.util.cmdline import CommandLine
+from pyltc.util.netlink import NETNS_RUN_DIR, entered
+
+
+CLIENT_ADDR = '10.0.0.1'
+SERVER_ADDR = '10.0.0.2'
+PREFIX_LEN = 24
+
+_serial = itertools.count(1)
+
+
+def netns_exists(name):
+    return os.path.exists(os.path.join(NETNS_RUN_DIR, name))
+
+
+class NetnsPair(object):
+    """Two network namespaces joined by a veth pair, plus an ifb device in the client one.
+    The names are unique per process and instance, so parallel test runs do not collide."""
+
+    client_dev = 'veth0'
+    server_dev = 'veth1'
+    ifb_dev = 'ifb0'
+    client_addr = CLIENT_ADDR
+    server_addr = SERVER_ADDR
+
+    def __init__(self, prefix='ltc'):
+        name = '{}{}-{}'.format(prefix, os.getpid(), next(_serial))
+        self.client = name + 'c'
+        self.server = name + 's'
+
+    def _ip(self, cmd):
+        CommandLine('ip ' + cmd, sudo=True).execute()
+
+    def create(self):
+        self._ip('netns add {}'.format(self.client))
+        try:
+            self._ip('netns add {}'.format(self.server))
+            self._ip('-n {} link add {} type veth peer name {} netns {}'.format(
+                self.client, self.client_dev, self.server_dev, self.server))
+            for netns, dev, addr in ((self.client, self.client_dev, self.client_addr),
+                                     (self.server, self.server_dev, self.server_addr)):
+                self._ip('-n {} addr add {}/{} dev {}'.format(netns, addr, PREFIX_LEN, dev))
+                self._ip('-n {} link set dev {} up'.format(netns, dev))
+                self._ip('-n {} link set dev lo up'.format(netns))
+            self._ip('-n {} link add {} type ifb'.format(self.client, self.ifb_dev))
+            self._ip('-n {} link set dev {} up'.format(self.client, self.ifb_dev))
+        except Exception:
+            self.destroy()
+            raise
+        return self
+
+    def destroy(self):
+        """Deletes both namespaces; their devices (and any tc setup on them) go with them."""
+        for netns in (self.client, self.server):
+            if netns_exists(netns):
+                CommandLine('ip netns del {}'.format(netns), ignore_errors=True, sudo=True).execute()
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, *exc_info):
+        self.destroy()
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+import socket
+
+
+def _can_create_netns():
+    if os.geteuid() != 0:
+        return False
+    try:
+        NetnsPair().create().destroy()
+    except Exception:
+        return False
+    return True
+
+
+@unittest.skipUnless(_can_create_netns(), "needs root and network namespace support")
+class TestNetnsPair(unittest.TestCase):
+
+    def test_create_destroy(self):
+        with NetnsPair() as fabric:
+            self.assertTrue(netns_exists(fabric.client))
+            self.assertTrue(netns_exists(fabric.server))
+        self.assertFalse(netns_exists(fabric.client))
+        self.assertFalse(netns_exists(fabric.server))
+
+    def test_unique_names(self):
+        first, second = NetnsPair(), NetnsPair()
+        self.assertNotEqual(first.client, second.client)
+
+    def test_connect_across(self):
+        with NetnsPair() as fabric:
+            with entered(fabric.server):
+                server = socket.socket()
+            with entered(fabric.client):
+                client = socket.socket()
+            with server, client:
+                server.bind((fabric.server_addr, 9100))
+                server.listen(1)
+                client.connect((fabric.server_addr, 9100))
+                conn, (peer, _) = server.accept()
+                conn.close()
+            self.assertEqual(fabric.client_addr, peer)
+
+    def test_isolated_from_host(self):
+        with NetnsPair() as fabric, socket.socket() as host_server:
+            host_server.bind(('127.0.0.1', 0))
+            host_server.listen(1)
+            with entered(fabric.client):
+                sock = socket.socket()
+            with sock:
+                self.assertRaises(ConnectionRefusedError, sock.connect, host_server.getsockname())
+            self.assertNotIn(fabric.client_dev, os.listdir('/sys/class/net'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,444 @@
+"""
+In-process traffic generator and sink for live tests.
+
+A Python replacement for the iperf server/client pairs of ``iperf_proc``:
+nothing is spawned and nothing is scraped from output. A ``TrafficSink``
+receives into a preallocated buffer (``recv_into``) and a ``TrafficSource``
+sends from preallocated buffers, paced to a target rate if one is given.
+UDP datagrams carry a flow id, a sequence number and a send timestamp, so the sink
+also reports loss and one-way delay. Several flows can run at once in one
+process, each on its own pair of threads::
+
+  results = measure_many([('tcp', 9100, None), ('udp', 9200, '10mbit')], duration=2)
+  results[9100].goodput  # bits/s
+
+Given a ``tolerance``, a flow stops early: its rate is sampled every
+``SAMPLE_INTERVAL`` and the source stops as soon as the 95% confidence
+interval of the mean rate is narrower than a share of the tolerance, so a
+probe that converges quickly takes a few hundred milliseconds; ``duration``
+is then only the cap::
+
+  measure('udp', 9200, rate='10mbit', duration=5, tolerance=0.25)
+
+Sources and sinks may live in network namespaces (see ``tests.util.netns``)::
+
+  measure('tcp', 9100, host=fabric.server_addr, source_netns=fabric.client, sink_netns=fabric.server)
+
+``TCPTrafficTest`` and ``UDPTrafficTest`` have the interface of the
+``NetPerfTest`` classes, so the live tests can use either.
+
+"""
+import itertools
+import socket
+import statistics
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from pyltc.util.rates import convert2bps
+from tests.util.netns import entered
+
+
+#: the UDP payload size (bytes), iperf's default
+UDP_PAYLOAD = 1470
+#: the size of the buffer TCP is received into
+TCP_CHUNK = 128 * 1024
+#: the most TCP is sent at once; small enough for a source in a slow class to notice its end in time
+TCP_SEND_CHUNK = 16 * 1024
+#: the TCP send buffer size; it bounds what is still queued (e.g. in a slow HTB class) once the source
+#: stops, so a flow through a shaped class ends soon after its duration
+TCP_SNDBUF = 8 * 1024
+#: the TCP segment size; loopback's 64K MTU would otherwise make segments so large that a slow
+#: class passes only a handful of them per second
+TCP_MSS = 1448
+#: how many datagrams are sent back to back per pacing check (at most a millisecond worth of them)
+UDP_BATCH = 8
+#: how long (sec.) the sink waits for queued packets once the source is done
+GRACE = 0.5
+#: how often (sec.) the rate of a flow is sampled when it may stop early
+SAMPLE_INTERVAL = 0.05
+#: the fewest rate samples a flow stops early on
+MIN_SAMPLES = 5
+#: the share of the tolerance the confidence interval of the rate may take up (the rest is left for the test)
+TOLERANCE_SHARE = 0.5
+
+#: two-sided 95% Student t quantiles by degrees of freedom (1..10); beyond that 2.0 is close enough
+_T95 = (12.71, 4.30, 3.18, 2.78, 2.57, 2.45, 2.36, 2.31, 2.26, 2.23)
+
+_HEADER = struct.Struct('!qqq')  # flow id, sequence number (-1 ends the flow), send time (ns)
+_END = -1
+_flow_ids = itertools.count(1)
+
+
+#: The outcome of one flow, as seen by the sink. ``goodput`` is in bits/s over
+#: ``duration`` (first to last byte received); ``sent``/``received`` count bytes;
+#: ``loss`` and ``delay`` (mean one-way delay, sec.) are only known for UDP.
+FlowResult = namedtuple('FlowResult', 'protocol port sent received duration goodput loss delay')
+
+
+class TrafficSink(object):
+    """Receives one flow on a local port and accounts for it."""
+
+    def __init__(self, protocol, host='127.0.0.1', port=5001, netns=None, flow=None):
+        """Initializer.
+
+        :param protocol: string - 'tcp' or 'udp'
+        :param netns: string - the named network namespace to receive in; None for our own
+        :param flow: int - the UDP flow id to account for; datagrams of other flows (e.g. still
+                     queued from an earlier one to the same port) are ignored. None takes any.
+        """
+        assert protocol in ('tcp', 'udp')
+        self._protocol = protocol
+        self._host = host
+        self._port = port
+        self._netns = netns
+        self._flow = flow
+        self._buffer = bytearray(TCP_CHUNK if protocol == 'tcp' else UDP_PAYLOAD)
+        self._view = memoryview(self._buffer)
+        self._sock = None
+        self._thread = None
+        self._source_done = None
+        self.received = 0
+        self.packets = 0
+        self.delay_sum = 0.0
+        self.first = None
+        self.first_bytes = 0
+        self.last = None
+        self.max_gap = 0.0
+
+    def start(self):
+        """Binds the port (so a source can connect right away) and starts receiving."""
+        kind = socket.SOCK_STREAM if self._protocol == 'tcp' else socket.SOCK_DGRAM
+        with entered(self._netns):
+            self._sock = socket.socket(socket.AF_INET, kind)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self._host, self._port))
+        if self._protocol == 'tcp':
+            self._sock.listen(1)
+        self._source_done = threading.Event()
+        self._thread = threading.Thread(target=getattr(self, '_receive_' + self._protocol), daemon=True)
+        self._thread.start()
+        return self
+
+    def source_done(self):
+        """Tells the sink the source has stopped sending (UDP cannot tell otherwise if the end is lost)."""
+        self._source_done.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        self._sock.close()
+
+    def take_max_gap(self):
+        """Returns the longest time (sec.) between two arrivals since the last call, and starts over."""
+        gap, self.max_gap = self.max_gap, 0.0
+        return gap
+
+    def _account(self, nbytes, now):
+        if self.first is None:
+            self.first, self.first_bytes = now, nbytes
+        elif now - self.last > self.max_gap:
+            self.max_gap = now - self.last
+        self.last = now
+        self.received += nbytes
+        self.packets += 1
+
+    def _receive_tcp(self):
+        conn, _ = self._sock.accept()
+        with conn:
+            while True:
+                nbytes = conn.recv_into(self._view)
+                if not nbytes:
+                    break
+                self._account(nbytes, time.perf_counter())
+
+    def _receive_udp(self):
+        self._sock.settimeout(0.05)
+        done_at = None
+        while True:
+            try:
+                nbytes = self._sock.recv_into(self._view)
+            except socket.timeout:
+                if self._source_done.is_set():
+                    done_at = done_at or time.perf_counter()
+                    if time.perf_counter() - done_at > GRACE:
+                        break
+                continue
+            flow, seq, sent_ns = _HEADER.unpack_from(self._buffer)
+            if self._flow is not None and flow != self._flow:
+                continue
+            if seq == _END:
+                break
+            now = time.perf_counter()
+            self._account(nbytes, now)
+            self.delay_sum += time.time_ns() / 1e9 - sent_ns / 1e9
+
+
+class TrafficSource(object):
+    """Sends one flow to a port, as fast as possible or paced at a rate."""
+
+    def __init__(self, protocol, host='127.0.0.1', port=5001, rate=None, duration=2.0, netns=None, flow=0):
+        """Initializer.
+
+        :param protocol: string - 'tcp' or 'udp'
+        :param rate: int or string - the sending rate (bits/s or e.g. '10mbit'); None means unpaced
+        :param duration: float - how long to send (sec.)
+        :param netns: string - the named network namespace to send from; None for our own
+        :param flow: int - the flow id UDP datagrams are tagged with
+        """
+        assert protocol in ('tcp', 'udp')
+        self._protocol = protocol
+        self._host = host
+        self._port = port
+        self._netns = netns
+        self._flow = flow
+        self._rate = convert2bps(rate) if isinstance(rate, str) else rate
+        self._duration = duration
+        self._thread = None
+        self._stop = threading.Event()
+        self.sent = 0
+        self.datagrams = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=getattr(self, '_send_' + self._protocol), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Makes the source stop sending before its duration is over."""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _pace(self, start, now):
+        """Sleeps until the bytes sent are due at the target rate."""
+        if not self._rate:
+            return
+        due = start + self.sent * 8 / self._rate
+        if due > now:
+            time.sleep(due - now)
+
+    def _send_tcp(self):
+        payload = memoryview(bytearray(TCP_SEND_CHUNK))
+        chunk = payload if not self._rate else payload[:max(1, min(TCP_SEND_CHUNK, self._rate // 8 // 100))]
+        with entered(self._netns):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        with sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TCP_SNDBUF)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG, TCP_MSS)
+            sock.connect((self._host, self._port))
+            start = time.perf_counter()
+            end = start + self._duration
+            now = start
+            while now < end and not self._stop.is_set():
+                sock.sendall(chunk)
+                self.sent += len(chunk)
+                now = time.perf_counter()
+                self._pace(start, now)
+
+    def _send_udp(self):
+        header = bytearray(_HEADER.size)
+        payload = memoryview(bytearray(UDP_PAYLOAD - _HEADER.size))
+        buffers = [header, payload]  # gathered by sendmsg(): the payload is never copied
+        batch = UDP_BATCH if not self._rate else max(1, min(UDP_BATCH, self._rate // (8 * UDP_PAYLOAD * 1000)))
+        with entered(self._netns):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        with sock:
+            sock.connect((self._host, self._port))
+            start = time.perf_counter()
+            end = start + self._duration
+            now = start
+            while now < end and not self._stop.is_set():
+                for _ in range(batch):
+                    _HEADER.pack_into(header, 0, self._flow, self.datagrams, time.time_ns())
+                    try:
+                        self.sent += sock.sendmsg(buffers)
+                    except (ConnectionRefusedError, BlockingIOError):
+                        pass  # datagrams are allowed to go missing
+                    self.datagrams += 1
+                now = time.perf_counter()
+                self._pace(start, now)
+            _HEADER.pack_into(header, 0, self._flow, _END, 0)
+            for _ in range(3):
+                sock.sendmsg([header])
+
+
+def rate_converged(samples, tolerance):
+    """Tells whether the 95% confidence interval of the mean of given rate samples
+    lies within ``TOLERANCE_SHARE * tolerance`` of the mean (relative)."""
+    if len(samples) < MIN_SAMPLES:
+        return False
+    mean = statistics.mean(samples)
+    if mean <= 0:
+        return False
+    dof = len(samples) - 1
+    quantile = _T95[dof - 1] if dof <= len(_T95) else 2.0
+    half_width = quantile * statistics.stdev(samples) / len(samples) ** 0.5
+    return half_width <= TOLERANCE_SHARE * tolerance * mean
+
+
+class _Flow(object):
+
+    def __init__(self, protocol, port, rate, host, duration, source_netns=None, sink_netns=None):
+        flow = next(_flow_ids)
+        self.sink = TrafficSink(protocol, host=host, port=port, netns=sink_netns, flow=flow)
+        self.source = TrafficSource(protocol, host=host, port=port, rate=rate, duration=duration, netns=source_netns,
+                                    flow=flow)
+        self.protocol = protocol
+        self.port = port
+        self.samples = list()
+        self._mark = None  # (time, bytes received) at the last sample
+
+    def sample(self, now):
+        """Records the rate since the last sample; the interval the first bytes arrive in is warm-up."""
+        received = self.sink.received
+        if self.sink.first is None:
+            return
+        if self._mark is not None:
+            self.samples.append((received - self._mark[1]) * 8 / (now - self._mark[0]))
+        self._mark = (now, received)
+
+    def result(self):
+        sink, source = self.sink, self.source
+        duration = (sink.last - sink.first) if sink.packets > 1 else 0.0
+        # the bytes of the first arrival were sent before the measured interval began
+        goodput = int((sink.received - sink.first_bytes) * 8 / duration) if duration else 0
+        loss = delay = None
+        if self.protocol == 'udp':
+            loss = 1.0 - sink.packets / source.datagrams if source.datagrams else 0.0
+            delay = sink.delay_sum / sink.packets if sink.packets else None
+        return FlowResult(self.protocol, self.port, source.sent, sink.received, duration, goodput, loss, delay)
+
+
+def _stop_when_converged(flows, tolerance, duration):
+    """Samples the flows until each has converged (and is stopped) or the duration is over."""
+    start = time.perf_counter()
+    pending = list(flows)
+    tick = start
+    while pending:
+        tick += SAMPLE_INTERVAL
+        if tick >= start + duration:
+            return
+        time.sleep(max(0.0, tick - time.perf_counter()))
+        now = time.perf_counter()
+        for flow in list(pending):
+            flow.sample(now)
+            if rate_converged(flow.samples, tolerance[flow.port]):
+                flow.source.stop()
+                pending.remove(flow)
+
+
+def measure_many(flows, host='127.0.0.1', duration=2.0, tolerance=None, source_netns=None, sink_netns=None):
+    """Runs several flows concurrently and waits for all of them.
+
+    :param flows: sequence of (protocol, port, rate) tuples; rate is None for unpaced flows
+    :param host: string - the address to send to and receive on
+    :param duration: float - how long each source sends (sec.); the cap if a tolerance is given
+    :param tolerance: float, or dict - port -> float; the relative error the rates are needed
+                      within, makes each flow stop as soon as its rate has converged
+    :param source_netns: string - the named network namespace to send from; None for our own
+    :param sink_netns: string - the named network namespace to receive in; None for our own
+    :return: dict - port -> FlowResult
+    """
+    flows = [_Flow(protocol, port, rate, host, duration, source_netns, sink_netns) for protocol, port, rate in flows]
+    for flow in flows:
+        flow.sink.start()
+    for flow in flows:
+        flow.source.start()
+    if tolerance is not None:
+        if not isinstance(tolerance, dict):
+            tolerance = dict((flow.port, tolerance) for flow in flows)
+        _stop_when_converged(flows, tolerance, duration)
+    for flow in flows:
+        flow.source.join()
+        flow.sink.source_done()
+    for flow in flows:
+        flow.sink.join(timeout=duration + 2 * GRACE + 5)
+    return dict((flow.port, flow.result()) for flow in flows)
+
+
+def measure(protocol, port, rate=None, host='127.0.0.1', duration=2.0, tolerance=None, source_netns=None,
+            sink_netns=None):
+    """Runs one flow; returns its FlowResult."""
+    return measure_many([(protocol, port, rate)], host=host, duration=duration, tolerance=tolerance,
+                        source_netns=source_netns, sink_netns=sink_netns)[port]
+
+
+class TCPTrafficTest(object):
+    """Measures the TCP goodput to a port; a drop-in for ``TCPNetPerfTest``."""
+
+    def __init__(self, sendrate, host='127.0.0.1', port=5001, duration=4, tolerance=None):
+        """``sendrate`` is only a dummy argument here, TCP sends as fast as it can.
+        With a ``tolerance``, ``duration`` is the cap of an early-stopping measurement."""
+        self._ip = host
+        self._port = port
+        self._duration = duration
+        self._tolerance = tolerance
+
+    def run(self):
+        return measure('tcp', self._port, host=self._ip, duration=self._duration, tolerance=self._tolerance).goodput
+
+
+class UDPTrafficTest(object):
+    """Measures the UDP goodput to a port at a given send rate; a drop-in for ``UDPNetPerfTest``."""
+
+    def __init__(self, sendrate, host='127.0.0.1', port=5001, duration=4, tolerance=None):
+        self._sendrate = sendrate
+        self._ip = host
+        self._port = port
+        self._duration = duration
+        self._tolerance = tolerance
+
+    def run(self):
+        return measure('udp', self._port, rate=self._sendrate, host=self._ip, duration=self._duration,
+                       tolerance=self._tolerance).goodput
+
+
+#________________________________________
+#  Test Section Below
+
+import unittest
+
+
+class TestTraffic(unittest.TestCase):
+
+    def test_tcp_unpaced(self):
+        result = measure('tcp', 18301, duration=0.3)
+        self.assertEqual(result.sent, result.received)
+        self.assertGreater(result.goodput, 100 * 1000 * 1000)
+
+    def test_udp_paced(self):
+        result = measure('udp', 18302, rate='8mbit', duration=0.5)
+        self.assertAlmostEqual(8e6, result.goodput, delta=8e6 * 0.1)
+        self.assertLess(result.loss, 0.05)
+        self.assertLess(result.delay, 0.1)
+
+    def test_concurrent(self):
+        start = time.perf_counter()
+        results = measure_many([('tcp', 18303, '4mbit'), ('udp', 18304, '2mbit'), ('udp', 18305, '1mbit')],
+                               duration=0.5)
+        self.assertLess(time.perf_counter() - start, 1.5)
+        self.assertAlmostEqual(4e6, results[18303].goodput, delta=4e6 * 0.1)
+        self.assertAlmostEqual(2e6, results[18304].goodput, delta=2e6 * 0.1)
+        self.assertAlmostEqual(1e6, results[18305].goodput, delta=1e6 * 0.1)
+
+    def test_early_stop(self):
+        start = time.perf_counter()
+        result = measure('udp', 18308, rate='4mbit', duration=5, tolerance=0.25)
+        self.assertLess(time.perf_counter() - start, 2.0)
+        self.assertAlmostEqual(4e6, result.goodput, delta=4e6 * 0.1)
+
+    def test_rate_converged(self):
+        self.assertFalse(rate_converged([1e6] * (MIN_SAMPLES - 1), 0.25))
+        self.assertTrue(rate_converged([1e6] * MIN_SAMPLES, 0.25))
+        self.assertFalse(rate_converged([1e6, 2e6, 1e6, 2e6, 1e6], 0.25))
+        self.assertTrue(rate_converged([1e6, 1.01e6, 0.99e6, 1e6, 1e6], 0.25))
+
+    def test_drop_in_interface(self):
+        self.assertGreater(TCPTrafficTest('dummy', port=18306, duration=0.2).run(), 0)
+        self.assertGreater(UDPTrafficTest('1mbit', port=18307, duration=0.2).run(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,12 @@ Unit tests for the commandline utility module.
 
 """
 
+import asyncio
+import time
 import unittest
 from subprocess import TimeoutExpired
 
-from pyltc.util.cmdline import CommandLine, CommandFailed
+from pyltc.util.cmdline import CommandLine, CommandFailed, AsyncCommandLine
 
 
 class TestCommandFailed(unittest.TestCase):
@@ -126,5 +128,41 @@ class TestCommandLine(unittest.TestCase):
     #     target.install(verbose=False)
 
 
+class TestAsyncCommandLine(unittest.TestCase):
+
+    def test_execute(self):
+        cmd = asyncio.run(AsyncCommandLine("echo ALPHA BRAVO").execute())
+        self.assertEqual(0, cmd.returncode)
+        self.assertEqual("ALPHA BRAVO", cmd.stdout.rstrip())
+
+    def test_ignore_errors(self):
+        self.assertRaises(CommandFailed, asyncio.run, AsyncCommandLine("/bin/false").execute())
+        cmd = asyncio.run(AsyncCommandLine("/bin/false", ignore_errors=True).execute())
+        self.assertNotEqual(0, cmd.returncode)
+
+    def test_timeout(self):
+        cmd = AsyncCommandLine("/bin/sleep 1", ignore_errors=True)
+        self.assertRaises(TimeoutExpired, asyncio.run, cmd.execute(timeout=0.1))
+
+    def test_concurrent(self):
+        async def run_all():
+            cmds = [AsyncCommandLine("/bin/sleep 0.3").execute() for _ in range(5)]
+            return await asyncio.gather(*cmds)
+
+        start = time.monotonic()
+        results = asyncio.run(run_all())
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual([0] * 5, [cmd.returncode for cmd in results])
+
+    def test_terminate_daemon(self):
+        async def run_and_stop():
+            cmd = await AsyncCommandLine("/bin/sleep 30").execute_daemon()
+            return await cmd.terminate()
+
+        start = time.monotonic()
+        self.assertEqual(-15, asyncio.run(run_and_stop()))  # SIGTERM
+        self.assertLess(time.monotonic() - start, 1.0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,192 @@
+"""
+Unit tests for the rtnetlink client.
+
+"""
+import errno
+import socket
+import struct
+import unittest
+
+from pyltc.util import netlink
+from pyltc.util.netlink import RtnlSocket, NetlinkError, LinkInfo, format_handle, iter_attrs, parse_tcmsg, \
+    parse_ifinfomsg, parse_link_info
+
+
+def _attr(attr_type, payload):
+    length = 4 + len(payload)
+    return struct.pack('=HH', length, attr_type) + payload + b'\0' * (-length % 4)
+
+
+def _tcmsg(ifindex, handle, parent, kind, stats2=None, legacy=None):
+    """Builds the payload of an RTM_NEWQDISC message: stats2 is (bytes, packets, qlen, backlog, drops,
+    requeues, overlimits); legacy is (bytes, packets, drops, overlimits, qlen, backlog)."""
+    payload = struct.pack('=BxxxiIII', socket.AF_UNSPEC, ifindex, handle, parent, 1)
+    payload += _attr(netlink.TCA_KIND, kind.encode() + b'\0')
+    payload += _attr(2, b'\x01\x02\x03')  # TCA_OPTIONS, skipped
+    if stats2:
+        nested = _attr(netlink.TCA_STATS_BASIC, struct.pack('=QI', *stats2[:2]) + b'\0' * 4)
+        nested += _attr(netlink.TCA_STATS_QUEUE, struct.pack('=IIIII', *stats2[2:]))
+        payload += _attr(netlink.TCA_STATS2 | 0x8000, nested)  # NLA_F_NESTED
+    if legacy:
+        nbytes, packets, drops, overlimits, qlen, backlog = legacy
+        payload += _attr(netlink.TCA_STATS, struct.pack('=QIIIIIII', nbytes, packets, drops, overlimits, 0, 0,
+                                                        qlen, backlog))
+    return payload
+
+
+def _message(msg_type, seq, payload):
+    return struct.pack('=IHHII', 16 + len(payload), msg_type, 2, seq, 0) + payload + b'\0' * (-len(payload) % 4)
+
+
+class FakeSocket(object):
+    """Answers each send with the next prepared list of receive buffers."""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.sent = list()
+        self._pending = list()
+
+    def send(self, data):
+        self.sent.append(data)
+        self._pending = list(self.answers.pop(0))
+
+    def recv(self, bufsize):
+        return self._pending.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeEventSocket(object):
+    """Returns the prepared receive buffers (or raises the prepared errors) without waiting."""
+
+    def __init__(self, buffers):
+        self.buffers = list(buffers)
+
+    def recv(self, bufsize, flags=0):
+        assert flags & socket.MSG_DONTWAIT
+        if not self.buffers:
+            raise BlockingIOError(errno.EAGAIN, 'Resource temporarily unavailable')
+        data = self.buffers.pop(0)
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+    def close(self):
+        pass
+
+
+def _link(ifindex, name, flags=0, operstate=None):
+    payload = struct.pack('=BxHiII', 0, 1, ifindex, flags, 0) + _attr(netlink.IFLA_IFNAME, name.encode() + b'\0')
+    if operstate is not None:
+        payload += _attr(netlink.IFLA_OPERSTATE, bytes([operstate]))
+    return payload
+
+
+def _fake_rtnl(answers, socket_class=FakeSocket):
+    rtnl = RtnlSocket.__new__(RtnlSocket)
+    rtnl._sock = socket_class(answers)
+    rtnl._seq = 0
+    rtnl._links = dict()
+    return rtnl
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_format_handle(self):
+        self.assertEqual('1:0', format_handle(0x10000))
+        self.assertEqual('2:1a', format_handle(0x2001a))
+        self.assertEqual('ffff:0', format_handle(0xffff0000))
+        self.assertEqual('root', format_handle(netlink.TC_H_ROOT))
+        self.assertEqual('ingress', format_handle(netlink.TC_H_INGRESS))
+
+    def test_iter_attrs(self):
+        data = _attr(1, b'abc') + _attr(0x8003, b'defg')
+        self.assertEqual([(1, b'abc'), (3, b'defg')], [(kind, bytes(value)) for kind, value in iter_attrs(data)])
+
+    def test_parse_tcmsg_stats2(self):
+        payload = _tcmsg(4, 0x20001, 0x20000, 'htb', stats2=(1500, 10, 2, 3000, 5, 1, 7),
+                         legacy=(99, 99, 99, 99, 99, 99))
+        stats = parse_tcmsg(payload)
+        self.assertEqual((4, 'htb', '2:1', '2:0'), stats[:4])
+        self.assertEqual(dict(bytes=1500, packets=10, drops=5, overlimits=7, requeues=1, backlog=3000, qlen=2),
+                         dict((name, getattr(stats, name)) for name in stats._fields[4:]))
+
+    def test_parse_tcmsg_legacy(self):
+        stats = parse_tcmsg(_tcmsg(1, 0x10000, netlink.TC_H_ROOT, 'netem', legacy=(100, 2, 1, 0, 3, 60)))
+        self.assertEqual(('netem', '1:0', 'root'), (stats.kind, stats.handle, stats.parent))
+        self.assertEqual((100, 2, 1, 0, 0, 60, 3), stats[4:])
+
+    def test_parse_ifinfomsg(self):
+        payload = struct.pack('=BxHiII', 0, 1, 7, 0, 0) + _attr(netlink.IFLA_IFNAME, b'veth0\0')
+        self.assertEqual((7, 'veth0'), parse_ifinfomsg(payload))
+
+    def test_parse_link_info(self):
+        self.assertEqual(LinkInfo(7, 'veth0', 0x1003, 'down'), parse_link_info(_link(7, 'veth0', 0x1003, 2)))
+        self.assertEqual(LinkInfo(1, 'lo', 0x9, 'unknown'), parse_link_info(_link(1, 'lo', 0x9)))
+
+
+class TestRtnlSocket(unittest.TestCase):
+
+    def test_dump_parts(self):
+        first = _message(netlink.RTM_NEWQDISC, 1, _tcmsg(1, 0x10000, netlink.TC_H_ROOT, 'htb', (10, 1, 0, 0, 0, 0, 0)))
+        second = (_message(netlink.RTM_NEWQDISC, 1, _tcmsg(2, 0x10000, netlink.TC_H_ROOT, 'htb')) +
+                  _message(netlink.NLMSG_DONE, 1, struct.pack('=i', 0)))
+        rtnl = _fake_rtnl([[first, second]])
+        qdiscs = rtnl.qdiscs()
+        self.assertEqual([1, 2], [stats.ifindex for stats in qdiscs])
+        self.assertEqual(10, qdiscs[0].bytes)
+        length, msg_type, flags = struct.unpack_from('=IHH', rtnl._sock.sent[0])
+        self.assertEqual((36, netlink.RTM_GETQDISC, netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP),
+                         (length, msg_type, flags))
+
+    def test_dump_skips_stale_parts(self):
+        stale = _message(netlink.RTM_NEWTCLASS, 1, _tcmsg(3, 0x10001, 0x10000, 'htb'))
+        answer = _message(netlink.NLMSG_DONE, 2, struct.pack('=i', 0))
+        rtnl = _fake_rtnl([[_message(netlink.NLMSG_DONE, 1, struct.pack('=i', 0))], [stale + answer]])
+        rtnl.classes(3)
+        self.assertEqual([], rtnl.classes(3))
+
+    def test_dump_error(self):
+        rtnl = _fake_rtnl([[_message(netlink.NLMSG_ERROR, 1, struct.pack('=i', -19))]])
+        with self.assertRaises(NetlinkError) as ctx:
+            rtnl.classes(42)
+        self.assertEqual(19, ctx.exception.errno)
+
+    def test_link_name_refreshes_on_unknown_index(self):
+        link = struct.pack('=BxHiII', 0, 1, 5, 0, 0) + _attr(netlink.IFLA_IFNAME, b'eth1\0')
+        done = _message(netlink.NLMSG_DONE, 1, struct.pack('=i', 0))
+        rtnl = _fake_rtnl([[_message(netlink.RTM_NEWLINK, 1, link) + done]])
+        self.assertEqual('eth1', rtnl.link_name(5))
+        self.assertEqual('eth1', rtnl.link_name(5))  # cached: no second dump
+        self.assertEqual(1, len(rtnl._sock.sent))
+
+    def test_link_infos(self):
+        done = _message(netlink.NLMSG_DONE, 1, struct.pack('=i', 0))
+        rtnl = _fake_rtnl([[_message(netlink.RTM_NEWLINK, 1, _link(1, 'lo', 0x9, 0)) +
+                            _message(netlink.RTM_NEWLINK, 1, _link(4, 'ifb0', 0x82, 2)) + done]])
+        self.assertEqual([LinkInfo(1, 'lo', 0x9, 'unknown'), LinkInfo(4, 'ifb0', 0x82, 'down')], rtnl.link_infos())
+
+    def test_notifications(self):
+        rtnl = _fake_rtnl([_message(netlink.RTM_NEWLINK, 0, _link(5, 'dummy0')) +
+                           _message(netlink.RTM_DELLINK, 0, _link(4, 'ifb0'))], socket_class=FakeEventSocket)
+        self.assertEqual([netlink.RTM_NEWLINK, netlink.RTM_DELLINK],
+                         [msg_type for msg_type, _ in rtnl.notifications()])
+        self.assertEqual([], rtnl.notifications())
+
+    def test_notifications_lost(self):
+        rtnl = _fake_rtnl([OSError(errno.ENOBUFS, 'No buffer space available'),
+                           _message(netlink.RTM_NEWLINK, 0, _link(5, 'dummy0'))], socket_class=FakeEventSocket)
+        with self.assertRaises(NetlinkError) as ctx:
+            rtnl.notifications()
+        self.assertEqual(errno.ENOBUFS, ctx.exception.errno)
+
+    def test_live_links(self):
+        with RtnlSocket() as rtnl:
+            self.assertIn('lo', rtnl.links().values())
+            self.assertIn('lo', [link.name for link in rtnl.link_infos()])
+            self.assertIsInstance(rtnl.qdiscs(), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
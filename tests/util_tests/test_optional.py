@@ -0,0 +1,26 @@
+"""
+Unit tests for the optional dependency helpers.
+
+"""
+import unittest
+from unittest import mock
+
+from pyltc.util import optional
+from pyltc.util.optional import require_numpy
+
+
+class TestRequireNumpy(unittest.TestCase):
+
+    def test_missing(self):
+        with mock.patch.object(optional, 'numpy', None):
+            with self.assertRaises(KeyError) as ctx:
+                require_numpy(KeyError, 'the feature')
+        self.assertEqual("NumPy is needed for the feature; please install it.", ctx.exception.args[0])
+
+    @unittest.skipIf(optional.numpy is None, "NumPy is not installed")
+    def test_installed(self):
+        require_numpy(KeyError, 'the feature')
+
+
+if __name__ == '__main__':
+    unittest.main()
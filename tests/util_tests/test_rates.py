@@ -1,7 +1,7 @@
 
 import unittest
 
-from pyltc.util.rates import convert2bps, split_rate
+from pyltc.util.rates import convert2bps, split_rate, format_rate
 
 
 class TestRate2Bps(unittest.TestCase):
@@ -91,5 +91,15 @@ class TestSplitRate(unittest.TestCase):
         self.assertRaises(ValueError, split_rate, 'kibps')
 
 
+class TestFormatRate(unittest.TestCase):
+
+    def test_format_rate(self):
+        self.assertEqual('1.5mbit', format_rate(1500000))
+        self.assertEqual('512kbit', format_rate(convert2bps('512kbit')))
+        self.assertEqual('15gbit', format_rate(convert2bps('15gbit')))
+        self.assertEqual('999bit', format_rate(999))
+        self.assertEqual('0bit', format_rate(0))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+"""
+Unit tests for the phase and command timing instrumentation.
+
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from pyltc.core.facade import TrafficControl
+from pyltc.main import pyltc_entry_point
+from pyltc.plugins.simnet import handle_timings_args
+from pyltc.util import timings
+from pyltc.util.cmdline import CommandLine
+from pyltc.util.timings import Timings, command_key
+from tests.util.fakekernel import FakeKernel
+from tests.util.fakeclock import FakeClock
+
+
+class TestTimings(unittest.TestCase):
+
+    def tearDown(self):
+        timings.disable()
+
+    def test_off_by_default(self):
+        self.assertIsNone(timings.active)
+        self.assertIs(timings.phase('build_tree'), timings.phase('marshal'))  # the shared no-op
+        with timings.phase('build_tree'):
+            pass
+
+    def test_phases(self):
+        recorder = timings.enable(FakeClock(now=50.0, tick=0.25))
+        with timings.phase('marshal'):
+            with timings.phase('device_up', device='ifb0'):
+                pass
+        self.assertIsNone(timings.disable().sudo_overhead)
+        self.assertEqual([('device_up', 0.5, 0.25, {'device': 'ifb0'}), ('marshal', 0.25, 0.75, {})],
+                         [(span.name, span.start, span.duration, span.args) for span in recorder.spans])
+        self.assertIsNone(timings.active)
+
+    def test_commands(self):
+        recorder = timings.enable()
+        CommandLine('/bin/true').execute()
+        CommandLine('/bin/false', ignore_errors=True).execute()
+        self.assertEqual(['/bin/true', '/bin/false'], [span.name for span in recorder.spans])
+        self.assertEqual([0, 1], [span.args['rc'] for span in recorder.spans])
+        self.assertTrue(all(0 <= span.args['spawn'] <= span.duration for span in recorder.spans))
+
+    def test_command_key(self):
+        self.assertEqual('tc class add', command_key('sudo tc -n ns1 class add dev lo parent 1:0'.split()))
+        self.assertEqual('ip link set', command_key('ip -o link set dev ifb0 up'.split()))
+        self.assertEqual('modprobe ifb numifbs=0', command_key('sudo modprobe ifb numifbs=0'.split()))
+
+    def test_summary(self):
+        recorder = Timings(FakeClock(now=50.0, tick=0.25))
+        for cmd in ('sudo tc qdisc add dev lo root handle 1:0 htb', 'sudo tc qdisc add dev lo parent 1:1 netem'):
+            recorder.command(cmd.split(), 1.0, 1.1, 1.5, 0)
+        recorder.record(timings.PHASE, 'marshal', 0.5, 2.0)
+        self.assertEqual([('phase', 'marshal', 1, 1.5, 1.5), ('command', 'tc qdisc add', 2, 1.0, 0.5)],
+                         recorder.summary())
+        recorder.sudo_overhead = 0.002
+        lines = recorder.format_summary().splitlines()
+        self.assertEqual(['count', 'total', 'ms', 'mean', 'ms', 'max', 'ms'], lines[0].split())
+        self.assertEqual(['command', 'tc', 'qdisc', 'add', '2', '1000.00', '500.00', '500.00'], lines[2].split())
+        self.assertEqual('sudo overhead (est.)  2  4.00  2.00'.split(), lines[3].split())
+
+    def test_chrome_trace(self):
+        recorder = Timings(FakeClock(now=50.0, tick=0.25))
+        recorder.command(['sudo', 'tc', 'qdisc', 'show'], 50.5, 50.6, 51.0, 0, lane='task')
+        event, = recorder.chrome_trace()['traceEvents']
+        self.assertEqual(('sudo tc qdisc show', 'command', 'X', 250000.0, 500000.0, 1),
+                         (event['name'], event['cat'], event['ph'], event['ts'], event['dur'], event['tid']))
+
+
+class TestTimingsArgs(unittest.TestCase):
+
+    def test_handle_timings_args(self):
+        self.assertEqual((['simnet', '-c'], None), handle_timings_args(['simnet', '-c']))
+        argv, options = handle_timings_args(['--timings', 'profile', '4g', '--timings-trace', 't.json',
+                                             '--timings-json=s.json'])
+        self.assertEqual(['profile', '4g'], argv)
+        self.assertEqual(dict(summary=True, trace='t.json', json='s.json'), options)
+
+    def test_apply(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'timings.json')
+            with FakeKernel(devices=('lo', 'ifb0')):
+                TrafficControl.init()
+                pyltc_entry_point(['simnet', '-c', '-u', 'tcp:dport:8000:1mbit', '-d', 'udp:all:2mbit',
+                                   '-b', 'ifb0', '--timings-json', path])
+            with open(path) as fhl:
+                spans = json.load(fhl)['spans']
+        self.assertIsNone(timings.active)
+        phases = set(span['name'] for span in spans if span['category'] == 'phase')
+        self.assertEqual({'parse_args', 'get_devices', 'device_up', 'build_tree', 'marshal'}, phases)
+        commands = [span['name'] for span in spans if span['category'] == 'command']
+        self.assertIn('sudo tc class add dev lo parent 2:0 classid 2:1 htb rate 1mbit', commands)
+
+
+if __name__ == '__main__':
+    unittest.main()